@@ -527,6 +527,13 @@ def get_world_group():
     return cdb.get_world_group()
 
 
+def get_backend(group=None):
+    global cdb
+    assert cdb is not None and cdb.is_initialized(
+    ), 'DeepSpeed backend not set, please initialize it using init_process_group()'
+    return cdb.get_backend(group)
+
+
 def get_world_size(group=None) -> int:
     """
     Returns the number of processes in the current process group
@@ -222,6 +222,39 @@ class DeepSpeedInferenceConfig(DeepSpeedConfigModel):
     passed.
     """
 
+    save_tp_shards_path: str = None
+    """
+    Directory to save the weights of each rank to after automatic tensor
+    parallelism (AutoTP) has sliced them, together with a manifest of the
+    layout. Later launches with the same `tp_size` can load them with
+    `load_tp_shards_path` instead of slicing the full model again.
+    """
+
+    load_tp_shards_path: str = None
+    """
+    Directory of AutoTP shards saved with `save_tp_shards_path`. Each rank
+    only reads its own shard, so the model should be created on the meta
+    device and no `checkpoint` should be passed. Loading fails if the shards
+    were saved with a different `tp_size` or dtype.
+    """
+
+    checkpoint_load_workers: int = Field(0, ge=0)
+    """
+    Number of threads that read checkpoint shards ahead of the shard being
+    sliced into the model. Reading the next shards then overlaps with slicing
+    and copying the current one, at the cost of holding up to this many
+    additional shards in host memory. 0 reads each shard when it is needed.
+    """
+
+    checkpoint_mmap: bool = False
+    """
+    Memory-map checkpoint shards instead of reading them into host memory.
+    Tensors are paged in from the file as they are sliced into the model, so
+    peak host memory does not grow with the size of the shards. Requires
+    checkpoints saved with the zipfile format of `torch.save` (the default
+    since torch 1.6) and torch >= 2.1.
+    """
+
     checkpoint_config: InferenceCheckpointConfig = Field({}, alias="ckpt_config")
     """
     TODO: Add docs. Expects a dictionary containing values for
@@ -14,6 +14,7 @@ from packaging import version as pkg_version
 from deepspeed.runtime.checkpoint_engine.torch_checkpoint_engine import TorchCheckpointEngine
 from deepspeed.utils.timer import SynchronizedWallClockTimer
 
+from .streamer import GenerationStream
 from ..runtime.state_dict_factory import SDLoaderFactory
 from ..runtime.weight_quantizer import WeightQuantization
 from ..module_inject import replace_transformer_layer, generic_injection
@@ -24,6 +25,7 @@ from ..module_inject import LinearAllreduce, LinearLayer, Normalize, ReplaceWith
 from deepspeed.accelerator import get_accelerator
 from ..module_inject.policy import TransformerPolicy
 from ..module_inject.auto_tp import AutoTP
+from ..module_inject.auto_tp_checkpoint import load_tp_shards, save_tp_shards
 
 from ..module_inject.replace_policy import generic_policies
 from ..module_inject.auto_tp_model_utils import build_bloom_alibi_tensor, build_mpt_atten_bias_tensor, build_mpt_alibi_tensor, get_alibi_mask
@@ -67,6 +69,8 @@ class InferenceEngine(Module):
         # patch model generate with ours if model uses it
         if hasattr(self.module, "generate"):
             self.generate = self._generate
+            self.stream_generate = self._stream_generate
+        self._generation_stream = None
 
         if hasattr(self.module, "config"):
             TransformerPolicy.hf_model_config = self.module.config
@@ -158,6 +162,9 @@ class InferenceEngine(Module):
                 self._apply_injection_policy(config)
             elif config.tensor_parallel.tp_size > 1:
                 # 3. Automatic Tensor Parallelism
+                if config.load_tp_shards_path is not None:
+                    assert config.checkpoint is None, \
+                        "load_tp_shards_path replaces checkpoint loading, please do not pass both"
                 parser_dict = AutoTP.tp_parser(model)
                 print("AutoTP: ", parser_dict)
                 for client_module, injection_policy in parser_dict:
@@ -175,6 +182,21 @@ class InferenceEngine(Module):
         else:
             self.module.to(device)
 
+        if self._autotp_applied(config):
+            if config.load_tp_shards_path is not None:
+                load_tp_shards(self.module,
+                               config.load_tp_shards_path,
+                               config.tensor_parallel.tp_size,
+                               mp_group=self.mp_group,
+                               dtype=config.dtype,
+                               mmap=config.checkpoint_mmap)
+            if config.save_tp_shards_path is not None:
+                save_tp_shards(self.module,
+                               config.save_tp_shards_path,
+                               config.tensor_parallel.tp_size,
+                               mp_group=self.mp_group,
+                               dtype=config.dtype)
+
         if config.tensor_parallel.tp_size > 1:
             _rng_state = get_accelerator().get_rng_state().to(get_accelerator().current_device_name())
             dist.broadcast(_rng_state, 0)
@@ -186,6 +208,9 @@ class InferenceEngine(Module):
         # Check if local CUDA graphs can be created in replacement modules
         self.local_cuda_graph = self._local_cuda_graph_used(self.module)
 
+    def _autotp_applied(self, config):
+        return not self.injection_dict and not config.replace_with_kernel_inject and config.tensor_parallel.tp_size > 1
+
     def destroy(self):
         # Have to import here because inference_module is a global, but python
         # globals only work at the module level and will not be updated unless
@@ -634,3 +659,25 @@ class InferenceEngine(Module):
                     )
 
         return self.module.generate(*inputs, **kwargs)
+
+    def _stream_generate(self, *inputs, skip_prompt=True, timeout=None, **kwargs):
+        """Start ``generate`` and stream its tokens as each decode step completes
+
+        Arguments:
+            *inputs: Variable length input list, as for ``generate``
+            skip_prompt: If True, the prompt is not yielded before the generated tokens
+            timeout: Seconds to wait for a token before ``queue.Empty`` is raised, or None to wait indefinitely
+            **kwargs: variable length keyword arguments, as for ``generate``
+
+        Returns:
+            A ``GenerationStream`` yielding the new token ids of every step. Call ``cancel()`` on it to stop
+            generation at the next step.
+        """
+        if "streamer" in kwargs:
+            raise ValueError("stream_generate provides its own streamer, `streamer` cannot be passed to it")
+        # The injected modules keep a single KV-cache, so only one generation may run at a time.
+        if self._generation_stream is not None and self._generation_stream.running:
+            raise RuntimeError("A streamed generation is still running, consume or close it before starting another")
+
+        self._generation_stream = GenerationStream(skip_prompt=skip_prompt, timeout=timeout)
+        return self._generation_stream.start(self._generate, *inputs, **kwargs)
@@ -0,0 +1,154 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+import torch
+
+from deepspeed.accelerator import get_accelerator
+
+_END_OF_STREAM = object()
+
+
+class _GenerationCancelled(Exception):
+    pass
+
+
+class GenerationStream:
+    """
+    Iterator over the tokens of a running ``generate`` call, yielding the new token ids of every
+    decode step as soon as the step completes.
+
+    The stream implements the HuggingFace streamer interface (``put``/``end``) and is passed to
+    ``generate`` as its ``streamer``. Generation runs in a background thread so the caller can
+    consume tokens while decoding proceeds. Tokens are produced by the wrapped module, so the
+    kernel-injected layers (and their CUDA graphs, if enabled) of the engine are used unchanged.
+
+    Streams that are abandoned before the end should be closed, e.g. by using them as a context
+    manager, so decoding does not continue in the background:
+
+        with engine.stream_generate(input_ids, max_new_tokens=64) as stream:
+            for tokens in stream:
+                if should_stop(tokens):
+                    break
+
+    Arguments:
+        skip_prompt (bool): If True, the prompt that ``generate`` echoes to its streamer before
+            the first decode step is not yielded.
+        timeout (Optional[float]): Seconds to wait for the next token before ``queue.Empty`` is
+            raised. Waits indefinitely if None.
+    """
+
+    def __init__(self, skip_prompt: bool = True, timeout: Optional[float] = None) -> None:
+        self._skip_prompt = skip_prompt
+        self._timeout = timeout
+
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._prompt_seen = False
+        self._thread = None
+        self._finished = False
+        self._output = None
+        self._error = None
+
+    def start(self, generate_fn: Callable[..., Any], *inputs, **kwargs) -> "GenerationStream":
+        """
+        Run ``generate_fn(*inputs, streamer=self, **kwargs)`` in a background thread.
+        """
+        if self._thread is not None:
+            raise RuntimeError("GenerationStream has already been started")
+
+        device = get_accelerator().current_device()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(device, generate_fn, inputs, kwargs),
+                                        name="ds-generation-stream",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self, device, generate_fn: Callable[..., Any], inputs, kwargs) -> None:
+        try:
+            # The current device is thread-local, so generate on the device of the caller.
+            get_accelerator().set_device(device)
+            self._output = generate_fn(*inputs, streamer=self, **kwargs)
+        except _GenerationCancelled:
+            pass
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._queue.put(_END_OF_STREAM)
+
+    def put(self, value: torch.Tensor) -> None:
+        """
+        Called by ``generate`` with the prompt and then with the token ids of every decode step.
+        Raising here is the only way to interrupt ``generate``, so cancellation takes effect at
+        the next decode step.
+        """
+        if self._cancelled.is_set():
+            raise _GenerationCancelled()
+        if self._skip_prompt and not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self._queue.put(value)
+
+    def end(self) -> None:
+        """
+        Called by ``generate`` after the last decode step. The stream ends when ``generate``
+        returns, so its output is available to ``output`` once iteration stops.
+        """
+        pass
+
+    def __iter__(self) -> "GenerationStream":
+        return self
+
+    def __next__(self) -> torch.Tensor:
+        if self._finished:
+            raise StopIteration
+
+        value = self._queue.get(timeout=self._timeout)
+        if value is _END_OF_STREAM:
+            self._finished = True
+            self._thread.join()
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+        return value
+
+    def cancel(self) -> None:
+        """
+        Stop generation at the next decode step. Tokens already produced can still be consumed.
+        """
+        self._cancelled.set()
+
+    def close(self) -> None:
+        """
+        Cancel generation and wait for the background thread to exit.
+        """
+        self.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def output(self) -> Any:
+        """
+        The return value of ``generate``. None while generation is running or if it was cancelled.
+        """
+        return self._output
+
+    def __enter__(self) -> "GenerationStream":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
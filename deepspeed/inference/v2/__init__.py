@@ -2,6 +2,12 @@
 # SPDX-License-Identifier: Apache-2.0
 
 # DeepSpeed Team
-from .config_v2 import RaggedInferenceEngineConfig, DeepSpeedTPConfig
+from .config_v2 import RaggedInferenceEngineConfig, DeepSpeedTPConfig, LoRAConfig, TelemetryConfig
 from .engine_v2 import InferenceEngineV2
 from .engine_factory import build_hf_engine, build_engine_from_ds_checkpoint
+from .scheduler import (ContinuousBatchingScheduler, FCFSPolicy, ShortestPromptFirstPolicy, ChunkedPrefillPolicy,
+                        SchedulingPolicy)
+from .speculative import SpeculativeDecoder
+from .sampling import BatchedSampler, SamplingParams
+from .telemetry import EngineTelemetry, StepTelemetry, TelemetryRingBuffer
+from .lora import LoRAAdapter
@@ -6,3 +6,4 @@
 from .base_engine import CheckpointEngineBase
 from .in_memory_engine import InMemoryModelEngine
 from .huggingface_engine import HuggingFaceCheckpointEngine
+from .shard_loader import ShardedCheckpointLoader
@@ -7,20 +7,55 @@ import os
 import json
 import torch
 from .base_engine import CheckpointEngineBase
-from typing import Iterable, Tuple
-from functools import partial
+from .shard_loader import ParamFilter, ShardedCheckpointLoader
+from deepspeed.utils.torch import required_torch_version
+from typing import Dict, Iterable, Optional, Tuple
 
-from ..logging import inference_logger
+
+def _load_bin(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Load a PyTorch checkpoint shard. The shard is memory-mapped when possible so that tensor parallel
+    ranks only copy the slices of the parameters they own.
+    """
+    if required_torch_version(min_version=2.1):
+        try:
+            return torch.load(path, map_location="cpu", mmap=True)
+        except RuntimeError:
+            # Shards saved in the legacy (non zipfile) format cannot be memory-mapped.
+            pass
+    return torch.load(path, map_location="cpu")
 
 
 class HuggingFaceCheckpointEngine(CheckpointEngineBase):
 
-    def __init__(self, model_name_or_path: str, auth_token: str = None) -> None:
+    def __init__(self,
+                 model_name_or_path: str,
+                 auth_token: str = None,
+                 prefetch_shards: int = 1,
+                 param_filter: Optional[ParamFilter] = None,
+                 local_rank: int = 0,
+                 local_world_size: int = 1) -> None:
+        """
+        Arguments:
+            model_name_or_path: HuggingFace model name or local checkpoint directory.
+            auth_token: Token used to download gated models from the HuggingFace Hub.
+            prefetch_shards: Number of checkpoint shards to read ahead of the one being consumed.
+                Safetensors shards are memory-mapped and read ahead into the page cache.
+            param_filter: Selects the parameters needed by the local rank, parameters it rejects
+                are never read. By default all parameters are loaded.
+            local_rank: Rank of this process among the tensor parallel ranks of the host.
+            local_world_size: Number of tensor parallel ranks of the host. The ranks split the
+                read-ahead of each shard between them since they share the page cache.
+        """
         super().__init__()
         from transformers import AutoConfig, GenerationConfig
 
         self.model_name_or_path = model_name_or_path
         self.auth_token = auth_token
+        self.prefetch_shards = prefetch_shards
+        self.param_filter = param_filter
+        self.local_rank = local_rank
+        self.local_world_size = local_world_size
         self.model_config = AutoConfig.from_pretrained(self.model_name_or_path)
         # Define this property here so we can use it in the model implementation
         if not hasattr(self.model_config, "max_seq_length"):
@@ -76,11 +111,12 @@ class HuggingFaceCheckpointEngine(CheckpointEngineBase):
             from safetensors.torch import load_file
             model_param_json_fname = "model.safetensors.index.json"
             model_file_fname = "model.safetensors"
+            # Only used for eager loading, ``parameters`` memory-maps safetensors shards.
             self._checkpoint_load_fn = load_file
         else:
             model_param_json_fname = "pytorch_model.bin.index.json"
             model_file_fname = "pytorch_model.bin"
-            self._checkpoint_load_fn = partial(torch.load, map_location="cpu")
+            self._checkpoint_load_fn = _load_bin
 
         model_param_json = os.path.join(self._local_checkpoint_dir, model_param_json_fname)
 
@@ -93,8 +129,8 @@ class HuggingFaceCheckpointEngine(CheckpointEngineBase):
             # weight_map -> { "lm_head.weight": "pytorch_model-00002-of-00002.bin", ... }
             weight_map = param_map["weight_map"]
 
-            # unique set of all checkpoint files
-            all_checkpoint_files = set(weight_map.values())
+            # unique set of all checkpoint files, in a deterministic order so ranks read them in lockstep
+            all_checkpoint_files = sorted(set(weight_map.values()))
 
             # get absolute path of all unique checkpoint files
             all_checkpoint_files = [os.path.join(self._local_checkpoint_dir, f) for f in all_checkpoint_files]
@@ -105,15 +141,13 @@ class HuggingFaceCheckpointEngine(CheckpointEngineBase):
         """
         Generator of model parameters (satisfies the CheckpointEngineBase interface).
         """
-        for checkpoint in self._all_ckpt_paths:
-            inference_logger().info(f"Loading checkpoint: {checkpoint}")
-            checkpoint_sd = self._checkpoint_load_fn(checkpoint)
-            param_keys = list(checkpoint_sd.keys())
-            for param_name in param_keys:
-                param = checkpoint_sd[param_name]
-                yield param_name, param
-
-            del checkpoint_sd
+        loader = ShardedCheckpointLoader(self._all_ckpt_paths,
+                                         load_fn=self._checkpoint_load_fn,
+                                         prefetch_shards=self.prefetch_shards,
+                                         param_filter=self.param_filter,
+                                         local_rank=self.local_rank,
+                                         local_world_size=self.local_world_size)
+        yield from loader.parameters()
 
 
 if __name__ == "__main__":
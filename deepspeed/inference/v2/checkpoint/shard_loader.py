@@ -0,0 +1,220 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import json
+import os
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import torch
+
+from ..logging import inference_logger
+
+ParamFilter = Callable[[str], bool]
+"""
+Returns whether the local rank needs the parameter with the given name. Parameters that are
+rejected are never read from disk.
+"""
+
+READAHEAD_CHUNK_BYTES = 64 * 1024 * 1024
+"""
+Granularity at which shard contents are pulled into the page cache when ``posix_fadvise`` is
+unavailable.
+"""
+
+
+def safetensors_data_ranges(path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse the header of a safetensors file.
+
+    Arguments:
+        path (str): Path to the safetensors file.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: The absolute [start, end) byte range of each tensor in the file.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+
+    data_start = 8 + header_size
+    return {
+        name: (data_start + info["data_offsets"][0], data_start + info["data_offsets"][1])
+        for name, info in header.items() if name != "__metadata__"
+    }
+
+
+def _readahead(path: str, ranges: Iterable[Tuple[int, int]]) -> None:
+    """
+    Pull the given byte ranges of a file into the page cache so that later accesses through a
+    memory map do not block on disk reads.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for start, end in ranges:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, start, end - start, os.POSIX_FADV_WILLNEED)
+            else:
+                os.lseek(fd, start, os.SEEK_SET)
+                remaining = end - start
+                while remaining > 0:
+                    n_read = len(os.read(fd, min(remaining, READAHEAD_CHUNK_BYTES)))
+                    if n_read == 0:
+                        break
+                    remaining -= n_read
+    finally:
+        os.close(fd)
+
+
+def _coalesce(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Merge adjacent or overlapping byte ranges.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _partition(ranges: List[Tuple[int, int]], rank: int, world_size: int) -> List[Tuple[int, int]]:
+    """
+    Split sorted, non-overlapping byte ranges into ``world_size`` parts of (nearly) equal size and
+    return the ``rank``-th one.
+    """
+    total = sum(end - start for start, end in ranges)
+    part_start = total * rank // world_size
+    part_end = total * (rank + 1) // world_size
+
+    partition = []
+    offset = 0
+    for start, end in ranges:
+        lo = max(part_start - offset, 0)
+        hi = min(part_end - offset, end - start)
+        if hi > lo:
+            partition.append((start + lo, start + hi))
+        offset += end - start
+    return partition
+
+
+class ShardedCheckpointLoader:
+    """
+    Streams the tensors of a checkpoint split across several shard files.
+
+    Safetensors shards are memory-mapped and tensors are yielded lazily as views of the mapping,
+    so only the bytes that are actually used are read. In particular, tensor parallel ranks that
+    slice their partition out of a parameter only copy the slice they own. While the tensors of one
+    shard are being consumed, a thread pool reads ahead the next shards into the page cache,
+    overlapping disk reads with sharding and host-to-device copies. Since the page cache is shared,
+    the ranks on a host split the read-ahead of each shard between them (see ``local_rank``), so each
+    shard is read from disk only once and no rank reads ahead a whole shard.
+
+    Other formats are loaded by ``load_fn``, in which case the next shards are loaded in the
+    background instead.
+    """
+
+    def __init__(self,
+                 checkpoint_files: List[str],
+                 load_fn: Optional[Callable[[str], Dict[str, torch.Tensor]]] = None,
+                 prefetch_shards: int = 1,
+                 param_filter: Optional[ParamFilter] = None,
+                 local_rank: int = 0,
+                 local_world_size: int = 1) -> None:
+        """
+        Arguments:
+            checkpoint_files (List[str]): Paths of the shards in the order they should be read.
+            load_fn (Callable[[str], Dict[str, torch.Tensor]]): Loader for shards that are not in
+                the safetensors format.
+            prefetch_shards (int): Number of shards to read ahead of the one being consumed. 0
+                disables prefetching.
+            param_filter (ParamFilter): Selects the parameters needed by the local rank. By default
+                all parameters are loaded.
+            local_rank (int): Rank of this process among the processes of the host loading the same
+                checkpoint, i.e. its tensor parallel rank.
+            local_world_size (int): Number of processes of the host loading the same checkpoint. Each
+                one reads ahead its own part of the wanted bytes of each safetensors shard.
+        """
+        if prefetch_shards < 0:
+            raise ValueError(f"Number of shards to prefetch must be non-negative, provided {prefetch_shards}")
+
+        if local_rank < 0 or local_rank >= local_world_size:
+            raise ValueError(f"Invalid local rank {local_rank} for {local_world_size} processes")
+
+        self._checkpoint_files = list(checkpoint_files)
+        self._load_fn = load_fn
+        self._prefetch_shards = prefetch_shards
+        self._param_filter = param_filter
+        self._local_rank = local_rank
+        self._local_world_size = local_world_size
+
+    def _wanted(self, name: str) -> bool:
+        return self._param_filter is None or self._param_filter(name)
+
+    def _open_shard(self, path: str) -> Tuple[List[str], Callable[[str], torch.Tensor]]:
+        """
+        Open a shard and bring its contents into memory. Runs on the prefetch threads.
+
+        Returns:
+            Tuple[List[str], Callable[[str], torch.Tensor]]: The names of the wanted parameters of
+                the shard and an accessor for them.
+        """
+        if path.endswith(".safetensors"):
+            from safetensors import safe_open
+
+            ranges = safetensors_data_ranges(path)
+            names = [name for name in ranges if self._wanted(name)]
+            wanted = _coalesce([ranges[name] for name in names])
+            _readahead(path, _partition(wanted, self._local_rank, self._local_world_size))
+
+            handle = safe_open(path, framework="pt", device="cpu")
+            return names, handle.get_tensor
+
+        if self._load_fn is None:
+            raise ValueError(f"No loader provided for checkpoint shard {path}")
+
+        state_dict = self._load_fn(path)
+        names = [name for name in state_dict.keys() if self._wanted(name)]
+        return names, state_dict.__getitem__
+
+    def parameters(self) -> Iterable[Tuple[str, torch.Tensor]]:
+        """
+        Generator of the ``(name, tensor)`` pairs of the wanted parameters, shard by shard.
+        """
+        if self._prefetch_shards == 0:
+            for path in self._checkpoint_files:
+                inference_logger().info(f"Loading checkpoint: {path}")
+                names, get_tensor = self._open_shard(path)
+                for name in names:
+                    yield name, get_tensor(name)
+            return
+
+        with ThreadPoolExecutor(max_workers=self._prefetch_shards,
+                                thread_name_prefix="ds_checkpoint_prefetch") as pool:
+            pending: Deque[Future] = deque()
+            next_shard = 0
+
+            def _submit_up_to(n_ahead: int) -> None:
+                nonlocal next_shard
+                while len(pending) < n_ahead and next_shard < len(self._checkpoint_files):
+                    pending.append(pool.submit(self._open_shard, self._checkpoint_files[next_shard]))
+                    next_shard += 1
+
+            try:
+                _submit_up_to(self._prefetch_shards + 1)
+                for path in self._checkpoint_files:
+                    inference_logger().info(f"Loading checkpoint: {path}")
+                    names, get_tensor = pending.popleft().result()
+                    _submit_up_to(self._prefetch_shards + 1)
+                    for name in names:
+                        yield name, get_tensor(name)
+                    del get_tensor
+            finally:
+                # Don't load shards that will never be consumed if the generator is closed early.
+                for future in pending:
+                    future.cancel()
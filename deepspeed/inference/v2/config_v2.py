@@ -3,9 +3,10 @@
 
 # DeepSpeed Team
 
-from typing import Optional
+from typing import Optional, Tuple
 from deepspeed.pydantic_v1 import Field
 from deepspeed.runtime.config_utils import DeepSpeedConfigModel
+from deepspeed.monitor.config import DeepSpeedMonitorConfig
 from .ragged import DSStateManagerConfig
 
 
@@ -26,6 +27,77 @@ class QuantizationConfig(DeepSpeedConfigModel):
     # TODO: may reuse the constants in deepspeed/compression/constants.py
 
 
+class KernelTuningConfig(DeepSpeedConfigModel):
+    """ Configure calibration-based selection of module implementations """
+
+    cache_path: Optional[str] = None
+    """
+    Path to the on-disk tuning cache. Module implementations recorded in the cache for the model's
+    shapes and data types are used instead of the static heuristics. The cache should not be
+    shared between different accelerator types.
+    """
+
+    calibrate: bool = False
+    """
+    On a tuning cache miss, time each interchangeable implementation for the module's shapes and
+    record the fastest in the cache. Requires ``cache_path``. Modules with a single implementation
+    supporting their config are not calibrated. This is currently the case for every module: the
+    only floating point linear implementation is ``blas_fp_linear`` and the attention and MoE
+    modules have no alternatives, so calibration has no effect until another implementation is
+    registered.
+    """
+
+    batch_buckets: Tuple[int, ...] = (1, 16, 128, 1024)
+    """ Numbers of tokens per forward to time during calibration. """
+
+    iterations: int = 10
+    """ Number of timed runs per implementation and batch bucket. """
+
+    model_key: str = ""
+    """ Identifier of the model (i.e. its name or path), included in the tuning cache keys. """
+
+
+class LoRAConfig(DeepSpeedConfigModel):
+    """ Configure serving of LoRA adapters """
+
+    max_cached_adapters: int = 8
+    """
+    Maximum number of adapters resident in device memory. This bounds the number of distinct
+    adapters a single batch may use.
+    """
+
+    targets: Tuple[str, ...] = ("qkv", "attn_out", "mlp_2")
+    """
+    Linear layers of the model that adapters may update. Layers with a fused activation
+    (i.e. ``mlp_1``) are not supported.
+    """
+
+
+class TelemetryConfig(DeepSpeedConfigModel):
+    """ Configure per-step telemetry of the inference engine """
+
+    enabled: bool = False
+    """ Whether to record telemetry for every forward of the engine. """
+
+    buffer_size: int = 1024
+    """ Number of most recent steps kept in the in-process ring buffer. """
+
+    synchronize: bool = True
+    """
+    Synchronize the accelerator at the boundary of each phase of a step so that timings reflect
+    device execution rather than kernel launches. This adds a small overhead per step.
+    """
+
+    monitor: DeepSpeedMonitorConfig = {}
+    """
+    Monitor backends (TensorBoard, WandB, CSV) to write step telemetry to. Expects a dictionary
+    containing values for :any:`DeepSpeedMonitorConfig`.
+    """
+
+    monitor_interval: int = 1
+    """ Write telemetry of every n-th step to the monitor backends. """
+
+
 class RaggedInferenceEngineConfig(DeepSpeedConfigModel):
     """ Sets parameters for DeepSpeed Inference Engine. """
 
@@ -41,3 +113,21 @@ class RaggedInferenceEngineConfig(DeepSpeedConfigModel):
     """
 
     quantization: QuantizationConfig = {}
+
+    kernel_tuning: KernelTuningConfig = {}
+    """
+    Configuration for calibration-based selection of module implementations. Expects a dictionary
+    containing values for :any:`KernelTuningConfig`.
+    """
+
+    lora: LoRAConfig = {}
+    """
+    Configuration for serving LoRA adapters. Expects a dictionary containing values for
+    :any:`LoRAConfig`.
+    """
+
+    telemetry: TelemetryConfig = {}
+    """
+    Configuration for per-step telemetry. Expects a dictionary containing values for
+    :any:`TelemetryConfig`.
+    """
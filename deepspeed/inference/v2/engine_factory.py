@@ -7,11 +7,13 @@ import json
 import logging
 import os
 import pickle
+from typing import Optional
 from packaging import version
 
 from .engine_v2 import InferenceEngineV2
 from .config_v2 import RaggedInferenceEngineConfig
 from .checkpoint import HuggingFaceCheckpointEngine
+from .checkpoint.shard_loader import ParamFilter
 from .logging import inference_logger
 from .model_implementations import (
     OPTPolicy,
@@ -29,7 +31,8 @@ from .model_implementations.flat_model_helpers import make_metadata_filename, Mo
 
 def build_engine_from_ds_checkpoint(path: str,
                                     engine_config: RaggedInferenceEngineConfig,
-                                    debug_level: int = logging.INFO) -> InferenceEngineV2:
+                                    debug_level: int = logging.INFO,
+                                    mmap: bool = False) -> InferenceEngineV2:
     """
     Creates an engine from a checkpoint saved by ``InferenceEngineV2``.
 
@@ -39,6 +42,9 @@ def build_engine_from_ds_checkpoint(path: str,
         engine_config: Engine configuration. See ``RaggedInferenceEngineConfig`` for details.
         debug_level: Logging level to use. Unless you are actively seeing issues, the recommended
             value is ``logging.INFO``.
+        mmap: Memory-map the serialized parameters of each rank instead of reading them. This
+            makes restarts of a replica on the same host nearly free, since the parameters are
+            served from the page cache shared by all processes. Requires torch >= 2.1.
 
     Returns:
         Fully initialized inference engine ready to serve queries.
@@ -59,14 +65,16 @@ def build_engine_from_ds_checkpoint(path: str,
 
     # Load the model config
     model_config = pickle.load(open(os.path.join(path, "ds_model_config.pkl"), "rb"))
-    policy = policy_cls(model_config, inf_checkpoint_path=path)
+    policy = policy_cls(model_config, inf_checkpoint_path=path, mmap_checkpoint=mmap)
 
     return InferenceEngineV2(policy, engine_config)
 
 
 def build_hf_engine(path: str,
                     engine_config: RaggedInferenceEngineConfig,
-                    debug_level: int = logging.INFO) -> InferenceEngineV2:
+                    debug_level: int = logging.INFO,
+                    mmap: bool = False,
+                    param_filter: Optional[ParamFilter] = None) -> InferenceEngineV2:
     """
     Build an InferenceV2 engine for HuggingFace models. This can accept both a HuggingFace
     model name or a path to an Inference-V2 checkpoint.
@@ -77,18 +85,27 @@ def build_hf_engine(path: str,
         engine_config: Engine configuration. See ``RaggedInferenceEngineConfig`` for details.
         debug_level: Logging level to use. Unless you are actively seeing issues, the recommended
             value is ``logging.INFO``.
+        mmap: Memory-map the parameters when ``path`` is an Inference-V2 checkpoint. See
+            ``build_engine_from_ds_checkpoint``.
+        param_filter: Selects the parameters of a HuggingFace checkpoint that are loaded, i.e. to
+            skip parameters the model does not use. Rejected parameters are never read.
 
     Returns:
         Fully initialized inference engine ready to serve queries.
     """
 
     if os.path.exists(os.path.join(path, "ds_model_config.pkl")):
-        return build_engine_from_ds_checkpoint(path, engine_config, debug_level=debug_level)
+        return build_engine_from_ds_checkpoint(path, engine_config, debug_level=debug_level, mmap=mmap)
     else:
         # Set up logging
         inference_logger(level=debug_level)
-        # get HF checkpoint engine
-        checkpoint_engine = HuggingFaceCheckpointEngine(path)
+        # get HF checkpoint engine. The checkpoint shards are memory-mapped and each tensor parallel
+        # rank only copies the slices it owns, so the ranks of the host share the read-ahead.
+        tp_size = engine_config.tensor_parallel.tp_size
+        checkpoint_engine = HuggingFaceCheckpointEngine(path,
+                                                        param_filter=param_filter,
+                                                        local_rank=int(os.getenv("LOCAL_RANK", 0)) % tp_size,
+                                                        local_world_size=tp_size)
 
         # get model config from HF AutoConfig
         model_config = checkpoint_engine.model_config
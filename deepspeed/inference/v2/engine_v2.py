@@ -6,7 +6,7 @@
 import os
 import json
 import pickle
-from typing import Iterable, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import torch
 
@@ -17,10 +17,13 @@ from deepspeed.comm.comm import init_distributed
 
 from .model_implementations import InferenceV2Policy
 from .logging import inference_logger
-from .ragged import DSStateManager, RaggedBatchWrapper, PlaceholderSequenceDescriptor
-from .scheduling_utils import SchedulingError, SchedulingResult
+from .ragged import (DSStateManager, KVCacheOccupancy, RaggedBatchWrapper, PlaceholderSequenceDescriptor,
+                     PreemptedSequence)
+from .scheduling_utils import BatchReservation, SchedulingError, SchedulingResult
 from .model_implementations.flat_model_helpers import make_param_filename, make_metadata_filename
 from .model_implementations.inference_model_base import DSInferenceModelBase
+from .telemetry import EngineTelemetry, StepTelemetry
+from .lora import LoRAAdapter, LoRAManager
 
 from .config_v2 import RaggedInferenceEngineConfig
 
@@ -44,6 +47,21 @@ class InferenceEngineV2:
     Persistent state manager for sequences and KV-cache.
     """
 
+    _telemetry: Optional[EngineTelemetry]
+    """
+    Per-step telemetry collector. Only present when telemetry is enabled in the config.
+    """
+
+    _lora: Optional[LoRAManager]
+    """
+    Manager of the registered LoRA adapters. Created when the first adapter is registered.
+    """
+
+    _seq_adapters: Dict[int, int]
+    """
+    LoRA adapter of each tracked sequence that does not run the base model.
+    """
+
     @property
     def free_blocks(self) -> torch.Tensor:
         """
@@ -59,6 +77,20 @@ class InferenceEngineV2:
         """
         return self._state_manager.n_kv_cache_groups
 
+    @property
+    def config(self) -> RaggedInferenceEngineConfig:
+        """
+        The engine configuration.
+        """
+        return self._config
+
+    @property
+    def telemetry(self) -> Optional[EngineTelemetry]:
+        """
+        Per-step telemetry of the engine, or ``None`` if telemetry is disabled in the config.
+        """
+        return self._telemetry
+
     def model(self) -> DSInferenceModelBase:
         """
         The model implementation.
@@ -90,6 +122,11 @@ class InferenceEngineV2:
                                              base_mp_group=self._base_mp_group)
         self._model.set_state_manager(self._state_manager)
 
+        self._telemetry = EngineTelemetry(self._config.telemetry) if self._config.telemetry.enabled else None
+
+        self._lora = None
+        self._seq_adapters = {}
+
     def _initialize_tp_group(self):
         """
         Implementation of our TP group initialization.
@@ -107,54 +144,187 @@ class InferenceEngineV2:
     def put(self,
             batch_uids: Iterable[int],
             batch_tokens: Iterable[torch.Tensor],
-            do_checks: bool = True) -> torch.Tensor:
+            do_checks: bool = True,
+            all_token_logits: bool = False,
+            adapter_ids: Optional[Iterable[Optional[int]]] = None) -> torch.Tensor:
         """
         Put a ragged batch onto the inference engine. This will perform one forward and return
         a Tensor of the shape [len(batch_uids), *output_shape]. Logits for the non-final tokens
-        are not calculated.
+        are not calculated unless ``all_token_logits`` is set.
 
         Arguments:
             batch_uids: Iterable of uids for the batch on the host
             batch_tokens: Iterable of token tensors for the batch on the host
             do_checks: Check schedulability when it is set to True. You can skip this check for better performance when it has already been completed.
+            all_token_logits: Return logits for every token of the batch, in batch order, as a Tensor of
+                shape [total_tokens, *output_shape]. Used to verify several tokens of a sequence in a
+                single forward (i.e. speculative decoding). Only supported without tensor parallelism.
+            adapter_ids: The LoRA adapter of each sequence, ``None`` to run the base model. The adapter of
+                a sequence is bound when it is created and is used for all of its forwards, so it only
+                needs to be provided for new sequences.
         """
+        if all_token_logits and self._model.tp_size > 1:
+            raise NotImplementedError("Logits for all tokens are not supported with tensor parallelism.")
+
+        step = self._telemetry.begin_step() if self._telemetry is not None else None
+
+        batch_adapters = self._resolve_adapters(batch_uids, adapter_ids)
 
         if do_checks:
             token_lens = [len(tokens) for tokens in batch_tokens]
             schedule_check = self.can_schedule(batch_uids, token_lens)
+            if schedule_check == SchedulingResult.KVCacheLimitExceeded and self.preempt_for(batch_uids, token_lens):
+                schedule_check = self.can_schedule(batch_uids, token_lens)
             if schedule_check != SchedulingResult.Success:
                 raise SchedulingError(schedule_check)
+            if step is not None:
+                step.mark("schedule")
 
         self._batch.clear()
-        for uid, tokens in zip(batch_uids, batch_tokens):
+        host_seq_descs = []
+        forward_tokens = []
+        prefix_cache_hits = 0
+        prefix_cache_hit_tokens = 0
+        for uid, tokens, adapter_id in zip(batch_uids, batch_tokens, batch_adapters):
+
+            if self._state_manager.is_parked(uid):
+                self._state_manager.resume_sequence(uid)
+
+            is_new = self._state_manager.get_sequence(uid) is None
+            # KV values depend on the adapter, so only base model sequences share cached prefixes.
+            host_seq_desc = self._state_manager.get_or_create_sequence(uid, tokens if adapter_id is None else None)
+            if is_new and adapter_id is not None:
+                self._seq_adapters[uid] = adapter_id
+            if is_new and host_seq_desc.seen_tokens > 0:
+                # The leading tokens were attached from the prefix cache and need no recompute.
+                tokens = tokens[host_seq_desc.seen_tokens:]
+                prefix_cache_hits += 1
+                prefix_cache_hit_tokens += host_seq_desc.seen_tokens
+            forward_tokens.append(tokens)
 
-            host_seq_desc = self._state_manager.get_or_create_sequence(uid)
             self._model.maybe_allocate_kv(host_seq_desc, tokens.numel())
             host_seq_desc.pre_forward(tokens.numel())
+            host_seq_descs.append(host_seq_desc)
 
-            # We can disable checks since we already validated schedulability.
-            self._batch.insert_sequence(host_seq_desc, tokens, do_checks=do_checks)
+        # We can disable checks since we already validated schedulability.
+        self._batch.insert_sequences(host_seq_descs, forward_tokens, do_checks=do_checks)
+        if step is not None:
+            step.mark("batch_build")
 
         # Send all metadata to the device
-        self._batch.finalize()
+        self._batch.finalize(all_token_logits=all_token_logits)
+        if step is not None:
+            step.mark("finalize")
 
         # Prep all data structures for the actual forward (in anticipation of CG in the future)
         # and also to amortize some of the costs in a more straightforward way.
         self._model.prepare_batch(self._batch)
 
+        if self._lora is not None:
+            self._lora.prepare(batch_adapters, [tokens.numel() for tokens in forward_tokens])
+
         # Model implementation will pick up in the forward.
         logits = self._model.forward(self._batch)
 
         # We return one set of logits per sequence in the batch (saves cost on unembedding)
-        assert logits.shape[0] == self._batch.current_sequences
-
-        for uid in batch_uids:
+        if all_token_logits:
+            assert logits.shape[0] == self._batch.current_tokens
+        else:
+            assert logits.shape[0] == self._batch.current_sequences
+        if step is not None:
+            step.mark("forward")
+
+        for uid, tokens, adapter_id in zip(batch_uids, forward_tokens, batch_adapters):
             host_seq_desc = self._state_manager.get_sequence(uid)
             host_seq_desc.post_forward()  # Updates sequence metadata.
+            if adapter_id is None:
+                self._state_manager.cache_prefix_blocks(host_seq_desc, tokens)
             self._model.maybe_free_kv(host_seq_desc)
 
+        if step is not None:
+            step.mark("post_forward")
+            step.prefix_cache_hits = prefix_cache_hits
+            step.prefix_cache_hit_tokens = prefix_cache_hit_tokens
+            self._record_step(step)
+
         return logits
 
+    def _record_step(self, step: StepTelemetry) -> None:
+        """
+        Fill in the batch and KV-cache counters of a completed step and publish it.
+        """
+        step.n_tokens = self._batch.current_tokens
+        step.n_sequences = self._batch.current_sequences
+        step.n_tracked_sequences = self._state_manager.n_tracked_sequences
+        step.free_blocks = tuple(int(free) for free in self._state_manager.free_blocks)
+        step.kv_fragmentation = self._state_manager.kv_fragmentation()
+        self._telemetry.end_step(step)
+
+    def _resolve_adapters(self, batch_uids: Iterable[int],
+                          adapter_ids: Optional[Iterable[Optional[int]]]) -> List[Optional[int]]:
+        """
+        Determine the LoRA adapter of each sequence of a batch, validating requested adapters against
+        the ones bound to existing sequences and the number of adapters that may be resident. This is
+        done before any state of the batch is modified.
+        """
+        if adapter_ids is None:
+            batch_adapters = [self._seq_adapters.get(uid, None) for uid in batch_uids]
+            self._check_adapter_capacity(batch_adapters)
+            return batch_adapters
+
+        batch_adapters = []
+        for uid, adapter_id in zip(batch_uids, adapter_ids):
+            if self._state_manager.get_sequence(uid) is not None:
+                bound = self._seq_adapters.get(uid, None)
+                if adapter_id is not None and adapter_id != bound:
+                    raise ValueError(f"Sequence {uid} is bound to LoRA adapter {bound}, requested {adapter_id}.")
+                adapter_id = bound
+            elif adapter_id is not None and (self._lora is None or not self._lora.has_adapter(adapter_id)):
+                raise ValueError(f"LoRA adapter {adapter_id} is not registered.")
+            batch_adapters.append(adapter_id)
+        self._check_adapter_capacity(batch_adapters)
+        return batch_adapters
+
+    def _check_adapter_capacity(self, batch_adapters: List[Optional[int]]) -> None:
+        """
+        Raise if a batch uses more distinct LoRA adapters than may be resident at once.
+        """
+        n_adapters = len(set(batch_adapters) - {None})
+        if n_adapters > 0 and n_adapters > self._lora.cache.capacity:
+            raise ValueError(f"Batch uses {n_adapters} LoRA adapters but only {self._lora.cache.capacity} may be "
+                             "resident, see LoRAConfig.max_cached_adapters.")
+
+    def register_adapter(self, adapter_id: int, adapter: LoRAAdapter) -> None:
+        """
+        Register a LoRA adapter of the served model. Sequences using the adapter share the base weights
+        and may be batched with sequences using other adapters or the base model. Adapters are copied
+        to device memory on demand and cached, see ``LoRAConfig``.
+
+        Arguments:
+            adapter_id (int): Identifier of the adapter, passed to ``put`` for sequences using it.
+            adapter (LoRAAdapter): The low-rank weights of the adapter.
+        """
+        if self._model.tp_size > 1:
+            raise NotImplementedError("LoRA adapters are not supported with tensor parallelism.")
+
+        if self._lora is None:
+            self._lora = LoRAManager(self._model, self._config.lora, get_accelerator().current_device())
+        self._lora.register_adapter(adapter_id, adapter)
+
+    def unregister_adapter(self, adapter_id: int) -> None:
+        """
+        Remove a LoRA adapter and release its device memory. The adapter must not be in use by any
+        tracked sequence.
+
+        Arguments:
+            adapter_id (int): Identifier of the adapter.
+        """
+        users = [uid for uid, bound in self._seq_adapters.items() if bound == adapter_id]
+        if users:
+            raise ValueError(f"LoRA adapter {adapter_id} is in use by sequences {users}.")
+        if self._lora is not None:
+            self._lora.unregister_adapter(adapter_id)
+
     def query(self, uid: int, max_request_tokens: int, max_request_blocks) -> Tuple[int, torch.Tensor]:
         """
         Determine the number of tokens and KV blocks to reserve for a given request. Given a UID
@@ -196,39 +366,80 @@ class InferenceEngineV2:
             bool: True if the batch can be scheduled, False otherwise.
         """
 
-        cur_seqs = self._state_manager.n_tracked_sequences
-        free_blocks = self._state_manager.free_blocks
-        req_blocks = 0
-        batch_len = 0
-
         if len(uids) > self._config.state_manager.max_ragged_sequence_count:
             # Can only compose a batch from a limited number of sequences
             return SchedulingResult.BatchSequenceLimitExceeded
 
+        reservation = self.create_reservation()
+        for uid, length in zip(uids, lengths):
+            reservation.add(uid, length)
+
+        return reservation.result
+
+    def create_reservation(self) -> BatchReservation:
+        """
+        Start building a proposal for the next batch. Candidate ``(uid, length)`` pairs can be added
+        to and removed from the returned reservation, which reports the ``SchedulingResult`` of the
+        proposal after each change in O(1). This is preferable to repeatedly calling ``can_schedule``
+        while composing a batch. The reservation is only valid until the engine state changes (i.e.
+        the next ``put`` or ``flush``).
+
+        Returns:
+            BatchReservation: An empty reservation against the current engine state.
+        """
+        return BatchReservation(self._state_manager, self._model, self._config.state_manager)
+
+    def preempt_for(self, uids: Iterable[int], lengths: Iterable[int]) -> List[int]:
+        """
+        Preempt tracked sequences outside of a proposed batch so that the batch fits the KV-cache,
+        according to the ``preemption`` policy of the state manager config. This is done by ``put``
+        when the checks are enabled. Preempted sequences are listed in ``preempted_sequences``:
+        swapped out ones are restored by the next ``put`` that includes them, released ones must be
+        put again with their full token history.
+
+        Arguments:
+            uids (Iterable[int]): Iterable of UIDs for the batch
+            lengths (Iterable[int]): Iterable of lengths for each sequence of the batch.
+
+        Returns:
+            List[int]: The UIDs of the preempted sequences, empty if the batch already fits or
+                cannot be made to fit by preemption.
+        """
+        reservation = self.create_reservation()
         for uid, length in zip(uids, lengths):
-            seq_desc = self._state_manager.get_sequence(uid)
-            if seq_desc is None:
-                cur_seqs += 1
-                seq_desc = PlaceholderSequenceDescriptor()
+            reservation.add(uid, length)
 
-            sched_len, sched_blocks = self._model.get_kv_requirements(seq_desc, length, free_blocks)
+        deficit = -reservation.free_blocks
+        if deficit <= 0:
+            return []
 
-            if sched_len != length:
-                # We ran out of KV cache
-                return SchedulingResult.KVCacheLimitExceeded
+        max_priority = max((self._state_manager.sequence_priority(uid) for uid in uids), default=0)
+        preempted = self._state_manager.preempt(deficit, exclude=uids, max_priority=max_priority)
+        return [seq.uid for seq in preempted]
 
-            batch_len += length
-            free_blocks -= sched_blocks
+    def set_priority(self, uid: int, priority: int) -> None:
+        """
+        Set the preemption priority of a sequence, which may not have been put yet. Sequences with a
+        higher priority are preempted later and re-admitted earlier. Defaults to 0.
 
-        if cur_seqs > self._config.state_manager.max_tracked_sequences:
-            # Would run out of tracking metadata
-            return SchedulingResult.EngineSequenceLimitExceeded
+        Arguments:
+            uid (int): The UID of the sequence.
+            priority (int): The priority of the sequence.
+        """
+        self._state_manager.set_sequence_priority(uid, priority)
 
-        if batch_len > self._config.state_manager.max_ragged_batch_size:
-            # Would exceed the maximum batch size
-            return SchedulingResult.BatchTokenLimitExceeded
+    @property
+    def preempted_sequences(self) -> Dict[int, PreemptedSequence]:
+        """
+        Preempted sequences awaiting re-admission, indexed by UID.
+        """
+        return self._state_manager.preempted_sequences
 
-        return SchedulingResult.Success
+    def readmission_order(self) -> List[int]:
+        """
+        The UIDs of the preempted sequences in the order they should be re-admitted.
+        """
+        return self._state_manager.readmission_order()
 
     def get_remaining_block_capacity(self, uid: int) -> int:
         """
@@ -247,6 +458,65 @@ class InferenceEngineV2:
             uid (int): The UID of the sequence to flush.
         """
         self._state_manager.flush_sequence(uid)
+        self._seq_adapters.pop(uid, None)
+
+    def truncate(self, uid: int, n_tokens: int) -> None:
+        """
+        Truncate a sequence to its first ``n_tokens`` tokens without flushing it, i.e. to trim a
+        generated stop sequence or prune a beam. KV blocks that no longer hold any of its tokens are
+        freed. The next ``put`` for the sequence continues from the truncated position.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+            n_tokens (int): The number of tokens to keep.
+        """
+        self._state_manager.truncate_sequence(uid, n_tokens)
+
+    def rollback(self, uid: int, n_tokens: int) -> None:
+        """
+        Discard the KV-cache state of the last ``n_tokens`` tokens of a sequence, such as rejected
+        speculative tokens, and free the KV blocks that are no longer needed.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+            n_tokens (int): The number of trailing tokens to discard.
+        """
+        self._state_manager.rollback_sequence(uid, n_tokens)
+
+    def park(self, uid: int) -> None:
+        """
+        Move the KV-cache of an idle sequence to host memory, freeing its accelerator KV blocks for
+        other sequences. The sequence is resumed automatically when it is next passed to ``put``, or
+        explicitly with ``resume``. Requires ``offload`` to be enabled in the state manager config.
+
+        Arguments:
+            uid (int): The UID of the sequence to park.
+        """
+        self._state_manager.park_sequence(uid)
+
+    def resume(self, uid: int) -> None:
+        """
+        Restore the KV-cache of a parked sequence to accelerator memory.
+
+        Arguments:
+            uid (int): The UID of the sequence to resume.
+        """
+        self._state_manager.resume_sequence(uid)
+
+    @property
+    def kv_cache_occupancy(self) -> Dict[str, Tuple[KVCacheOccupancy, ...]]:
+        """
+        Per cache group block occupancy of the ``"device"`` and ``"host"`` KV-cache tiers. Schedulers
+        can use this to decide when to park idle sequences.
+        """
+        return self._state_manager.kv_cache_occupancy()
+
+    @property
+    def n_parked_sequences(self) -> int:
+        """
+        Number of sequences whose KV-cache is currently parked in host memory.
+        """
+        return self._state_manager.n_parked_sequences
 
     def serialize(self, save_path: str) -> None:
         """
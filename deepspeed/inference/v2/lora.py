@@ -0,0 +1,283 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from .config_v2 import LoRAConfig
+from .inference_utils import ActivationType
+from .modules.interfaces import DSLinearBase
+
+LoRAKey = Tuple[int, str]
+"""
+``(layer_idx, target)`` identifying the linear layer an update applies to, i.e. ``(3, "qkv")``.
+"""
+
+LoRAWeights = Dict[LoRAKey, Tuple[torch.Tensor, torch.Tensor]]
+"""
+The ``(A, B)`` factors of each adapted linear layer. ``A`` has shape ``[in_channels, rank]`` and
+``B`` has shape ``[rank, out_channels]``, so the update to the layer's output is
+``hidden_states @ A @ B``.
+"""
+
+
+class LoRAAdapter:
+    """
+    Host copy of the low-rank updates of a single adapter.
+    """
+
+    weights: LoRAWeights
+    """
+    Factors of each adapted layer. The scaling of the adapter is folded into ``B``.
+    """
+
+    def __init__(self, weights: LoRAWeights, scaling: float = 1.0) -> None:
+        """
+        Arguments:
+            weights (LoRAWeights): Factors of each adapted layer. Weights in the PEFT layout
+                (``lora_A.weight`` of shape ``[rank, in_channels]`` and ``lora_B.weight`` of shape
+                ``[out_channels, rank]``) must be transposed.
+            scaling (float): Scaling of the update, ``lora_alpha / rank`` for PEFT adapters.
+        """
+        if not weights:
+            raise ValueError("LoRA adapter has no weights.")
+
+        self.weights = {}
+        for key, (a, b) in weights.items():
+            if a.dim() != 2 or b.dim() != 2 or a.shape[1] != b.shape[0]:
+                raise ValueError(f"Invalid LoRA factors for {key}: A {tuple(a.shape)}, B {tuple(b.shape)}")
+            self.weights[key] = (a.detach().cpu(), (b * scaling).detach().cpu())
+
+    @staticmethod
+    def fuse(factors: Sequence[Tuple[torch.Tensor, torch.Tensor]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Combine the factors of layers whose outputs are concatenated into a single fused layer,
+        such as separate Q, K and V projections into the ``qkv`` layer. The ranks are stacked, so
+        the fused update is equivalent to applying each update to its slice of the output.
+        """
+        a = torch.cat([a for a, _ in factors], dim=1)
+        b = torch.block_diag(*[b for _, b in factors])
+        return a, b
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.numel() * a.element_size() + b.numel() * b.element_size() for a, b in self.weights.values())
+
+
+class LoRAAdapterCache:
+    """
+    LRU cache of adapter weights in device memory. Adapters used by the current batch are always
+    resident; the least recently used adapters are evicted to make room for them.
+    """
+
+    def __init__(self, capacity: int, device: torch.device, dtype: torch.dtype) -> None:
+        """
+        Arguments:
+            capacity (int): Maximum number of adapters resident on the device.
+            device (torch.device): Device to copy the adapters to.
+            dtype (torch.dtype): Data type of the device copies.
+        """
+        if capacity < 1:
+            raise ValueError(f"LoRA adapter cache capacity must be positive, provided {capacity}")
+
+        self._capacity = capacity
+        self._device = device
+        self._dtype = dtype
+        self._resident: "OrderedDict[int, LoRAWeights]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def resident_adapters(self) -> List[int]:
+        """
+        Ids of the resident adapters, least recently used first.
+        """
+        return list(self._resident.keys())
+
+    def evict(self, adapter_id: int) -> None:
+        self._resident.pop(adapter_id, None)
+
+    def load(self, adapters: Dict[int, LoRAAdapter]) -> Dict[int, LoRAWeights]:
+        """
+        Make the given adapters resident and mark them as most recently used.
+
+        Arguments:
+            adapters (Dict[int, LoRAAdapter]): Adapters needed by the current batch, by id.
+
+        Returns:
+            Dict[int, LoRAWeights]: The device weights of each of the adapters.
+        """
+        if len(adapters) > self._capacity:
+            raise ValueError(f"Batch uses {len(adapters)} LoRA adapters but only {self._capacity} may be resident.")
+
+        for adapter_id in adapters:
+            if adapter_id in self._resident:
+                self._resident.move_to_end(adapter_id)
+                self.hits += 1
+
+        for adapter_id, adapter in adapters.items():
+            if adapter_id in self._resident:
+                continue
+            self.misses += 1
+            while len(self._resident) >= self._capacity:
+                # Adapters of this batch were moved to the end, so the front is never one of them.
+                self._resident.popitem(last=False)
+            device_weights = {}
+            for key, factors in adapter.weights.items():
+                device_weights[key] = tuple(f.to(self._device, self._dtype, non_blocking=True) for f in factors)
+            self._resident[adapter_id] = device_weights
+
+        return {adapter_id: self._resident[adapter_id] for adapter_id in adapters}
+
+
+class LoRALinear(torch.nn.Module):
+    """
+    Wraps a ``DSLinearBase`` so that the low-rank updates of the current batch's adapters are added
+    to its output. The base weights are shared by all adapters.
+    """
+
+    def __init__(self, base: DSLinearBase, target: str, manager: "LoRAManager") -> None:
+        super().__init__()
+        self.base = base
+        self._target = target
+        self._manager = manager
+
+    @property
+    def output(self) -> torch.Tensor:
+        return self.base.output
+
+    def transform_param(self, param: torch.Tensor):
+        return self.base.transform_param(param)
+
+    def forward(self, hidden_states: torch.Tensor, w: torch.Tensor, b: Optional[torch.Tensor] = None) -> torch.Tensor:
+        output = self.base(hidden_states, w, b=b)
+        self._manager.apply(self._target, w, hidden_states, output)
+        return output
+
+
+class LoRAManager:
+    """
+    Serves many LoRA adapters of one base model from a single ragged batch. The targeted linear
+    layers of the model are wrapped with ``LoRALinear``, and before each forward the tokens of the
+    batch are segmented by adapter. Each wrapped layer then applies, for every adapter in the batch,
+    one gather, two small matmuls and one scatter-add over the adapter's tokens.
+
+    Only layers without a fused activation can be adapted, since the update must be added before the
+    activation. Sequences without an adapter run the base model.
+    """
+
+    def __init__(self, model, config: LoRAConfig, device: torch.device) -> None:
+        """
+        Arguments:
+            model (DSTransformerModelBase): Model whose linear layers are adapted.
+            config (LoRAConfig): LoRA serving configuration.
+            device (torch.device): Device of the model.
+        """
+        self._model = model
+        self._device = device
+        self._targets = tuple(config.targets)
+        self._adapters: Dict[int, LoRAAdapter] = {}
+        self._segments: List[Tuple[int, Optional[torch.Tensor]]] = []
+        self._batch_weights: Dict[int, LoRAWeights] = {}
+
+        bases = [getattr(model, target, None) for target in self._targets]
+        for target, base in zip(self._targets, bases):
+            if not isinstance(base, DSLinearBase):
+                raise ValueError(f"Model has no linear layer {target} to adapt.")
+            if base._config.activation != ActivationType.IDENTITY:
+                raise ValueError(f"Linear layer {target} has a fused activation and cannot be adapted.")
+
+        for target, base in zip(self._targets, bases):
+            setattr(model, target, LoRALinear(base, target, self))
+
+        self._cache = LoRAAdapterCache(config.max_cached_adapters, device, bases[0]._config.output_dtype)
+        self._layer_of_weight: Dict[Tuple[str, int], int] = {}
+
+    @property
+    def cache(self) -> LoRAAdapterCache:
+        return self._cache
+
+    @property
+    def adapter_ids(self) -> List[int]:
+        return list(self._adapters.keys())
+
+    def register_adapter(self, adapter_id: int, adapter: LoRAAdapter) -> None:
+        if adapter_id in self._adapters:
+            raise ValueError(f"LoRA adapter {adapter_id} is already registered.")
+        for layer_idx, target in adapter.weights:
+            if target not in self._targets:
+                raise ValueError(f"LoRA adapter {adapter_id} targets {target}, which is not one of {self._targets}")
+            if not 0 <= layer_idx < self._model.num_layers:
+                raise ValueError(f"LoRA adapter {adapter_id} targets layer {layer_idx} which does not exist.")
+        self._adapters[adapter_id] = adapter
+
+    def unregister_adapter(self, adapter_id: int) -> None:
+        self._adapters.pop(adapter_id, None)
+        self._cache.evict(adapter_id)
+
+    def has_adapter(self, adapter_id: int) -> bool:
+        return adapter_id in self._adapters
+
+    def _layer_idx(self, target: str, w: torch.Tensor) -> int:
+        """
+        Identify the layer being executed from its weight, since a single linear module is shared by
+        all layers of the model.
+        """
+        key = (target, w.data_ptr())
+        if key not in self._layer_of_weight:
+            self._layer_of_weight = {(t, getattr(layer, f"{t}_w").data_ptr()): idx
+                                     for idx, layer in enumerate(self._model._transformer) for t in self._targets}
+        return self._layer_of_weight[key]
+
+    def prepare(self, adapter_ids: Sequence[Optional[int]], token_counts: Sequence[int]) -> None:
+        """
+        Segment the tokens of the next batch by adapter and make the adapters resident.
+
+        Arguments:
+            adapter_ids (Sequence[Optional[int]]): Adapter of each sequence in the batch, ``None`` for
+                the base model.
+            token_counts (Sequence[int]): Number of tokens of each sequence in the batch.
+        """
+        token_idx: Dict[int, List[int]] = {}
+        offset = 0
+        for adapter_id, n_tokens in zip(adapter_ids, token_counts):
+            if adapter_id is not None:
+                token_idx.setdefault(adapter_id, []).extend(range(offset, offset + n_tokens))
+            offset += n_tokens
+
+        self._batch_weights = self._cache.load({adapter_id: self._adapters[adapter_id] for adapter_id in token_idx})
+
+        self._segments = []
+        for adapter_id, idx in token_idx.items():
+            if len(idx) == offset:
+                # The whole batch uses this adapter, no need to gather.
+                self._segments.append((adapter_id, None))
+            else:
+                self._segments.append((adapter_id, torch.tensor(idx, dtype=torch.int64).to(self._device,
+                                                                                           non_blocking=True)))
+
+    def apply(self, target: str, w: torch.Tensor, hidden_states: torch.Tensor, output: torch.Tensor) -> None:
+        """
+        Add the updates of the batch's adapters for one layer to its output, in place.
+        """
+        if not self._segments:
+            return
+
+        layer_idx = self._layer_idx(target, w)
+        for adapter_id, token_idx in self._segments:
+            factors = self._batch_weights[adapter_id].get((layer_idx, target), None)
+            if factors is None:
+                continue
+            a, b = factors
+            if token_idx is None:
+                output.add_(hidden_states @ a @ b)
+            else:
+                output.index_add_(0, token_idx, hidden_states.index_select(0, token_idx) @ a @ b)
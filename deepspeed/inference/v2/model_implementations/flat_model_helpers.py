@@ -11,6 +11,7 @@ import torch
 from deepspeed.accelerator import get_accelerator
 from deepspeed.ops.op_builder import RaggedUtilsBuilder
 from deepspeed.runtime.config_utils import DeepSpeedConfigModel
+from deepspeed.utils.torch import required_torch_version
 from .layer_container_base import LayerContainer
 from ..inference_parameter import InferenceParameter, STR_TO_DTYPE
 from ..inference_utils import elem_size
@@ -97,6 +98,33 @@ def make_model_config_filename(base: str) -> str:
     return path.join(base, "ds_model_config.json")
 
 
+def load_flattened_buffer(buffer_path: str, mmap: bool = False) -> torch.Tensor:
+    """
+    Load a flattened parameter buffer saved by ``InferenceEngineV2.serialize``.
+
+    Arguments:
+        buffer_path: Path to the buffer file (see ``make_param_filename``).
+        mmap: Memory-map the file rather than reading it. The file contents are then shared through
+            the page cache by all processes on the host that load it, and only a single copy to the
+            accelerator is performed. When the accelerator is the host itself, the parameters are
+            views into the mapping and no copy is made at all. Requires torch >= 2.1.
+
+    Returns:
+        torch.Tensor: The flattened buffer on the current accelerator device.
+    """
+    if not mmap:
+        return torch.load(buffer_path)
+
+    if not required_torch_version(min_version=2.1):
+        raise RuntimeError(f"Memory-mapped checkpoint loading requires torch >= 2.1, found {torch.__version__}")
+
+    buffer = torch.load(buffer_path, map_location="cpu", mmap=True)
+    device = torch.device(get_accelerator().current_device_name())
+    if device.type != "cpu":
+        buffer = buffer.to(device)
+    return buffer
+
+
 def flatten_inference_model(
     transformer_containers: Iterable[LayerContainer],
     non_transformer_container: LayerContainer,
@@ -7,8 +7,6 @@ import json
 from abc import ABC, ABCMeta, abstractmethod
 from typing import Any, Iterable, List, Optional, Union
 
-import torch
-
 from ..config_v2 import RaggedInferenceEngineConfig
 from ..checkpoint import CheckpointEngineBase
 from ..logging import inference_logger
@@ -16,6 +14,7 @@ from .layer_container_base import LayerContainer
 from .inference_model_base import DSInferenceModelBase
 from .flat_model_helpers import (
     flatten_inference_model,
+    load_flattened_buffer,
     make_param_filename,
     make_metadata_filename,
     ModelMetadata,
@@ -113,6 +112,7 @@ class InferenceV2Policy(ABC, metaclass=PolicyMeta):
         model_config: Any,
         checkpoint_engine: Optional[CheckpointEngineBase] = None,
         inf_checkpoint_path: Optional[str] = None,
+        mmap_checkpoint: bool = False,
     ) -> None:
         """
         Create the Policy with sufficient context to build the model. There are two supported
@@ -123,7 +123,8 @@ class InferenceV2Policy(ABC, metaclass=PolicyMeta):
         turn will be sharded/transformed by the model implementation.
 
         The second is used to re-create a previously serialized DeepSpeed inference model. These
-        checkpoints should not be used across different model backend configurations.
+        checkpoints should not be used across different model backend configurations. With
+        ``mmap_checkpoint``, the serialized parameter buffer is memory-mapped rather than read.
 
         TODO(cmikeh2): Enforce this in code
         """
@@ -135,6 +136,7 @@ class InferenceV2Policy(ABC, metaclass=PolicyMeta):
 
         self._checkpoint_engine = checkpoint_engine
         self._inf_checkpoint_path = inf_checkpoint_path
+        self._mmap_checkpoint = mmap_checkpoint
         self._model_config = model_config
 
     def build_model(self, engine_config: RaggedInferenceEngineConfig, mp_group: Any) -> DSInferenceModelBase:
@@ -205,7 +207,7 @@ class InferenceV2Policy(ABC, metaclass=PolicyMeta):
             buffer_path = make_param_filename(self._inf_checkpoint_path, self.model.tp_rank, self.model.tp_size)
             metadata_path = make_metadata_filename(self._inf_checkpoint_path, self.model.tp_rank, self.model.tp_size)
 
-            buffer = torch.load(buffer_path)
+            buffer = load_flattened_buffer(buffer_path, mmap=self._mmap_checkpoint)
             metadata = json.load(open(metadata_path, "r"))
             metadata = ModelMetadata.parse_raw(metadata)
 
@@ -28,6 +28,8 @@ from ..modules import heuristics
 from ..ragged import (
     DSSequenceDescriptor,
     KVCacheConfig,
+    KVCacheType,
+    KVQuantizationType,
     RaggedBatchWrapper,
 )
 from .inference_model_base import (
@@ -186,6 +188,23 @@ class DSTransformerModelBase(DSInferenceModelBase):
         """
         return is_gated(self.mlp_activation_fn)
 
+    @property
+    def kv_window_size(self) -> Optional[int]:
+        """
+        Number of trailing tokens each token attends to, ``None`` for full attention. Models whose
+        attention implementation masks tokens outside of the window may override this so that KV
+        blocks falling out of the window are freed as sequences advance.
+        """
+        return None
+
+    @property
+    def kv_sink_blocks(self) -> int:
+        """
+        Number of leading KV blocks of each sequence retained as attention sinks once they fall out
+        of the window. Only used with ``kv_window_size``.
+        """
+        return 0
+
     """
     Method implementations
     """
@@ -318,6 +337,12 @@ class DSTransformerModelBase(DSInferenceModelBase):
         """
         Builds the attention layer for the model. This sets the `self.attn` attribute.
         """
+        kv_quantization = KVQuantizationType(self._engine_config.state_manager.kv_quantization)
+        if kv_quantization is not KVQuantizationType.NONE:
+            # Fail here rather than when no attention implementation accepts the config.
+            raise ValueError(f"KV-cache quantization {kv_quantization.value} is not supported by any attention "
+                             "implementation, set state_manager.kv_quantization to none")
+
         softmax_scale = 1.0 / (self.head_size**0.5)
 
         attn_config = DSSelfAttentionConfig(max_tokens=self._engine_config.state_manager.max_ragged_batch_size,
@@ -329,7 +354,8 @@ class DSTransformerModelBase(DSInferenceModelBase):
                                             input_dtype=self.activation_dtype,
                                             output_dtype=self.activation_dtype,
                                             positional_embedding_type=self.positional_embedding_type,
-                                            positional_embedding_config=self.positional_embedding_config)
+                                            positional_embedding_config=self.positional_embedding_config,
+                                            kv_quantization=self._engine_config.state_manager.kv_quantization)
 
         self.attn = heuristics.instantiate_attention(attn_config, self._engine_config)
 
@@ -370,6 +396,15 @@ class DSTransformerModelBase(DSInferenceModelBase):
             new_blocks = self.state_manager.allocate_blocks(n_needed_blocks)
             sequence.extend_kv_cache(new_blocks)
 
+    def maybe_free_kv(self, sequence: DSSequenceDescriptor) -> None:
+        """
+        See ``DSInferenceModelBase.maybe_free_kv`` for documentation.
+
+        Frees the KV blocks that fell out of the attention window when ``kv_window_size`` is set.
+        """
+        if self.kv_window_size is not None:
+            self.state_manager.release_retired_blocks(sequence)
+
     def kv_cache_config(self) -> Tuple[KVCacheConfig, ...]:
         """
         See ``DSInferenceModelBase.kv_cache_config`` for documentation.
@@ -380,10 +415,15 @@ class DSTransformerModelBase(DSInferenceModelBase):
         if self._kv_cache_config is None:
             cache_shape = (self.num_layers, self.n_heads_kv_local, self.head_size)
             max_blocks = ceil_div(self.max_sequence_length, self.attn.kv_block_size)
-            self._kv_cache_config = KVCacheConfig(block_size=self.attn.kv_block_size,
+            cache_type = KVCacheType.DENSE if self.kv_window_size is None else KVCacheType.LOCAL
+            self._kv_cache_config = KVCacheConfig(type=cache_type,
+                                                  block_size=self.attn.kv_block_size,
                                                   cache_shape=cache_shape,
                                                   cache_dtype=self.activation_dtype,
-                                                  max_blocks_per_allocation_group=max_blocks)
+                                                  max_blocks_per_allocation_group=max_blocks,
+                                                  quantization=self._engine_config.state_manager.kv_quantization,
+                                                  window_size=self.kv_window_size,
+                                                  sink_blocks=self.kv_sink_blocks)
         return (self._kv_cache_config, )
 
     def prepare_batch(self, wrapped_batch: RaggedBatchWrapper) -> None:
@@ -7,6 +7,7 @@ from enum import Enum
 from typing import Dict, Optional
 
 from ...inference_utils import DtypeEnum
+from ...ragged.manager_configs import KVQuantizationType
 from ...modules.ds_module import DSModuleConfig
 from deepspeed.runtime.config_utils import DeepSpeedConfigModel
 
@@ -108,3 +109,6 @@ class DSSelfAttentionConfig(DSModuleConfig):
     new configs for each type (as necessary) and annotate this with the
     Union[RotateHalfConfig, OtherConfig, ...] type.
     """
+
+    # Storage format of the KV-cache
+    kv_quantization: KVQuantizationType = KVQuantizationType.NONE
@@ -3,10 +3,17 @@
 
 # DeepSpeed Team
 
+from typing import Callable
+
+import torch
+
+from deepspeed.accelerator import get_accelerator
+
 from ..config_v2 import RaggedInferenceEngineConfig
-from ..inference_utils import NormTypeEnum
+from ..inference_utils import NormTypeEnum, is_gated
 
 from .module_registry import ConfigBundle
+from .tuning_cache import select_implementation
 from ..modules.configs import (
     DSEmbeddingsConfig,
     DSLinearConfig,
@@ -48,8 +55,9 @@ def instantiate_attention(attention_config: DSSelfAttentionConfig,
         An attention module implementing the given configuration.
     """
 
-    # Currently, we only have one implementation, so we just return it.
-    config = ConfigBundle(name="dense_blocked_attention", config=attention_config)
+    name = select_implementation(DSSelfAttentionRegistry, "dense_blocked_attention", attention_config,
+                                 engine_config.kernel_tuning)
+    config = ConfigBundle(name=name, config=attention_config)
     return DSSelfAttentionRegistry.instantiate_config(config)
 
 
@@ -72,6 +80,26 @@ def instantiate_embed(embed_config: DSEmbeddingsConfig, engine_config: RaggedInf
     return DSEmbeddingRegistry.instantiate_config(config)
 
 
+QUANTIZED_LINEAR_MODULES = {"wf6af16": "quantized_wf6af16_linear"}
+"""
+Linear implementation for each quantization mode. These are never calibrated against the
+floating point implementations since they change the numerics of the model.
+"""
+
+
+def _linear_benchmark(module: DSLinearBase, linear_config: DSLinearConfig,
+                      n_tokens: int) -> Callable[[], torch.Tensor]:
+    """
+    Calibration run of a linear module on random inputs of ``n_tokens`` tokens.
+    """
+    device = get_accelerator().current_device()
+    out_channels = linear_config.out_channels * 2 if is_gated(linear_config.activation) else linear_config.out_channels
+    w = module.transform_param(
+        torch.randn(out_channels, linear_config.in_channels, dtype=linear_config.input_dtype, device=device))
+    hidden_states = torch.randn(n_tokens, linear_config.in_channels, dtype=linear_config.input_dtype, device=device)
+    return lambda: module(hidden_states, w)
+
+
 def instantiate_linear(linear_config: DSLinearConfig, engine_config: RaggedInferenceEngineConfig) -> DSLinearBase:
     """
     Choose an appropriate linear implementation based on the given configurations. This
@@ -88,11 +116,18 @@ def instantiate_linear(linear_config: DSLinearConfig, engine_config: RaggedInfer
 
     quantization_mode = engine_config.quantization.quantization_mode
     if quantization_mode is None:
-        config = ConfigBundle(name="blas_fp_linear", config=linear_config)
+        # ``blas_fp_linear`` is the only floating point implementation today, so there is nothing to
+        # calibrate against and the tuning cache is only consulted.
+        name = select_implementation(DSLinearRegistry,
+                                     "blas_fp_linear",
+                                     linear_config,
+                                     engine_config.kernel_tuning,
+                                     exclude=QUANTIZED_LINEAR_MODULES.values(),
+                                     benchmark=_linear_benchmark)
+        config = ConfigBundle(name=name, config=linear_config)
     else:
         # Currently, we only support ``quantized_wf6af16_linear`` on NVIDIA Ampere GPUs.
         if quantization_mode == "wf6af16":
-            import torch
             if not torch.cuda.is_available():  #ignore-cuda
                 raise ValueError("WF6AF16 quantization is only supported on CUDA")
             else:
@@ -101,7 +136,7 @@ def instantiate_linear(linear_config: DSLinearConfig, engine_config: RaggedInfer
                     raise ValueError("WF6AF16 quantization is only supported on NVIDIA GPUs")
                 elif torch.cuda.get_device_properties(0).major != 8:  #ignore-cuda
                     raise ValueError("WF6AF16 quantization is only supported on Ampere architectures")
-            config = ConfigBundle(name="quantized_wf6af16_linear", config=linear_config)
+            config = ConfigBundle(name=QUANTIZED_LINEAR_MODULES[quantization_mode], config=linear_config)
         else:
             raise ValueError(f"Unsupported quantization mode: {quantization_mode}")
     return DSLinearRegistry.instantiate_config(config)
@@ -129,10 +164,12 @@ def instantiate_moe(moe_config: DSMoEConfig, engine_config: RaggedInferenceEngin
             "weight_dtype": moe_config.input_dtype,
         }
 
-    # Currently, we only have one implementation, so we just return it.
-    config = ConfigBundle(name="cutlass_multi_gemm_moe",
-                          config=moe_config,
-                          implementation_config=implementation_config)
+    name = select_implementation(DSMoERegistry,
+                                 moe_type,
+                                 moe_config,
+                                 engine_config.kernel_tuning,
+                                 implementation_config=implementation_config)
+    config = ConfigBundle(name=name, config=moe_config, implementation_config=implementation_config)
     return DSMoERegistry.instantiate_config(config)
 
 
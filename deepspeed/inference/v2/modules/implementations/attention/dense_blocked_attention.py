@@ -19,7 +19,7 @@ from ....kernels.ragged_ops import (
     get_kv_block_size,
     LinearBlockedKVCopy,
 )
-from ....ragged import RaggedBatchWrapper, split_kv
+from ....ragged import KVQuantizationType, RaggedBatchWrapper, split_kv
 from deepspeed.ops.op_builder import RaggedUtilsBuilder
 
 from ...interfaces import DSSelfAttentionBase, DSSelfAttentionRegistry
@@ -60,6 +60,10 @@ class DSDenseBlockedAttention(DSSelfAttentionBase):
         if MaskingType(config.masking_type) != MaskingType.causal:
             return False
 
+        # The blocked flash kernels read keys and values in the activation dtype.
+        if KVQuantizationType(config.kv_quantization) is not KVQuantizationType.NONE:
+            return False
+
         return True
 
     def __init__(self, config: DSSelfAttentionConfig, implementation_config: Dict[str, Any]) -> None:
@@ -21,7 +21,8 @@ from ...configs import DSUnembedConfig
 class DSRaggedUnembed(DSUnembedBase):
     """
     Ragged unembedding implementation. This implementation will gather only the last token
-    of each sequence in the ragged inflight batch and calculate the logits only for those rows.
+    of each sequence in the ragged inflight batch and calculate the logits only for those rows,
+    unless logits for all tokens were requested for the batch.
     """
 
     @staticmethod
@@ -99,9 +100,15 @@ class DSRaggedUnembed(DSUnembedBase):
             beta (Optional[torch.Tensor]): The beta tensor for normalization.
         """
 
-        cut_down_hidden_states = empty_from(self._intermediate,
-                                            (ragged_metadata.current_sequences, self._config.model_dim))
-        self._logits_gather(cut_down_hidden_states, hidden_states, ragged_metadata)
+        if ragged_metadata.all_token_logits:
+            # Logits are needed for every token (i.e. speculative verification), skip the gather. The
+            # hidden states are copied since normalization is performed in place.
+            n_rows = ragged_metadata.current_tokens
+            cut_down_hidden_states = hidden_states[:n_rows].clone()
+        else:
+            n_rows = ragged_metadata.current_sequences
+            cut_down_hidden_states = empty_from(self._intermediate, (n_rows, self._config.model_dim))
+            self._logits_gather(cut_down_hidden_states, hidden_states, ragged_metadata)
 
         if self._config.norm_type == 'rms_norm':
             if gamma is None:
@@ -112,7 +119,12 @@ class DSRaggedUnembed(DSUnembedBase):
                 raise ValueError('Normalization enabled but gamma and/or beta not provided.')
             self._norm(cut_down_hidden_states, cut_down_hidden_states, gamma, beta)
 
-        output = empty_from(self._output, (ragged_metadata.current_sequences, self._config.vocab_size))
+        if ragged_metadata.all_token_logits:
+            output = torch.empty((n_rows, self._config.vocab_size),
+                                 dtype=self._output.dtype,
+                                 device=self._output.device)
+        else:
+            output = empty_from(self._output, (n_rows, self._config.vocab_size))
         self._linear(output, cut_down_hidden_states, vocab_embedding)
         if bias is not None:
             self._act_fn(output, bias)
@@ -4,7 +4,7 @@
 # DeepSpeed Team
 
 from abc import ABC, abstractstaticmethod
-from typing import Any, Dict, Type
+from typing import Any, Dict, List, Type
 
 from deepspeed.runtime.config_utils import DeepSpeedConfigModel
 from .ds_module import DSModuleBase
@@ -38,6 +38,13 @@ class DSModuleRegistryBase(ABC):
 
         return cls.registry[config_bundle.name](config_bundle.config, config_bundle.implementation_config)
 
+    @classmethod
+    def supported_implementations(cls, config: DeepSpeedConfigModel) -> List[str]:
+        """
+        Names of the registered implementations that support the given config.
+        """
+        return [name for name, implementation in cls.registry.items() if implementation.supports_config(config)]
+
     @abstractstaticmethod
     def associated_class() -> Type[DSModuleBase]:
         """
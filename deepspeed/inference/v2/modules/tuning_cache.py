@@ -0,0 +1,246 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Type
+
+from deepspeed.accelerator import get_accelerator
+from deepspeed.runtime.config_utils import DeepSpeedConfigModel
+
+from ..config_v2 import KernelTuningConfig
+from ..logging import inference_logger
+from .ds_module import DSModuleBase
+from .module_registry import DSModuleRegistryBase
+
+TUNING_CACHE_VERSION = 1
+
+BenchmarkFactory = Callable[[DSModuleBase, DeepSpeedConfigModel, int], Callable[[], Any]]
+"""
+Given an instantiated module, its config and a number of tokens, returns a callable that runs the
+module once on inputs of that size.
+"""
+
+
+def tuning_key(registry: Type[DSModuleRegistryBase], config: DeepSpeedConfigModel, model_key: str = "") -> str:
+    """
+    Key of a module configuration in the tuning cache. The module config captures the shapes and
+    data types the module is built for.
+    """
+    fields = ",".join(f"{name}={value}" for name, value in sorted(config.dict().items()))
+    return f"{registry.associated_class().__name__}|{model_key}|{get_accelerator().device_name()}|{fields}"
+
+
+class TuningCache:
+    """
+    On-disk cache of the implementation chosen for each module configuration by calibration.
+    Entries are stored as JSON; saving merges with entries written by other processes since the
+    cache was loaded.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Arguments:
+            path (str): Path to the JSON file backing the cache. It is created on the first save.
+        """
+        self._path = path
+        self._entries = self._read()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, "r") as f:
+                contents = json.load(f)
+        except (OSError, ValueError) as e:
+            inference_logger().warning(f"Ignoring unreadable kernel tuning cache {self._path}: {e}")
+            return {}
+        if contents.get("version", None) != TUNING_CACHE_VERSION:
+            inference_logger().warning(f"Ignoring kernel tuning cache {self._path} with an unsupported version.")
+            return {}
+        return contents.get("entries", {})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Name of the implementation recorded for ``key``, if any.
+        """
+        entry = self._entries.get(key, None)
+        return entry["module"] if entry is not None else None
+
+    def timings(self, key: str) -> Dict[str, Dict[str, float]]:
+        """
+        Calibration timings recorded for ``key``, in seconds, by implementation and then by number
+        of tokens.
+        """
+        entry = self._entries.get(key, None)
+        return entry["timings"] if entry is not None else {}
+
+    def record(self, key: str, module: str, timings: Optional[Dict[str, Dict[int, float]]] = None) -> None:
+        """
+        Record the implementation selected for ``key`` and the calibration timings it was chosen from.
+        """
+        json_timings = {}
+        for name, bucket_times in (timings or {}).items():
+            json_timings[name] = {str(n_tokens): t for n_tokens, t in bucket_times.items()}
+        self._entries[key] = {"module": module, "timings": json_timings}
+
+    def save(self) -> None:
+        """
+        Write the cache to disk atomically.
+        """
+        entries = self._read()
+        entries.update(self._entries)
+        self._entries = entries
+
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": TUNING_CACHE_VERSION, "entries": entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._path)
+
+
+_OPEN_CACHES: Dict[str, TuningCache] = {}
+
+
+def get_tuning_cache(path: str) -> TuningCache:
+    """
+    Get the tuning cache backed by ``path``, shared by all modules built in this process.
+    """
+    path = os.path.abspath(path)
+    if path not in _OPEN_CACHES:
+        _OPEN_CACHES[path] = TuningCache(path)
+    return _OPEN_CACHES[path]
+
+
+def _time(fn: Callable[[], Any], iterations: int) -> float:
+    """
+    Mean time of ``fn`` in seconds after a warmup call.
+    """
+    fn()
+    get_accelerator().synchronize()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    get_accelerator().synchronize()
+    return (time.perf_counter() - start) / iterations
+
+
+def calibrate(registry: Type[DSModuleRegistryBase],
+              candidates: Iterable[str],
+              config: DeepSpeedConfigModel,
+              benchmark: BenchmarkFactory,
+              batch_buckets: Iterable[int],
+              iterations: int = 10,
+              implementation_config: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Dict[int, float]]]:
+    """
+    Time each candidate implementation of a module for every batch bucket.
+
+    Arguments:
+        registry (Type[DSModuleRegistryBase]): Registry of the module's interface.
+        candidates (Iterable[str]): Names of the interchangeable implementations to compare.
+            Candidates that fail to build or run are skipped.
+        config (DeepSpeedConfigModel): Module configuration, with the model's actual shapes.
+        benchmark (BenchmarkFactory): Builds a single run of a module for a number of tokens.
+        batch_buckets (Iterable[int]): Numbers of tokens to time. Buckets are clipped to the
+            module's ``max_tokens``.
+        iterations (int): Number of timed runs per bucket.
+        implementation_config (Dict[str, Any]): Implementation config passed to every candidate.
+
+    Returns:
+        Tuple[str, Dict[str, Dict[int, float]]]: The implementation with the lowest total time over
+            all buckets and the mean time of each candidate for each bucket.
+    """
+    buckets = sorted({min(n, config.max_tokens) for n in batch_buckets})
+    timings: Dict[str, Dict[int, float]] = {}
+    for name in candidates:
+        try:
+            module = registry.registry[name](config, implementation_config or {})
+            timings[name] = {n_tokens: _time(benchmark(module, config, n_tokens), iterations) for n_tokens in buckets}
+        except Exception as e:
+            inference_logger().warning(f"Skipping {name} during kernel calibration: {e}")
+
+    if not timings:
+        raise RuntimeError(f"No candidate implementation could be calibrated for {config}")
+
+    winner = min(timings, key=lambda name: sum(timings[name].values()))
+    return winner, timings
+
+
+def select_implementation(registry: Type[DSModuleRegistryBase],
+                          default: str,
+                          config: DeepSpeedConfigModel,
+                          tuning_config: KernelTuningConfig,
+                          exclude: Iterable[str] = (),
+                          benchmark: Optional[BenchmarkFactory] = None,
+                          implementation_config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Choose the implementation of a module, consulting the tuning cache configured in
+    ``tuning_config`` and running calibration on a cache miss if enabled. Calibration only runs when
+    more than one interchangeable implementation supports ``config``; otherwise ``default`` is
+    returned and nothing is recorded.
+
+    Arguments:
+        registry (Type[DSModuleRegistryBase]): Registry of the module's interface.
+        default (str): Implementation chosen by the static heuristics.
+        config (DeepSpeedConfigModel): Module configuration.
+        tuning_config (KernelTuningConfig): Tuning cache and calibration settings.
+        exclude (Iterable[str]): Registered implementations that are not interchangeable with
+            ``default`` and must not be selected.
+        benchmark (BenchmarkFactory): Builds a single run of a module. Without it, nothing is
+            calibrated.
+        implementation_config (Dict[str, Any]): Implementation config passed to the candidates.
+
+    Returns:
+        str: The name of the implementation to instantiate.
+    """
+    if tuning_config.cache_path is None:
+        return default
+
+    cache = get_tuning_cache(tuning_config.cache_path)
+    key = tuning_key(registry, config, tuning_config.model_key)
+
+    exclude = set(exclude)
+
+    cached = cache.lookup(key)
+    if cached is not None:
+        implementation = registry.registry.get(cached, None)
+        if cached not in exclude and implementation is not None and implementation.supports_config(config):
+            return cached
+        inference_logger().warning(f"Ignoring tuned implementation {cached}, it is not a valid candidate for {key}")
+
+    if not tuning_config.calibrate:
+        return default
+
+    candidates = [name for name in registry.supported_implementations(config) if name not in exclude]
+
+    if len(candidates) <= 1:
+        inference_logger().debug(f"No alternative implementations to calibrate for {key}, using {default}")
+        return default
+
+    if benchmark is None:
+        inference_logger().info(f"No calibration benchmark for {key}, using {default}")
+        return default
+
+    winner, timings = calibrate(registry,
+                                candidates,
+                                config,
+                                benchmark,
+                                tuning_config.batch_buckets,
+                                iterations=tuning_config.iterations,
+                                implementation_config=implementation_config)
+    inference_logger().info(f"Calibrated {key}: selected {winner}")
+
+    cache.record(key, winner, timings)
+    cache.save()
+    return winner
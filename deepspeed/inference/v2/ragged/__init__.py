@@ -3,13 +3,19 @@
 
 # DeepSpeed Team
 
-from .kv_cache import split_kv
+from .kv_cache import KVCacheOccupancy, split_kv
 from .manager_configs import (
     AllocationMode,
     DSStateManagerConfig,
     KVCacheConfig,
+    KVCacheType,
+    KVQuantizationType,
     MemoryConfig,
+    PreemptionConfig,
+    PreemptionMode,
+    PreemptionOrder,
 )
+from .preemption import PreemptedSequence, PreemptionCandidate, PreemptionPolicy
 from .ragged_manager import DSStateManager
 from .ragged_wrapper import RaggedBatchWrapper
 from .sequence_descriptor import DSSequenceDescriptor, PlaceholderSequenceDescriptor
@@ -11,21 +11,19 @@ import torch
 class BlockedAllocator:
     """
     Allocator class for managing which blocks are free/used in the
-    blocked KV-cache. This is a simple allocator that uses a linked list
-    to keep track of which blocks are free/used. The cost of allocation/deallocation
-    is O(blocks), where blocks is the number of blocks to allocate/deallocate.
-
-    TODO(cmikeh2): Evaluate performance of this allocator and migrate
-    to C++ if necessary.
+    blocked KV-cache. Free blocks are kept in a stack (a preallocated tensor whose first
+    ``free_blocks`` entries are the free block ids) alongside a bitmap of which blocks are
+    currently in use. Allocating or freeing N blocks is performed with a constant number of
+    batched tensor operations rather than a Python loop over the blocks.
     """
     # Number of blocks in the KV-cache(s).
     _num_blocks: int
 
-    # Array of blocks, where each element is the next block in the linked list.
-    _blocks: torch.Tensor
+    # Stack of free block ids. Only the first ``_free_blocks`` entries are valid.
+    _free_stack: torch.Tensor
 
-    # Index of the head of the linked list.
-    _head: int
+    # Bitmap of which blocks are currently allocated.
+    _allocated: torch.Tensor
 
     # Number of free blocks in the KV-cache.
     _free_blocks: int
@@ -33,7 +31,7 @@ class BlockedAllocator:
     def __init__(self, num_blocks: int) -> None:
         """
         Initialize an allocator with `num_blocks` blocks. This requires at least
-        `num_blocks` * 4 bytes of host memory.
+        `num_blocks` * 5 bytes of host memory.
 
         Parameters:
             num_blocks (int): The number of blocks to allocate.
@@ -43,8 +41,9 @@ class BlockedAllocator:
             raise ValueError(f'Blocked KV-cache must have at least 1 block, provided {num_blocks}')
 
         self._num_blocks = num_blocks
-        self._blocks = torch.arange(1, num_blocks + 1, dtype=torch.int32, device='cpu', pin_memory=True)
-        self._head = 0
+        # Stored in reverse so that blocks are handed out in ascending order from a fresh allocator.
+        self._free_stack = torch.arange(num_blocks - 1, -1, -1, dtype=torch.int32, device='cpu')
+        self._allocated = torch.zeros(num_blocks, dtype=torch.bool, device='cpu')
         self._free_blocks = num_blocks
 
     def allocate(self, num_blocks: int) -> torch.Tensor:
@@ -62,12 +61,12 @@ class BlockedAllocator:
         if num_blocks > self._free_blocks:
             raise ValueError(f'Not enough free blocks in the KV-cache to allocate {num_blocks} blocks')
 
-        allocated_blocks = torch.zeros(num_blocks, dtype=torch.int32)
-        for i in range(num_blocks):
-            allocated_blocks[i] = self._head
-            self._head = self._blocks[self._head].item()
-            self._blocks[allocated_blocks[i]] = -1  # Mark as used
-            self._free_blocks -= 1
+        new_top = self._free_blocks - num_blocks
+        # Pop from the top of the stack (most recently freed first). The flip keeps the
+        # returned ids in allocation order and also produces a copy we can hand to the caller.
+        allocated_blocks = self._free_stack[new_top:self._free_blocks].flip(0)
+        self._allocated[allocated_blocks.long()] = True
+        self._free_blocks = new_top
 
         return allocated_blocks
 
@@ -84,18 +83,30 @@ class BlockedAllocator:
         if isinstance(blocks, int):
             blocks = [blocks]
 
-        for block in blocks:
-            # Parse all blocks for validity before mutating the list.
-            if block < 0 or block >= self._num_blocks:
-                raise ValueError(f'Invalid block {block} provided to free')
+        if isinstance(blocks, torch.Tensor):
+            blocks = blocks.flatten().to(device='cpu', dtype=torch.int64)
+        else:
+            blocks = torch.tensor(list(blocks), dtype=torch.int64)
+
+        n_blocks = blocks.numel()
+        if n_blocks == 0:
+            return
+
+        # Parse all blocks for validity before mutating the allocator state.
+        invalid = (blocks < 0) | (blocks >= self._num_blocks)
+        if invalid.any():
+            raise ValueError(f'Invalid block {blocks[invalid][0].item()} provided to free')
+
+        already_free = ~self._allocated[blocks]
+        if already_free.any():
+            raise ValueError(f'Block {blocks[already_free][0].item()} is already free')
 
-            if self._blocks[block] != -1:
-                raise ValueError(f'Block {block} is already free')
+        if n_blocks > 1 and torch.unique(blocks).numel() != n_blocks:
+            raise ValueError('Duplicate blocks provided to free')
 
-        for block in blocks:
-            self._blocks[block] = self._head
-            self._head = block
-            self._free_blocks += 1
+        self._allocated[blocks] = False
+        self._free_stack[self._free_blocks:self._free_blocks + n_blocks] = blocks.flip(0).to(torch.int32)
+        self._free_blocks += n_blocks
 
     @property
     def free_blocks(self) -> int:
@@ -1,98 +1,300 @@
-from typing import Dict, List, Set, Optional
-import hashlib
-from collections import defaultdict
-from enum import Enum
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
 import torch
 
 
-# This function creates a state for each 
-def sequence_to_state(token_ids: Optional[torch.Tensor] = None):
-    # Convert the tensor to bytes
-    tensor_bytes = token_ids.numpy().tobytes()
-    hash_obj = hashlib.sha256()
-    # Update the hash object with the bytes
-    hash_obj.update(tensor_bytes)
-    # Get the hexadecimal digest of the hash
-    sequence_state = hash_obj.hexdigest()
-    return sequence_state
-
-
-class SequenceStateNode:
-    def __init__(self, block_address: Optional[int] = None,
-                 hash_token_chunk: Optional[torch.Tensor] = None):
-        self.name =  hash_token_chunk
-        self.block_address: int = block_address
-        self.ref_count: int = 0
-        self.last_refrenced = float("-inf")
-        self.children: Dict[SequenceStateNode] = []
-        return
-    
-    def visit(self, refrence_time: int):
-        self.ref_count += 1
-        self.last_refrenced = refrence_time
-        return
-   
-
-class Tree:
-
-    def __init__(self):
-        self.root =  SequenceStateNode()
-        self._tree_universal_time = 0
-        self.eviction_pool: Dict[int, List] = {}
-        return
-    
-    def update_time(self):
-        self._tree_universal_time += 1
-        return
-    
-    def lookup_nodes(self, tokens: torch.Tensor):
-        self._update_time()
-        n_blocks = len(tokens) // self.block_size
-        current_node = self.root
-        cached_blocks = torch.tensor([], dtype=torch.int32)
+class PrefixCacheNode:
+    """
+    A single full KV block in the prefix cache. The node is keyed in its parent by the tokens
+    of the block, so the path from the root to a node uniquely identifies the full token prefix
+    whose KV values are stored in ``block_id``.
+    """
+
+    __slots__ = ("key", "block_id", "parent", "children", "ref_count", "last_access")
+
+    key: Optional[Tuple[int, ...]]
+    """
+    Tokens of the block represented by this node.
+    """
+
+    block_id: int
+    """
+    KV block holding the keys and values of this node's tokens.
+    """
+
+    parent: Optional["PrefixCacheNode"]
+    """
+    Node of the preceding block. ``None`` for the root and for evicted nodes.
+    """
+
+    children: Dict[Tuple[int, ...], "PrefixCacheNode"]
+    """
+    Nodes of the blocks that have been observed to follow this one.
+    """
+
+    ref_count: int
+    """
+    Number of live sequences whose KV-cache references this block.
+    """
+
+    last_access: int
+    """
+    Logical timestamp of the last lookup or insertion touching this node. Used for LRU eviction.
+    """
+
+    def __init__(self,
+                 key: Optional[Tuple[int, ...]] = None,
+                 block_id: int = -1,
+                 parent: Optional["PrefixCacheNode"] = None) -> None:
+        self.key = key
+        self.block_id = block_id
+        self.parent = parent
+        self.children = {}
+        self.ref_count = 0
+        self.last_access = 0
+
+
+class PrefixCacheTree:
+    """
+    Radix tree of full KV blocks keyed by their token contents. Sequences that share a prompt
+    prefix (e.g. a common system prompt) can attach the KV blocks of the longest cached prefix
+    rather than recomputing them.
+
+    Blocks are reference counted by the sequences using them. Once no sequence references a block
+    it remains cached, but becomes a candidate for eviction. Eviction is LRU and always removes
+    leaves first, since a child block is only reachable through its parent.
+    """
+
+    _block_size: int
+    """
+    Number of tokens per KV block.
+    """
+
+    _root: PrefixCacheNode
+    """
+    Sentinel node representing the empty prefix. Does not own a block.
+    """
+
+    _n_blocks: int
+    """
+    Number of blocks owned by the tree.
+    """
+
+    _n_evictable: int
+    """
+    Number of blocks owned by the tree that are not referenced by any sequence.
+    """
+
+    _eviction_heap: List[Tuple[int, int, PrefixCacheNode]]
+    """
+    Lazily maintained min-heap of (last_access, insertion order, node) eviction candidates.
+    Entries are validated when popped.
+    """
+
+    def __init__(self, block_size: int) -> None:
+        """
+        Create an empty prefix cache.
+
+        Parameters:
+            block_size (int): Number of tokens per KV block.
+        """
+        if block_size < 1:
+            raise ValueError(f"Prefix cache block size must be positive, provided {block_size}")
+
+        self._block_size = block_size
+        self._root = PrefixCacheNode()
+        self._clock = 0
+        self._heap_counter = 0
+        self._n_blocks = 0
+        self._n_evictable = 0
+        self._eviction_heap = []
+
+    @property
+    def root(self) -> PrefixCacheNode:
+        """
+        Sentinel node representing the empty prefix.
+        """
+        return self._root
+
+    @property
+    def block_size(self) -> int:
+        """
+        Number of tokens per KV block.
+        """
+        return self._block_size
+
+    @property
+    def n_cached_blocks(self) -> int:
+        """
+        Number of KV blocks owned by the prefix cache.
+        """
+        return self._n_blocks
+
+    @property
+    def n_evictable_blocks(self) -> int:
+        """
+        Number of KV blocks owned by the prefix cache that may be reclaimed by ``evict``.
+        """
+        return self._n_evictable
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _push_candidate(self, node: PrefixCacheNode) -> None:
+        self._heap_counter += 1
+        heapq.heappush(self._eviction_heap, (node.last_access, self._heap_counter, node))
+
+        if len(self._eviction_heap) > 2 * self._n_blocks + 64:
+            self._compact_heap()
+
+    def _compact_heap(self) -> None:
+        """
+        Drop stale entries from the eviction heap so repeated acquire/release cycles do not grow
+        it without bound.
+        """
+        live = {}
+        for entry in self._eviction_heap:
+            node = entry[2]
+            if node.parent is None or node.ref_count > 0 or node.children:
+                continue
+            live[id(node)] = (node.last_access, entry[1], node)
+        self._eviction_heap = list(live.values())
+        heapq.heapify(self._eviction_heap)
+
+    def match(self,
+              tokens: Union[torch.Tensor, Sequence[int]],
+              max_blocks: Optional[int] = None) -> List[PrefixCacheNode]:
+        """
+        Find the longest cached prefix of ``tokens`` made up of full blocks. The returned nodes
+        are marked as recently used but no references are taken; see ``acquire``.
+
+        Parameters:
+            tokens (Union[torch.Tensor, Sequence[int]]): Tokens of the prompt to look up.
+            max_blocks (Optional[int]): Upper bound on the number of blocks to match.
+
+        Returns:
+            List[PrefixCacheNode]: Nodes of the matched blocks in sequence order.
+        """
+        if isinstance(tokens, torch.Tensor):
+            tokens = tokens.tolist()
+
+        n_blocks = len(tokens) // self._block_size
+        if max_blocks is not None:
+            n_blocks = min(n_blocks, max_blocks)
+
+        now = self._tick()
+        matched = []
+        node = self._root
         for i in range(n_blocks):
-            chunk = tokens[:(i+1)*self.block_size]
-            current_state_node = sequence_to_state(chunk)
-            if current_state_node not in current_node.children:
+            key = tuple(tokens[i * self._block_size:(i + 1) * self._block_size])
+            node = node.children.get(key, None)
+            if node is None:
                 break
-            current_node = current_node.children[current_state_node]
-            cached_blocks.append(current_node.block_address)
-            current_node.visit(self._tree_universal_time)
-        return cached_blocks
-        
-    def add_nodes(self, tokens: torch.Tensor, new_block_ids: List[int]):
-        self._update_time()
-        n_blocks = len(tokens) // self.block_size
-        current_node = self.root
-        for i in range(n_blocks):
-            chunk = tokens[:(i+1)*self.block_size]
-            current_state_node = sequence_to_state(chunk)
-            if current_state_node not in current_node.children:
-                current_node.children[current_state_node] = SequenceStateNode(address = new_block_ids[i])
-            current_node = current_node.children[current_state_node]
-            current_node.visit(self._tree_universal_time)
-                
-    def remove_nodes(self, tokens: torch.Tensor) -> None:
-        n_blocks = len(tokens) // self.block_size
-        current_node = self.root
-        elimination_stack: List = []
-        for i in range(n_blocks):
-            chunk = tokens[:(i+1)*self.block_size]
-            current_state_node = sequence_to_state(chunk)
-            if current_state_node in current_node.children:
-                current_node = current_node.children[current_state_node]
-                elimination_stack.push(current_node)
-                current_node.ref_count -= 1
-            else:
-                raise ValueError(f'Deleting the block of tokens 
-                                 {tokens[i-1*self.block_size: i *self.block_size]} 
-                                 which were never in cache')
-        elimination_sequence:List = []
-        while elimination_stack[-1].ref_count == 0:
-            leaf_node = elimination_stack.pop()
-            elimination_sequence.append(leaf_node)
-
-
-        
-
-        
\ No newline at end of file
+            node.last_access = now
+            matched.append(node)
+
+        return matched
+
+    def insert(self, parent: Optional[PrefixCacheNode], tokens: Sequence[int],
+               block_id: int) -> Tuple[PrefixCacheNode, bool]:
+        """
+        Insert a full block following ``parent``. If an identical block is already cached under
+        ``parent``, the existing node is returned and ``block_id`` is not taken over by the tree.
+
+        Parameters:
+            parent (Optional[PrefixCacheNode]): Node of the preceding block or ``None`` for the
+                first block of a sequence.
+            tokens (Sequence[int]): The ``block_size`` tokens of the block.
+            block_id (int): KV block holding the computed keys and values of ``tokens``.
+
+        Returns:
+            Tuple[PrefixCacheNode, bool]: The node for the block and whether ``block_id`` is now
+                owned by the tree.
+        """
+        if len(tokens) != self._block_size:
+            raise ValueError(f"Prefix cache blocks must have {self._block_size} tokens, provided {len(tokens)}")
+
+        if parent is None:
+            parent = self._root
+
+        key = tuple(tokens)
+        now = self._tick()
+        node = parent.children.get(key, None)
+        if node is not None:
+            node.last_access = now
+            return node, False
+
+        node = PrefixCacheNode(key, block_id, parent)
+        node.last_access = now
+        parent.children[key] = node
+        self._n_blocks += 1
+        # Newly inserted nodes are unreferenced until acquired.
+        self._n_evictable += 1
+        self._push_candidate(node)
+        return node, True
+
+    def acquire(self, nodes: Sequence[PrefixCacheNode]) -> None:
+        """
+        Take a reference on each of ``nodes`` on behalf of a sequence.
+        """
+        for node in nodes:
+            if node.ref_count == 0:
+                self._n_evictable -= 1
+            node.ref_count += 1
+
+    def release(self, nodes: Sequence[PrefixCacheNode]) -> None:
+        """
+        Drop a reference on each of ``nodes``. Blocks that are no longer referenced stay cached
+        until they are evicted.
+        """
+        for node in nodes:
+            if node.ref_count <= 0:
+                raise ValueError(f"Releasing prefix cache block {node.block_id} which is not referenced")
+            node.ref_count -= 1
+            if node.ref_count == 0:
+                self._n_evictable += 1
+                if not node.children:
+                    self._push_candidate(node)
+
+    def evict(self, n_blocks: int) -> List[int]:
+        """
+        Evict up to ``n_blocks`` unreferenced blocks in least recently used order.
+
+        Parameters:
+            n_blocks (int): Number of blocks to reclaim.
+
+        Returns:
+            List[int]: The ids of the evicted blocks. The caller is responsible for returning
+                these to the allocator.
+        """
+        evicted = []
+        while len(evicted) < n_blocks and self._eviction_heap:
+            last_access, _, node = heapq.heappop(self._eviction_heap)
+
+            if node.parent is None or node.ref_count > 0 or node.children:
+                # Stale entry, the node was evicted, re-referenced, or gained a child.
+                continue
+
+            if last_access != node.last_access:
+                # Touched since it was queued, requeue with its current timestamp.
+                self._push_candidate(node)
+                continue
+
+            parent = node.parent
+            del parent.children[node.key]
+            node.parent = None
+            self._n_blocks -= 1
+            self._n_evictable -= 1
+            evicted.append(node.block_id)
+
+            if parent is not self._root and parent.ref_count == 0 and not parent.children:
+                self._push_candidate(parent)
+
+        return evicted
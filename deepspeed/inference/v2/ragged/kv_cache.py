@@ -5,7 +5,7 @@
 
 import operator
 from functools import reduce
-from typing import Any, Iterable, Optional, Tuple
+from typing import Any, Iterable, List, Optional, Tuple
 
 import torch
 
@@ -13,10 +13,10 @@ import deepspeed.comm as dist
 from deepspeed.comm.reduce_op import ReduceOp
 
 from deepspeed.accelerator import get_accelerator
-from ..inference_utils import elem_size
 from ..logging import inference_logger
 from .blocked_allocator import BlockedAllocator
-from .manager_configs import AllocationMode, KVCacheConfig, MemoryConfig
+from .kv_quantization import dequantize_kv_blocks, kv_storage_dtype, quantize_kv_blocks
+from .manager_configs import AllocationMode, KVCacheConfig, KVQuantizationType, MemoryConfig
 
 
 def split_kv(kv_cache: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
@@ -37,12 +37,73 @@ def split_kv(kv_cache: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
     return kv_cache[:, :, 0, :, :], kv_cache[:, :, 1, :, :]
 
 
+def _contiguous_runs(block_ids: List[int]) -> List[Tuple[int, int, int]]:
+    """
+    Split a list of block ids into runs of consecutive ids so they can be copied with as few
+    copies as possible.
+
+    Returns:
+        List[Tuple[int, int, int]]: Tuples of (offset into ``block_ids``, first block id, run length).
+    """
+    runs = []
+    start = 0
+    for i in range(1, len(block_ids) + 1):
+        if i == len(block_ids) or block_ids[i] != block_ids[i - 1] + 1:
+            runs.append((start, block_ids[start], i - start))
+            start = i
+    return runs
+
+
+def _bytes_view(tensor: Optional[torch.Tensor]) -> Optional[torch.Tensor]:
+    """
+    View 1-byte floating point tensors (fp8) as uint8, since indexing and copy operators are not
+    implemented for them.
+    """
+    if tensor is not None and tensor.is_floating_point() and tensor.element_size() == 1:
+        return tensor.view(torch.uint8)
+    return tensor
+
+
+class KVCacheOccupancy:
+    """
+    Block occupancy of a single KV-cache tier for one cache group.
+    """
+
+    def __init__(self, total_blocks: int, free_blocks: int) -> None:
+        self.total_blocks = total_blocks
+        self.free_blocks = free_blocks
+
+    @property
+    def used_blocks(self) -> int:
+        """
+        Number of blocks currently in use.
+        """
+        return self.total_blocks - self.free_blocks
+
+    @property
+    def utilization(self) -> float:
+        """
+        Fraction of the tier's blocks currently in use.
+        """
+        return self.used_blocks / self.total_blocks if self.total_blocks > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return f"KVCacheOccupancy(total_blocks={self.total_blocks}, free_blocks={self.free_blocks})"
+
+
 class BlockedKVCache:
 
     _caches: Tuple[torch.Tensor, ...]
     """
     Backing storage for all KV caches. This is a 6D tensor with the following shape:
         (num_caches, num_blocks, block_size, 2, num_heads, head_size)
+    Quantized caches are stored in the quantized data type.
+    """
+
+    _scales: Tuple[Optional[torch.Tensor], ...]
+    """
+    Float32 scales of the quantized KV caches, with shape (num_caches, num_blocks, 2, num_heads).
+    None for caches that are not quantized.
     """
 
     _allocators: Tuple[BlockedAllocator, ...]
@@ -57,37 +118,60 @@ class BlockedKVCache:
     GPT-Neo).
     """
 
+    _host_caches: Tuple[torch.Tensor, ...]
+    """
+    Pinned host storage for offloaded blocks. Unlike the accelerator caches these are block-major
+    so that each block is contiguous: (num_host_blocks, num_caches, block_size, 2, num_heads, head_size).
+    Empty if offloading is disabled.
+    """
+
+    _host_scales: Tuple[Optional[torch.Tensor], ...]
+    """
+    Pinned host storage for the scales of offloaded blocks of quantized caches, block-major like
+    ``_host_caches``: (num_host_blocks, num_caches, 2, num_heads).
+    """
+
+    _host_allocators: Tuple[BlockedAllocator, ...]
+    """
+    Block allocator for tracking usage of the host caches.
+    """
+
+    _pending_frees: List[Tuple[Any, torch.Tensor, int]]
+    """
+    Accelerator blocks whose contents are still being copied to the host. Each entry is the
+    (event, blocks, cache_group) of an in-flight offload. The blocks are returned to the allocator
+    once the event completes.
+    """
+
     def __init__(self,
                  configs: Tuple[KVCacheConfig, ...],
                  memory_config: MemoryConfig,
                  mp_group: Optional[Any] = None,
-                 offload: bool = False) -> None:
+                 offload: bool = False,
+                 num_host_blocks: int = 0) -> None:
         """
         Create a container that will maintain the storage and allocations for a set of
         blocked KV-caches.
 
         Parameters:
             config (KVCacheConfig): The configuration of the KV-cache.
-            slack (int): The amount of slack space to reserve in GPU memory for the cache.
-            enable_offload (bool): Whether to enable offloading of the cache to the host.
-            blocks (int): The number of blocks to pre-allocate for the cache. If this is set,
-                slack will be ignored.
+            memory_config (MemoryConfig): Directive for how much accelerator memory to use for the cache.
+            mp_group (Optional[Any]): The model parallel group, used to agree on the number of blocks.
+            offload (bool): Whether to enable offloading of the cache to the host.
+            num_host_blocks (int): The number of blocks per cache group to allocate in pinned host
+                memory when offloading is enabled.
         """
         self._configs = configs
         self._memory_config = memory_config
         self._enable_offload = offload
 
-        if self._enable_offload:
-            raise NotImplementedError("Offloading of KV-caches is not yet supported.")
+        if self._enable_offload and num_host_blocks < 1:
+            raise ValueError(f"KV-cache offloading requires at least 1 host block, provided {num_host_blocks}")
 
         if AllocationMode(self._memory_config.mode) is AllocationMode.RESERVE:
             # TODO(cmikeh2): Change the weighting based on the type of the KV-cache
 
-            total_per_block_footprint = 0
-            for config in self._configs:
-                per_block_footprint = reduce(operator.mul, config.cache_shape, config.block_size)
-                per_block_footprint *= 2  # for key and value
-                total_per_block_footprint += per_block_footprint * elem_size(config.cache_dtype)
+            total_per_block_footprint = sum(self.block_footprint(config) for config in self._configs)
 
             # Perform a dummy nccl call before calculating available memory, on some systems (H100) we've observed higher memory allocations from NCCL
             if dist.get_world_size(group=mp_group) > 1:
@@ -124,6 +208,7 @@ class BlockedKVCache:
             num_blocks = self._memory_config.size
 
         caches = []
+        scales = []
         allocators = []
 
         for cache_group_id, config in enumerate(self._configs):
@@ -134,13 +219,79 @@ class BlockedKVCache:
             alloc_shape = (num_caches, num_blocks, config.block_size, 2, num_heads, head_size)
             inference_logger().info(
                 f"Allocating KV-cache {cache_group_id} with shape: {alloc_shape} consisting of {num_blocks} blocks.")
-            caches.append(torch.empty(alloc_shape, dtype=config.cache_dtype,
-                                      device=get_accelerator().current_device()))
+            caches.append(
+                torch.empty(alloc_shape,
+                            dtype=kv_storage_dtype(config.quantization, config.cache_dtype),
+                            device=get_accelerator().current_device()))
+            if KVQuantizationType(config.quantization) is KVQuantizationType.NONE:
+                scales.append(None)
+            else:
+                scales.append(
+                    torch.ones((num_caches, num_blocks, 2, num_heads),
+                               dtype=torch.float32,
+                               device=get_accelerator().current_device()))
             allocators.append(BlockedAllocator(num_blocks))
 
         self._caches = tuple(caches)
+        self._scales = tuple(scales)
         self._allocators = tuple(allocators)
 
+        host_caches = []
+        host_scales = []
+        host_allocators = []
+        if self._enable_offload:
+            for cache_group_id, (cache, cache_scales) in enumerate(zip(self._caches, self._scales)):
+                host_shape = (num_host_blocks, cache.shape[0], *cache.shape[2:])
+                inference_logger().info(
+                    f"Allocating host KV-cache {cache_group_id} with shape: {host_shape} consisting of {num_host_blocks} blocks."
+                )
+                host_caches.append(get_accelerator().pin_memory(
+                    torch.empty(host_shape, dtype=cache.dtype, device="cpu")))
+                if cache_scales is None:
+                    host_scales.append(None)
+                else:
+                    scales_shape = (num_host_blocks, cache_scales.shape[0], *cache_scales.shape[2:])
+                    host_scales.append(get_accelerator().pin_memory(
+                        torch.empty(scales_shape, dtype=cache_scales.dtype, device="cpu")))
+                host_allocators.append(BlockedAllocator(num_host_blocks))
+
+        self._host_caches = tuple(host_caches)
+        self._host_scales = tuple(host_scales)
+        self._host_allocators = tuple(host_allocators)
+        self._pending_frees = []
+
+        # All host <-> accelerator copies are issued on a single side stream so that they are ordered
+        # with respect to each other. Accelerators without stream support copy synchronously.
+        stream_cls = get_accelerator().Stream
+        self._copy_stream = stream_cls() if self._enable_offload and stream_cls is not None else None
+
+    @staticmethod
+    def block_footprint(config: KVCacheConfig) -> int:
+        """
+        Number of bytes of accelerator memory used by a single block of a cache group, including the
+        scales of quantized caches.
+        """
+        num_caches, num_heads, _ = config.cache_shape
+        storage_dtype = kv_storage_dtype(config.quantization, config.cache_dtype)
+        footprint = reduce(operator.mul, config.cache_shape, config.block_size)
+        footprint *= 2 * torch.empty((), dtype=storage_dtype).element_size()  # for key and value
+        if KVQuantizationType(config.quantization) is not KVQuantizationType.NONE:
+            footprint += num_caches * 2 * num_heads * 4  # float32 scales
+        return footprint
+
+    def _group_tensors(self, cache_group: int) -> List[Tuple[torch.Tensor, Optional[torch.Tensor]]]:
+        """
+        The accelerator tensors holding the blocks of a cache group (the cache and, if quantized, its
+        scales) paired with their host tier counterparts. All have the block dimension at index 1 on
+        the accelerator and at index 0 on the host.
+        """
+        host_cache = self._host_caches[cache_group] if self._enable_offload else None
+        tensors = [(_bytes_view(self._caches[cache_group]), _bytes_view(host_cache))]
+        if self._scales[cache_group] is not None:
+            host_scales = self._host_scales[cache_group] if self._enable_offload else None
+            tensors.append((self._scales[cache_group], host_scales))
+        return tensors
+
     def reserve(self, num_blocks: int, cache_group: int = 0) -> torch.Tensor:
         """
         Reserve a number of blocks from the cache. This will return a 1D tensor of
@@ -150,6 +301,7 @@ class BlockedKVCache:
             num_blocks (int): The number of blocks to reserve.
             cache_group (int): The cache group to reserve from. Default is 0.
         """
+        self._reclaim_offloaded_blocks(wait=num_blocks > self._allocators[cache_group].free_blocks)
         return self._allocators[cache_group].allocate(num_blocks)
 
     def free(self, blocks: Iterable[int], cache_group: int = 0) -> None:
@@ -163,25 +315,147 @@ class BlockedKVCache:
         """
         self._allocators[cache_group].free(blocks)
 
+    def copy_blocks(self, src_blocks: torch.Tensor, dst_blocks: torch.Tensor, cache_group: int = 0) -> None:
+        """
+        Copy the contents of KV blocks into other blocks of the same cache group for all caches
+        in the group.
+
+        Parameters:
+            src_blocks (torch.Tensor): The blocks to copy from.
+            dst_blocks (torch.Tensor): The blocks to copy into, in the order of ``src_blocks``.
+            cache_group (int): The cache group of the blocks. Default is 0.
+        """
+        cache = self._caches[cache_group]
+        src_blocks = src_blocks.to(device=cache.device, dtype=torch.int64)
+        dst_blocks = dst_blocks.to(device=cache.device, dtype=torch.int64)
+        for tensor, _ in self._group_tensors(cache_group):
+            tensor.index_copy_(1, dst_blocks, tensor.index_select(1, src_blocks))
+
+    def _reclaim_offloaded_blocks(self, wait: bool = False) -> None:
+        """
+        Return accelerator blocks whose offload copies have completed to the allocator.
+
+        Parameters:
+            wait (bool): Block until all in-flight offloads have completed.
+        """
+        while self._pending_frees:
+            event, blocks, cache_group = self._pending_frees[0]
+            if event is not None and not event.query():
+                if not wait:
+                    break
+                event.synchronize()
+            self._allocators[cache_group].free(blocks)
+            self._pending_frees.pop(0)
+
     def offload(self, blocks: Iterable[int], cache_group: int = 0) -> torch.Tensor:
         """
-        Offload KV-cache blocks from accelerator memory to the host.
+        Offload KV-cache blocks from accelerator memory to the host. The copy is issued asynchronously
+        and ownership of ``blocks`` is transferred to the cache: they are returned to the accelerator
+        allocator once the copy has completed and must not be freed by the caller.
 
         Parameters:
             blocks (Iterable[int]): The blocks to offload.
             cache_group (int): The cache group to offload from. Default is 0.
+
+        Returns:
+            torch.Tensor: The host block ids holding the offloaded contents, in the order of ``blocks``.
         """
-        raise NotImplementedError("Offloading is not yet supported.")
+        if not self._enable_offload:
+            raise RuntimeError("KV-cache offloading is not enabled.")
+
+        if not isinstance(blocks, torch.Tensor):
+            blocks = torch.tensor(list(blocks), dtype=torch.int32)
+        blocks = blocks.cpu()
+
+        host_blocks = self._host_allocators[cache_group].allocate(blocks.numel())
+        if blocks.numel() == 0:
+            return host_blocks
+
+        copy_stream = self._copy_stream
+        current_stream = get_accelerator().current_stream()
+
+        if copy_stream is not None:
+            # Pending writes to the blocks (i.e. the forward that produced them) must land first.
+            copy_stream.wait_stream(current_stream)
+
+        with get_accelerator().stream(copy_stream):
+            device_blocks = blocks.to(device=self._caches[cache_group].device, dtype=torch.int64, non_blocking=True)
+            for tensor, host_tensor in self._group_tensors(cache_group):
+                # Gather into a block-major staging buffer so each block is a single contiguous copy.
+                staging = tensor.index_select(1, device_blocks).transpose(0, 1).contiguous()
+                for offset, first_block, n_blocks in _contiguous_runs(host_blocks.tolist()):
+                    host_tensor[first_block:first_block + n_blocks].copy_(staging[offset:offset + n_blocks],
+                                                                          non_blocking=True)
+
+        event = None
+        if copy_stream is not None:
+            event = get_accelerator().Event()
+            event.record(copy_stream)
+
+        self._pending_frees.append((event, blocks, cache_group))
+        self._reclaim_offloaded_blocks()
+        return host_blocks
 
     def restore(self, blocks: Iterable[int], cache_group: int = 0) -> torch.Tensor:
         """
-        Restore KV-cache blocks from the host to accelerator memory.
+        Restore KV-cache blocks from the host to accelerator memory. New accelerator blocks are
+        allocated for the contents and the host blocks are released. The copy is asynchronous with
+        respect to the host, but work subsequently issued on the current stream (i.e. the next forward)
+        is ordered after it.
 
         Parameters:
-            blocks (Iterable[int]): The blocks to restore.
+            blocks (Iterable[int]): The host blocks to restore.
             cache_group (int): The cache group to restore to. Default is 0.
+
+        Returns:
+            torch.Tensor: The accelerator block ids now holding the contents, in the order of ``blocks``.
+        """
+        if not self._enable_offload:
+            raise RuntimeError("KV-cache offloading is not enabled.")
+
+        if not isinstance(blocks, torch.Tensor):
+            blocks = torch.tensor(list(blocks), dtype=torch.int32)
+        blocks = blocks.cpu()
+
+        new_blocks = self.reserve(blocks.numel(), cache_group=cache_group)
+        if blocks.numel() == 0:
+            return new_blocks
+
+        copy_stream = self._copy_stream
+        current_stream = get_accelerator().current_stream()
+
+        if copy_stream is not None:
+            # The newly reserved blocks may have been read by work still in flight on the current stream.
+            copy_stream.wait_stream(current_stream)
+
+        with get_accelerator().stream(copy_stream):
+            device = self._caches[cache_group].device
+            device_blocks = new_blocks.to(device=device, dtype=torch.int64, non_blocking=True)
+            for tensor, host_tensor in self._group_tensors(cache_group):
+                staging = torch.empty((blocks.numel(), tensor.shape[0], *tensor.shape[2:]),
+                                      dtype=tensor.dtype,
+                                      device=device)
+                for offset, first_block, n_blocks in _contiguous_runs(blocks.tolist()):
+                    staging[offset:offset + n_blocks].copy_(host_tensor[first_block:first_block + n_blocks],
+                                                            non_blocking=True)
+                tensor.index_copy_(1, device_blocks, staging.transpose(0, 1))
+
+        if copy_stream is not None:
+            current_stream.wait_stream(copy_stream)
+
+        # Safe to reuse immediately since all subsequent host cache writes are ordered on the copy stream.
+        self._host_allocators[cache_group].free(blocks)
+        return new_blocks
+
+    def free_host(self, blocks: Iterable[int], cache_group: int = 0) -> None:
         """
-        raise NotImplementedError("Offloading is not yet supported.")
+        Release host blocks without restoring their contents.
+
+        Parameters:
+            blocks (Iterable[int]): The host blocks to free.
+            cache_group (int): The cache group to free from. Default is 0.
+        """
+        self._host_allocators[cache_group].free(blocks)
 
     def get_cache(self, cache_id: int, cache_group: int = 0) -> torch.Tensor:
         """
@@ -193,12 +467,88 @@ class BlockedKVCache:
         """
         return self._caches[cache_group][cache_id]
 
+    def get_scales(self, cache_id: int, cache_group: int = 0) -> Optional[torch.Tensor]:
+        """
+        Get the scales of the given cache ID, of shape (num_blocks, 2, num_heads). None if the cache
+        group is not quantized.
+
+        Parameters:
+            cache_id (int): The ID of the cache tensor to get the scales of.
+            cache_group (int): The cache group to get from. Default is 0.
+        """
+        scales = self._scales[cache_group]
+        return scales[cache_id] if scales is not None else None
+
+    def store_blocks(self, cache_id: int, blocks: torch.Tensor, values: torch.Tensor, cache_group: int = 0) -> None:
+        """
+        Write the keys and values of full blocks, quantizing them if the cache group is quantized.
+        This is the reference path for quantized caches; attention kernels write the cache directly.
+
+        Parameters:
+            cache_id (int): The ID of the cache tensor to write to.
+            blocks (torch.Tensor): The blocks to write.
+            values (torch.Tensor): Keys and values of shape [len(blocks), block_size, 2, num_heads, head_size].
+            cache_group (int): The cache group to write to. Default is 0.
+        """
+        cache = self._caches[cache_group][cache_id]
+        blocks = blocks.to(device=cache.device, dtype=torch.int64)
+        quantization = KVQuantizationType(self._configs[cache_group].quantization)
+        if quantization is KVQuantizationType.NONE:
+            cache.index_copy_(0, blocks, values.to(device=cache.device, dtype=cache.dtype))
+        else:
+            quantized, scales = quantize_kv_blocks(values.to(cache.device), quantization)
+            _bytes_view(cache).index_copy_(0, blocks, _bytes_view(quantized))
+            self._scales[cache_group][cache_id].index_copy_(0, blocks, scales)
+
+    def load_blocks(self, cache_id: int, blocks: torch.Tensor, cache_group: int = 0) -> torch.Tensor:
+        """
+        Read the keys and values of blocks in the ``cache_dtype`` of the cache group, dequantizing
+        them if the cache group is quantized.
+
+        Parameters:
+            cache_id (int): The ID of the cache tensor to read from.
+            blocks (torch.Tensor): The blocks to read.
+            cache_group (int): The cache group to read from. Default is 0.
+
+        Returns:
+            torch.Tensor: Keys and values of shape [len(blocks), block_size, 2, num_heads, head_size].
+        """
+        cache = self._caches[cache_group][cache_id]
+        blocks = blocks.to(device=cache.device, dtype=torch.int64)
+        scales = self.get_scales(cache_id, cache_group)
+        if scales is None:
+            return cache.index_select(0, blocks)
+        quantized = _bytes_view(cache).index_select(0, blocks).view(cache.dtype)
+        return dequantize_kv_blocks(quantized, scales.index_select(0, blocks), self._configs[cache_group].cache_dtype)
+
     @property
     def free_blocks(self) -> torch.Tensor:
         """
-        Return the number of free blocks in each cache
+        Return the number of free blocks in each cache. Blocks that are still being offloaded are
+        counted as free since ``reserve`` will wait for them if needed.
+        """
+        free_blocks = [allocator.free_blocks for allocator in self._allocators]
+        for _, blocks, cache_group in self._pending_frees:
+            free_blocks[cache_group] += blocks.numel()
+        return free_blocks
+
+    @property
+    def offload_enabled(self) -> bool:
+        """
+        Whether the host tier is available.
+        """
+        return self._enable_offload
+
+    def occupancy(self) -> Tuple[Tuple[KVCacheOccupancy, ...], Tuple[KVCacheOccupancy, ...]]:
+        """
+        Block occupancy of each cache group for the accelerator and host tiers. The host tier is
+        empty when offloading is disabled.
         """
-        return [allocator.free_blocks for allocator in self._allocators]
+        device = tuple(KVCacheOccupancy(cache.shape[1], free) for cache, free in zip(self._caches, self.free_blocks))
+        host = tuple(
+            KVCacheOccupancy(cache.shape[0], allocator.free_blocks)
+            for cache, allocator in zip(self._host_caches, self._host_allocators))
+        return device, host
 
     @property
     def num_caches(self) -> int:
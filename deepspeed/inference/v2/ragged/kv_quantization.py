@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Tuple
+
+import torch
+
+from .manager_configs import KVQuantizationType
+
+_QUANTIZED_MAX = {
+    KVQuantizationType.INT8: 127.0,
+    KVQuantizationType.FP8: 448.0,
+}
+
+
+def kv_storage_dtype(quantization: KVQuantizationType, cache_dtype: torch.dtype) -> torch.dtype:
+    """
+    Data type the KV-cache is stored in for the given quantization.
+    """
+    quantization = KVQuantizationType(quantization)
+    if quantization is KVQuantizationType.NONE:
+        return cache_dtype
+    if quantization is KVQuantizationType.INT8:
+        return torch.int8
+    if not hasattr(torch, "float8_e4m3fn"):
+        raise RuntimeError("fp8 KV-cache quantization requires a version of PyTorch with float8_e4m3fn support.")
+    return torch.float8_e4m3fn
+
+
+def quantize_kv_blocks(blocks: torch.Tensor, quantization: KVQuantizationType) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Reference (pure PyTorch) quantization of full KV blocks. Blocks are quantized symmetrically with
+    one scale for each block, key/value and head, computed from the absolute maximum over the tokens
+    of the block and the head dimension.
+
+    Arguments:
+        blocks (torch.Tensor): Keys and values of shape [..., block_size, 2, num_heads, head_size].
+        quantization (KVQuantizationType): The quantized storage format.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: The quantized blocks, with the same shape as ``blocks``,
+            and their float32 scales of shape [..., 2, num_heads].
+    """
+    quantization = KVQuantizationType(quantization)
+    if quantization is KVQuantizationType.NONE:
+        raise ValueError("Cannot quantize KV blocks without a quantization type.")
+
+    values = blocks.float()
+    q_max = _QUANTIZED_MAX[quantization]
+    scales = (values.abs().amax(dim=(-4, -1)) / q_max).clamp(min=torch.finfo(torch.float32).tiny)
+    scaled = (values / scales[..., None, :, :, None]).clamp(-q_max, q_max)
+    if quantization is KVQuantizationType.INT8:
+        scaled = scaled.round()
+    return scaled.to(kv_storage_dtype(quantization, blocks.dtype)), scales
+
+
+def dequantize_kv_blocks(quantized: torch.Tensor, scales: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    """
+    Dequantize KV blocks produced by ``quantize_kv_blocks``.
+
+    Arguments:
+        quantized (torch.Tensor): Quantized keys and values of shape
+            [..., block_size, 2, num_heads, head_size].
+        scales (torch.Tensor): Scales of shape [..., 2, num_heads].
+        dtype (torch.dtype): Data type of the result.
+    """
+    return (quantized.float() * scales[..., None, :, :, None]).to(dtype)
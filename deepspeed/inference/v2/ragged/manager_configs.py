@@ -4,9 +4,9 @@
 # DeepSpeed Team
 
 from enum import Enum
-from typing import Tuple
+from typing import Optional, Tuple
 
-from deepspeed.pydantic_v1 import PositiveInt, validator
+from deepspeed.pydantic_v1 import NonNegativeInt, PositiveInt, validator
 
 from deepspeed.runtime.config_utils import DeepSpeedConfigModel
 from ..inference_utils import DtypeEnum
@@ -25,6 +25,27 @@ class KVCacheType(Enum):
     """
 
 
+class KVQuantizationType(Enum):
+    """
+    Storage format of the KV-cache.
+    """
+
+    NONE = "none"
+    """
+    Store keys and values in ``cache_dtype``.
+    """
+
+    INT8 = "int8"
+    """
+    Store keys and values as symmetric int8 with a scale per block, key/value and head.
+    """
+
+    FP8 = "fp8"
+    """
+    Store keys and values as float8 (e4m3) with a scale per block, key/value and head.
+    """
+
+
 class KVCacheConfig(DeepSpeedConfigModel):
 
     type: KVCacheType = KVCacheType.DENSE
@@ -66,7 +87,14 @@ class KVCacheConfig(DeepSpeedConfigModel):
 
     cache_dtype: DtypeEnum = DtypeEnum.fp16
     """
-    Data type of the KV-cache.
+    Data type of the KV-cache. With ``quantization``, the data type that keys and values are
+    dequantized to.
+    """
+
+    quantization: KVQuantizationType = KVQuantizationType.NONE
+    """
+    Storage format of the KV-cache. Quantized caches store roughly half as many bytes per token as
+    fp16/bf16 caches, so about twice as many blocks fit in the same memory.
     """
 
     max_blocks_per_allocation_group: PositiveInt = 64
@@ -74,6 +102,32 @@ class KVCacheConfig(DeepSpeedConfigModel):
     Maximum number of blocks that can be associated with an allocation group.
     """
 
+    window_size: Optional[PositiveInt] = None
+    """
+    For ``LOCAL`` caches, the number of trailing tokens each new token attends to. KV blocks that
+    fall entirely out of the window of the next token are returned to the allocator as the
+    sequence advances, so the memory held by a sequence is bounded by its sink blocks and window
+    rather than its length. The attention implementation must not read the released blocks.
+    """
+
+    sink_blocks: NonNegativeInt = 0
+    """
+    Number of leading KV blocks of each sequence that are always retained (attention sinks), even
+    once they fall out of the window. Only valid with ``window_size``.
+    """
+
+    @validator("window_size")
+    def window_size_validator(cls, v: Optional[int], values: dict):
+        if v is not None and "type" in values and KVCacheType(values["type"]) is not KVCacheType.LOCAL:
+            raise ValueError("window_size is only supported for local KV caches")
+        return v
+
+    @validator("sink_blocks")
+    def sink_blocks_validator(cls, v: int, values: dict):
+        if v > 0 and values.get("window_size", None) is None:
+            raise ValueError("sink_blocks requires window_size to be set")
+        return v
+
 
 """
 The config above is a little confusing so let's use a couple of concrete examples of
@@ -134,6 +188,60 @@ class MemoryConfig(DeepSpeedConfigModel):
     """
 
 
+class PreemptionMode(Enum):
+    """
+    How the KV blocks of a preempted sequence are reclaimed.
+    """
+
+    NONE = "none"
+    """
+    Never preempt sequences. Batches that do not fit the KV-cache fail to schedule.
+    """
+
+    RECOMPUTE = "recompute"
+    """
+    Release the KV blocks of the victim. The sequence is re-admitted by putting its full token
+    history again, which recomputes its KV-cache.
+    """
+
+    SWAP = "swap"
+    """
+    Park the KV blocks of the victim on the host tier and restore them when the sequence is next
+    scheduled. Falls back to ``RECOMPUTE`` when the host tier is full. Requires ``offload``.
+    """
+
+
+class PreemptionOrder(Enum):
+    """
+    Order in which sequences are chosen as preemption victims.
+    """
+
+    PRIORITY = "priority"
+    """
+    Lowest priority first, then the most recently admitted. Sequences with a higher priority than
+    every sequence of the batch being scheduled are never preempted.
+    """
+
+    NEWEST = "newest"
+    """
+    Most recently admitted first, regardless of priority.
+    """
+
+
+class PreemptionConfig(DeepSpeedConfigModel):
+
+    mode: PreemptionMode = PreemptionMode.NONE
+    """
+    How the KV blocks of preempted sequences are reclaimed. Preemption is disabled by default.
+    """
+
+    order: PreemptionOrder = PreemptionOrder.PRIORITY
+    """
+    Order in which victims are chosen. Preempted sequences are re-admitted in the reverse order:
+    highest priority first, then the earliest admitted.
+    """
+
+
 class DSStateManagerConfig(DeepSpeedConfigModel):
 
     max_tracked_sequences: PositiveInt = 2048
@@ -170,7 +278,36 @@ class DSStateManagerConfig(DeepSpeedConfigModel):
 
     offload: bool = False
     """
-    Enable tracking for offloading KV-cache to host memory. Currently unsupported.
+    Allocate a pinned host-memory tier for the KV-cache so that idle sequences can be parked
+    (their KV blocks copied to the host and released on the accelerator) and later resumed
+    without recomputation.
+    """
+
+    offload_blocks: PositiveInt = 4096
+    """
+    Number of KV blocks per cache group to allocate in pinned host memory when ``offload``
+    is enabled.
+    """
+
+    enable_prefix_cache: bool = False
+    """
+    Cache full KV blocks by their token contents so that new sequences sharing a prompt prefix
+    with a previous sequence can reuse its KV blocks instead of recomputing them. Unreferenced
+    cached blocks are evicted in LRU order when the KV-cache runs out of free blocks. Only
+    supported for models with a single KV cache group and allocation group.
+    """
+
+    kv_quantization: KVQuantizationType = KVQuantizationType.NONE
+    """
+    Storage format of the KV-cache, applied to all of the model's KV-cache groups. See
+    KVQuantizationType for more details. None of the current attention implementations read
+    quantized KV-caches, so transformer models reject values other than NONE at build time.
+    """
+
+    preemption: PreemptionConfig = PreemptionConfig()
+    """
+    Policy for preempting tracked sequences when a batch does not fit the KV-cache. See
+    PreemptionConfig for more details.
     """
 
     @validator("max_ragged_sequence_count")
@@ -181,3 +318,9 @@ class DSStateManagerConfig(DeepSpeedConfigModel):
         if "max_ragged_batch_size" in values and v > values["max_ragged_batch_size"]:
             raise ValueError("max_ragged_sequence_count must be less than max_ragged_batch_size")
         return v
+
+    @validator("preemption")
+    def preemption_validator(cls, v: PreemptionConfig, values: dict):
+        if PreemptionMode(v.mode) is PreemptionMode.SWAP and not values.get("offload", False):
+            raise ValueError("Swap preemption requires offload to be enabled")
+        return v
@@ -0,0 +1,152 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Iterable, List, Optional
+
+from .manager_configs import PreemptionConfig, PreemptionMode, PreemptionOrder
+
+
+class PreemptionCandidate:
+    """
+    A tracked sequence that may be preempted to reclaim KV blocks.
+    """
+
+    uid: int
+    """
+    The UID of the sequence.
+    """
+
+    priority: int
+    """
+    Priority of the sequence, higher values are preempted later.
+    """
+
+    arrival: int
+    """
+    Order in which the sequence was first admitted.
+    """
+
+    n_blocks: int
+    """
+    Number of KV blocks that preempting the sequence returns to the accelerator KV-cache. Blocks
+    that stay referenced by the prefix cache or by other sequences are not counted.
+    """
+
+    def __init__(self, uid: int, priority: int, arrival: int, n_blocks: int) -> None:
+        self.uid = uid
+        self.priority = priority
+        self.arrival = arrival
+        self.n_blocks = n_blocks
+
+
+class PreemptedSequence:
+    """
+    Record of a preempted sequence awaiting re-admission.
+    """
+
+    uid: int
+    """
+    The UID of the sequence.
+    """
+
+    mode: PreemptionMode
+    """
+    ``SWAP`` if the KV blocks of the sequence are parked on the host and will be restored, or
+    ``RECOMPUTE`` if they were released and the full token history must be put again.
+    """
+
+    n_tokens: int
+    """
+    Number of tokens the sequence had seen when it was preempted.
+    """
+
+    priority: int
+    """
+    Priority of the sequence.
+    """
+
+    arrival: int
+    """
+    Order in which the sequence was first admitted. Kept across re-admission so preempted sequences
+    do not lose their place to newer ones.
+    """
+
+    def __init__(self, uid: int, mode: PreemptionMode, n_tokens: int, priority: int, arrival: int) -> None:
+        self.uid = uid
+        self.mode = mode
+        self.n_tokens = n_tokens
+        self.priority = priority
+        self.arrival = arrival
+
+
+class PreemptionPolicy:
+    """
+    Decides which sequences to preempt when a batch does not fit the KV-cache and in which order
+    preempted sequences are re-admitted. The policy only sees ``PreemptionCandidate`` summaries, so
+    it does not depend on the KV-cache itself.
+    """
+
+    def __init__(self, config: PreemptionConfig) -> None:
+        self._mode = PreemptionMode(config.mode)
+        self._order = PreemptionOrder(config.order)
+
+    @property
+    def enabled(self) -> bool:
+        return self._mode is not PreemptionMode.NONE
+
+    @property
+    def mode(self) -> PreemptionMode:
+        return self._mode
+
+    def victim_order(self, candidates: Iterable[PreemptionCandidate]) -> List[PreemptionCandidate]:
+        """
+        Order the candidates from the first to the last to preempt.
+        """
+        if self._order is PreemptionOrder.PRIORITY:
+            return sorted(candidates, key=lambda c: (c.priority, -c.arrival))
+        return sorted(candidates, key=lambda c: -c.arrival)
+
+    def select_victims(self,
+                       candidates: Iterable[PreemptionCandidate],
+                       n_blocks: int,
+                       max_priority: Optional[int] = None) -> List[PreemptionCandidate]:
+        """
+        Choose the sequences to preempt in order to reclaim ``n_blocks`` KV blocks.
+
+        Arguments:
+            candidates (Iterable[PreemptionCandidate]): Sequences that may be preempted.
+            n_blocks (int): Number of KV blocks to reclaim.
+            max_priority (Optional[int]): Priority of the work the blocks are reclaimed for. With the
+                ``PRIORITY`` order, sequences of a higher priority are not preempted for it.
+
+        Returns:
+            List[PreemptionCandidate]: The victims, in preemption order. Empty if preemption is
+                disabled or the candidates cannot cover ``n_blocks``, since preempting them would
+                not allow the batch to be scheduled.
+        """
+        if not self.enabled or n_blocks <= 0:
+            return []
+
+        victims = []
+        reclaimed = 0
+        for candidate in self.victim_order(candidates):
+            if candidate.n_blocks == 0:
+                continue
+            if (self._order is PreemptionOrder.PRIORITY and max_priority is not None
+                    and candidate.priority > max_priority):
+                break
+            victims.append(candidate)
+            reclaimed += candidate.n_blocks
+            if reclaimed >= n_blocks:
+                return victims
+        return []
+
+    def readmission_order(self, preempted: Iterable[PreemptedSequence]) -> List[int]:
+        """
+        Order the uids of preempted sequences from the first to the last to re-admit.
+        """
+        if self._order is PreemptionOrder.PRIORITY:
+            return [seq.uid for seq in sorted(preempted, key=lambda s: (-s.priority, s.arrival))]
+        return [seq.uid for seq in sorted(preempted, key=lambda s: s.arrival)]
@@ -4,18 +4,32 @@
 # DeepSpeed Team
 
 import torch
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from deepspeed.accelerator import get_accelerator
 from deepspeed.ops.op_builder import RaggedUtilsBuilder
 from deepspeed.utils.logging import logger
 
 from .blocked_allocator import BlockedAllocator
-from .kv_cache import BlockedKVCache
-from .manager_configs import DSStateManagerConfig, KVCacheConfig
+from .cache_tree import PrefixCacheTree
+from .kv_cache import BlockedKVCache, KVCacheOccupancy
+from .manager_configs import DSStateManagerConfig, KVCacheConfig, PreemptionMode
+from .preemption import PreemptedSequence, PreemptionCandidate, PreemptionPolicy
 from .sequence_descriptor import DSSequenceDescriptor
 
 
+def retired_kv_blocks(n_tokens: int, kv_config: KVCacheConfig) -> int:
+    """
+    Number of leading KV blocks of a sequence with ``n_tokens`` seen tokens that are out of the
+    attention window of its next token, and so no longer needed. Always 0 for caches without a
+    ``window_size``.
+    """
+    if kv_config.window_size is None:
+        return 0
+    # The next token (at position n_tokens) attends to the window_size tokens ending at itself.
+    return max(n_tokens - kv_config.window_size + 1, 0) // kv_config.block_size
+
+
 class DSStateManager:
     """
     Base abstract class for managing blocked KV caches. Will probably have a single
@@ -52,6 +66,37 @@ class DSStateManager:
     _all_block_ids: Tuple[torch.Tensor, ...]
     _all_block_ids_shadow: Tuple[torch.Tensor, ...]
 
+    _parked_blocks: Dict[int, List[List[torch.Tensor]]]
+    """
+    Host block ids of parked sequences, indexed by uid, then cache group, then allocation group.
+    """
+
+    _prefix_cache: Optional[PrefixCacheTree]
+    """
+    Cache of full KV blocks shared between sequences with common prompt prefixes. Only present
+    when ``enable_prefix_cache`` is set in the config.
+    """
+
+    _preemption_policy: PreemptionPolicy
+    """
+    Chooses the victims of ``preempt`` and the order in which they are re-admitted.
+    """
+
+    _preempted: Dict[int, PreemptedSequence]
+    """
+    Preempted sequences awaiting re-admission, indexed by uid.
+    """
+
+    _priorities: Dict[int, int]
+    """
+    Priorities set with ``set_sequence_priority``. Sequences without an entry have priority 0.
+    """
+
+    _arrivals: Dict[int, int]
+    """
+    Admission order of each sequence, kept while a preempted sequence awaits re-admission.
+    """
+
     def __init__(self,
                  config: DSStateManagerConfig,
                  kv_configs: Tuple[KVCacheConfig, ...],
@@ -95,7 +140,25 @@ class DSStateManager:
         self._kv_cache = BlockedKVCache(self._kv_configs,
                                         self._config.memory_config,
                                         mp_group=base_mp_group,
-                                        offload=self._config.offload)
+                                        offload=self._config.offload,
+                                        num_host_blocks=self._config.offload_blocks)
+        self._parked_blocks = {}
+
+        self._prefix_cache = None
+        if self._config.enable_prefix_cache:
+            if any(kv_config.window_size is not None for kv_config in self._kv_configs):
+                logger.warning("Prefix caching is not supported for models with windowed KV caches, disabling it.")
+            elif len(self._kv_configs) == 1 and self._kv_configs[0].num_allocation_groups == 1:
+                self._prefix_cache = PrefixCacheTree(self._kv_configs[0].block_size)
+            else:
+                logger.warning("Prefix caching is only supported for models with a single KV cache group and "
+                               "allocation group, disabling it.")
+
+        self._preemption_policy = PreemptionPolicy(self._config.preemption)
+        self._preempted = {}
+        self._priorities = {}
+        self._arrivals = {}
+        self._n_admitted = 0
 
     def get_cache(self, cache_id: int, cache_group: int = 0) -> torch.Tensor:
         """
@@ -107,17 +170,50 @@ class DSStateManager:
         """
         return self._kv_cache.get_cache(cache_id, cache_group=cache_group)
 
+    def get_cache_scales(self, cache_id: int, cache_group: int = 0) -> Optional[torch.Tensor]:
+        """
+        Return the per-block scales of the given cache id if the cache group is quantized, otherwise
+        None. See ``KVCacheConfig.quantization``.
+
+        Arguments:
+            cache_group (str): The KV cache group.
+            cache_id (int): The cache id within that group.
+        """
+        return self._kv_cache.get_scales(cache_id, cache_group=cache_group)
+
     def flush_sequence(self, uid: int) -> None:
         """
         Free all resources associated with the given sequence id.
         """
+        self._priorities.pop(uid, None)
+        self._arrivals.pop(uid, None)
+        preempted = self._preempted.pop(uid, None)
+
         if uid not in self._seqs:
-            logger.warning(f"Attempting to flush sequence {uid} which does not exist.")
+            if preempted is None:
+                logger.warning(f"Attempting to flush sequence {uid} which does not exist.")
             return
 
+        self._release_sequence(uid)
+
+    def _release_sequence(self, uid: int) -> None:
+        """
+        Free the KV blocks (on both tiers) and the tracking slot of a sequence.
+        """
         seq = self._seqs[uid]
+        parked_blocks = self._parked_blocks.pop(uid, None)
+        if parked_blocks is not None:
+            for i, group_blocks in enumerate(parked_blocks):
+                self._kv_cache.free_host(torch.cat(group_blocks), cache_group=i)
+
         for i in range(self.n_kv_cache_groups):
-            self._kv_cache.free(seq.all_block_ids(cache_group=i), cache_group=i)
+            block_ids = seq.all_block_ids(cache_group=i)
+            if i == 0 and self._prefix_cache is not None and seq.prefix_nodes:
+                # Blocks owned by the prefix cache stay cached (and evictable) after the flush.
+                cached_ids = torch.tensor([node.block_id for node in seq.prefix_nodes], dtype=block_ids.dtype)
+                block_ids = block_ids[~torch.isin(block_ids.cpu(), cached_ids)]
+                self._prefix_cache.release(seq.prefix_nodes)
+            self._kv_cache.free(block_ids, cache_group=i)
 
         self._tracking_allocator.free(seq.tracking_id)
         del self._seqs[uid]
@@ -129,20 +225,25 @@ class DSStateManager:
         """
         return self._seqs.get(uid, None)
 
-    def get_or_create_sequence(self, uid: int) -> DSSequenceDescriptor:
+    def get_or_create_sequence(self, uid: int, tokens: Optional[torch.Tensor] = None) -> DSSequenceDescriptor:
         """
         Get the existing sequence descriptor for a given uid or initialize one if
         it does not exist. NOTE: This will always return a valid sequence descriptor
         if one may be allocated and should not be used from APIs that are attempting
         to test the schedulability of a hypothetical batch.
+
+        If prefix caching is enabled and ``tokens`` (the first tokens of a new sequence) are
+        provided, the KV blocks for the longest cached prefix of ``tokens`` are attached to the
+        new sequence and counted as seen. The caller should only run the forward for
+        ``tokens[seq.seen_tokens:]``.
         """
         seq = self.get_sequence(uid)
         if seq is not None:
             return seq
         else:
-            return self._create_sequence(uid)
+            return self._create_sequence(uid, tokens)
 
-    def _create_sequence(self, uid: int) -> DSSequenceDescriptor:
+    def _create_sequence(self, uid: int, tokens: Optional[torch.Tensor] = None) -> DSSequenceDescriptor:
         """
         Create a new sequence descriptor for the given sequence id.
         """
@@ -163,10 +264,386 @@ class DSStateManager:
                                                seq_block_ids,
                                                seq_block_ids_shadow,
                                                max_context=self._config.max_context)
+
+        if uid not in self._arrivals:
+            self._arrivals[uid] = self._n_admitted
+            self._n_admitted += 1
+        # A sequence preempted by recompute is re-admitted by creating it again.
+        self._preempted.pop(uid, None)
+
+        if self._prefix_cache is not None and tokens is not None:
+            self._attach_cached_prefix(self._seqs[uid], tokens)
+
         # TODO(cmikeh2): Debug call here might be unnecessary and is potentially on critical path.
         logger.debug(f"Created sequence {uid} with tracking slot {tracking_slot}.")
         return self._seqs[uid]
 
+    def _attach_cached_prefix(self, seq: DSSequenceDescriptor, tokens: torch.Tensor) -> None:
+        """
+        Attach the KV blocks of the longest cached prefix of ``tokens`` to a new sequence.
+        """
+        # Always leave at least one token to run through the model so there are logits to return.
+        max_blocks = (tokens.numel() - 1) // self._prefix_cache.block_size
+        if max_blocks <= 0:
+            return
+
+        nodes = self._prefix_cache.match(tokens, max_blocks=max_blocks)
+        if not nodes:
+            return
+
+        self._prefix_cache.acquire(nodes)
+        seq.prefix_nodes.extend(nodes)
+        block_ids = torch.tensor([node.block_id for node in nodes], dtype=torch.int32)
+        seq.extend_kv_cache(block_ids, n_cached_tokens=len(nodes) * self._prefix_cache.block_size)
+
+    def cache_prefix_blocks(self, seq: DSSequenceDescriptor, tokens: torch.Tensor) -> None:
+        """
+        Record the tokens of a completed forward for ``seq`` and insert any newly filled KV
+        blocks into the prefix cache. This is a no-op when prefix caching is disabled.
+
+        Arguments:
+            seq (DSSequenceDescriptor): The sequence that completed a forward.
+            tokens (torch.Tensor): The tokens of ``seq`` that were part of the forward.
+        """
+        if self._prefix_cache is None:
+            return
+
+        block_size = self._prefix_cache.block_size
+        pending = seq.uncached_tokens
+        pending.extend(tokens.tolist())
+
+        n_full = len(pending) // block_size
+        if n_full == 0:
+            return
+
+        block_ids = seq.kv_cache_ids(cache_group=0, on_device=False)[0]
+        parent = seq.prefix_nodes[-1] if seq.prefix_nodes else None
+        for i in range(n_full):
+            block_idx = len(seq.prefix_nodes)
+            chunk = pending[i * block_size:(i + 1) * block_size]
+            node, _ = self._prefix_cache.insert(parent, chunk, block_ids[block_idx].item())
+            self._prefix_cache.acquire([node])
+            seq.prefix_nodes.append(node)
+            parent = node
+
+        del pending[:n_full * block_size]
+
+    def truncate_sequence(self, uid: int, n_tokens: int) -> None:
+        """
+        Truncate a sequence to its first ``n_tokens`` tokens (i.e. to discard rejected speculative
+        tokens, pruned beams, or a trailing stop sequence) without flushing it. KV blocks that no
+        longer hold any of its tokens are freed or, if they are owned by the prefix cache, released.
+        A partially kept block that is shared through the prefix cache is copied first so the cached
+        contents are not overwritten by subsequent tokens.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+            n_tokens (int): The number of tokens to keep.
+        """
+        seq = self.get_sequence(uid)
+        if seq is None:
+            raise ValueError(f"Cannot truncate sequence {uid} which does not exist.")
+
+        if uid in self._parked_blocks:
+            raise RuntimeError(f"Cannot truncate sequence {uid} while it is parked.")
+
+        if n_tokens == seq.seen_tokens:
+            return
+
+        for i, kv_config in enumerate(self._kv_configs):
+            n_released = seq.n_released_blocks(i)
+            if n_released > 0 and retired_kv_blocks(n_tokens, kv_config) < kv_config.sink_blocks + n_released:
+                raise RuntimeError(f"Cannot truncate sequence {uid} to {n_tokens} tokens, its attention window "
+                                   "would include KV blocks that have been released.")
+
+        seq.truncate(n_tokens)
+        new_seen = seq.seen_tokens
+
+        for i, kv_config in enumerate(self._kv_configs):
+            n_keep = (new_seen + kv_config.block_size - 1) // kv_config.block_size
+            released_ids = None
+
+            if i == 0 and self._prefix_cache is not None:
+                n_full = new_seen // kv_config.block_size
+                n_partial = new_seen % kv_config.block_size
+                released = seq.prefix_nodes[n_full:]
+
+                if len(seq.prefix_nodes) > n_full:
+                    # The partially kept block (if any) was full and is now owned by the prefix cache.
+                    seq.uncached_tokens[:] = list(seq.prefix_nodes[n_full].key[:n_partial])
+                else:
+                    del seq.uncached_tokens[n_partial:]
+
+                if released:
+                    released_ids = torch.tensor([node.block_id for node in released], dtype=torch.int32)
+                    # When the block had already been cached by another sequence, the node holds that
+                    # sequence's block and this sequence's own copy is still private, so it is kept as is.
+                    own_block = seq.kv_cache_ids(cache_group=0, on_device=False)[0][n_full].item()
+                    if n_partial > 0 and own_block == seq.prefix_nodes[n_full].block_id:
+                        shared_block = torch.tensor([own_block], dtype=torch.int32)
+                        private_block = self.allocate_blocks(1, cache_group=0)
+                        self._kv_cache.copy_blocks(shared_block, private_block, cache_group=0)
+                        seq.replace_kv_block(n_full, private_block.item())
+                    self._prefix_cache.release(released)
+                    del seq.prefix_nodes[n_full:]
+
+            for block_ids in seq.detach_kv_blocks(n_keep, cache_group=i):
+                if released_ids is not None:
+                    block_ids = block_ids[~torch.isin(block_ids, released_ids)]
+                if block_ids.numel() > 0:
+                    self._kv_cache.free(block_ids, cache_group=i)
+
+    def release_retired_blocks(self, seq: DSSequenceDescriptor) -> None:
+        """
+        Return the KV blocks of a sequence that fell out of the attention window of a local KV-cache
+        to the allocator, keeping the sink blocks of the cache (see ``KVCacheConfig.window_size``).
+        This is a no-op for caches without a window.
+
+        Arguments:
+            seq (DSSequenceDescriptor): The sequence that completed a forward.
+        """
+        for i, kv_config in enumerate(self._kv_configs):
+            n_retired = retired_kv_blocks(seq.seen_tokens, kv_config)
+            if n_retired <= kv_config.sink_blocks:
+                continue
+            released = torch.cat(seq.release_kv_blocks(kv_config.sink_blocks, n_retired, cache_group=i))
+            if released.numel() > 0:
+                self._kv_cache.free(released, cache_group=i)
+
+    def rollback_sequence(self, uid: int, n_tokens: int) -> None:
+        """
+        Discard the last ``n_tokens`` tokens of a sequence. See ``truncate_sequence``.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+            n_tokens (int): The number of tokens to discard.
+        """
+        seq = self.get_sequence(uid)
+        if seq is None:
+            raise ValueError(f"Cannot roll back sequence {uid} which does not exist.")
+
+        if n_tokens < 0 or n_tokens > seq.seen_tokens:
+            raise ValueError(f"Cannot roll back {n_tokens} tokens from sequence {uid} with {seq.seen_tokens} tokens.")
+
+        self.truncate_sequence(uid, seq.seen_tokens - n_tokens)
+
+    def park_sequence(self, uid: int) -> None:
+        """
+        Copy the KV blocks of an idle sequence to the host tier and release them on the accelerator.
+        The sequence remains tracked and must be resumed with ``resume_sequence`` before its next
+        forward. Blocks shared through the prefix cache stay on the accelerator.
+        """
+        seq = self.get_sequence(uid)
+        if seq is None:
+            raise ValueError(f"Cannot park sequence {uid} which does not exist.")
+
+        if not self._kv_cache.offload_enabled:
+            raise RuntimeError("Parking sequences requires KV-cache offloading to be enabled.")
+
+        if uid in self._parked_blocks:
+            return
+
+        if seq.in_flight_tokens > 0:
+            raise RuntimeError(f"Cannot park sequence {uid} while it has tokens in flight.")
+
+        if any(seq.n_released_blocks(i) > 0 for i in range(self.n_kv_cache_groups)):
+            raise RuntimeError(f"Cannot park sequence {uid} which has released KV blocks.")
+
+        n_host_blocks = []
+        for i in range(self.n_kv_cache_groups):
+            n_keep = len(seq.prefix_nodes) if i == 0 else 0
+            n_host_blocks.append(sum(max(ids.numel() - n_keep, 0) for ids in seq.allocation_group_block_ids(i)))
+
+        occupancy = self._kv_cache.occupancy()[1]
+        for i, n_blocks in enumerate(n_host_blocks):
+            if n_blocks > occupancy[i].free_blocks:
+                raise RuntimeError(f"Not enough free host KV blocks to park sequence {uid}.")
+
+        parked = []
+        for i in range(self.n_kv_cache_groups):
+            n_keep = len(seq.prefix_nodes) if i == 0 else 0
+            parked.append([self._kv_cache.offload(ids, cache_group=i) for ids in seq.detach_kv_blocks(n_keep, i)])
+
+        self._parked_blocks[uid] = parked
+
+    def resume_sequence(self, uid: int) -> None:
+        """
+        Restore the KV blocks of a parked sequence from the host tier onto the accelerator.
+        """
+        seq = self.get_sequence(uid)
+        if seq is None:
+            raise ValueError(f"Cannot resume sequence {uid} which does not exist.")
+
+        parked = self._parked_blocks.get(uid, None)
+        if parked is None:
+            return
+
+        n_needed = [sum(blocks.numel() for blocks in group_blocks) for group_blocks in parked]
+        if any(needed > free for needed, free in zip(n_needed, self.free_blocks)):
+            raise RuntimeError(f"Not enough free KV blocks to resume sequence {uid}.")
+
+        if self._prefix_cache is not None:
+            deficit = n_needed[0] - self._kv_cache.free_blocks[0]
+            if deficit > 0:
+                evicted = self._prefix_cache.evict(deficit)
+                if evicted:
+                    self._kv_cache.free(evicted, cache_group=0)
+
+        # Eviction is best effort, so check the accelerator tier again before restoring anything.
+        if any(needed > free for needed, free in zip(n_needed, self._kv_cache.free_blocks)):
+            raise RuntimeError(f"Not enough free KV blocks to resume sequence {uid}.")
+
+        for i, group_blocks in enumerate(parked):
+            seq.extend_kv_cache([self._kv_cache.restore(blocks, cache_group=i) for blocks in group_blocks],
+                                cache_group=i)
+
+        del self._parked_blocks[uid]
+        self._preempted.pop(uid, None)
+
+    def is_parked(self, uid: int) -> bool:
+        """
+        Whether the sequence with the given uid is currently parked on the host.
+        """
+        return uid in self._parked_blocks
+
+    @property
+    def n_parked_sequences(self) -> int:
+        """
+        Return the number of sequences currently parked on the host.
+        """
+        return len(self._parked_blocks)
+
+    def set_sequence_priority(self, uid: int, priority: int) -> None:
+        """
+        Set the preemption priority of a sequence. Sequences with a higher priority are preempted
+        later and re-admitted earlier. The priority may be set before the sequence is created and is
+        kept until it is flushed.
+        """
+        self._priorities[uid] = priority
+
+    def sequence_priority(self, uid: int) -> int:
+        """
+        Return the preemption priority of a sequence, 0 unless set with ``set_sequence_priority``.
+        """
+        return self._priorities.get(uid, 0)
+
+    def _preemption_candidates(self, exclude: Iterable[int]) -> List[PreemptionCandidate]:
+        exclude = set(exclude)
+        # Parking keeps the blocks shared through the prefix cache on the accelerator.
+        swap = self._preemption_policy.mode is PreemptionMode.SWAP
+        candidates = []
+        for uid, seq in self._seqs.items():
+            if uid in exclude or uid in self._parked_blocks or seq.in_flight_tokens > 0:
+                continue
+            n_blocks = seq.all_block_ids(cache_group=0).numel() - len(seq.prefix_nodes)
+            if not swap:
+                # Released prefix cache blocks become evictable unless another sequence shares them.
+                n_blocks += sum(1 for node in seq.prefix_nodes if node.ref_count == 1)
+            candidates.append(PreemptionCandidate(uid, self.sequence_priority(uid), self._arrivals[uid], n_blocks))
+        return candidates
+
+    def preempt(self,
+                n_blocks: int,
+                exclude: Iterable[int] = (),
+                max_priority: Optional[int] = None) -> List[PreemptedSequence]:
+        """
+        Preempt tracked sequences chosen by the preemption policy until ``n_blocks`` more KV blocks
+        (of cache group 0) are free. Victims are parked on the host with ``SWAP`` preemption (when
+        the host tier has room) or released otherwise, and are recorded for re-admission. Nothing is
+        preempted if the candidates cannot reclaim enough blocks.
+
+        Arguments:
+            n_blocks (int): Number of KV blocks to reclaim.
+            exclude (Iterable[int]): UIDs that must not be preempted, i.e. the batch being scheduled.
+            max_priority (Optional[int]): Priority of the batch being scheduled, see
+                ``PreemptionPolicy.select_victims``.
+
+        Returns:
+            List[PreemptedSequence]: The sequences preempted by this call.
+        """
+        victims = self._preemption_policy.select_victims(self._preemption_candidates(exclude),
+                                                         n_blocks,
+                                                         max_priority=max_priority)
+
+        preempted = []
+        for victim in victims:
+            seq = self._seqs[victim.uid]
+            mode = PreemptionMode.RECOMPUTE
+            if self._preemption_policy.mode is PreemptionMode.SWAP:
+                try:
+                    self.park_sequence(victim.uid)
+                    mode = PreemptionMode.SWAP
+                except RuntimeError:
+                    logger.debug(f"Unable to swap out sequence {victim.uid}, releasing it instead.")
+
+            record = PreemptedSequence(victim.uid, mode, seq.seen_tokens, victim.priority, victim.arrival)
+            if mode == PreemptionMode.RECOMPUTE:
+                self._release_sequence(victim.uid)
+            self._preempted[victim.uid] = record
+            preempted.append(record)
+
+        return preempted
+
+    @property
+    def preempted_sequences(self) -> Dict[int, PreemptedSequence]:
+        """
+        Preempted sequences awaiting re-admission, indexed by uid. Swapped out sequences are
+        re-admitted by ``resume_sequence``, released ones by creating them again with their full
+        token history.
+        """
+        return self._preempted
+
+    def readmission_order(self) -> List[int]:
+        """
+        Return the uids of the preempted sequences in the order they should be re-admitted.
+        """
+        return self._preemption_policy.readmission_order(self._preempted.values())
+
+    def kv_cache_occupancy(self) -> Dict[str, Tuple[KVCacheOccupancy, ...]]:
+        """
+        Return the per cache group block occupancy of the ``"device"`` and ``"host"`` KV-cache tiers.
+        The host tier is empty if offloading is disabled. Unreferenced prefix cache blocks are counted
+        as free.
+        """
+        device, host = self._kv_cache.occupancy()
+        free_blocks = self.free_blocks
+        device = tuple(KVCacheOccupancy(tier.total_blocks, free) for tier, free in zip(device, free_blocks))
+        return {"device": device, "host": host}
+
+    def kv_fragmentation(self) -> Tuple[float, ...]:
+        """
+        Return, per cache group, the fraction of token slots in the KV blocks allocated to tracked
+        sequences that do not hold a token (i.e. the unfilled tail of each sequence's last block).
+        Blocks shared through the prefix cache are full and counted once.
+        """
+        fragmentation = []
+        for cache_group, kv_config in enumerate(self._kv_configs):
+            slots_per_block = kv_config.block_size / kv_config.num_allocation_groups
+            allocated_slots = 0
+            used_slots = 0
+            prefix_nodes = set()
+            for seq in self._seqs.values():
+                seq_slots = seq.n_retained_blocks(cache_group) * slots_per_block
+                # Tokens in released blocks no longer occupy any slot.
+                seq_tokens = seq.seen_tokens - seq.n_released_blocks(cache_group) * slots_per_block
+                if cache_group == 0 and seq.prefix_nodes:
+                    # A block cached first by another sequence leaves this sequence with a private (full)
+                    # copy, which is counted with the sequence rather than as shared.
+                    own_blocks = seq.kv_cache_ids(cache_group=0, on_device=False)[0][:len(seq.prefix_nodes)]
+                    shared = [
+                        node for node, block_id in zip(seq.prefix_nodes, own_blocks.tolist())
+                        if node.block_id == block_id
+                    ]
+                    prefix_nodes.update(shared)
+                    seq_slots -= len(shared) * slots_per_block
+                    seq_tokens -= len(shared) * slots_per_block
+                allocated_slots += seq_slots
+                used_slots += min(seq_tokens, seq_slots)
+            allocated_slots += len(prefix_nodes) * slots_per_block
+            used_slots += len(prefix_nodes) * slots_per_block
+            fragmentation.append(1.0 - used_slots / allocated_slots if allocated_slots > 0 else 0.0)
+        return tuple(fragmentation)
+
     @property
     def tracked_sequences(self) -> Dict[int, DSSequenceDescriptor]:
         """
@@ -186,7 +663,7 @@ class DSStateManager:
         """
         Return the block size of the KV cache.
         """
-        return self._kv_config.block_size
+        return self._kv_configs[0].block_size
 
     @property
     def n_kv_cache_groups(self) -> int:
@@ -196,11 +673,28 @@ class DSStateManager:
         return self._kv_cache.num_caches
 
     @property
-    def free_blocks(self) -> torch.Tensor:
+    def free_blocks(self) -> List[int]:
+        """
+        Return the number of free blocks in the KV cache. Unreferenced blocks held by the prefix
+        cache are counted as free since they will be evicted on demand.
+        """
+        free_blocks = self._kv_cache.free_blocks
+        if self._prefix_cache is not None:
+            free_blocks[0] += self._prefix_cache.n_evictable_blocks
+        return free_blocks
+
+    @property
+    def prefix_cache(self) -> Optional[PrefixCacheTree]:
         """
-        Return the number of free blocks in the KV cache.
+        The prefix cache, if prefix caching is enabled.
         """
-        return self._kv_cache.free_blocks
+        return self._prefix_cache
 
     def allocate_blocks(self, n_blocks: int, cache_group: int = 0) -> torch.Tensor:
+        if self._prefix_cache is not None and cache_group == 0:
+            deficit = n_blocks - self._kv_cache.free_blocks[0]
+            if deficit > 0:
+                evicted = self._prefix_cache.evict(deficit)
+                if evicted:
+                    self._kv_cache.free(evicted, cache_group=0)
         return self._kv_cache.reserve(n_blocks, cache_group=cache_group)
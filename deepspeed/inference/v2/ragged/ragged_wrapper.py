@@ -3,7 +3,8 @@
 
 # DeepSpeed Team
 
-from typing import Optional
+import math
+from typing import Iterable, Optional, Tuple
 
 import torch
 
@@ -28,6 +29,12 @@ def to_padded(original_size: int) -> int:
     return _pad_to_mul_of_pow2(original_size, granularity)
 
 
+METADATA_ALIGNMENT = 128
+"""
+Byte alignment of each metadata Tensor within the packed metadata buffer.
+"""
+
+
 class RaggedBatchWrapper:
     """
     Container for all the auxiliary Tensors used in the management of a ragged batch.
@@ -35,6 +42,17 @@ class RaggedBatchWrapper:
     For each Tensor, we maintain a shadow Tensor on the host. This Tensor is what is
     directly populated when constructing the ragged batch. The shadow Tensors, when possible,
     should be allocated so as to support fast host-to-accelerator copies.
+
+    All of the Tensors are views into a single packed buffer (and its host shadow) so that
+    flushing the batch metadata to the device is a single host-to-accelerator transfer.
+    """
+
+    _metadata_storage: torch.Tensor
+    _metadata_storage_shadow: torch.Tensor
+    """
+    Packed byte buffers backing all of the Tensors below. The layout is, in order, the batch
+    metadata, in-flight sequence descriptors, KV pointers, token to sequence mapping and input ids,
+    so that only the used prefix of the buffer needs to be transferred.
     """
 
     # Tensors to populate the ragged batch into.
@@ -85,36 +103,50 @@ class RaggedBatchWrapper:
         The underlying data structures are implemented in `ragged_batch_descriptor.h`.
         """
         self._config = config
-        self._input_ids = torch.zeros((self._config.max_ragged_batch_size),
-                                      dtype=torch.int64,
-                                      device=get_accelerator().current_device())
-
-        self._batch_metadata_storage = torch.zeros(2, dtype=torch.int32, device=get_accelerator().current_device())
-
-        self._token_to_seq_storage = torch.zeros((self._config.max_ragged_batch_size),
-                                                 dtype=torch.int32,
-                                                 device=get_accelerator().current_device())
-        self._inflight_seq_descriptors = torch.zeros((self._config.max_ragged_sequence_count, 4),
-                                                     dtype=torch.int32,
-                                                     device=get_accelerator().current_device())
-        self._kv_ptrs = torch.zeros((self._config.max_ragged_sequence_count),
-                                    dtype=torch.int64,
-                                    device=get_accelerator().current_device())
+        max_tokens = self._config.max_ragged_batch_size
+        max_sequences = self._config.max_ragged_sequence_count
+
+        layout = (
+            ("_batch_metadata_storage", (2, ), torch.int32),
+            ("_inflight_seq_descriptors", (max_sequences, 4), torch.int32),
+            ("_kv_ptrs", (max_sequences, ), torch.int64),
+            ("_token_to_seq_storage", (max_tokens, ), torch.int32),
+            ("_input_ids", (max_tokens, ), torch.int64),
+        )
+
+        def _n_bytes(shape: Tuple[int, ...], dtype: torch.dtype) -> int:
+            return math.prod(shape) * torch.tensor([], dtype=dtype).element_size()
+
+        offsets = []
+        n_bytes = 0
+        for _, shape, dtype in layout:
+            offsets.append(n_bytes)
+            n_bytes += _n_bytes(shape, dtype)
+            n_bytes = (n_bytes + METADATA_ALIGNMENT - 1) // METADATA_ALIGNMENT * METADATA_ALIGNMENT
+
+        self._metadata_storage = torch.zeros(n_bytes, dtype=torch.uint8, device=get_accelerator().current_device())
 
         self._utils_module = RaggedUtilsBuilder().load()
         host_alloc = self._utils_module.allocate_fast_host_buffer
+        self._metadata_storage_shadow = host_alloc(self._metadata_storage)
 
-        self._input_ids_shadow = host_alloc(self._input_ids)
-        self._batch_metadata_storage_shadow = host_alloc(self._batch_metadata_storage)
-        self._token_to_seq_storage_shadow = host_alloc(self._token_to_seq_storage)
-        self._inflight_seq_descriptors_shadow = host_alloc(self._inflight_seq_descriptors)
-        self._kv_ptrs_shadow = host_alloc(self._kv_ptrs)
+        def _view(buffer: torch.Tensor, offset: int, shape: Tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+            return buffer[offset:offset + _n_bytes(shape, dtype)].view(dtype).view(shape)
+
+        for (name, shape, dtype), offset in zip(layout, offsets):
+            setattr(self, name, _view(self._metadata_storage, offset, shape, dtype))
+            setattr(self, name + "_shadow", _view(self._metadata_storage_shadow, offset, shape, dtype))
+
+        self._input_ids_offset = offsets[-1]
 
         # Default behavior should be no padding
         self._is_padded = False
+        self._all_token_logits = False
 
         self._current_tokens = 0
         self._current_sequences = 0
+        self._flushed_tokens = 0
+        self._flushed_sequences = 0
         self._batch_tokens = []
         self._inflight_seq_descriptors_shadow_buf = []
         self._kv_blocks_ptr_buf = []
@@ -126,6 +158,8 @@ class RaggedBatchWrapper:
         """
         self._current_tokens = 0
         self._current_sequences = 0
+        self._flushed_tokens = 0
+        self._flushed_sequences = 0
         self._batch_tokens = []
         self._inflight_seq_descriptors_shadow_buf = []
         self._kv_blocks_ptr_buf = []
@@ -169,6 +203,97 @@ class RaggedBatchWrapper:
         self._current_tokens += seq_tokens
         self._current_sequences += 1
 
+    def insert_sequences(self,
+                         seq_descriptors: Iterable[DSSequenceDescriptor],
+                         batch_tokens: Iterable[torch.Tensor],
+                         do_checks: bool = True) -> None:
+        """
+        Insert several sequences into the ragged batch at once. The metadata for all of the
+        sequences is computed with a handful of batched Tensor operations and written directly into
+        the host shadow buffers, which is considerably cheaper than repeated calls to
+        ``insert_sequence`` for large batches.
+
+        Arguments:
+            seq_descriptors (Iterable[DSSequenceDescriptor]): The descriptors of the sequences.
+            batch_tokens (Iterable[torch.Tensor]): The tokens of each sequence, on the host.
+            do_checks (bool): Check that the sequences fit in the batch.
+        """
+        seq_descriptors = list(seq_descriptors)
+        batch_tokens = list(batch_tokens)
+        n_seqs = len(seq_descriptors)
+        if n_seqs != len(batch_tokens):
+            raise ValueError(f"Expected tokens for {n_seqs} sequences, received {len(batch_tokens)}")
+
+        if n_seqs == 0:
+            return
+
+        if any(tokens.device != torch.device("cpu") for tokens in batch_tokens):
+            # This doesn't really fall under schedulability, so we'll unconditionally check for it.
+            raise RuntimeError("Expected tokens to be on host")
+
+        seq_lens = torch.tensor([tokens.numel() for tokens in batch_tokens], dtype=torch.int32)
+        n_tokens = int(seq_lens.sum())
+
+        if do_checks and self.current_sequences + n_seqs > self._config.max_ragged_sequence_count:
+            raise RuntimeError(f"Ragged batch is full due to sequence limit: {self._config.max_ragged_sequence_count}")
+
+        if do_checks and self.current_tokens + n_tokens > self._config.max_ragged_batch_size:
+            raise RuntimeError(f"Ragged batch is full due to capacity limit: {self._config.max_ragged_batch_size})")
+
+        # Entries from earlier ``insert_sequence`` calls precede these in the shadow buffers.
+        self._flush_host_buffers()
+
+        start_tok = self.current_tokens
+        start_seq = self.current_sequences
+        end_tok = start_tok + n_tokens
+        end_seq = start_seq + n_seqs
+
+        # The shadow buffers may be write-combined memory, so they are only ever written to.
+        torch.cat([tokens.flatten() for tokens in batch_tokens], out=self._input_ids_shadow[start_tok:end_tok])
+
+        seq_ids = torch.arange(start_seq, end_seq, dtype=torch.int32)
+        self._token_to_seq_storage_shadow[start_tok:end_tok].copy_(torch.repeat_interleave(seq_ids, seq_lens))
+
+        descriptors = torch.zeros((n_seqs, 4), dtype=torch.int32)
+        descriptors[:, 0] = torch.cumsum(seq_lens, dim=0, dtype=torch.int32) - seq_lens + start_tok
+        descriptors[:, 1] = seq_lens
+        descriptors[:, 2] = torch.tensor([seq_desc.seen_tokens for seq_desc in seq_descriptors], dtype=torch.int32)
+        self._inflight_seq_descriptors_shadow[start_seq:end_seq].copy_(descriptors)
+
+        self._kv_ptrs_shadow[start_seq:end_seq].copy_(
+            torch.tensor([seq_desc.kv_blocks_ptr for seq_desc in seq_descriptors], dtype=torch.int64))
+
+        self._current_tokens = end_tok
+        self._current_sequences = end_seq
+        self._flushed_tokens = end_tok
+        self._flushed_sequences = end_seq
+
+    def _flush_host_buffers(self) -> None:
+        """
+        Write the entries recorded by ``insert_sequence`` since the last flush into the host shadow
+        buffers.
+        """
+        if self._flushed_sequences == self.current_sequences:
+            return
+
+        start_tok, end_tok = self._flushed_tokens, self.current_tokens
+        start_seq, end_seq = self._flushed_sequences, self.current_sequences
+
+        self._inflight_seq_descriptors_shadow[start_seq:end_seq].copy_(
+            torch.tensor(self._inflight_seq_descriptors_shadow_buf, dtype=torch.int32).view(-1, 4))
+        if end_tok > start_tok:
+            torch.cat(self._batch_tokens, out=self._input_ids_shadow[start_tok:end_tok])
+            self._token_to_seq_storage_shadow[start_tok:end_tok].copy_(
+                torch.tensor(self._token_to_seq_storage_shadow_buf, dtype=torch.int32))
+        self._kv_ptrs_shadow[start_seq:end_seq].copy_(torch.tensor(self._kv_blocks_ptr_buf, dtype=torch.int64))
+
+        self._batch_tokens = []
+        self._inflight_seq_descriptors_shadow_buf = []
+        self._kv_blocks_ptr_buf = []
+        self._token_to_seq_storage_shadow_buf = []
+        self._flushed_tokens = end_tok
+        self._flushed_sequences = end_seq
+
     @property
     def tensor_toks(self) -> torch.Tensor:
         """
@@ -181,20 +306,21 @@ class RaggedBatchWrapper:
         else:
             return cur_toks
 
-    def finalize(self, padding: Optional[bool] = False) -> None:
+    def finalize(self, padding: Optional[bool] = False, all_token_logits: bool = False) -> None:
         """
         Completes construction of the ragged batch by flushing the host buffers to the device.
+
+        Arguments:
+            padding (bool): Pad the number of tokens to a backend friendly granularity.
+            all_token_logits (bool): Request logits for every token of the batch rather than only the
+                final token of each sequence.
         """
         cur_toks = self.current_tokens
+        self._all_token_logits = all_token_logits
 
         # Batch-copy the values recorded in insert_sequence() into PyTorch tensors to enhance efficiency.
-        self._inflight_seq_descriptors_shadow.flatten()[:len(self._inflight_seq_descriptors_shadow_buf)].copy_(
-            torch.tensor(self._inflight_seq_descriptors_shadow_buf))
-        self._input_ids_shadow[:self.current_tokens].copy_(torch.cat(self._batch_tokens, dim=0))
-        self._token_to_seq_storage_shadow[:len(self._token_to_seq_storage_shadow_buf)].copy_(
-            torch.tensor(self._token_to_seq_storage_shadow_buf))
-        self._kv_ptrs_shadow[:len(self._kv_blocks_ptr_buf)].copy_(torch.tensor(self._kv_blocks_ptr_buf))
-        self._batch_metadata_storage_shadow.copy_(torch.tensor([cur_toks, self.current_sequences]))
+        self._flush_host_buffers()
+        self._batch_metadata_storage_shadow.copy_(torch.tensor([cur_toks, self.current_sequences], dtype=torch.int32))
 
         if padding:
             padded_toks = to_padded(cur_toks)
@@ -205,17 +331,10 @@ class RaggedBatchWrapper:
             padded_toks = cur_toks
             self._is_padded = False
 
-        current_sequences = self.current_sequences
-
-        def _noblock_copy(dst: torch.Tensor, src: torch.Tensor) -> None:
-            dst.copy_(src, non_blocking=True)
-
-        _noblock_copy(self._input_ids[:padded_toks], self._input_ids_shadow[:padded_toks])
-        _noblock_copy(self._batch_metadata_storage, self._batch_metadata_storage_shadow)
-        _noblock_copy(self._token_to_seq_storage[:padded_toks], self._token_to_seq_storage_shadow[:padded_toks])
-        _noblock_copy(self._inflight_seq_descriptors[:current_sequences],
-                      self._inflight_seq_descriptors_shadow[:current_sequences])
-        _noblock_copy(self._kv_ptrs[:current_sequences], self._kv_ptrs_shadow[:current_sequences])
+        # The input ids are the final entry of the packed buffer, so everything up to the last used
+        # input id covers all of the batch metadata.
+        n_bytes = self._input_ids_offset + padded_toks * self._input_ids.element_size()
+        self._metadata_storage[:n_bytes].copy_(self._metadata_storage_shadow[:n_bytes], non_blocking=True)
 
     def input_ids(self, on_device: bool = True) -> torch.Tensor:
         """
@@ -275,6 +394,14 @@ class RaggedBatchWrapper:
         """
         return None
 
+    @property
+    def all_token_logits(self) -> bool:
+        """
+        Whether logits should be computed for every token in the batch rather than only the final
+        token of each sequence.
+        """
+        return self._all_token_logits
+
     @property
     def current_tokens(self) -> int:
         """
@@ -3,7 +3,7 @@
 
 # DeepSpeed Team
 
-from typing import List, Tuple, Union
+from typing import Any, List, Tuple, Union
 
 import torch
 
@@ -81,7 +81,19 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
 
     _blocks_per_allocation_group: Tuple[torch.IntTensor, ...]
     """
-    Number of blocks allocated for each allocation group in each cache group.
+    Number of blocks allocated for each allocation group in each cache group, including released
+    blocks.
+    """
+
+    _released_blocks: Tuple[torch.IntTensor, ...]
+    """
+    Number of blocks released by ``release_kv_blocks`` for each allocation group in each cache group.
+    Released blocks directly follow the sink blocks of the cache group.
+    """
+
+    _sink_blocks: List[int]
+    """
+    Number of leading blocks of each cache group that are never released.
     """
 
     # Padded list of KV-cache IDs for the sequence.
@@ -95,6 +107,18 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
     # are stored. Used on flush.
     _tracking_id: int
 
+    _prefix_nodes: List[Any]
+    """
+    Prefix cache nodes referenced by this sequence, one per leading full block of the sequence.
+    Only populated when prefix caching is enabled.
+    """
+
+    _uncached_tokens: List[int]
+    """
+    Tokens that have completed a forward pass but are not yet part of a cached full block.
+    Only populated when prefix caching is enabled.
+    """
+
     def __init__(self,
                  tracking_id: int,
                  kv_cache_ids: Tuple[torch.Tensor, ...],
@@ -123,10 +147,16 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
         self._seen_tokens = 0
         self._in_flight_tokens = 0
 
+        self._prefix_nodes = []
+        self._uncached_tokens = []
+
         self._num_allocation_groups = tuple(kv_cache_ids_shadow.shape[0]
                                             for kv_cache_ids_shadow in kv_cache_ids_shadow)
         self._blocks_per_allocation_group = tuple(
             torch.zeros(num_groups, dtype=torch.int32, device="cpu") for num_groups in self._num_allocation_groups)
+        self._released_blocks = tuple(
+            torch.zeros(num_groups, dtype=torch.int32, device="cpu") for num_groups in self._num_allocation_groups)
+        self._sink_blocks = [0] * self._n_cache_groups
 
         for cache_group, kv_cache_ids in enumerate(kv_cache_ids):
             assert self._num_allocation_groups[cache_group] == kv_cache_ids.shape[0]
@@ -160,17 +190,34 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
         """
         return self._tracking_id
 
+    @property
+    def prefix_nodes(self) -> List[Any]:
+        """
+        Prefix cache nodes referenced by this sequence. The i-th node corresponds to the
+        i-th KV block of the sequence in cache group 0.
+        """
+        return self._prefix_nodes
+
+    @property
+    def uncached_tokens(self) -> List[int]:
+        """
+        Tokens that have completed a forward pass but do not yet fill a block that can be
+        inserted into the prefix cache.
+        """
+        return self._uncached_tokens
+
     @property
     def cur_allocated_blocks(self, cache_group: int = 0) -> int:
         """
         Returns the number of blocks currently allocated for this sequence in the specified cache group.
+        Blocks released by ``release_kv_blocks`` are included since later blocks keep their position.
 
         Arguments:
             cache_group (int): The cache group to query.
         """
-        # Currently, there is only one allocation group.
+        # Usually, there is only one allocation group.
         # A shortcut is used here to bypass the overhead of sum().
-        if len(self._blocks_per_allocation_group) == 1:
+        if len(self._blocks_per_allocation_group) == 1 and self._num_allocation_groups[0] == 1:
             return self._blocks_per_allocation_group[0].item()
         return self._blocks_per_allocation_group[cache_group].sum().item()
 
@@ -199,19 +246,118 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
         """
         return self._kv_cache_ids[cache_group].data_ptr()
 
+    def allocation_group_block_ids(self, cache_group: int = 0) -> List[torch.Tensor]:
+        """
+        Return the host-side block IDs for each allocation group of the specified cache group,
+        excluding released blocks. The returned Tensors are views into the shadow buffer unless
+        blocks have been released.
+
+        Arguments:
+            cache_group (int): The cache group to query.
+        """
+        return self._retained_block_ids(self._kv_cache_ids_shadow[cache_group], cache_group)
+
+    def _retained_block_ids(self, kv_cache_ids: torch.Tensor, cache_group: int) -> List[torch.Tensor]:
+        """
+        The block IDs of each allocation group in ``kv_cache_ids``, excluding released blocks. Views are
+        returned when no blocks have been released.
+        """
+        n_sink = self._sink_blocks[cache_group]
+        block_ids = []
+        for allocation_group, num_blocks, n_released in zip(kv_cache_ids,
+                                                            self._blocks_per_allocation_group[cache_group].tolist(),
+                                                            self._released_blocks[cache_group].tolist()):
+            if n_released == 0:
+                block_ids.append(allocation_group[:num_blocks])
+            else:
+                block_ids.append(
+                    torch.cat([allocation_group[:n_sink], allocation_group[n_sink + n_released:num_blocks]]))
+        return block_ids
+
+    def n_released_blocks(self, cache_group: int = 0) -> int:
+        """
+        Number of blocks of the specified cache group released by ``release_kv_blocks``.
+        """
+        return self._released_blocks[cache_group].sum().item()
+
+    def n_retained_blocks(self, cache_group: int = 0) -> int:
+        """
+        Number of blocks of the specified cache group held by the sequence, i.e. allocated and not
+        released by ``release_kv_blocks``.
+        """
+        return (self._blocks_per_allocation_group[cache_group].sum() - self._released_blocks[cache_group].sum()).item()
+
+    def release_kv_blocks(self, n_sink: int, n_retired: int, cache_group: int = 0) -> List[torch.Tensor]:
+        """
+        Release the blocks of each allocation group whose index is in ``[n_sink, n_retired)``, i.e. the
+        blocks that fell out of the attention window of a local KV-cache, other than the sinks. The
+        released blocks are not freed; ownership passes to the caller. Their entries in the block
+        table are left in place so that the following blocks keep their position, and must not be
+        read by attention. ``seen_tokens`` is unchanged.
+
+        Arguments:
+            n_sink (int): Number of leading blocks that are never released. Must be the same for all
+                calls on a cache group.
+            n_retired (int): Number of leading blocks no longer needed by the sequence.
+            cache_group (int): The cache group to release from.
+
+        Returns:
+            List[torch.Tensor]: The newly released block IDs of each allocation group.
+        """
+        if self.n_released_blocks(cache_group) > 0 and n_sink != self._sink_blocks[cache_group]:
+            raise ValueError(f"Sequence was released with {self._sink_blocks[cache_group]} sink blocks, "
+                             f"provided {n_sink}")
+        self._sink_blocks[cache_group] = n_sink
+
+        released = []
+        for group_id, (allocation_group, num_blocks, n_released) in enumerate(
+                zip(self._kv_cache_ids_shadow[cache_group], self._blocks_per_allocation_group[cache_group].tolist(),
+                    self._released_blocks[cache_group].tolist())):
+            start = n_sink + n_released
+            end = min(n_retired, num_blocks)
+            if end > start:
+                released.append(allocation_group[start:end].clone())
+                self._released_blocks[cache_group][group_id] = end - n_sink
+            else:
+                released.append(allocation_group[:0].clone())
+        return released
+
+    def detach_kv_blocks(self, n_keep: int = 0, cache_group: int = 0) -> List[torch.Tensor]:
+        """
+        Detach all but the first ``n_keep`` blocks of each allocation group from the sequence. The
+        detached blocks are not freed; ownership passes to the caller. ``seen_tokens`` is unchanged.
+
+        Arguments:
+            n_keep (int): Number of leading blocks to keep in each allocation group.
+            cache_group (int): The cache group to detach from.
+
+        Returns:
+            List[torch.Tensor]: The detached block IDs of each allocation group.
+        """
+        n_retained_prefix = self._sink_blocks[cache_group] + self._released_blocks[cache_group].max().item()
+        if self.n_released_blocks(cache_group) > 0 and n_keep < n_retained_prefix:
+            raise ValueError(f"Cannot detach blocks before block {n_retained_prefix}, the sequence has released "
+                             "blocks that cannot be restored.")
+
+        detached = []
+        for group_id, (allocation_group, num_blocks) in enumerate(
+                zip(self._kv_cache_ids_shadow[cache_group], self._blocks_per_allocation_group[cache_group].tolist())):
+            block_ids = allocation_group[:num_blocks]
+            keep = min(n_keep, block_ids.numel())
+            detached.append(block_ids[keep:].clone())
+            self._blocks_per_allocation_group[cache_group][group_id] = keep
+        return detached
+
     #TODO: this was previously a property but causing issues with PR-4668 need to consult w. Connor
     def all_block_ids(self, cache_group: int = 0) -> torch.Tensor:
         """
         Return the Tensor containing all block IDs for this sequence in the specified cache group.
+        Released blocks are not included.
 
         Arguments:
             cache_group (int): The cache group to query.
         """
-        block_ids = []
-        for allocation_group, num_blocks in zip(self._kv_cache_ids[cache_group],
-                                                self._blocks_per_allocation_group[cache_group]):
-            block_ids.append(allocation_group[:num_blocks])
-        return torch.cat(block_ids)
+        return torch.cat(self._retained_block_ids(self._kv_cache_ids[cache_group], cache_group))
 
     def pre_forward(self, num_tokens: int) -> None:
         """
@@ -232,7 +378,10 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
         self._seen_tokens += self._in_flight_tokens
         self._in_flight_tokens = 0
 
-    def extend_kv_cache(self, new_ids: Union[List[torch.IntTensor], torch.IntTensor], cache_group: int = 0) -> None:
+    def extend_kv_cache(self,
+                        new_ids: Union[List[torch.IntTensor], torch.IntTensor],
+                        cache_group: int = 0,
+                        n_cached_tokens: int = 0) -> None:
         """
         Extend the KV-cache for the sequence.
 
@@ -241,6 +390,10 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
                 to add to the KV-cache. If there is only one allocation group, a single tensor can be
                 provided. Otherwise, a list of tensors should be provided. The tensors do not need
                 to have the same shape.
+            cache_group (int): The cache group to extend.
+            n_cached_tokens (int): Number of tokens whose keys and values are already populated in
+                the new blocks (i.e. blocks attached from the prefix cache). These tokens are
+                counted as seen and will not be recomputed. Only valid before the first forward.
         """
         if isinstance(new_ids, torch.Tensor):
             new_ids = [new_ids]
@@ -249,6 +402,9 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
             raise ValueError(
                 f"Only {len(new_ids)} allocation groups provided, expected {self._num_allocation_groups[cache_group]}")
 
+        if n_cached_tokens > 0 and (self._seen_tokens > 0 or self._in_flight_tokens > 0):
+            raise RuntimeError("Cached KV blocks may only be attached to a sequence before its first forward")
+
         for group_id, new_group_ids in enumerate(new_ids):
             new_blocks = new_group_ids.numel()
 
@@ -267,14 +423,87 @@ class DSSequenceDescriptor(BaseSequenceDescriptor):
 
             self._blocks_per_allocation_group[cache_group][group_id] += new_blocks
 
+        self._seen_tokens += n_cached_tokens
+
+    def truncate(self, n_tokens: int) -> None:
+        """
+        Truncate the sequence to its first ``n_tokens`` tokens that completed a forward, i.e. to discard
+        rejected speculative tokens or pruned beams. The KV blocks of the sequence are not modified;
+        releasing blocks that no longer hold any tokens is the responsibility of the caller (see
+        ``detach_kv_blocks``).
+
+        Arguments:
+            n_tokens (int): The number of tokens to keep.
+        """
+        if self._in_flight_tokens > 0:
+            raise RuntimeError("Cannot truncate a sequence with tokens in flight.")
+
+        if n_tokens < 0 or n_tokens > self._seen_tokens:
+            raise ValueError(f"Cannot truncate a sequence with {self._seen_tokens} seen tokens to {n_tokens} tokens.")
+
+        self._seen_tokens = n_tokens
+
+    def replace_kv_block(self, block_idx: int, new_id: int, cache_group: int = 0, allocation_group: int = 0) -> None:
+        """
+        Replace an already allocated KV block of the sequence (i.e. for copy-on-write of a shared block).
+
+        Arguments:
+            block_idx (int): Index of the block within the allocation group.
+            new_id (int): The ID of the replacement block.
+            cache_group (int): The cache group of the block.
+            allocation_group (int): The allocation group of the block.
+        """
+        if block_idx >= self._blocks_per_allocation_group[cache_group][allocation_group]:
+            raise ValueError(f"Block {block_idx} is not allocated for this sequence.")
+
+        self._kv_cache_ids_shadow[cache_group][allocation_group][block_idx] = new_id
+        self._kv_cache_ids[cache_group][allocation_group][block_idx:block_idx + 1].copy_(
+            self._kv_cache_ids_shadow[cache_group][allocation_group][block_idx:block_idx + 1], non_blocking=True)
+
     def free_kv_cache(self, free_ids: Union[List[torch.IntTensor], torch.IntTensor], cache_group: int = 0) -> None:
         """
-        Free blocks from the KV-cache for the sequence.
+        Remove blocks from the KV-cache for the sequence. The remaining blocks of each allocation group
+        keep their relative order. The blocks are not returned to the allocator; that is the
+        responsibility of the caller. ``seen_tokens`` is unchanged, use ``truncate`` to discard tokens.
 
         Arguments:
             free_ids (Union[List[torch.IntTensor], torch.IntTensor]): The ids of blocks to free
                 from the KV-cache. If there is only one allocation group, a single tensor can be
                 provided. Otherwise, a list of tensors should be provided. The tensors do not need
                 to have the same shape.
+            cache_group (int): The cache group to free from.
         """
-        raise NotImplementedError("Partial KV-cache freeing is not yet supported.")
+        if isinstance(free_ids, torch.Tensor):
+            free_ids = [free_ids]
+
+        if len(free_ids) != self._num_allocation_groups[cache_group]:
+            raise ValueError(
+                f"Only {len(free_ids)} allocation groups provided, expected {self._num_allocation_groups[cache_group]}"
+            )
+
+        if self.n_released_blocks(cache_group) > 0:
+            raise RuntimeError("Cannot remove blocks from a sequence with released blocks, it would shift the "
+                               "position of the remaining blocks.")
+
+        block_ids = self.allocation_group_block_ids(cache_group)
+
+        # Validate all groups before mutating any state.
+        keep_masks = []
+        for group_id, (group_ids, group_free_ids) in enumerate(zip(block_ids, free_ids)):
+            group_free_ids = group_free_ids.flatten().to(device="cpu", dtype=group_ids.dtype)
+            owned = torch.isin(group_free_ids, group_ids)
+            if not owned.all():
+                raise ValueError(
+                    f"Block {group_free_ids[~owned][0].item()} is not allocated to allocation group {group_id}")
+            keep_masks.append(~torch.isin(group_ids, group_free_ids))
+
+        for group_id, (group_ids, keep_mask) in enumerate(zip(block_ids, keep_masks)):
+            kept = group_ids[keep_mask].clone()
+            n_kept = kept.numel()
+            if n_kept == group_ids.numel():
+                continue
+
+            shadow_alloc_group = self._kv_cache_ids_shadow[cache_group][group_id]
+            shadow_alloc_group[:n_kept].copy_(kept)
+            self._kv_cache_ids[cache_group][group_id][:n_kept].copy_(shadow_alloc_group[:n_kept], non_blocking=True)
+            self._blocks_per_allocation_group[cache_group][group_id] = n_kept
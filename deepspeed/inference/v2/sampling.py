@@ -0,0 +1,362 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+
+# splitmix64 constants as signed 64-bit integers, since torch has no unsigned 64-bit arithmetic.
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15 - (1 << 64)
+_MIX_1 = 0xBF58476D1CE4E5B9 - (1 << 64)
+_MIX_2 = 0x94D049BB133111EB - (1 << 64)
+
+NUCLEUS_CANDIDATES = 256
+"""
+Number of most likely tokens searched for the top-p nucleus before falling back to sorting the
+whole vocabulary.
+"""
+
+
+def _logical_rshift(x: torch.Tensor, shift: int) -> torch.Tensor:
+    return (x >> shift) & ((1 << (64 - shift)) - 1)
+
+
+def uniform_from_counter(seeds: torch.Tensor, counters: torch.Tensor) -> torch.Tensor:
+    """
+    Counter-based uniform random numbers in [0, 1). Each output is a pure function of its seed and
+    counter (splitmix64), so every sequence draws the same stream regardless of which other
+    sequences share its batch.
+
+    Arguments:
+        seeds (torch.Tensor): int64 seed of each row.
+        counters (torch.Tensor): int64 index of the draw within each row's stream.
+
+    Returns:
+        torch.Tensor: float64 uniform samples with the shape of ``seeds``.
+    """
+    z = seeds + (counters + 1) * _GOLDEN_GAMMA
+    z = (z ^ _logical_rshift(z, 30)) * _MIX_1
+    z = (z ^ _logical_rshift(z, 27)) * _MIX_2
+    z = z ^ _logical_rshift(z, 31)
+    return _logical_rshift(z, 11).to(torch.float64) / float(1 << 53)
+
+
+def _nucleus_cutoff(candidates: torch.Tensor, probs: torch.Tensor, top_p: torch.Tensor) -> torch.Tensor:
+    """
+    Smallest logit of each row's nucleus, given the row's most likely logits in descending order
+    and their probabilities.
+    """
+    # Keep a token if the tokens ranked above it have not yet reached top_p (always keeps the first).
+    excluded = torch.cumsum(probs, dim=-1) - probs >= top_p.unsqueeze(1)
+    return candidates.masked_fill(excluded, float("inf")).min(dim=-1).values
+
+
+class SamplingParams:
+    """
+    Sampling configuration of a single request.
+    """
+
+    temperature: float
+    """
+    Softmax temperature. 0 selects greedy decoding.
+    """
+
+    top_k: int
+    """
+    Only sample from the ``top_k`` most likely tokens. 0 disables top-k filtering.
+    """
+
+    top_p: float
+    """
+    Only sample from the smallest set of most likely tokens whose probability exceeds ``top_p``.
+    1.0 disables nucleus filtering.
+    """
+
+    repetition_penalty: float
+    """
+    Penalty applied to the logits of tokens present in the prompt or generated so far. Positive
+    logits are divided by the penalty and negative logits multiplied by it. 1.0 disables it.
+    """
+
+    stop_token_ids: Tuple[int, ...]
+    """
+    Generation is finished once any of these tokens is sampled.
+    """
+
+    max_new_tokens: Optional[int]
+    """
+    Generation is finished once this many tokens have been sampled. ``None`` for no limit.
+    """
+
+    seed: Optional[int]
+    """
+    Seed of the request's random stream. ``None`` derives it from the sampler seed and the uid.
+    """
+
+    def __init__(self,
+                 temperature: float = 1.0,
+                 top_k: int = 0,
+                 top_p: float = 1.0,
+                 repetition_penalty: float = 1.0,
+                 stop_token_ids: Iterable[int] = (),
+                 max_new_tokens: Optional[int] = None,
+                 seed: Optional[int] = None) -> None:
+        if temperature < 0:
+            raise ValueError(f"Temperature must be non-negative, provided {temperature}")
+        if top_k < 0:
+            raise ValueError(f"top_k must be non-negative, provided {top_k}")
+        if not 0 < top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], provided {top_p}")
+        if repetition_penalty <= 0:
+            raise ValueError(f"Repetition penalty must be positive, provided {repetition_penalty}")
+        if max_new_tokens is not None and max_new_tokens < 1:
+            raise ValueError(f"max_new_tokens must be positive, provided {max_new_tokens}")
+
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.stop_token_ids = tuple(stop_token_ids)
+        self.max_new_tokens = max_new_tokens
+        self.seed = seed
+
+
+class _RequestState:
+    """
+    Host-side sampling state of a request.
+    """
+
+    __slots__ = ("params", "seed", "n_generated", "slot")
+
+    def __init__(self, params: SamplingParams, seed: int, slot: int) -> None:
+        self.params = params
+        self.seed = seed
+        self.n_generated = 0
+        self.slot = slot
+
+
+class BatchedSampler:
+    """
+    Samples the next token of every sequence of a ragged batch from the ``[n_seqs, vocab_size]``
+    final-token logits returned by ``InferenceEngineV2.put``. Each request has its own
+    ``SamplingParams``; all requests in a batch are processed together with batched Tensor ops on
+    the device of the logits, rather than one request at a time.
+
+    Sampling is deterministic per uid: a request draws from a counter-based random stream keyed by
+    its seed, so its output does not depend on the composition of the batches it is part of.
+    """
+
+    _requests: Dict[int, _RequestState]
+    """
+    State of each registered request.
+    """
+
+    _presence: Optional[torch.Tensor]
+    """
+    ``[n_slots, vocab_size]`` mask of the tokens each request has seen, for the repetition
+    penalty. Allocated once the vocabulary size is known.
+    """
+
+    def __init__(self, seed: int = 0) -> None:
+        """
+        Arguments:
+            seed (int): Base seed from which the seeds of requests without an explicit seed are
+                derived.
+        """
+        self._seed = seed
+        self._requests = {}
+        self._free_slots: List[int] = []
+        self._n_slots = 0
+        self._presence = None
+        self._pending_prompts: Dict[int, torch.Tensor] = {}
+
+    def add_request(self, uid: int, params: SamplingParams, prompt_tokens: Optional[torch.Tensor] = None) -> None:
+        """
+        Register a request.
+
+        Arguments:
+            uid (int): Identifier of the request, matching the uid used with the engine.
+            params (SamplingParams): Sampling configuration of the request.
+            prompt_tokens (torch.Tensor): Prompt of the request. Only used by the repetition penalty.
+        """
+        if uid in self._requests:
+            raise ValueError(f"Request {uid} is already registered.")
+
+        seed = params.seed if params.seed is not None else self._seed * 1000003 + uid
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = self._n_slots
+            self._n_slots += 1
+        self._requests[uid] = _RequestState(params, seed, slot)
+
+        if params.repetition_penalty != 1.0 and prompt_tokens is not None:
+            self._pending_prompts[uid] = prompt_tokens.flatten()
+
+    def remove_request(self, uid: int) -> None:
+        """
+        Drop the state of a request.
+        """
+        state = self._requests.pop(uid, None)
+        if state is None:
+            return
+        self._pending_prompts.pop(uid, None)
+        if self._presence is not None and state.slot < self._presence.shape[0]:
+            self._presence[state.slot] = False
+        self._free_slots.append(state.slot)
+
+    def n_generated(self, uid: int) -> int:
+        """
+        Number of tokens sampled for a request.
+        """
+        return self._requests[uid].n_generated
+
+    def _presence_rows(self, vocab_size: int, device: torch.device) -> torch.Tensor:
+        """
+        Get the presence mask, growing it to cover all slots and applying pending prompts.
+        """
+        if self._presence is None:
+            self._presence = torch.zeros((self._n_slots, vocab_size), dtype=torch.bool, device=device)
+        elif self._presence.shape[1] != vocab_size:
+            raise ValueError(f"Expected logits over {self._presence.shape[1]} tokens, received {vocab_size}")
+        elif self._presence.shape[0] < self._n_slots:
+            grown = torch.zeros((max(self._n_slots, 2 * self._presence.shape[0]), vocab_size),
+                                dtype=torch.bool,
+                                device=device)
+            grown[:self._presence.shape[0]] = self._presence
+            self._presence = grown
+
+        if self._pending_prompts:
+            slots = [self._requests[uid].slot for uid in self._pending_prompts]
+            lengths = torch.tensor([tokens.numel() for tokens in self._pending_prompts.values()])
+            rows = torch.repeat_interleave(torch.tensor(slots), lengths).to(device)
+            cols = torch.cat(list(self._pending_prompts.values())).to(device=device, dtype=torch.int64)
+            self._presence[rows, cols] = True
+            self._pending_prompts.clear()
+
+        return self._presence
+
+    def _sample_rows(self, logits: torch.Tensor, params: List[SamplingParams],
+                     states: List[_RequestState]) -> torch.Tensor:
+        """
+        Sample from the rows that do not use greedy decoding. Top-k and top-p filtering are applied
+        as a per-row logit threshold so that the full vocabulary rarely needs to be sorted; sampling
+        itself is an inverse CDF lookup in vocabulary order.
+        """
+        n_rows, vocab_size = logits.shape
+        device = logits.device
+
+        def _column(values: List, dtype: torch.dtype) -> torch.Tensor:
+            return torch.tensor(values, dtype=dtype).to(device, non_blocking=True)
+
+        logits = logits / _column([p.temperature for p in params], torch.float32).unsqueeze(1)
+        threshold = torch.full((n_rows, ), float("-inf"), device=device)
+
+        top_k = [min(p.top_k, vocab_size) for p in params]
+        max_k = max(top_k)
+        if max_k > 0:
+            # Sorted in descending order.
+            top_values = torch.topk(logits, max_k, dim=-1).values
+            kth_idx = _column([k - 1 if k > 0 else max_k - 1 for k in top_k], torch.int64).unsqueeze(1)
+            kth_values = torch.gather(top_values, 1, kth_idx).squeeze(1)
+            threshold = torch.where(_column([k > 0 for k in top_k], torch.bool), kth_values, threshold)
+
+        nucleus_rows = [i for i, p in enumerate(params) if p.top_p < 1.0]
+        if nucleus_rows:
+            rows = _column(nucleus_rows, torch.int64)
+            row_logits = logits[rows]
+            row_logits = row_logits.masked_fill(row_logits < threshold[rows].unsqueeze(1), float("-inf"))
+            top_p = _column([params[i].top_p for i in nucleus_rows], torch.float32)
+
+            # The nucleus usually lies within the few most likely tokens, so look for it there first.
+            candidates = torch.topk(row_logits, min(vocab_size, NUCLEUS_CANDIDATES), dim=-1).values
+            probs = torch.exp(candidates - torch.logsumexp(row_logits, dim=-1, keepdim=True))
+            cutoff = _nucleus_cutoff(candidates, probs, top_p)
+
+            incomplete = torch.nonzero(probs.sum(dim=-1) < top_p).squeeze(1)
+            if incomplete.numel() > 0:
+                candidates = torch.sort(row_logits[incomplete], dim=-1, descending=True).values
+                cutoff[incomplete] = _nucleus_cutoff(candidates, torch.softmax(candidates, dim=-1), top_p[incomplete])
+
+            threshold[rows] = torch.maximum(threshold[rows], cutoff)
+
+        logits = logits.masked_fill(logits < threshold.unsqueeze(1), float("-inf"))
+        cdf = torch.cumsum(torch.softmax(logits, dim=-1), dim=-1)
+
+        seeds = _column([state.seed for state in states], torch.int64)
+        counters = _column([state.n_generated for state in states], torch.int64)
+        total = cdf[:, -1:]
+        draws = uniform_from_counter(seeds, counters).to(cdf.dtype).unsqueeze(1) * total
+        # Guard against rounding up to the total, which would select past the last kept token.
+        draws = torch.minimum(draws, torch.nextafter(total, torch.zeros_like(total)))
+        return torch.searchsorted(cdf, draws, right=True).squeeze(1)
+
+    def sample(self, batch_uids: Iterable[int], logits: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Sample the next token of each sequence.
+
+        Arguments:
+            batch_uids (Iterable[int]): The uid of each row of ``logits``.
+            logits (torch.Tensor): ``[n_seqs, vocab_size]`` final-token logits.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The sampled token of each sequence and whether each
+                sequence finished (sampled a stop token or reached ``max_new_tokens``).
+        """
+        states = [self._requests[uid] for uid in batch_uids]
+        n_seqs, vocab_size = logits.shape
+        if len(states) != n_seqs:
+            raise ValueError(f"Expected logits for {len(states)} sequences, received {n_seqs}")
+
+        device = logits.device
+        params = [state.params for state in states]
+
+        def _column(values: List, dtype: torch.dtype) -> torch.Tensor:
+            return torch.tensor(values, dtype=dtype).to(device, non_blocking=True)
+
+        slots = _column([state.slot for state in states], torch.int64)
+
+        penalized_rows = [i for i, p in enumerate(params) if p.repetition_penalty != 1.0]
+        if penalized_rows:
+            # Copy, the penalty is applied in place.
+            logits = logits.to(torch.float32, copy=True)
+            rows = _column(penalized_rows, torch.int64)
+            present = self._presence_rows(vocab_size, device)[slots[rows]]
+            penalty = _column([params[i].repetition_penalty for i in penalized_rows], torch.float32).unsqueeze(1)
+            row_logits = logits[rows]
+            penalized = torch.where(row_logits > 0, row_logits / penalty, row_logits * penalty)
+            logits[rows] = torch.where(present, penalized, row_logits)
+        else:
+            logits = logits.float()
+
+        tokens = torch.argmax(logits, dim=-1)
+        sampled_rows = [i for i, p in enumerate(params) if p.temperature > 0]
+        if sampled_rows:
+            rows = _column(sampled_rows, torch.int64)
+            tokens[rows] = self._sample_rows(logits[rows], [params[i] for i in sampled_rows],
+                                             [states[i] for i in sampled_rows])
+
+        if penalized_rows:
+            # Track seen tokens for requests using the repetition penalty.
+            rows = _column(penalized_rows, torch.int64)
+            self._presence[slots[rows], tokens[rows]] = True
+
+        max_stops = max(len(p.stop_token_ids) for p in params)
+        if max_stops > 0:
+            stops = _column([list(p.stop_token_ids) + [-1] * (max_stops - len(p.stop_token_ids)) for p in params],
+                            torch.int64)
+            finished = (tokens.unsqueeze(1) == stops).any(dim=1)
+        else:
+            finished = torch.zeros(n_seqs, dtype=torch.bool, device=device)
+
+        for state in states:
+            state.n_generated += 1
+        max_new_tokens = [p.max_new_tokens if p.max_new_tokens is not None else -1 for p in params]
+        if any(limit > 0 for limit in max_new_tokens):
+            n_generated = _column([state.n_generated for state in states], torch.int64)
+            limits = _column(max_new_tokens, torch.int64)
+            finished |= (limits > 0) & (n_generated >= limits)
+
+        return tokens, finished
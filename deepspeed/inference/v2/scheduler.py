@@ -0,0 +1,383 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import torch
+
+from .scheduling_utils import SchedulingResult
+
+TokenSampler = Callable[[torch.Tensor], torch.Tensor]
+"""
+Maps the final-token logits of a batch ([n_seqs, vocab_size]) to the next token of each sequence ([n_seqs]).
+"""
+
+
+def greedy_sampler(logits: torch.Tensor) -> torch.Tensor:
+    """
+    Default sampler, picks the most likely next token for each sequence.
+    """
+    return torch.argmax(logits, dim=-1)
+
+
+class SchedulerRequest:
+    """
+    Host-side state of a single generation request tracked by the ``ContinuousBatchingScheduler``.
+    """
+
+    uid: int
+    """
+    Identifier of the request. Also used as the sequence uid on the inference engine.
+    """
+
+    prompt: torch.Tensor
+    """
+    Prompt tokens (1D, on the host).
+    """
+
+    max_new_tokens: int
+    """
+    Maximum number of tokens to generate.
+    """
+
+    stop_token_ids: Tuple[int, ...]
+    """
+    Generation stops once any of these tokens is produced. The stop token is included in the output.
+    """
+
+    arrival: int
+    """
+    Order in which the request was submitted to the scheduler.
+    """
+
+    prefilled_tokens: int
+    """
+    Number of prompt tokens that have completed a forward.
+    """
+
+    generated: List[int]
+    """
+    Tokens generated so far.
+    """
+
+    def __init__(self,
+                 uid: int,
+                 prompt: torch.Tensor,
+                 max_new_tokens: int,
+                 stop_token_ids: Iterable[int] = (),
+                 arrival: int = 0) -> None:
+        if prompt.numel() == 0:
+            raise ValueError(f"Request {uid} has an empty prompt.")
+        if max_new_tokens < 1:
+            raise ValueError(f"Request {uid} must generate at least one token, requested {max_new_tokens}.")
+
+        self.uid = uid
+        self.prompt = prompt.flatten().cpu()
+        self.max_new_tokens = max_new_tokens
+        self.stop_token_ids = tuple(stop_token_ids)
+        self.arrival = arrival
+        self.prefilled_tokens = 0
+        self.generated = []
+
+    @property
+    def prompt_length(self) -> int:
+        return self.prompt.numel()
+
+    @property
+    def in_prefill(self) -> bool:
+        """
+        Whether prompt tokens remain to be processed.
+        """
+        return self.prefilled_tokens < self.prompt_length
+
+    @property
+    def remaining_prefill(self) -> int:
+        return self.prompt_length - self.prefilled_tokens
+
+    @property
+    def done(self) -> bool:
+        if len(self.generated) >= self.max_new_tokens:
+            return True
+        return len(self.generated) > 0 and self.generated[-1] in self.stop_token_ids
+
+    def next_tokens(self, n_tokens: int) -> torch.Tensor:
+        """
+        The next ``n_tokens`` tokens to send to the engine for this request.
+        """
+        if self.in_prefill:
+            return self.prompt[self.prefilled_tokens:self.prefilled_tokens + n_tokens]
+        return torch.tensor([self.generated[-1]], dtype=self.prompt.dtype)
+
+
+class SchedulingPolicy:
+    """
+    Base class for scheduler policies. A policy decides the order in which waiting and partially
+    prefilled requests are admitted into a batch, and how prompt processing may be split across
+    forwards. Requests that are already decoding are always scheduled first.
+    """
+
+    chunk_prefill: bool = False
+    """
+    Whether prompts may be split into chunks across several forwards. Prompts that are longer than
+    the engine's ``max_ragged_batch_size`` are always chunked.
+    """
+
+    prefill_token_budget: Optional[int] = None
+    """
+    Maximum number of prompt tokens to include in a single forward. ``None`` for no limit beyond
+    the engine's batch size.
+    """
+
+    def prioritize(self, requests: List[SchedulerRequest]) -> List[SchedulerRequest]:
+        """
+        Order the requests that still have prompt tokens to process. Requests are admitted in the
+        returned order and admission stops at the first request that does not fit.
+        """
+        raise NotImplementedError()
+
+
+class FCFSPolicy(SchedulingPolicy):
+    """
+    Admit requests in the order they were submitted.
+    """
+
+    def prioritize(self, requests: List[SchedulerRequest]) -> List[SchedulerRequest]:
+        return sorted(requests, key=lambda req: req.arrival)
+
+
+class ShortestPromptFirstPolicy(SchedulingPolicy):
+    """
+    Admit requests with the fewest remaining prompt tokens first. Partially prefilled requests keep
+    priority over ones that have not started so their KV blocks are not held idle.
+    """
+
+    def prioritize(self, requests: List[SchedulerRequest]) -> List[SchedulerRequest]:
+        return sorted(requests, key=lambda req: (req.prefilled_tokens == 0, req.remaining_prefill, req.arrival))
+
+
+class ChunkedPrefillPolicy(FCFSPolicy):
+    """
+    First-come first-served admission where prompts are split into chunks so that no forward
+    processes more than ``token_budget`` prompt tokens. This bounds the latency impact of long
+    prompts on the requests that are decoding alongside them.
+    """
+
+    def __init__(self, token_budget: int) -> None:
+        if token_budget < 1:
+            raise ValueError(f"Chunked prefill token budget must be positive, provided {token_budget}")
+        self.chunk_prefill = True
+        self.prefill_token_budget = token_budget
+
+
+class ContinuousBatchingScheduler:
+    """
+    Drives an ``InferenceEngineV2`` with continuous batching. Each step packs one decode token for
+    every running request and fills the rest of the batch with prompt tokens of waiting requests,
+    within the engine's batch size, sequence count and KV-cache limits.
+
+    The scheduler only relies on the ``put``, ``query``, ``create_reservation``, ``flush``,
+    ``free_blocks`` and ``config`` members of the engine, so any object providing them may be driven.
+    """
+
+    def __init__(self,
+                 engine,
+                 policy: Optional[SchedulingPolicy] = None,
+                 sampler: Optional[TokenSampler] = None) -> None:
+        """
+        Arguments:
+            engine (InferenceEngineV2): The engine to drive.
+            policy (SchedulingPolicy): Admission policy. Defaults to ``FCFSPolicy``.
+            sampler (TokenSampler): Selects the next token from the final-token logits. Defaults
+                to greedy sampling.
+        """
+        self._engine = engine
+        self._policy = policy if policy is not None else FCFSPolicy()
+        self._sampler = sampler if sampler is not None else greedy_sampler
+
+        manager_config = engine.config.state_manager
+        self._max_batch_tokens = manager_config.max_ragged_batch_size
+        self._max_batch_sequences = manager_config.max_ragged_sequence_count
+
+        self._requests: Dict[int, SchedulerRequest] = {}
+        self._waiting: Deque[SchedulerRequest] = deque()
+        self._running: List[SchedulerRequest] = []
+        self._n_submitted = 0
+
+    def add_request(self, uid: int, prompt: torch.Tensor, max_new_tokens: int,
+                    stop_token_ids: Iterable[int] = ()) -> SchedulerRequest:
+        """
+        Submit a new generation request.
+
+        Arguments:
+            uid (int): Unique identifier of the request. Must not collide with a sequence already
+                tracked by the engine.
+            prompt (torch.Tensor): Prompt tokens.
+            max_new_tokens (int): Maximum number of tokens to generate.
+            stop_token_ids (Iterable[int]): Tokens that end generation early (e.g. EOS).
+        """
+        if uid in self._requests:
+            raise ValueError(f"Request {uid} is already scheduled.")
+
+        request = SchedulerRequest(uid, prompt, max_new_tokens, stop_token_ids, arrival=self._n_submitted)
+        self._n_submitted += 1
+        self._requests[uid] = request
+        self._waiting.append(request)
+        return request
+
+    def cancel(self, uid: int) -> None:
+        """
+        Drop a request and release its state on the engine.
+        """
+        request = self._requests.pop(uid, None)
+        if request is None:
+            return
+
+        if request in self._waiting:
+            self._waiting.remove(request)
+        else:
+            self._running.remove(request)
+            self._engine.flush(uid)
+
+    @property
+    def has_pending(self) -> bool:
+        """
+        Whether any submitted request has not yet completed.
+        """
+        return len(self._requests) > 0
+
+    def _build_batch(self) -> Tuple[List[SchedulerRequest], List[int]]:
+        """
+        Choose the requests and the number of tokens of each to include in the next forward.
+        """
+        batch: List[SchedulerRequest] = []
+        lengths: List[int] = []
+        batch_tokens = 0
+        free_blocks = self._engine.free_blocks[0]
+
+        def try_add(request: SchedulerRequest, n_tokens: int, allow_partial: bool) -> bool:
+            nonlocal batch_tokens, free_blocks
+            if len(batch) == self._max_batch_sequences:
+                return False
+
+            n_tokens = min(n_tokens, self._max_batch_tokens - batch_tokens)
+            if n_tokens <= 0:
+                return False
+
+            sched_tokens, sched_blocks = self._engine.query(request.uid, n_tokens, free_blocks)
+            if sched_tokens < n_tokens:
+                if not allow_partial or sched_tokens <= 0:
+                    return False
+                n_tokens = sched_tokens
+
+            batch.append(request)
+            lengths.append(n_tokens)
+            batch_tokens += n_tokens
+            free_blocks -= sched_blocks
+            return True
+
+        # Decodes go first so running requests keep making progress.
+        for request in self._running:
+            if not request.in_prefill:
+                try_add(request, 1, allow_partial=False)
+
+        prefill_budget = self._policy.prefill_token_budget
+        prefill_candidates = [req for req in self._running if req.in_prefill] + list(self._waiting)
+        for request in self._policy.prioritize(prefill_candidates):
+            n_tokens = request.remaining_prefill
+            # Prompts that can never fit in one forward are chunked regardless of policy.
+            allow_partial = self._policy.chunk_prefill or n_tokens > self._max_batch_tokens
+            if prefill_budget is not None:
+                if prefill_budget <= 0:
+                    break
+                if n_tokens > prefill_budget:
+                    if not allow_partial:
+                        break
+                    n_tokens = prefill_budget
+
+            if not allow_partial and n_tokens > self._max_batch_tokens - batch_tokens:
+                break
+
+            if not try_add(request, n_tokens, allow_partial):
+                break
+
+            if prefill_budget is not None:
+                prefill_budget -= lengths[-1]
+
+        # The local accounting above does not see engine-wide limits such as the number of tracked
+        # sequences, so confirm with the engine and shed the lowest priority entries if needed.
+        reservation = self._engine.create_reservation()
+        for req, n_tokens in zip(batch, lengths):
+            reservation.add(req.uid, n_tokens)
+        while batch and reservation.result != SchedulingResult.Success:
+            reservation.remove(batch.pop().uid)
+            lengths.pop()
+
+        return batch, lengths
+
+    def step(self) -> Dict[int, int]:
+        """
+        Run a single forward of the engine.
+
+        Returns:
+            Dict[int, int]: The token generated in this step for each request that produced one.
+        """
+        batch, lengths = self._build_batch()
+        if not batch:
+            if self.has_pending:
+                raise RuntimeError("Unable to schedule any pending request, the KV-cache or sequence "
+                                   "tracking capacity of the engine is exhausted.")
+            return {}
+
+        tokens = [req.next_tokens(n_tokens) for req, n_tokens in zip(batch, lengths)]
+        logits = self._engine.put([req.uid for req in batch], tokens, do_checks=False)
+
+        # Only sample for sequences whose final-token logits correspond to a new token.
+        produces_token = []
+        for req, n_tokens in zip(batch, lengths):
+            if req.in_prefill:
+                if req.prefilled_tokens == 0:
+                    self._waiting.remove(req)
+                    self._running.append(req)
+                req.prefilled_tokens += n_tokens
+            produces_token.append(not req.in_prefill)
+
+        new_tokens: Dict[int, int] = {}
+        if any(produces_token):
+            sample_idx = torch.tensor([i for i, produces in enumerate(produces_token) if produces])
+            sampled = self._sampler(logits[sample_idx.to(logits.device)]).tolist()
+            for idx, token in zip(sample_idx.tolist(), sampled):
+                req = batch[idx]
+                req.generated.append(token)
+                new_tokens[req.uid] = token
+
+        for req in batch:
+            if req.done:
+                self._running.remove(req)
+                del self._requests[req.uid]
+                self._engine.flush(req.uid)
+
+        return new_tokens
+
+    def stream(self) -> Iterator[Tuple[int, int]]:
+        """
+        Run until all submitted requests complete, yielding ``(uid, token)`` pairs as tokens are
+        generated. Requests may be added or cancelled between iterations.
+        """
+        while self.has_pending:
+            for uid, token in self.step().items():
+                yield uid, token
+
+    def run(self) -> Dict[int, List[int]]:
+        """
+        Run until all submitted requests complete.
+
+        Returns:
+            Dict[int, List[int]]: The generated tokens of each request.
+        """
+        outputs: Dict[int, List[int]] = {}
+        for uid, token in self.stream():
+            outputs.setdefault(uid, []).append(token)
+        return outputs
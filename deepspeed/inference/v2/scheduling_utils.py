@@ -3,7 +3,11 @@
 
 # DeepSpeed Team
 
+import sys
 from enum import Enum
+from typing import Any, Dict, Tuple
+
+from .ragged import DSStateManagerConfig, PlaceholderSequenceDescriptor
 
 
 class SchedulingResult(Enum):
@@ -52,3 +56,151 @@ class SchedulingError(RuntimeError):
     def __init__(self, result: SchedulingResult) -> None:
         self.result = result
         super().__init__(f"Batch scheduling failed with result {result}")
+
+
+class BatchReservation:
+    """
+    Incrementally built proposal for the next ragged batch. Candidate ``(uid, length)`` pairs may be
+    added and removed while the reservation keeps running totals of the tokens, KV blocks and new
+    sequences the batch requires, so the ``SchedulingResult`` of the current proposal is available
+    in O(1) after every change rather than by re-running ``can_schedule`` over the whole batch.
+
+    The block requirement of each candidate is computed once, when it is added. A reservation is a
+    snapshot: it assumes the engine state (tracked sequences and free blocks) does not change while
+    it is being built, so create a new one for each batch.
+    """
+
+    _candidates: Dict[int, Tuple[int, int, bool]]
+    """
+    For each candidate uid, the (length, required blocks, is new sequence) triple.
+    """
+
+    def __init__(self, state_manager: Any, model: Any, config: DSStateManagerConfig) -> None:
+        """
+        Arguments:
+            state_manager (DSStateManager): Source of the tracked sequences and free KV blocks.
+            model (DSInferenceModelBase): Provides the KV block requirements of a sequence.
+            config (DSStateManagerConfig): The engine's state manager limits.
+        """
+        self._state_manager = state_manager
+        self._model = model
+        self._config = config
+
+        self._free_blocks = state_manager.free_blocks[0]
+        self._tracked_sequences = state_manager.n_tracked_sequences
+        self._candidates = {}
+        self._tokens = 0
+        self._blocks = 0
+        self._new_sequences = 0
+        self._unschedulable = 0
+
+    def _requirements(self, uid: int, length: int) -> Tuple[int, bool]:
+        seq_desc = self._state_manager.get_sequence(uid)
+        is_new = seq_desc is None
+        if is_new:
+            seq_desc = PlaceholderSequenceDescriptor()
+
+        # Ask for the full requirement; whether it fits is decided against the running total.
+        sched_len, sched_blocks = self._model.get_kv_requirements(seq_desc, length, sys.maxsize)
+        if sched_len != length:
+            # The model cannot hold this many tokens for the sequence regardless of free blocks.
+            sched_blocks = sys.maxsize
+        return sched_blocks, is_new
+
+    def add(self, uid: int, length: int) -> SchedulingResult:
+        """
+        Add a candidate sequence to the proposed batch, replacing any previous entry for ``uid``.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+            length (int): The number of tokens of the sequence to include in the forward.
+
+        Returns:
+            SchedulingResult: The result of the updated proposal.
+        """
+        if uid in self._candidates:
+            self.remove(uid)
+
+        blocks, is_new = self._requirements(uid, length)
+        self._candidates[uid] = (length, blocks, is_new)
+        self._tokens += length
+        if blocks == sys.maxsize:
+            self._unschedulable += 1
+        else:
+            self._blocks += blocks
+        self._new_sequences += is_new
+        return self.result
+
+    def remove(self, uid: int) -> SchedulingResult:
+        """
+        Remove a candidate sequence from the proposed batch.
+
+        Arguments:
+            uid (int): The UID of the sequence.
+
+        Returns:
+            SchedulingResult: The result of the updated proposal.
+        """
+        length, blocks, is_new = self._candidates.pop(uid)
+        self._tokens -= length
+        if blocks == sys.maxsize:
+            self._unschedulable -= 1
+        else:
+            self._blocks -= blocks
+        self._new_sequences -= is_new
+        return self.result
+
+    @property
+    def result(self) -> SchedulingResult:
+        """
+        Whether the proposed batch can be scheduled. Limits are checked in the same order as
+        ``InferenceEngineV2.can_schedule``.
+        """
+        if len(self._candidates) > self._config.max_ragged_sequence_count:
+            return SchedulingResult.BatchSequenceLimitExceeded
+
+        if self._unschedulable > 0 or self._blocks > self._free_blocks:
+            return SchedulingResult.KVCacheLimitExceeded
+
+        if self._tracked_sequences + self._new_sequences > self._config.max_tracked_sequences:
+            return SchedulingResult.EngineSequenceLimitExceeded
+
+        if self._tokens > self._config.max_ragged_batch_size:
+            return SchedulingResult.BatchTokenLimitExceeded
+
+        return SchedulingResult.Success
+
+    @property
+    def n_sequences(self) -> int:
+        """
+        Number of candidate sequences in the proposal.
+        """
+        return len(self._candidates)
+
+    @property
+    def n_tokens(self) -> int:
+        """
+        Number of tokens in the proposal.
+        """
+        return self._tokens
+
+    @property
+    def n_blocks(self) -> int:
+        """
+        Number of new KV blocks the proposal requires.
+        """
+        return self._blocks
+
+    @property
+    def free_blocks(self) -> int:
+        """
+        Number of KV blocks that remain available after the proposal.
+        """
+        return self._free_blocks - self._blocks
+
+    @property
+    def free_tokens(self) -> int:
+        """
+        Number of tokens that may still be added without exceeding the batch size limit.
+        """
+        return self._config.max_ragged_batch_size - self._tokens
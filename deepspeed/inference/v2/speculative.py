@@ -0,0 +1,165 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Dict, Iterable, List
+
+import torch
+
+
+class SpeculativeSequence:
+    """
+    Host-side speculative decoding state of a single sequence.
+    """
+
+    target_pending: int
+    """
+    Last accepted token. It has not yet been processed by the target model.
+    """
+
+    draft_pending: List[int]
+    """
+    Accepted tokens that have not yet been processed by the draft model. Contains either the last
+    accepted token, or the final draft token followed by the bonus token when every draft token
+    was accepted.
+    """
+
+    def __init__(self, first_token: int) -> None:
+        self.target_pending = first_token
+        self.draft_pending = [first_token]
+
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding with a small draft model and a large target model, both served by
+    ``InferenceEngineV2`` instances sharing a tokenizer.
+
+    Every step, the draft model proposes ``num_speculative_tokens`` tokens per sequence with
+    single-token forwards. The target model then scores the last accepted token together with all
+    the proposals in a single ragged forward. The longest prefix of proposals matching the target's
+    greedy choices is accepted along with one token chosen by the target, so each step produces
+    between 1 and ``num_speculative_tokens + 1`` tokens and the output is identical to greedy
+    decoding with the target model alone. The KV-cache state of rejected tokens is rolled back on
+    both engines.
+    """
+
+    def __init__(self, target_engine, draft_engine, num_speculative_tokens: int = 4) -> None:
+        """
+        Arguments:
+            target_engine (InferenceEngineV2): Engine serving the model whose output is produced.
+            draft_engine (InferenceEngineV2): Engine serving the cheaper proposal model.
+            num_speculative_tokens (int): Number of tokens proposed by the draft model per step.
+        """
+        if num_speculative_tokens < 1:
+            raise ValueError(f"Number of speculative tokens must be positive, provided {num_speculative_tokens}")
+
+        self._target = target_engine
+        self._draft = draft_engine
+        self._k = num_speculative_tokens
+        self._sequences: Dict[int, SpeculativeSequence] = {}
+
+    @property
+    def num_speculative_tokens(self) -> int:
+        return self._k
+
+    def prefill(self, batch_uids: Iterable[int], batch_prompts: Iterable[torch.Tensor]) -> Dict[int, int]:
+        """
+        Process the prompts of new sequences on both engines.
+
+        Arguments:
+            batch_uids (Iterable[int]): UIDs of the new sequences.
+            batch_prompts (Iterable[torch.Tensor]): Prompt tokens of each sequence.
+
+        Returns:
+            Dict[int, int]: The first generated token of each sequence.
+        """
+        batch_uids = list(batch_uids)
+        batch_prompts = list(batch_prompts)
+        for uid in batch_uids:
+            if uid in self._sequences:
+                raise ValueError(f"Sequence {uid} is already being decoded.")
+
+        logits = self._target.put(batch_uids, batch_prompts)
+        self._draft.put(batch_uids, batch_prompts)
+
+        first_tokens = torch.argmax(logits, dim=-1).tolist()
+        for uid, token in zip(batch_uids, first_tokens):
+            self._sequences[uid] = SpeculativeSequence(token)
+        return dict(zip(batch_uids, first_tokens))
+
+    def _propose(self, batch_uids: List[int]) -> List[List[int]]:
+        """
+        Run the draft model autoregressively to propose ``num_speculative_tokens`` tokens per sequence.
+        """
+        proposals: List[List[int]] = [[] for _ in batch_uids]
+        batch_tokens = [torch.tensor(self._sequences[uid].draft_pending) for uid in batch_uids]
+        for _ in range(self._k):
+            logits = self._draft.put(batch_uids, batch_tokens)
+            next_tokens = torch.argmax(logits, dim=-1).tolist()
+            for proposal, token in zip(proposals, next_tokens):
+                proposal.append(token)
+            batch_tokens = [torch.tensor([token]) for token in next_tokens]
+        return proposals
+
+    def step(self, batch_uids: Iterable[int]) -> Dict[int, List[int]]:
+        """
+        Run one speculative step for the given sequences.
+
+        Arguments:
+            batch_uids (Iterable[int]): UIDs of sequences that completed ``prefill``.
+
+        Returns:
+            Dict[int, List[int]]: The newly accepted tokens of each sequence.
+        """
+        batch_uids = list(batch_uids)
+        for uid in batch_uids:
+            if uid not in self._sequences:
+                raise ValueError(f"Sequence {uid} has not been prefilled.")
+
+        proposals = self._propose(batch_uids)
+
+        # Verify all proposals in one forward. Logits at position i of a sequence are the target's
+        # prediction for the token following input i.
+        verify_tokens = [
+            torch.tensor([self._sequences[uid].target_pending] + proposal)
+            for uid, proposal in zip(batch_uids, proposals)
+        ]
+        logits = self._target.put(batch_uids, verify_tokens, all_token_logits=True)
+        target_choices = torch.argmax(logits, dim=-1).tolist()
+
+        accepted_tokens: Dict[int, List[int]] = {}
+        offset = 0
+        for uid, proposal in zip(batch_uids, proposals):
+            choices = target_choices[offset:offset + self._k + 1]
+            offset += self._k + 1
+
+            n_accepted = 0
+            while n_accepted < self._k and proposal[n_accepted] == choices[n_accepted]:
+                n_accepted += 1
+            bonus = choices[n_accepted]
+            accepted_tokens[uid] = proposal[:n_accepted] + [bonus]
+
+            seq = self._sequences[uid]
+            n_rejected = self._k - n_accepted
+            # The target processed ``pending, d_1..d_k``; keep ``pending, d_1..d_n``.
+            self._target.rollback(uid, n_rejected)
+            seq.target_pending = bonus
+
+            if n_rejected > 0:
+                # The draft processed ``draft_pending, d_1..d_(k-1)``; keep ``draft_pending, d_1..d_n``.
+                self._draft.rollback(uid, n_rejected - 1)
+                seq.draft_pending = [bonus]
+            else:
+                # ``d_k`` was sampled but never processed by the draft model.
+                seq.draft_pending = [proposal[-1], bonus]
+
+        return accepted_tokens
+
+    def flush(self, uid: int) -> None:
+        """
+        Remove a sequence from both engines.
+        """
+        self._sequences.pop(uid, None)
+        self._target.flush(uid)
+        self._draft.flush(uid)
@@ -0,0 +1,239 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from deepspeed.accelerator import get_accelerator
+
+from .config_v2 import TelemetryConfig
+
+
+class StepTelemetry:
+    """
+    Telemetry of a single ``InferenceEngineV2.put``.
+    """
+
+    step: int
+    """
+    Index of the step since the engine was created.
+    """
+
+    timings: Dict[str, float]
+    """
+    Wall time in seconds of each phase of the step, in execution order. The phases of a ``put`` are
+    ``schedule`` (schedulability checks, if enabled), ``batch_build`` (sequence lookup, KV block
+    allocation and batch packing), ``finalize`` (host to device copy of the batch metadata),
+    ``forward`` (model forward, including the gather and unembedding of the logits) and
+    ``post_forward`` (sequence bookkeeping and prefix caching).
+    """
+
+    n_tokens: int
+    """
+    Number of tokens in the batch.
+    """
+
+    n_sequences: int
+    """
+    Number of sequences in the batch.
+    """
+
+    n_tracked_sequences: int
+    """
+    Number of sequences tracked by the engine after the step, including parked sequences.
+    """
+
+    free_blocks: Tuple[int, ...]
+    """
+    Free KV blocks of each cache group after the step.
+    """
+
+    kv_fragmentation: Tuple[float, ...]
+    """
+    Fraction of the allocated KV token slots of each cache group that hold no token after the step.
+    """
+
+    prefix_cache_hits: int
+    """
+    Number of new sequences that attached KV blocks from the prefix cache.
+    """
+
+    prefix_cache_hit_tokens: int
+    """
+    Number of prompt tokens whose KV values were taken from the prefix cache rather than computed.
+    """
+
+    def __init__(self, step: int, synchronize: bool = False) -> None:
+        self.step = step
+        self.timings = {}
+        self.n_tokens = 0
+        self.n_sequences = 0
+        self.n_tracked_sequences = 0
+        self.free_blocks = ()
+        self.kv_fragmentation = ()
+        self.prefix_cache_hits = 0
+        self.prefix_cache_hit_tokens = 0
+
+        self._synchronize = synchronize
+        self._last_mark = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """
+        Record the end of a phase, which started at the end of the previous phase (or the creation of
+        the record).
+        """
+        if self._synchronize:
+            get_accelerator().synchronize()
+        now = time.perf_counter()
+        self.timings[phase] = now - self._last_mark
+        self._last_mark = now
+
+    @property
+    def total_time(self) -> float:
+        """
+        Wall time in seconds of the whole step.
+        """
+        return sum(self.timings.values())
+
+    def events(self, prefix: str = "Inference") -> List[Tuple[str, float, int]]:
+        """
+        The telemetry of the step as ``(name, value, step)`` events for ``deepspeed.monitor`` backends.
+        """
+        events = [(f"{prefix}/Time/{phase}", value, self.step) for phase, value in self.timings.items()]
+        events.append((f"{prefix}/Time/total", self.total_time, self.step))
+        events.append((f"{prefix}/Batch/tokens", self.n_tokens, self.step))
+        events.append((f"{prefix}/Batch/sequences", self.n_sequences, self.step))
+        events.append((f"{prefix}/Batch/tracked_sequences", self.n_tracked_sequences, self.step))
+        for group, free in enumerate(self.free_blocks):
+            events.append((f"{prefix}/KVCache/free_blocks_{group}", free, self.step))
+        for group, fragmentation in enumerate(self.kv_fragmentation):
+            events.append((f"{prefix}/KVCache/fragmentation_{group}", fragmentation, self.step))
+        events.append((f"{prefix}/PrefixCache/hits", self.prefix_cache_hits, self.step))
+        events.append((f"{prefix}/PrefixCache/hit_tokens", self.prefix_cache_hit_tokens, self.step))
+        return events
+
+
+TelemetryHook = Callable[[StepTelemetry], None]
+"""
+Called with the telemetry of each completed step.
+"""
+
+
+class TelemetryRingBuffer:
+    """
+    Keeps the telemetry of the most recent steps in memory.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError(f"Telemetry buffer capacity must be positive, provided {capacity}")
+        self._records: Deque[StepTelemetry] = deque(maxlen=capacity)
+
+    @property
+    def capacity(self) -> int:
+        return self._records.maxlen
+
+    def append(self, record: StepTelemetry) -> None:
+        self._records.append(record)
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    @property
+    def latest(self) -> Optional[StepTelemetry]:
+        """
+        Telemetry of the most recent step, if any.
+        """
+        return self._records[-1] if self._records else None
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[StepTelemetry]:
+        """
+        Iterate over the buffered steps, oldest first.
+        """
+        return iter(self._records)
+
+    def mean_timings(self) -> Dict[str, float]:
+        """
+        Mean wall time in seconds of each phase over the buffered steps.
+        """
+        totals: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        for record in self._records:
+            for phase, value in record.timings.items():
+                totals[phase] = totals.get(phase, 0.0) + value
+                counts[phase] = counts.get(phase, 0) + 1
+        return {phase: totals[phase] / counts[phase] for phase in totals}
+
+
+class EngineTelemetry:
+    """
+    Collects per-step telemetry for an ``InferenceEngineV2``. Completed steps are appended to a ring
+    buffer, passed to the registered hooks, and written to the configured ``deepspeed.monitor``
+    backends.
+    """
+
+    def __init__(self, config: TelemetryConfig, monitor=None) -> None:
+        """
+        Arguments:
+            config (TelemetryConfig): Telemetry configuration.
+            monitor (Monitor): Backend to write step events to. Defaults to a ``MonitorMaster`` built
+                from ``config.monitor`` if any backend is enabled there.
+        """
+        if config.monitor_interval < 1:
+            raise ValueError(f"Telemetry monitor interval must be positive, provided {config.monitor_interval}")
+
+        self._config = config
+        self._buffer = TelemetryRingBuffer(config.buffer_size)
+        self._hooks: List[TelemetryHook] = []
+        self._n_steps = 0
+
+        if monitor is None and config.monitor.enabled:
+            from deepspeed.monitor.monitor import MonitorMaster
+            monitor = MonitorMaster(config.monitor)
+        self._monitor = monitor
+
+    @property
+    def buffer(self) -> TelemetryRingBuffer:
+        """
+        Telemetry of the most recent steps.
+        """
+        return self._buffer
+
+    @property
+    def n_steps(self) -> int:
+        """
+        Number of steps recorded so far.
+        """
+        return self._n_steps
+
+    def add_hook(self, hook: TelemetryHook) -> None:
+        """
+        Register a callable to receive the telemetry of each completed step.
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: TelemetryHook) -> None:
+        self._hooks.remove(hook)
+
+    def begin_step(self) -> StepTelemetry:
+        """
+        Start recording a step. The timing of its first phase starts now.
+        """
+        return StepTelemetry(self._n_steps, synchronize=self._config.synchronize)
+
+    def end_step(self, record: StepTelemetry) -> None:
+        """
+        Publish a completed step.
+        """
+        self._n_steps += 1
+        self._buffer.append(record)
+        for hook in self._hooks:
+            hook(record)
+        if self._monitor is not None and record.step % self._config.monitor_interval == 0:
+            self._monitor.write_events(record.events())
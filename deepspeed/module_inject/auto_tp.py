@@ -394,7 +394,8 @@ class AutoTP():
             data = child.weight.ds_tensor.data.split(get_shard_size_list(child.weight.shape[1], self.mp_size), dim=1)
         else:
             data = child.weight.data.split(get_shard_size_list(child.weight.shape[1], self.mp_size, name), dim=1)
-        data = data[mp_replace.gpu_index].to(get_accelerator().current_device_name())
+        # move() allocates an empty slice for meta tensors, e.g. when the weights are loaded from AutoTP shards later.
+        data = move(data[mp_replace.gpu_index], get_accelerator().current_device_name())
         data = torch.nn.parameter.Parameter(data, requires_grad=False)
 
         new_embedding = nn.Embedding(child.weight.shape[0], get_shard_size(child.weight.shape[1], self.mp_size, name))
@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+# Pre-sharded checkpoints of AutoTP models
+import json
+import os
+
+import torch
+from deepspeed import comm as dist
+from deepspeed.utils import logger
+
+from .load_checkpoint import load_state_dict
+
+TP_SHARDS_MANIFEST = "ds_tp_shards.json"
+TP_SHARDS_VERSION = 1.0
+
+
+def tp_shard_name(tp_rank):
+    return f"tp_rank_{tp_rank:0>2d}.pt"
+
+
+def _tp_rank(mp_group):
+    return dist.get_rank(group=mp_group) if mp_group is not None else 0
+
+
+def _named_tensors(module):
+    # Buffers are included whether they are persistent or not, since non-persistent buffers (e.g. rotary
+    # frequencies) are not initialized when the model is created on the meta device. Tied parameters are
+    # only returned once, so loading into them keeps them tied.
+    tensors = dict(module.named_parameters())
+    tensors.update(dict(module.named_buffers()))
+    return tensors
+
+
+def save_tp_shards(module, save_dir, tp_size, mp_group=None, dtype=None):
+    """ Save the weights each rank holds after AutoTP slicing, so later launches with the same
+    tensor-parallel degree can load them with ``load_tp_shards`` instead of slicing the full model.
+    Each rank writes its own shard. The first rank also writes a manifest with the tensor-parallel
+    degree, the data type, the shard of each rank and the names of the tensors every shard holds.
+    Arguments:
+        module (torch.nn.Module): the model after AutoTP replacement
+        save_dir (str): directory to write the shards and the manifest to
+        tp_size (int): the tensor-parallel degree the model was sliced for
+        mp_group: the tensor-parallel group, None if the model is not sliced across ranks
+        dtype (torch.dtype): data type of the model, recorded in the manifest
+    """
+    tp_rank = _tp_rank(mp_group)
+    if tp_rank < 0:
+        # Ranks outside the tensor-parallel group hold a replica of a shard that is already saved.
+        return
+
+    os.makedirs(save_dir, exist_ok=True)
+    tensors = _named_tensors(module)
+    torch.save({name: tensor.detach()
+                for name, tensor in tensors.items()}, os.path.join(save_dir, tp_shard_name(tp_rank)))
+
+    if tp_rank == 0:
+        manifest = {
+            'type': 'autotp',
+            'version': TP_SHARDS_VERSION,
+            'model': module.__class__.__name__,
+            'tp_size': tp_size,
+            'dtype': str(dtype).replace('torch.', '') if dtype is not None else None,
+            'shards': [tp_shard_name(r) for r in range(tp_size)],
+            'tensors': list(tensors.keys())
+        }
+        with open(os.path.join(save_dir, TP_SHARDS_MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    if mp_group is not None:
+        dist.barrier(group=mp_group)
+    if tp_rank == 0:
+        logger.info(f"Saved AutoTP shards for tp_size={tp_size} to {save_dir}")
+
+
+def load_tp_shards(module, load_dir, tp_size, mp_group=None, dtype=None, mmap=False):
+    """ Load the shard of this rank saved by ``save_tp_shards`` into a model after AutoTP replacement.
+    Only the shard of this rank is read, the full checkpoint is not. The model may have been created
+    on the meta device, in which case AutoTP replacement only allocates the sliced tensors.
+    Arguments:
+        module (torch.nn.Module): the model after AutoTP replacement, with its tensors on their device
+        load_dir (str): directory holding the shards and the manifest
+        tp_size (int): the tensor-parallel degree of this launch, which must match the saved one
+        mp_group: the tensor-parallel group, None if the model is not sliced across ranks
+        dtype (torch.dtype): data type of the model, which must match the saved one
+        mmap (bool): memory-map the shard instead of reading it into host memory
+    """
+    manifest_file = os.path.join(load_dir, TP_SHARDS_MANIFEST)
+    if not os.path.isfile(manifest_file):
+        raise FileNotFoundError(f"No AutoTP shard manifest found at {manifest_file}")
+    with open(manifest_file, "r") as f:
+        manifest = json.load(f)
+
+    if manifest['tp_size'] != tp_size:
+        raise ValueError(f"AutoTP shards in {load_dir} were saved for tp_size={manifest['tp_size']}, "
+                         f"they cannot be loaded with tp_size={tp_size}")
+    saved_dtype = manifest.get('dtype')
+    if dtype is not None and saved_dtype is not None and saved_dtype != str(dtype).replace('torch.', ''):
+        raise ValueError(f"AutoTP shards in {load_dir} were saved with dtype {saved_dtype}, not {dtype}")
+
+    tensors = _named_tensors(module)
+    missing = [name for name in tensors if name not in manifest['tensors']]
+    unexpected = [name for name in manifest['tensors'] if name not in tensors]
+    if missing or unexpected:
+        raise ValueError(f"AutoTP shards in {load_dir} do not match the model. "
+                         f"Missing tensors: {missing}, unexpected tensors: {unexpected}")
+
+    # Ranks outside the tensor-parallel group slice with index -1 in ``ReplaceWithTensorSlicing``,
+    # so they hold the same tensors as the last rank of the group.
+    tp_rank = _tp_rank(mp_group)
+    sd = load_state_dict(os.path.join(load_dir, manifest['shards'][tp_rank]), mmap=mmap)
+    with torch.no_grad():
+        for name, tensor in tensors.items():
+            if sd[name].shape != tensor.shape:
+                raise ValueError(f"Shape of {name} in the AutoTP shard of rank {tp_rank} is {tuple(sd[name].shape)}, "
+                                 f"the model expects {tuple(tensor.shape)}")
+            tensor.copy_(sd[name])
+    sd = None
@@ -15,10 +15,64 @@ import deepspeed.ops.transformer as transformer_inference
 from .layers import LinearLayer, Normalize, EmbeddingLayer, OPTEmbedding, RMSNormalize
 import torch
 import gc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from packaging import version as pkg_version
 from deepspeed.accelerator import get_accelerator
 import re
 
 
+def load_state_dict(ckpt_file, mmap=False):
+    """ Load one checkpoint shard on the CPU.
+    Arguments:
+        ckpt_file (str): path to a ``torch.save`` or safetensors checkpoint file
+        mmap (bool): memory-map the file instead of reading it, so tensors are only paged in when they are
+                     sliced into the model. Safetensors files are always read through a memory map.
+    Returns:
+        The state dict of the shard.
+    """
+    if ckpt_file.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(ckpt_file)
+    if mmap:
+        assert pkg_version.parse(torch.__version__) >= pkg_version.parse("2.1"), \
+            "Memory-mapped checkpoint loading requires torch >= 2.1"
+        return torch.load(ckpt_file, map_location='cpu', mmap=True)
+    return torch.load(ckpt_file, map_location='cpu')
+
+
+def prefetch_state_dicts(ckpt_groups, num_workers=0, mmap=False):
+    """ Yield the state dicts of each group of checkpoint files in order, reading ahead on a thread pool.
+    With ``num_workers`` > 0, the files of the next ``num_workers`` groups are read on background threads
+    while the caller slices the current group into the model. Groups are not read further ahead than that,
+    so at most ``num_workers + 1`` groups are held in host memory at once.
+    Arguments:
+        ckpt_groups (list): list of lists of checkpoint files, one list per call to ``load_model_with_checkpoint``
+        num_workers (int): number of groups to read ahead, 0 reads each group on the calling thread when needed
+        mmap (bool): memory-map the checkpoint files, see ``load_state_dict``
+    """
+    if num_workers == 0:
+        for ckpt_files in ckpt_groups:
+            yield [load_state_dict(ckpt_file, mmap) for ckpt_file in ckpt_files]
+        return
+
+    ckpt_groups = list(ckpt_groups)
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="ds_ckpt_load") as pool:
+        pending = deque()
+        for ckpt_files in ckpt_groups[:num_workers]:
+            pending.append([pool.submit(load_state_dict, ckpt_file, mmap) for ckpt_file in ckpt_files])
+        next_group = len(pending)
+
+        while pending:
+            sds = [future.result() for future in pending.popleft()]
+            if next_group < len(ckpt_groups):
+                pending.append(
+                    [pool.submit(load_state_dict, ckpt_file, mmap) for ckpt_file in ckpt_groups[next_group]])
+                next_group += 1
+            yield sds
+            sds = None
+
+
 def load_model_with_checkpoint(r_module,
                                sd,
                                mp_replace,
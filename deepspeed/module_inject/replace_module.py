@@ -18,7 +18,7 @@ from .auto_tp import AutoTP, ReplaceWithTensorSlicing, Loading
 from deepspeed import comm as dist
 from deepspeed.module_inject.tp_shard import set_num_kv_heads, set_n_embd
 
-from .load_checkpoint import load_model_with_checkpoint
+from .load_checkpoint import load_model_with_checkpoint, prefetch_state_dicts
 import time
 
 from .utils import policy_to_ds_container
@@ -340,13 +340,14 @@ def replace_transformer_layer(orig_layer_impl, model, checkpoint_dict, config, m
         # AutoTP shard loading
         checkpoint = checkpoint_dict["checkpoints"]
         pbar = tqdm.tqdm(total=len(checkpoint), desc=f"Loading {len(checkpoint)} checkpoint shards")
-        for i in range(len(checkpoint)):
-            checkpoint_file = os.path.join(config.base_dir, checkpoint[i])
+        ckpt_groups = [[os.path.join(config.base_dir, ckpt_file)] for ckpt_file in checkpoint]
+        for sds in prefetch_state_dicts(ckpt_groups, config.checkpoint_load_workers, config.checkpoint_mmap):
             replaced_module = replace_module(model=model,
                                              orig_class=orig_layer_impl,
                                              replace_fn=replace_fn,
                                              _replace_policy=config.injection_policy_tuple,
-                                             checkpoint=checkpoint_file)
+                                             checkpoint=sds[0])
+            sds = None
             pbar.update(1)
             gc.collect()
         replaced_module = set_lm_head(replaced_module)
@@ -373,8 +374,8 @@ def replace_transformer_layer(orig_layer_impl, model, checkpoint_dict, config, m
         if ckpt_type == 'pp' and type(checkpoint) is list:
             pbar = tqdm.tqdm(total=len(checkpoint), desc=f"Loading {len(checkpoint)} checkpoint shards")
 
-            for i in range(len(checkpoint)):
-                sd = [torch.load(os.path.join(base_dir1, checkpoint[i]), map_location='cpu')]
+            ckpt_groups = [[os.path.join(base_dir1, ckpt_file)] for ckpt_file in checkpoint]
+            for sd in prefetch_state_dicts(ckpt_groups, config.checkpoint_load_workers, config.checkpoint_mmap):
                 load_model_with_checkpoint(replaced_module,
                                            sd,
                                            mp_replace,
@@ -382,6 +383,7 @@ def replace_transformer_layer(orig_layer_impl, model, checkpoint_dict, config, m
                                            ckpt_mp_size,
                                            quantizer,
                                            container=container_g)
+                sd = None
                 pbar.update(1)
         else:
             num_checkpoints = len(ckpt_list) // ckpt_mp_size
@@ -389,14 +391,15 @@ def replace_transformer_layer(orig_layer_impl, model, checkpoint_dict, config, m
             sd_offset = int(rank / tp_split_size)
             sd_count = int((rank + max(1, tp_split_size)) / tp_split_size) - sd_offset
             pbar = tqdm.tqdm(total=num_checkpoints, desc=f"Loading {num_checkpoints} checkpoint shards")
+            ckpt_groups = []
             for i in range(num_checkpoints):
-                pbar.update(1)
                 ckpt_index = i * ckpt_mp_size + sd_offset
-                ckpt_files = [
+                ckpt_groups.append([
                     os.path.join(base_dir1, ckpt_list[ckpt_index + j]) if base_dir1 else ckpt_list[ckpt_index + j]
                     for j in range(sd_count)
-                ]
-                sds = [torch.load(ckpt_file, map_location='cpu') for ckpt_file in ckpt_files]
+                ])
+            for sds in prefetch_state_dicts(ckpt_groups, config.checkpoint_load_workers, config.checkpoint_mmap):
+                pbar.update(1)
                 load_model_with_checkpoint(replaced_module,
                                            sds,
                                            mp_replace,
@@ -412,11 +415,10 @@ def replace_transformer_layer(orig_layer_impl, model, checkpoint_dict, config, m
                 pbar = tqdm.tqdm(total=len(checkpoint["non_tp"]),
                                  desc=f"Loading {len(checkpoint['non_tp'])} checkpoint shards")
 
-                for i in range(len(checkpoint["non_tp"])):
+                ckpt_groups = [[os.path.join(base_dir1, ckpt_file) if base_dir1 else ckpt_file]
+                               for ckpt_file in checkpoint["non_tp"]]
+                for sds in prefetch_state_dicts(ckpt_groups, config.checkpoint_load_workers, config.checkpoint_mmap):
                     pbar.update(1)
-                    ckpt_file = os.path.join(base_dir1,
-                                             checkpoint["non_tp"][i]) if base_dir1 else checkpoint["non_tp"][i]
-                    sds = [torch.load(ckpt_file, map_location='cpu')]
                     load_model_with_checkpoint(replaced_module,
                                                sds,
                                                mp_replace,
@@ -573,11 +575,15 @@ def replace_module(model, orig_class, replace_fn, _replace_policy, checkpoint=No
         orig_class (torch.nn.Module): the module to search for
         replace_fn (method): a method to convert instances of ``orig_class`` to the
                              desired type and return a new instance.
+        checkpoint (str or dict): path to a checkpoint shard, or its loaded state dict, to
+                                  load into the replaced modules.
     Returns:
         A modified ``model``.
     """
     sd = None
-    if checkpoint is not None:
+    if isinstance(checkpoint, dict):
+        sd = checkpoint
+    elif checkpoint is not None:
         if checkpoint.endswith(".safetensors"):
             from safetensors.torch import load_file
             sd = load_file(checkpoint)
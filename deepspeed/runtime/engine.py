@@ -725,6 +725,9 @@ class DeepSpeedEngine(Module):
     def zero_multi_rank_bucket_allreduce(self):
         return self._config.zero_config.use_multi_rank_bucket_allreduce
 
+    def zero_hierarchical_reduce_scatter(self):
+        return self._config.zero_config.hierarchical_reduce_scatter
+
     def zero_allgather_bucket_size(self):
         return self._config.zero_config.allgather_bucket_size
 
@@ -764,6 +767,15 @@ class DeepSpeedEngine(Module):
     def zero_prefetch_bucket_size(self):
         return self._config.zero_config.prefetch_bucket_size
 
+    def zero_trace_cache_path(self):
+        return self._config.zero_config.trace_cache_path
+
+    def zero_max_prefetch_traces(self):
+        return self._config.zero_config.max_prefetch_traces
+
+    def zero_adaptive_prefetch(self):
+        return self._config.zero_config.adaptive_prefetch
+
     def zero_param_persistence_threshold(self):
         return self._config.zero_config.param_persistence_threshold
 
@@ -1522,6 +1534,7 @@ class DeepSpeedEngine(Module):
                 expert_parallel_group=self.expert_parallel_group if self.has_moe_layers else None,
                 expert_data_parallel_group=self.expert_data_parallel_group if self.has_moe_layers else None,
                 reduce_scatter=self.zero_reduce_scatter(),
+                hierarchical_reduce_scatter=self.zero_hierarchical_reduce_scatter(),
                 overlap_comm=overlap_comm,
                 offload_optimizer_config=self.zero_offload_optimizer(),
                 mpu=self.mpu,
@@ -1560,6 +1573,9 @@ class DeepSpeedEngine(Module):
                     zero_param_parallel_group=zero_param_parallel_group,
                     zero_quantized_weights=self.zero_quantized_weights(),
                     zero_quantized_nontrainable_weights=self.zero_quantized_nontrainable_weights(),
+                    trace_cache_path=self.zero_trace_cache_path(),
+                    max_prefetch_traces=self.zero_max_prefetch_traces(),
+                    adaptive_prefetch=self.zero_adaptive_prefetch(),
                 )
             else:
                 log_dist(
@@ -1606,6 +1622,9 @@ class DeepSpeedEngine(Module):
                     zero_hpz_partition_size=self.zero_hpz_partition_size(),
                     zero_quantized_weights=self.zero_quantized_weights(),
                     zero_quantized_nontrainable_weights=self.zero_quantized_nontrainable_weights(),
+                    trace_cache_path=self.zero_trace_cache_path(),
+                    max_prefetch_traces=self.zero_max_prefetch_traces(),
+                    adaptive_prefetch=self.zero_adaptive_prefetch(),
                 )
 
         else:
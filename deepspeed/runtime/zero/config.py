@@ -115,6 +115,13 @@ class DeepSpeedZeroConfig(DeepSpeedConfigModel):
     reduces the message sizes of each packet.
     """
 
+    hierarchical_reduce_scatter: bool = False
+    """
+    Average gradients in two levels, first among the ranks of a node and then across nodes,
+    so that only 1/ranks-per-node of the gradients is exchanged between nodes. Uses the
+    intra-node and inter-node groups of the MiCS hierarchical parameter gather.
+    """
+
     allgather_partitions: bool = True
     """
     Chooses between allgather collective or a series of broadcast collectives
@@ -226,6 +233,31 @@ class DeepSpeedZeroConfig(DeepSpeedConfigModel):
     parameters. Smaller values use less memory, but perform more communication.
     """
 
+    trace_cache_path: Optional[str] = Field(None, alias="stage3_trace_cache_path")
+    """
+    Directory in which to persist the parameter fetch trace that ZeRO-3 records
+    during the first step. The trace is keyed by a fingerprint of the model
+    structure and reloaded by later runs of the same model, so prefetching
+    starts on the first step instead of after a recording step.
+    """
+
+    max_prefetch_traces: int = Field(4, ge=1, alias="stage3_max_prefetch_traces")
+    """
+    Maximum number of distinct parameter fetch traces ZeRO-3 keeps for models
+    whose submodule order changes between steps, e.g. through mixture-of-experts
+    routing or early exits. Prefetching follows the trace matching the submodules
+    run so far, and predicts upcoming submodules from the submodule adjacency of
+    the kept traces when none matches.
+    """
+
+    adaptive_prefetch: bool = Field(False, alias="stage3_adaptive_prefetch")
+    """
+    Tune the prefetch bucket size and how many submodules ahead parameters are
+    prefetched every step, from the measured all-gather latency and submodule
+    compute time. ``stage3_prefetch_bucket_size`` is the initial bucket size and
+    ``stage3_max_live_parameters`` caps it.
+    """
+
     gather_16bit_weights_on_model_save: bool = Field(False, alias="stage3_gather_16bit_weights_on_model_save")
     """
     Consolidate the weights before saving the model by ``save_16bit_model()``.
@@ -3,13 +3,17 @@
 
 # DeepSpeed Team
 
+import bisect
+import logging
+
 import torch
 
 from deepspeed import comm as dist
+from deepspeed.utils import logger
 
 
 def print_rank_0(message):
-    if dist.get_rank() == 0:
+    if not dist.is_initialized() or dist.get_rank() == 0:
         print(message)
 
 
@@ -21,7 +25,13 @@ class ContiguousMemoryAllocator(object):
         #address to contiguous size available
         self.contiguous_sizes = {}
 
-        self.contiguous_sizes[0] = size
+        #end address to address of contiguous size available, to coalesce with the preceding block
+        self.contiguous_ends = {}
+
+        #(size, address) of contiguous sizes available, sorted for best-fit allocation
+        self.free_blocks = []
+
+        self._add_free_block(0, size)
 
         #tensor id to its address
         self.tensor_addresses = {}
@@ -45,6 +55,10 @@ class ContiguousMemoryAllocator(object):
 
         self.count = 0
 
+        #number of defragmentations and number of elements they moved
+        self.num_defragmentations = 0
+        self.defragmented_numel = 0
+
     #create a tensor of size from the pre-allocated buffer
     #if not enough free space will fail
     #if not enough contiguous space, will defragment and allocate
@@ -55,9 +69,7 @@ class ContiguousMemoryAllocator(object):
         if self.largest_contiguous < size:
             print_rank_0("Needs defragmentation to allocate. Before Defragmentation:")
             self.print_allocation(resolution=100)
-            self._defragment_memory()
-            #set the param data to the new tensor buffer locations
-            self._reset_param_data()
+            self._defragment_memory(size)
             print_rank_0("After defragmentation:")
             self.print_allocation(resolution=100)
 
@@ -70,9 +82,10 @@ class ContiguousMemoryAllocator(object):
         tensor_address = self._get_new_tensor_address(size)
 
         ret_tensor = self._get_new_tensor(tensor_address, size)
-        print_rank_0(
-            f"Free before allocation {free_before}. Allocating {size}. Free after allocation {self.total_free}. Max allocated {self.max_allocated}"
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Free before allocation {free_before}. Allocating {size}. Free after allocation {self.total_free}. Max allocated {self.max_allocated}"
+            )
         assert self.total_free + size == free_before, "Allocation bookkeeping error"
 
         return ret_tensor
@@ -101,8 +114,9 @@ class ContiguousMemoryAllocator(object):
         self._release_tensor(tensor_id)
         self._unassign_params(tensor_id)
         self.total_free += tensor_size
-        print_rank_0(
-            f"Free before release {free_before}. Released {tensor.numel()}. Total free after {self.total_free}.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Free before release {free_before}. Released {tensor.numel()}. Total free after {self.total_free}.")
         assert self.total_free - tensor_size == free_before, "Release bookkeeping error"
 
     def release_tensor_with_id(self, tensor_id):
@@ -113,8 +127,9 @@ class ContiguousMemoryAllocator(object):
         self._release_tensor(tensor_id)
         self._unassign_params(tensor_id)
         self.total_free += tensor_size
-        print_rank_0(
-            f"Free before release {free_before}. Released {tensor.numel()}. Total free after {self.total_free}.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Free before release {free_before}. Released {tensor.numel()}. Total free after {self.total_free}.")
         assert self.total_free - tensor_size == free_before, "Release bookkeeping error"
 
     #shows the current memory allocation at specified resolution
@@ -133,12 +148,34 @@ class ContiguousMemoryAllocator(object):
     def max_allocated(self):
         return self.max_allocated
 
+    #fraction of the free memory outside of the largest contiguous size available
+    def fragmentation(self):
+        if self.total_free == 0:
+            return 0.0
+        return 1.0 - self.largest_contiguous / self.total_free
+
+    def memory_stats(self):
+        return {
+            "total_size": self.total_size,
+            "total_free": self.total_free,
+            "largest_contiguous": self.largest_contiguous,
+            "max_allocated": self.max_allocated,
+            "num_free_blocks": len(self.free_blocks),
+            "fragmentation": self.fragmentation(),
+            "num_defragmentations": self.num_defragmentations,
+            "defragmented_numel": self.defragmented_numel,
+        }
+
     #to be called after defragmentation that moves the tensor buffers
     #this call reassigns the data of all the parameters using the tensor buffers
     def _reset_param_data(self):
-        for id, tensor in self.tensor_map.items():
-            for param in self.id_to_params[id]:
-                param.data = tensor.narrow(0, 0, param.numel()).view(param.data.shape).data
+        for id in self.tensor_map.keys():
+            self._reset_tensor_param_data(id)
+
+    def _reset_tensor_param_data(self, tensor_id):
+        tensor = self.tensor_map[tensor_id]
+        for param in self.id_to_params.get(tensor_id, []):
+            param.data = tensor.narrow(0, 0, param.numel()).view(param.data.shape).data
 
     def _unassign_params(self, tensor_id):
         if tensor_id in self.id_to_params.keys():
@@ -158,25 +195,125 @@ class ContiguousMemoryAllocator(object):
         self._consolidate_address(address, contiguous_size)
         self.largest_contiguous = self._largest_contiguous()
 
+    def _add_free_block(self, address, contiguous_size):
+        self.contiguous_sizes[address] = contiguous_size
+        self.contiguous_ends[address + contiguous_size] = address
+        bisect.insort(self.free_blocks, (contiguous_size, address))
+
+    def _remove_free_block(self, address):
+        contiguous_size = self.contiguous_sizes.pop(address)
+        del self.contiguous_ends[address + contiguous_size]
+        del self.free_blocks[bisect.bisect_left(self.free_blocks, (contiguous_size, address))]
+        return contiguous_size
+
     def _consolidate_address(self, address, contiguous_size):
 
         #consolidate next buffer
         end_address = address + contiguous_size
         if end_address in self.contiguous_sizes:
-            contiguous_size += self.contiguous_sizes[end_address]
-            del self.contiguous_sizes[end_address]
+            contiguous_size += self._remove_free_block(end_address)
 
         #consolidate previous buffer
-        for addr, size in self.contiguous_sizes.items():
-            if addr + size == address:
-                del self.contiguous_sizes[addr]
-                contiguous_size += size
-                address = addr
+        if address in self.contiguous_ends:
+            address = self.contiguous_ends[address]
+            contiguous_size += self._remove_free_block(address)
+
+        self._add_free_block(address, contiguous_size)
+
+    #frees a contiguous size of at least size, moving as few tensor elements as possible.
+    #if the tensors in the way cannot be moved elsewhere, all tensors are compacted to the
+    #start of the buffer
+    def _defragment_memory(self, size=None):
+        self.num_defragmentations += 1
+        if size is not None and self._defragment_window(size):
+            return
+
+        self._compact_memory()
+        #set the param data to the new tensor buffer locations
+        self._reset_param_data()
+
+    #looks for the range of the buffer of at least size that holds the fewest tensor elements
+    #and moves its tensors into contiguous sizes available outside of it
+    def _defragment_window(self, size):
+        segments = sorted([(address, contiguous_size, None)
+                           for address, contiguous_size in self.contiguous_sizes.items()] +
+                          [(address, tensor_size, self.tensor_ids[address])
+                           for address, tensor_size in self.tensor_sizes.items()])
+
+        candidates = []
+        end = 0
+        span = 0
+        occupied = 0
+        for start in range(len(segments)):
+            while end < len(segments) and span < size:
+                span += segments[end][1]
+                occupied += segments[end][1] if segments[end][2] is not None else 0
+                end += 1
+            if span < size:
                 break
+            #the occupied elements have to fit into what is available outside of the range
+            if self.total_free - (span - occupied) >= occupied:
+                candidates.append((occupied, start, end))
+            span -= segments[start][1]
+            occupied -= segments[start][1] if segments[start][2] is not None else 0
+
+        for _, start, end in sorted(candidates):
+            if self._move_tensors_out_of(segments[start:end]):
+                return True
+        return False
+
+    def _move_tensors_out_of(self, segments):
+        start_address = segments[0][0]
+        end_address = segments[-1][0] + segments[-1][1]
+        available = [(contiguous_size, address) for contiguous_size, address in self.free_blocks
+                     if address + contiguous_size <= start_address or address >= end_address]
+
+        #place the largest tensors first, each into the smallest contiguous size it fits
+        moves = []
+        for address, tensor_size, tensor_id in sorted([s for s in segments if s[2] is not None],
+                                                      key=lambda s: s[1],
+                                                      reverse=True):
+            index = bisect.bisect_left(available, (tensor_size, -1))
+            if index == len(available):
+                return False
+            contiguous_size, new_address = available.pop(index)
+            if contiguous_size > tensor_size:
+                bisect.insort(available, (contiguous_size - tensor_size, new_address + tensor_size))
+            moves.append((tensor_id, new_address))
+
+        #the freed slots are only coalesced once all tensors are moved, so that the contiguous
+        #sizes available the moves were planned against keep their addresses
+        for tensor_id, new_address in moves:
+            self._move_tensor(tensor_id, new_address)
+        for address, contiguous_size, tensor_id in segments:
+            if tensor_id is None:
+                self._remove_free_block(address)
+        self._consolidate_address(start_address, end_address - start_address)
+        self.largest_contiguous = self._largest_contiguous()
+        return True
 
-        self.contiguous_sizes[address] = contiguous_size
+    #moves a tensor to the start of a contiguous size available that does not overlap it,
+    #the old address is left to the caller to free
+    def _move_tensor(self, tensor_id, new_address):
+        tensor = self.tensor_map[tensor_id]
+        tensor_size = tensor.numel()
+        old_address = self.tensor_addresses[tensor_id]
+
+        new_buffer = self.buffer.narrow(0, new_address, tensor_size)
+        new_buffer.data.copy_(self.buffer.narrow(0, old_address, tensor_size).data)
+        self._mark_as_occupied(new_address, tensor_size)
+
+        del self.tensor_ids[old_address]
+        del self.tensor_sizes[old_address]
 
-    def _defragment_memory(self):
+        tensor.data = new_buffer.data
+        self.tensor_ids[new_address] = tensor_id
+        self.tensor_addresses[tensor_id] = new_address
+        self.tensor_sizes[new_address] = tensor_size
+        self._reset_tensor_param_data(tensor_id)
+        self.defragmented_numel += tensor_size
+
+    def _compact_memory(self):
         empty_addresses = sorted(self.contiguous_sizes.keys())
         tensor_addresses = sorted(self.tensor_addresses.values())
 
@@ -221,6 +358,7 @@ class ContiguousMemoryAllocator(object):
                         dest_addr += copy_size
 
                 self._replace_old_address_with_new(tensor_id, empty_addr)
+                self.defragmented_numel += tensor_size
 
                 tensor_index += 1
 
@@ -243,15 +381,11 @@ class ContiguousMemoryAllocator(object):
         self.tensor_addresses[tensor_id] = new_address
         self.tensor_sizes[new_address] = tensor_size
 
+    #best fit: the smallest contiguous size available that fits, at the lowest address
     def _get_new_tensor_address(self, size):
-        tensor_address = None
-        for address, contiguous_size in self.contiguous_sizes.items():
-            if contiguous_size >= size and \
-                    (tensor_address is None or \
-                    contiguous_size < self.contiguous_sizes[tensor_address]):
-                tensor_address = address
-        assert tensor_address is not None, "address cannot be None"
-        return tensor_address
+        index = bisect.bisect_left(self.free_blocks, (size, -1))
+        assert index < len(self.free_blocks), "address cannot be None"
+        return self.free_blocks[index][1]
 
     def _get_new_tensor(self, address, size):
         available_contiguous_size = self.contiguous_sizes[address]
@@ -272,16 +406,15 @@ class ContiguousMemoryAllocator(object):
         return new_tensor
 
     def _largest_contiguous(self):
-        if len(self.contiguous_sizes) > 0:
-            return max([size for _, size in self.contiguous_sizes.items()])
+        if len(self.free_blocks) > 0:
+            return self.free_blocks[-1][0]
         else:
             return 0
 
     def _mark_as_occupied(self, address, size):
-        available_contiguous_size = self.contiguous_sizes[address]
-        del self.contiguous_sizes[address]
+        available_contiguous_size = self._remove_free_block(address)
 
         if available_contiguous_size != size:
-            self.contiguous_sizes[address + size] = available_contiguous_size - size
+            self._add_free_block(address + size, available_contiguous_size - size)
 
         self.largest_contiguous = self._largest_contiguous()
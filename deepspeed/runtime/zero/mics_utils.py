@@ -15,6 +15,7 @@ import torch
 from torch import Tensor
 
 from deepspeed import comm as dist
+from deepspeed.comm.constants import GLOO_BACKEND
 from deepspeed.accelerator import get_accelerator
 from deepspeed.utils import logger
 
@@ -125,20 +126,8 @@ def create_mics_comm_groups(
         assert n_span_nodes > 1, "sharding spans on single node, no need for hierarchy allgather"
         assert len(ranks_of_shard_group[0]) % n_span_nodes == 0
 
-        n_gpu_per_node = len(ranks_of_shard_group[0]) // n_span_nodes
-        intra_node_ranks_group = []
-        inter_node_ranks_group = []
-        for shard_group in ranks_of_shard_group:
-            _intra_node_ranks = []
-            for i in range(0, len(shard_group), n_gpu_per_node):
-                _intra_node_ranks.append(shard_group[i:i + n_gpu_per_node])
-            _inter_node_ranks = []
-            for i in range(n_gpu_per_node):
-                _ranks = [_g[i] for _g in _intra_node_ranks]
-                _inter_node_ranks.append(_ranks)
-
-            intra_node_ranks_group.append(_intra_node_ranks)
-            inter_node_ranks_group.append(_inter_node_ranks)
+        intra_node_ranks_group, inter_node_ranks_group = _generate_hierarchical_ranks(
+            ranks_of_shard_group, n_span_nodes)
 
         _log_rank0(f"create for hierarchy all-gather groups: intra nodes {intra_node_ranks_group}")
         _log_rank0(f"create for hierarchy all-gather groups: inter nodes {inter_node_ranks_group}")
@@ -160,6 +149,91 @@ def create_mics_comm_groups(
     return groups
 
 
+def create_hierarchical_dp_groups(dp_group):
+    """
+    create the intra-node and inter-node groups of the data parallel group, the same
+    way as the hierarchical all-gather groups of MiCS are created for the shard group
+
+    Returns:
+        (intra-node group, inter-node group) of this rank, or None if the data parallel
+        group does not span several nodes with more than one rank on each
+    """
+    # env var for debugging purpose
+    ndevices_per_node = int(os.environ.get("NDEV_PER_NODE", get_accelerator().device_count()))
+    world_size = dist.get_world_size()
+    global_rank = dist.get_rank()
+
+    # every rank has to take part in creating every group, so collect the data parallel groups of all ranks
+    dp_ranks = sorted(dist.get_global_rank(dp_group, r) for r in range(dist.get_world_size(group=dp_group)))
+    ranks = torch.tensor(dp_ranks, dtype=torch.long, device=get_accelerator().current_device_name())
+    all_ranks = [torch.empty_like(ranks) for _ in range(world_size)]
+    dist.all_gather(all_ranks, ranks)
+    ranks_of_dp_groups = sorted(set(tuple(r.tolist()) for r in all_ranks))
+
+    n_span_nodes = len(set(r // ndevices_per_node for r in dp_ranks))
+    if n_span_nodes == 1 or n_span_nodes == len(dp_ranks):
+        return None
+    for group_ranks in ranks_of_dp_groups:
+        ranks_per_node = [[r for r in group_ranks if r // ndevices_per_node == node]
+                          for node in sorted(set(r // ndevices_per_node for r in group_ranks))]
+        assert len(ranks_per_node) == n_span_nodes and _sizes_all_same(ranks_per_node), \
+            f"data parallel group {list(group_ranks)} must have the same number of ranks on {n_span_nodes} nodes"
+
+    intra_node_ranks_group, inter_node_ranks_group = _generate_hierarchical_ranks(
+        [list(group_ranks) for group_ranks in ranks_of_dp_groups], n_span_nodes)
+    _log_rank0(f"create for hierarchy reduce groups: intra nodes {intra_node_ranks_group}")
+    _log_rank0(f"create for hierarchy reduce groups: inter nodes {inter_node_ranks_group}")
+
+    intra_node_group, inter_node_group = None, None
+    for dp_group_ranks in intra_node_ranks_group:
+        for intra_node_ranks in dp_group_ranks:
+            _group = dist.new_group(intra_node_ranks)
+            if global_rank in intra_node_ranks:
+                intra_node_group = _group
+    for dp_group_ranks in inter_node_ranks_group:
+        for inter_node_ranks in dp_group_ranks:
+            _group = dist.new_group(inter_node_ranks)
+            if global_rank in inter_node_ranks:
+                inter_node_group = _group
+    return intra_node_group, inter_node_group
+
+
+def hierarchical_all_reduce(tensor, intra_node_group, inter_node_group):
+    """
+    all-reduce a tensor over the data parallel group in two levels: reduce-scatter among the
+    ranks of the node, all-reduce of the reduced 1/ranks-per-node of the tensor with the ranks
+    holding the same part on the other nodes, and all-gather among the ranks of the node
+    """
+    local_size = dist.get_world_size(group=intra_node_group)
+    local_rank = dist.get_rank(group=intra_node_group)
+    numel = tensor.numel()
+    shard_numel = (numel + local_size - 1) // local_size
+
+    flat = tensor.view(-1)
+    if shard_numel * local_size != numel:
+        flat = torch.cat([flat, flat.new_zeros(shard_numel * local_size - numel)])
+
+    # gloo supports neither reduce-scatter nor all-gather into a tensor
+    is_gloo = dist.get_backend(intra_node_group) == GLOO_BACKEND
+    if is_gloo:
+        dist.all_reduce(flat, group=intra_node_group)
+        shard = flat.narrow(0, local_rank * shard_numel, shard_numel)
+    else:
+        shard = flat.new_empty(shard_numel)
+        dist.reduce_scatter_fn(shard, flat, group=intra_node_group)
+
+    dist.all_reduce(shard, group=inter_node_group)
+
+    if is_gloo:
+        dist.all_gather(list(flat.chunk(local_size)), shard.clone(), group=intra_node_group)
+    else:
+        dist.allgather_fn(flat, shard, group=intra_node_group)
+
+    if flat.numel() != numel:
+        tensor.copy_(flat.narrow(0, 0, numel).view_as(tensor))
+    return tensor
+
+
 def _generate_mics_config(world_size, ndev_per_node, shard_size, pp_size=1):
     """Generating the configuration for sharding This shard config generation assume
     that the pipeline stages are partitioned in order, i.e., first ranks
@@ -194,6 +268,26 @@ def _generate_mics_config(world_size, ndev_per_node, shard_size, pp_size=1):
     return config
 
 
+def _generate_hierarchical_ranks(ranks_groups, n_span_nodes):
+    """split each group of ranks spanning n_span_nodes nodes into the ranks of each node
+    (intra-node) and the ranks with the same position on every node (inter-node)"""
+    n_gpu_per_node = len(ranks_groups[0]) // n_span_nodes
+    intra_node_ranks_group = []
+    inter_node_ranks_group = []
+    for ranks_group in ranks_groups:
+        _intra_node_ranks = []
+        for i in range(0, len(ranks_group), n_gpu_per_node):
+            _intra_node_ranks.append(ranks_group[i:i + n_gpu_per_node])
+        _inter_node_ranks = []
+        for i in range(n_gpu_per_node):
+            _ranks = [_g[i] for _g in _intra_node_ranks]
+            _inter_node_ranks.append(_ranks)
+
+        intra_node_ranks_group.append(_intra_node_ranks)
+        inter_node_ranks_group.append(_inter_node_ranks)
+    return intra_node_ranks_group, inter_node_ranks_group
+
+
 def _sizes_all_same(groups):
     """all groups have same length"""
     all_same = True
@@ -13,6 +13,7 @@ from deepspeed.runtime.zero.offload_config import OffloadDeviceEnum
 from deepspeed.runtime.zero.partition_parameters import _init_external_params
 from deepspeed.runtime.zero.partition_parameters import *
 from deepspeed.runtime.zero.partitioned_param_coordinator import PartitionedParameterCoordinator, InflightParamRegistry, iter_params
+from deepspeed.runtime.zero.partitioned_param_trace import PartitionedParameterTraceCache
 from deepspeed.accelerator import get_accelerator
 
 FWD_MODULE_STACK = list()
@@ -99,6 +100,9 @@ class DeepSpeedZeRoOffload(object):
         zero_param_parallel_group=None,
         zero_quantized_weights=False,
         zero_quantized_nontrainable_weights=False,
+        trace_cache_path=None,
+        max_prefetch_traces=4,
+        adaptive_prefetch=False,
     ):
 
         see_memory_usage("DeepSpeedZeRoOffload initialize [begin]", force=True)
@@ -114,6 +118,9 @@ class DeepSpeedZeRoOffload(object):
         self.zero_param_parallel_group = zero_param_parallel_group
         self.zero_quantized_weights = zero_quantized_weights
         self.zero_quantized_nontrainable_weights = zero_quantized_nontrainable_weights
+        self.trace_cache_path = trace_cache_path
+        self.max_prefetch_traces = max_prefetch_traces
+        self.adaptive_prefetch = adaptive_prefetch
 
         if offload_param_config is not None and offload_param_config.device != OffloadDeviceEnum.none:
             self.offload_device = offload_param_config.device
@@ -176,6 +183,10 @@ class DeepSpeedZeRoOffload(object):
                 timers=self.timers,
                 zero_quantized_weights=self.zero_quantized_weights,
                 zero_quantized_nontrainable_weights=self.zero_quantized_nontrainable_weights,
+                trace_cache=PartitionedParameterTraceCache(self.trace_cache_path, self.module, training)
+                if self.trace_cache_path is not None else None,
+                max_prefetch_traces=self.max_prefetch_traces,
+                adaptive_prefetch=self.adaptive_prefetch,
             )
 
         return self.param_coordinators[training]
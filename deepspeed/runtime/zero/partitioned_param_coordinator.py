@@ -13,7 +13,11 @@ from deepspeed.utils import z3_leaf_module
 from deepspeed.utils.logging import logger
 from deepspeed.runtime.zero.offload_config import OffloadDeviceEnum
 from deepspeed.runtime.zero.partition_parameters import *
+from deepspeed.runtime.zero.partitioned_param_prefetch import AdaptivePrefetchController
 from deepspeed.runtime.zero.partitioned_param_profiler import PartitionedParameterProfiler
+from deepspeed.runtime.zero.partitioned_param_trace import (PATH_SIGNATURE_INIT, PartitionedParameterTraceCache,
+                                                            PartitionedParameterTraceLibrary, SubmoduleTrace,
+                                                            extend_path_signature)
 from deepspeed.runtime.swap_tensor.partitioned_param_swapper import PartitionedParamStatus
 from deepspeed.utils.debug import debug_module2name_id, debug_param2name_id
 from deepspeed.accelerator import get_accelerator
@@ -39,12 +43,20 @@ def iter_params(module: Module, recurse=False) -> Iterable[Parameter]:
     return map(lambda pair: pair[1], get_all_parameters(module, recurse))
 
 
+def _is_currently_on_nvme(param: Parameter) -> bool:
+    if param.nvme_swapper is None:
+        return False
+
+    return param.ds_tensor.final_location == OffloadDeviceEnum.nvme \
+        and param.ds_tensor.status == PartitionedParamStatus.NOT_AVAILABLE
+
+
 class ZeRoTraceMode(Enum):
     # Record trace of the network during a single forward+backward (for training) or forward (for inference)
     RECORD = 1
     # Use recorded network trace to optimize current forward+backward or forward
     COMPLETE = 2
-    # Recorded trace does not match current forward+backward or forward pass.
+    # No recorded trace matches current forward+backward or forward pass, predict from submodule adjacency.
     INVALID = 3
 
 
@@ -86,6 +98,9 @@ class PartitionedParameterCoordinator:
         timers=None,
         zero_quantized_weights=False,
         zero_quantized_nontrainable_weights=False,
+        trace_cache: PartitionedParameterTraceCache = None,
+        max_prefetch_traces: int = 4,
+        adaptive_prefetch: bool = False,
     ) -> None:
         # mapping of param -> handle for each param that is currently in flight
         self.__inflight_param_registry = inflight_param_registry
@@ -98,6 +113,15 @@ class PartitionedParameterCoordinator:
         self.__param_order: Iterable[__class__.__ParamInTrace] = []
         self.__most_recent_step_id_param_fetched_for = collections.defaultdict(lambda: int(-1e10))
         self.__step_id_module_fetched_for = collections.defaultdict(lambda: collections.deque())
+        # traces of the differing submodule orders seen so far, and the submodules run in the current step
+        self.__trace_library = PartitionedParameterTraceLibrary(max_prefetch_traces)
+        self.__active_trace: SubmoduleTrace = None
+        self.__observed_order: List[Module] = []
+        self.__path_signature: int = PATH_SIGNATURE_INIT
+        # parameters prefetched in the current step, and whether the step diverged from the trace they
+        # were prefetched from. Prefetched parameters a diverged step did not use are released at its end.
+        self.__prefetched_params: Set[Parameter] = set()
+        self.__diverged: bool = False
         # number of available params, and max number of available params
         self.__n_available_params: int = 0
         self.__max_n_available_params: int = max_available_parameters_in_numel
@@ -107,6 +131,12 @@ class PartitionedParameterCoordinator:
         # side of the dequeue as they are fetched
         self.__param_queue: Deque[__class__.__ParamInTrace] = None
         self.__prefetch_bucket_sz: int = prefetch_bucket_sz
+        # number of submodules ahead of the current one to prefetch for, unlimited if None
+        self.__prefetch_depth: int = None
+        # tunes prefetch bucket size and depth from measured all-gather and compute times
+        self.__prefetch_controller = AdaptivePrefetchController(
+            prefetch_bucket_sz, max_available_parameters_in_numel) if adaptive_prefetch else None
+        self.__step_numel: int = 0
         self.__prefetch_nvme: bool = prefetch_nvme
         self.hierarchy: int = 0
         self.zero_quantized_weights = zero_quantized_weights
@@ -129,6 +159,13 @@ class PartitionedParameterCoordinator:
         self.__max_ongoing_fetch_events: int = 2
         self.__profiler = PartitionedParameterProfiler(timers if ENABLE_PROFILER else None)
 
+        # completed traces are persisted here and reloaded by later runs of the same model
+        self.__trace_cache = trace_cache
+        if self.__trace_cache is not None:
+            submodule_orders = self.__trace_cache.load()
+            if submodule_orders is not None:
+                self._load_traces(submodule_orders)
+
     """Tracing and Tracking
     TODO. consider performing trace before initializing PartitionedParameterCoordinator
     and passing trace results into constructor. This way all the code in here can
@@ -160,23 +197,33 @@ class PartitionedParameterCoordinator:
         self._clear_trace_structures()
 
     def trace_prologue(self, sub_module: Module) -> None:
+        self.__observed_order.append(sub_module)
+        self.__path_signature = extend_path_signature(self.__path_signature, sub_module)
+
         if self.is_complete_trace():
-            # sub_module must match expectation else invalidate trace cache
+            # sub_module must match expectation else switch to another trace or invalidate trace cache
+            if self.__step_id < len(self.__submodule_order) and sub_module == self.__submodule_order[self.__step_id]:
+                return
+
+            self.__diverged = True
+            trace = self.__trace_library.match(self.__step_id, self.__path_signature, sub_module)
+            if trace is not None:
+                print_rank_0(f"Switch trace cache @ step {self.__step_id} and module {sub_module.id}", force=False)
+                self._activate_trace(trace, self.__step_id)
+                return
+
             if len(self.__submodule_order) <= self.__step_id:
                 print_rank_0(
                     f"Invalidate trace cache @ step {self.__step_id} and module {sub_module.id}: "
                     f"cache has only {len(self.__submodule_order)} modules",
-                    force=True)
-                self._invalidate_trace()
-                return
-
-            if sub_module != self.__submodule_order[self.__step_id]:
+                    force=False)
+            else:
                 expected_module_id = self.__submodule_order[self.__step_id].id
                 print_rank_0(
                     f"Invalidate trace cache @ step {self.__step_id}: "
                     f"expected module {expected_module_id}, but got module {sub_module.id}",
-                    force=True)
-                self._invalidate_trace()
+                    force=False)
+            self._invalidate_trace()
 
     @compiler.disable
     def record_module(self, sub_module: Module) -> None:
@@ -202,44 +249,101 @@ class PartitionedParameterCoordinator:
         for sub_module in self.__submodule_order:
             self.record_parameters(sub_module)
 
+    def _load_traces(self, submodule_orders: Iterable[Iterable[Module]]) -> None:
+        """use traces recorded by an earlier run, so prefetching starts on the first step"""
+        for submodule_order in submodule_orders:
+            self.__trace_library.add(submodule_order)
+        self._activate_trace(self.__trace_library.most_recent())
+        print_rank_0(f"loaded {len(self.__trace_library)} traces from cache", force=False)
+
+    def _activate_trace(self, trace: SubmoduleTrace, step_id: int = 0) -> None:
+        """prefetch according to ``trace`` from ``step_id`` on. ``trace`` must match the
+        submodules run so far in the current step."""
+        if trace.param_order is None:
+            param_order = []
+            for trace_step_id, sub_module in enumerate(trace.submodule_order):
+                for param in sorted(set(iter_params(sub_module, recurse=z3_leaf_module(sub_module))),
+                                    key=lambda p: p.ds_id):
+                    param_order.append(__class__.__ParamInTrace(param=param, step_id_last_used_at=trace_step_id))
+            trace.param_order = tuple(param_order)
+
+        self.__active_trace = trace
+        self.__submodule_order = trace.submodule_order
+        self.__param_order = trace.param_order
+        self.__trace_mode = ZeRoTraceMode.COMPLETE
+        self.__param_queue = collections.deque(p for p in self.__param_order if p.step_id_last_used_at >= step_id)
+        self.__most_recent_step_id_param_fetched_for = collections.defaultdict(lambda: int(-1e10))
+
     def reset_step(self) -> None:
         """indicate that we have completed one fwd+bwd for the model"""
+        if self.is_complete_trace() and self.__step_id < len(self.__submodule_order):
+            # the step ended before the trace did
+            self.__diverged = True
+        if self.__diverged:
+            self.__release_unused_prefetches()
+
         if self.__inflight_param_registry:
             raise RuntimeError(f"still have inflight params "
                                f"{[p.ds_summary() for p in self.__inflight_param_registry.keys()]}")
 
-        if not self.is_complete_trace():  # not self.trace_complete:
+        if self.__prefetch_controller is not None and self.__prefetch_controller.end_step(
+                self.__step_id, self.__step_numel, self.is_complete_trace()):
+            self.__prefetch_bucket_sz = self.__prefetch_controller.bucket_size
+            self.__prefetch_depth = self.__prefetch_controller.depth
+
+        if self.is_record_trace():
             # Make sure that recorded submodule orders are identical across ranks
             assert_ints_same_as_other_ranks([m.id for m in self.__submodule_order])
 
-            if self.is_record_trace():
-                # Successfully recorded a trace
-                self.construct_parameter_trace_from_module_trace()
-                # Make sure that recorded parameter orders are identical across ranks
-                assert_ints_same_as_other_ranks([p.param.ds_id for p in self.__param_order])
-                assert_ints_same_as_other_ranks([p.step_id_last_used_at for p in self.__param_order])
-
-                self.__submodule_order = tuple(self.__submodule_order)  # freeze
-                self.__param_order = tuple(self.__param_order)  # freeze
-                self.__trace_mode = ZeRoTraceMode.COMPLETE
+            # Successfully recorded a trace
+            self.construct_parameter_trace_from_module_trace()
+            # Make sure that recorded parameter orders are identical across ranks
+            assert_ints_same_as_other_ranks([p.param.ds_id for p in self.__param_order])
+            assert_ints_same_as_other_ranks([p.step_id_last_used_at for p in self.__param_order])
+
+            self.__submodule_order = tuple(self.__submodule_order)  # freeze
+            self.__param_order = tuple(self.__param_order)  # freeze
+            self.__trace_mode = ZeRoTraceMode.COMPLETE
+            print_rank_0(
+                f"completed record trace of {len(self.__submodule_order)} sub modules: {[m.id for m in self.__submodule_order]}",
+                force=False)
+            self.__add_trace(self.__submodule_order).param_order = self.__param_order
+
+        elif self.__diverged:
+            # Make sure that the submodule orders of the diverged step are identical across ranks
+            assert_ints_same_as_other_ranks([m.id for m in self.__observed_order])
+
+            trace = self.__trace_library.get(len(self.__observed_order), self.__path_signature)
+            if trace is None:
+                trace = self.__add_trace(self.__observed_order)
                 print_rank_0(
-                    f"completed record trace of {len(self.__submodule_order)} sub modules: {[m.id for m in self.__submodule_order]}",
+                    f"added trace of {len(trace.submodule_order)} sub modules to trace library, "
+                    f"which holds {len(self.__trace_library)} traces",
                     force=False)
-            else:
-                # Enable trace recording for next forward/backward pass
-                self.__trace_mode = ZeRoTraceMode.RECORD
+            self.__trace_library.use(trace)
 
         else:
             if self.__profiler is not None:
                 self.__profiler.log_events()
 
-        self.__param_queue = collections.deque(self.__param_order)  # reset fetch queue
-        self.__most_recent_step_id_param_fetched_for = collections.defaultdict(lambda: int(-1e10))
+        # start the next step from the most recently used trace, which is the one this step took
+        self._activate_trace(self.__trace_library.most_recent())
         self.__step_id_module_fetched_for = collections.defaultdict(lambda: collections.deque())
+        self.__observed_order = []
+        self.__path_signature = PATH_SIGNATURE_INIT
+        self.__prefetched_params = set()
+        self.__diverged = False
         self.__step_id = 0
+        self.__step_numel = 0
         self.__n_available_params = 0
         self.__profiler.reset_events()
 
+    def __add_trace(self, submodule_order: Iterable[Module]) -> SubmoduleTrace:
+        trace = self.__trace_library.add(submodule_order)
+        if self.__trace_cache is not None:
+            self.__trace_cache.save(trace.submodule_order for trace in self.__trace_library)
+        return trace
+
     def _dump_params(self, tag, sub_module, params, step_id=None):
         if step_id is None:
             step_id = self.__step_id
@@ -278,6 +382,22 @@ class PartitionedParameterCoordinator:
         fetch_numel = sum(
             [p.partition_numel() for p in params_to_fetch if p.ds_status == ZeroParamStatus.NOT_AVAILABLE])
 
+        # time fetches that block, both of prefetched parameters still in flight and of
+        # parameters that were not prefetched, for the adaptive prefetch controller
+        timed_fetch = None
+        timed_fetch_numel = 0
+        if self.__prefetch_controller is not None:
+            self.__prefetch_controller.start_step()
+            self.__step_numel += sum(p.ds_numel for p in params_to_fetch)
+            if any(p in self.__inflight_param_registry for p in params_to_fetch):
+                timed_fetch = True
+            elif fetch_numel > 0:
+                timed_fetch = False
+                timed_fetch_numel = sum(p.ds_numel for p in params_to_fetch
+                                        if p.ds_status == ZeroParamStatus.NOT_AVAILABLE)
+            if timed_fetch is not None:
+                self.__prefetch_controller.start_fetch(prefetched=timed_fetch)
+
         if fetch_numel > 0:
             event_name = __class__.FORWARD_FETCH_SUBMIT if forward else __class__.BACKWARD_FETCH_SUBMIT
             self._dump_param_ids(event_name, current_submodule.id,
@@ -318,6 +438,8 @@ class PartitionedParameterCoordinator:
         if not get_accelerator().resolves_data_dependency():
             get_accelerator().current_stream().wait_stream(self.__allgather_stream)
         self.__profiler.stop_event(wait_event_name, wait_numel)
+        if timed_fetch is not None:
+            self.__prefetch_controller.stop_fetch(prefetched=timed_fetch, numel=timed_fetch_numel)
 
         # kick off parameter prefetches for upcoming modules
         # don't prefetch if we dont have a completed model trace
@@ -343,13 +465,6 @@ class PartitionedParameterCoordinator:
                     f"parameter fetch queue to be {tuple(p.ds_summary(use_debug_name=True) for p in params_not_already_fetched)} \n"
                     f"but got \n {tuple(p.ds_summary(use_debug_name=True) for p in discarded_from_prefetch_queue)}.")
 
-            def _is_currently_on_nvme(param):
-                if param.nvme_swapper is None:
-                    return False
-
-                return param.ds_tensor.final_location == OffloadDeviceEnum.nvme \
-                    and param.ds_tensor.status == PartitionedParamStatus.NOT_AVAILABLE
-
             # kick off all gather for params in the next few submodules (prefetch)
             if self.__prefetch_bucket_sz > 0:
                 max_params_to_prefetch = min(self.__max_n_available_params - self.__n_available_params,
@@ -357,6 +472,9 @@ class PartitionedParameterCoordinator:
                 params_to_prefetch = set()
                 numel_prefetching = 0
                 while self.__param_queue and numel_prefetching < max_params_to_prefetch:
+                    if (self.__prefetch_depth is not None
+                            and self.__param_queue[0].step_id_last_used_at > self.__step_id + self.__prefetch_depth):
+                        break
                     param_in_trace: __class__.__ParamInTrace = self.__param_queue.popleft()
 
                     if _is_currently_on_nvme(param_in_trace.param):
@@ -385,12 +503,61 @@ class PartitionedParameterCoordinator:
                             debug_rank0(f"-prefetch: {param.ds_summary()}")
                     self.__all_gather_params(params_to_prefetch, forward)
                     self.__profiler.stop_event(event_name, numel_prefetching)
+                    self.__prefetched_params.update(params_to_prefetch)
 
                 if self.__prefetch_nvme:
                     self.__prefetch_nvme_param_partitions()
 
+        # without a matching trace, prefetch the submodules that usually follow the current one
+        elif self.is_invalid_trace() and self.__prefetch_bucket_sz > 0:
+            self.__prefetch_predicted_sub_modules(current_submodule, forward)
+
         self.__step_id += 1
 
+    @instrument_w_nvtx
+    def __prefetch_predicted_sub_modules(self, current_submodule: Module, forward: bool) -> None:
+        prev_submodule = self.__observed_order[-2] if len(self.__observed_order) > 1 else None
+        max_params_to_prefetch = min(self.__max_n_available_params - self.__n_available_params,
+                                     self.__prefetch_bucket_sz)
+        params_to_prefetch = set()
+        numel_prefetching = 0
+        for sub_module in itertools.islice(self.__trace_library.predict(prev_submodule, current_submodule),
+                                           self.__prefetch_depth):
+            if numel_prefetching >= max_params_to_prefetch:
+                break
+            for param in iter_params(sub_module, recurse=z3_leaf_module(sub_module)):
+                # parameters on nvme are left to be fetched when they are used, since the
+                # swap buffers are reserved for the parameters of a matching trace
+                if (param.ds_status == ZeroParamStatus.NOT_AVAILABLE and param not in params_to_prefetch
+                        and not _is_currently_on_nvme(param)):
+                    params_to_prefetch.add(param)
+                    numel_prefetching += param.ds_numel
+
+        if numel_prefetching > 0:
+            event_name = __class__.FORWARD_PREFETCH_SUBMIT if forward else __class__.BACKWARD_PREFETCH_SUBMIT
+            self.__profiler.start_event(event_name)
+            if logger.isEnabledFor(logging.DEBUG):
+                for param in params_to_prefetch:
+                    debug_rank0(f"-predicted prefetch: {param.ds_summary()}")
+            self.__all_gather_params(params_to_prefetch, forward)
+            self.__profiler.stop_event(event_name, numel_prefetching)
+            self.__prefetched_params.update(params_to_prefetch)
+
+    @instrument_w_nvtx
+    @torch.no_grad()
+    def __release_unused_prefetches(self) -> None:
+        """release parameters prefetched for submodules that did not run in a diverged step"""
+        with get_accelerator().stream(self.__allgather_stream):
+            for handle in set(self.__inflight_param_registry.values()):
+                handle.wait()
+        if not get_accelerator().resolves_data_dependency():
+            get_accelerator().current_stream().wait_stream(self.__allgather_stream)
+        self.__inflight_param_registry.clear()
+
+        for param in self.__prefetched_params:
+            if not param.ds_persist:
+                self.__release_param(param)
+
     @instrument_w_nvtx
     @torch.no_grad()
     def release_sub_module(self, submodule: Module) -> None:
@@ -484,11 +651,13 @@ class PartitionedParameterCoordinator:
             self.__n_available_params -= param.ds_numel
 
     @instrument_w_nvtx
-    @functools.lru_cache(maxsize=None)
     def __params_to_release(self, submodule_to_release: Module, step_id: int) -> Set[int]:
         if not self.is_complete_trace():
             raise RuntimeError("expected trace to be complete")
 
+        if (submodule_to_release, step_id) in self.__active_trace.params_to_release:
+            return self.__active_trace.params_to_release[(submodule_to_release, step_id)]
+
         params_to_release = set(
             p.ds_id for p in iter_params(submodule_to_release, recurse=z3_leaf_module(submodule_to_release))
             if not p.ds_persist)
@@ -515,6 +684,7 @@ class PartitionedParameterCoordinator:
                 params_to_release.discard(param.ds_id)
                 params_traversed += param.ds_numel
 
+        self.__active_trace.params_to_release[(submodule_to_release, step_id)] = params_to_release
         return params_to_release
 
     @instrument_w_nvtx
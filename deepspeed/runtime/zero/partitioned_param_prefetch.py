@@ -0,0 +1,128 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import math
+from typing import Optional
+
+import torch
+
+from deepspeed import comm as dist
+from deepspeed.accelerator import get_accelerator
+from deepspeed.utils import log_dist
+from deepspeed.utils.timer import SynchronizedWallClockTimer
+
+
+class AdaptivePrefetchController:
+    """Tunes the prefetch bucket size and depth of the ZeRO-3 parameter coordinator from
+    the all-gather latency and the submodule compute time it measures every step.
+
+    The latency of fetching a parameter element is measured on fetches that were not
+    prefetched, the compute time is the time of a step not spent waiting for parameters.
+    Prefetching runs far enough ahead for the all-gathers of upcoming submodules to be
+    hidden behind the compute of the current ones, and further if prefetched parameters
+    are still waited for. The bucket size never exceeds the number of parameters allowed to be live.
+    """
+
+    STEP_TIMER = 'zero3_prefetch_step'
+    FETCH_TIMER = 'zero3_prefetch_fetch'
+    WAIT_TIMER = 'zero3_prefetch_wait'
+
+    def __init__(self,
+                 prefetch_bucket_size: int,
+                 max_live_parameters: int,
+                 exposed_wait_tolerance: float = 0.05,
+                 smoothing: float = 0.5) -> None:
+        self.bucket_size = prefetch_bucket_size
+        # number of submodules ahead of the current one to prefetch for, None before the first measurement
+        self.depth: Optional[int] = None
+        self.max_live_parameters = max_live_parameters
+        # fraction of the compute time parameters may be waited for before prefetching further ahead
+        self.exposed_wait_tolerance = exposed_wait_tolerance
+        # weight of the latest measurement in the running latency estimate
+        self.smoothing = smoothing
+        self.timers = SynchronizedWallClockTimer()
+
+        self.__msec_per_numel: Optional[float] = None
+        self.__extra_depth = 0
+        self.__fetch_numel = 0
+        self.__step_started = False
+
+    def start_step(self) -> None:
+        if not self.__step_started:
+            self.timers(__class__.STEP_TIMER).start()
+            self.__step_started = True
+
+    def start_fetch(self, prefetched: bool) -> None:
+        """start timing a fetch, of parameters that were prefetched or of parameters that were not"""
+        self.timers(__class__.WAIT_TIMER if prefetched else __class__.FETCH_TIMER).start()
+
+    def stop_fetch(self, prefetched: bool, numel: int = 0) -> None:
+        self.timers(__class__.WAIT_TIMER if prefetched else __class__.FETCH_TIMER).stop()
+        if not prefetched:
+            self.__fetch_numel += numel
+
+    def end_step(self, num_sub_modules: int, step_numel: int, trace_complete: bool) -> bool:
+        """measure the step that ended and update bucket size and depth, returns whether they changed.
+        Measurements are averaged over all ranks, so all ranks prefetch the same parameters."""
+        if not self.__step_started:
+            return False
+        self.__step_started = False
+        self.timers(__class__.STEP_TIMER).stop()
+
+        measurements = [
+            self.timers(name).elapsed(reset=True)
+            for name in (__class__.STEP_TIMER, __class__.FETCH_TIMER, __class__.WAIT_TIMER)
+        ] + [float(self.__fetch_numel)]
+        self.__fetch_numel = 0
+        if dist.is_initialized():
+            measurements = torch.tensor(measurements,
+                                        dtype=torch.float64,
+                                        device=get_accelerator().current_device_name())
+            dist.all_reduce(measurements, op=dist.ReduceOp.SUM)
+            measurements = (measurements / dist.get_world_size()).tolist()
+
+        step_msec, fetch_msec, wait_msec, fetch_numel = measurements
+        changed = self.update(step_msec, fetch_msec, wait_msec, fetch_numel, num_sub_modules, step_numel,
+                              trace_complete)
+        if changed:
+            log_dist(
+                f"adaptive prefetch: bucket size = {self.bucket_size}, depth = {self.depth} | "
+                f"{__class__.STEP_TIMER}: {step_msec:.2f} | {__class__.FETCH_TIMER}: {fetch_msec:.2f} | "
+                f"{__class__.WAIT_TIMER}: {wait_msec:.2f} | fetch numel: {int(fetch_numel)} | "
+                f"sub modules: {num_sub_modules}",
+                ranks=[0])
+        return changed
+
+    def update(self, step_msec: float, fetch_msec: float, wait_msec: float, fetch_numel: float, num_sub_modules: int,
+               step_numel: int, trace_complete: bool) -> bool:
+        """update bucket size and depth from the measurements of a step, returns whether they changed"""
+        if fetch_numel > 0:
+            msec_per_numel = fetch_msec / fetch_numel
+            self.__msec_per_numel = msec_per_numel if self.__msec_per_numel is None else (
+                self.smoothing * msec_per_numel + (1 - self.smoothing) * self.__msec_per_numel)
+        if self.__msec_per_numel is None or num_sub_modules == 0 or step_numel == 0:
+            return False
+
+        numel_per_sub_module = step_numel / num_sub_modules
+        compute_msec = max(step_msec - fetch_msec - wait_msec, 0.0)
+        compute_msec_per_sub_module = compute_msec / num_sub_modules
+
+        # waiting for prefetched parameters while following a trace means the all-gathers were
+        # issued too late, so prefetching has to run further ahead than estimated
+        if trace_complete:
+            if wait_msec > self.exposed_wait_tolerance * compute_msec:
+                self.__extra_depth = min(self.__extra_depth + 1, num_sub_modules)
+            elif self.__extra_depth > 0:
+                self.__extra_depth -= 1
+
+        fetch_msec_per_sub_module = numel_per_sub_module * self.__msec_per_numel
+        depth = math.ceil(fetch_msec_per_sub_module / max(compute_msec_per_sub_module, 1e-6)) + self.__extra_depth
+        depth = min(max(depth, 1), num_sub_modules)
+        bucket_size = min(max(int(depth * numel_per_sub_module), 1), self.max_live_parameters)
+
+        changed = depth != self.depth or bucket_size != self.bucket_size
+        self.depth = depth
+        self.bucket_size = bucket_size
+        return changed
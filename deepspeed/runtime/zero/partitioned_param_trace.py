@@ -0,0 +1,230 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import collections
+import hashlib
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import torch
+from torch.nn import Module
+
+from deepspeed import comm as dist
+from deepspeed.accelerator import get_accelerator
+from deepspeed.utils import logger, z3_leaf_module
+
+
+def model_fingerprint(module: Module) -> str:
+    """hash of the module hierarchy and parameter shapes of a model, which determine
+    the submodule trace ZeRO-3 records for it"""
+    fingerprint = hashlib.sha256()
+    for name, sub_module in module.named_modules():
+        type_name = f"{type(sub_module).__module__}.{type(sub_module).__qualname__}"
+        fingerprint.update(f"{name}:{type_name}:{z3_leaf_module(sub_module)};".encode())
+        for param_name, param in sub_module.named_parameters(recurse=False):
+            shape = tuple(param.ds_shape) if hasattr(param, "ds_shape") else tuple(param.shape)
+            fingerprint.update(f"{param_name}:{shape}:{param.dtype};".encode())
+    return fingerprint.hexdigest()
+
+
+# signature of the empty submodule path, see ``extend_path_signature``
+PATH_SIGNATURE_INIT = 0
+
+
+def extend_path_signature(signature: int, sub_module: Module) -> int:
+    """cheap rolling signature of the submodules run so far in a step, extended by ``sub_module``"""
+    return hash((signature, sub_module.id))
+
+
+@dataclass
+class SubmoduleTrace:
+    """order in which submodules ran during a forward+backward (for training) or forward (for inference)"""
+    submodule_order: Tuple[Module, ...]
+    # path signature after each step of the trace
+    prefix_signatures: Tuple[int, ...]
+    # parameter trace of the submodule order, built by the coordinator when the trace is first used
+    param_order: Optional[tuple] = None
+    # parameters the coordinator releases after a submodule at a step of the trace
+    params_to_release: dict = field(default_factory=dict)
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return len(self.submodule_order), self.prefix_signatures[-1] if self.prefix_signatures else PATH_SIGNATURE_INIT
+
+
+class PartitionedParameterTraceLibrary:
+    """A small library of submodule traces, for models whose submodule order changes from step
+    to step, e.g. through mixture-of-experts routing or early exits.
+
+    Traces are matched against the path taken so far in a step by comparing path signatures, the
+    least recently used trace is evicted once ``max_traces`` are stored. The submodule adjacency of
+    the stored traces is used to predict upcoming submodules when none of them matches.
+    """
+
+    def __init__(self, max_traces: int) -> None:
+        if max_traces < 1:
+            raise ValueError(f"expected max_traces >= 1, got {max_traces}")
+        self.max_traces = max_traces
+        # least recently used trace first
+        self.__traces: collections.OrderedDict = collections.OrderedDict()
+        # successors of a submodule, and of a submodule reached from a given predecessor. The latter
+        # tells forward and backward passes apart, which visit the same submodules in reverse order.
+        self.__successors = collections.defaultdict(collections.Counter)
+        self.__successors_after = collections.defaultdict(collections.Counter)
+
+    def __len__(self) -> int:
+        return len(self.__traces)
+
+    def __iter__(self) -> Iterator[SubmoduleTrace]:
+        """traces from least to most recently used"""
+        return iter(list(self.__traces.values()))
+
+    def get(self, length: int, signature: int) -> Optional[SubmoduleTrace]:
+        """the trace of ``length`` submodules with path signature ``signature``, None if there is none"""
+        return self.__traces.get((length, signature))
+
+    def add(self, submodule_order: Iterable[Module]) -> SubmoduleTrace:
+        """add a trace, or return the stored one if it is already in the library"""
+        submodule_order = tuple(submodule_order)
+        prefix_signatures = []
+        signature = PATH_SIGNATURE_INIT
+        for sub_module in submodule_order:
+            signature = extend_path_signature(signature, sub_module)
+            prefix_signatures.append(signature)
+
+        trace = SubmoduleTrace(submodule_order=submodule_order, prefix_signatures=tuple(prefix_signatures))
+        if trace.key in self.__traces:
+            return self.use(self.__traces[trace.key])
+
+        self.__traces[trace.key] = trace
+        self.__count_successors(trace, 1)
+        if len(self.__traces) > self.max_traces:
+            _, evicted = self.__traces.popitem(last=False)
+            self.__count_successors(evicted, -1)
+        return trace
+
+    def use(self, trace: SubmoduleTrace) -> SubmoduleTrace:
+        """mark a trace as most recently used"""
+        self.__traces.move_to_end(trace.key)
+        return trace
+
+    def most_recent(self) -> Optional[SubmoduleTrace]:
+        return next(reversed(self.__traces.values()), None)
+
+    def match(self, step_id: int, signature: int, sub_module: Module) -> Optional[SubmoduleTrace]:
+        """the most recently used trace that ran ``sub_module`` at ``step_id`` after the same
+        submodules as the current step, whose path signature is ``signature``"""
+        for trace in reversed(self.__traces.values()):
+            if (step_id < len(trace.submodule_order) and trace.prefix_signatures[step_id] == signature
+                    and trace.submodule_order[step_id] is sub_module):
+                return trace
+        return None
+
+    def predict(self, prev_sub_module: Optional[Module], sub_module: Module) -> Iterator[Module]:
+        """submodules likely to run after ``sub_module``, reached from ``prev_sub_module``, following
+        the most frequent successor in the stored traces"""
+        max_steps = max((len(trace.submodule_order) for trace in self.__traces.values()), default=0)
+        for _ in range(max_steps):
+            successors = self.__successors_after.get(
+                (prev_sub_module, sub_module)) or self.__successors.get(sub_module)
+            if not successors:
+                return
+            prev_sub_module, sub_module = sub_module, successors.most_common(1)[0][0]
+            yield sub_module
+
+    def __count_successors(self, trace: SubmoduleTrace, count: int) -> None:
+        submodule_order = trace.submodule_order
+        for prev_sub_module, sub_module, next_sub_module in zip((None, ) + submodule_order, submodule_order,
+                                                                submodule_order[1:]):
+            for successors in (self.__successors[sub_module], self.__successors_after[(prev_sub_module, sub_module)]):
+                successors[next_sub_module] += count
+                if successors[next_sub_module] <= 0:
+                    del successors[next_sub_module]
+
+
+class PartitionedParameterTraceCache:
+    """Persists completed ZeRO-3 submodule traces, so later runs of the same model can
+    prefetch from their first step instead of recording a trace first.
+
+    The traces of a trace library are stored as submodule names in a json file keyed by the
+    fingerprint of the model, one for training and one for evaluation.
+    """
+
+    VERSION = 2
+
+    def __init__(self, cache_dir: str, module: Module, training: bool) -> None:
+        self.__modules_by_name = dict(module.named_modules())
+        self.__names_by_module = {sub_module: name for name, sub_module in self.__modules_by_name.items()}
+        self.fingerprint = model_fingerprint(module)
+        mode = "train" if training else "eval"
+        self.path = os.path.join(cache_dir, f"zero3_trace_{mode}_{self.fingerprint[:16]}.json")
+
+    def load(self) -> Optional[List[List[Module]]]:
+        """load the cached traces of the model from least to most recently used, None if there
+        are none. The traces are only used if every rank loaded the same ones, since ranks must
+        prefetch identically."""
+        submodule_orders = self._read()
+        if not self.__same_on_all_ranks(submodule_orders):
+            return None
+        return submodule_orders
+
+    def save(self, submodule_orders: Iterable[Iterable[Module]]) -> None:
+        """save completed traces. Each node writes them once, in case the cache directory
+        is not shared between nodes."""
+        if dist.is_initialized() and dist.get_local_rank() != 0:
+            return
+
+        trace = {
+            "version":
+            __class__.VERSION,
+            "fingerprint":
+            self.fingerprint,
+            "submodule_orders": [[self.__names_by_module[sub_module] for sub_module in submodule_order]
+                                 for submodule_order in submodule_orders],
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial trace
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(trace, f)
+        os.replace(tmp_path, self.path)
+
+    def _read(self) -> Optional[List[List[Module]]]:
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, "r") as f:
+                trace = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable ZeRO-3 trace cache {self.path}: {e}")
+            return None
+
+        if trace.get("version") != __class__.VERSION or trace.get("fingerprint") != self.fingerprint:
+            return None
+        submodule_orders = trace["submodule_orders"]
+        if not submodule_orders or any(name not in self.__modules_by_name for submodule_order in submodule_orders
+                                       for name in submodule_order):
+            return None
+        return [[self.__modules_by_name[name] for name in submodule_order] for submodule_order in submodule_orders]
+
+    def __same_on_all_ranks(self, submodule_orders: Optional[List[List[Module]]]) -> bool:
+        if not dist.is_initialized():
+            return submodule_orders is not None
+
+        if submodule_orders is None:
+            checksum = -1
+        else:
+            names = ";".join(",".join(self.__names_by_module[sub_module] for sub_module in submodule_order)
+                             for submodule_order in submodule_orders)
+            checksum = zlib.crc32(names.encode())
+        # a single max reduction gives both the largest and the smallest checksum
+        checksums = torch.tensor([checksum, -checksum],
+                                 dtype=torch.int64,
+                                 device=get_accelerator().current_device_name())
+        dist.all_reduce(checksums, op=dist.ReduceOp.MAX)
+        return checksum >= 0 and checksums[0].item() == -checksums[1].item()
@@ -121,6 +121,9 @@ class DeepSpeedZeroOptimizer_Stage3(ZeROOptimizer):
         zero_hpz_partition_size=1,
         zero_quantized_weights=False,
         zero_quantized_nontrainable_weights=False,
+        trace_cache_path=None,
+        max_prefetch_traces=4,
+        adaptive_prefetch=False,
     ):
         see_memory_usage("Stage 3 initialize beginning", force=True)
 
@@ -191,7 +194,10 @@ class DeepSpeedZeroOptimizer_Stage3(ZeROOptimizer):
             mpu=mpu,
             zero_param_parallel_group=zero_param_parallel_group,
             zero_quantized_weights=zero_quantized_weights,
-            zero_quantized_nontrainable_weights=zero_quantized_nontrainable_weights)
+            zero_quantized_nontrainable_weights=zero_quantized_nontrainable_weights,
+            trace_cache_path=trace_cache_path,
+            max_prefetch_traces=max_prefetch_traces,
+            adaptive_prefetch=adaptive_prefetch)
 
         self.persistent_parameters = self.parameter_offload.persistent_parameters
         self._configure_offloading(offload_optimizer_config, offload_param_config)
@@ -423,6 +429,9 @@ class DeepSpeedZeroOptimizer_Stage3(ZeROOptimizer):
         zero_param_parallel_group,
         zero_quantized_weights,
         zero_quantized_nontrainable_weights,
+        trace_cache_path=None,
+        max_prefetch_traces=4,
+        adaptive_prefetch=False,
     ):
         return DeepSpeedZeRoOffload(module=module,
                                     timers=timers,
@@ -438,7 +447,10 @@ class DeepSpeedZeroOptimizer_Stage3(ZeROOptimizer):
                                     mpu=mpu,
                                     zero_param_parallel_group=zero_param_parallel_group,
                                     zero_quantized_weights=zero_quantized_weights,
-                                    zero_quantized_nontrainable_weights=zero_quantized_nontrainable_weights)
+                                    zero_quantized_nontrainable_weights=zero_quantized_nontrainable_weights,
+                                    trace_cache_path=trace_cache_path,
+                                    max_prefetch_traces=max_prefetch_traces,
+                                    adaptive_prefetch=adaptive_prefetch)
 
     def _get_trainable_parameter_groups(self):
         param_groups = []
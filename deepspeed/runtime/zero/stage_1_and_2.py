@@ -15,6 +15,7 @@ from deepspeed.runtime.utils import (empty_cache, see_memory_usage, inf, is_mode
                                      align_dense_tensors, all_gather_dp_groups)
 from deepspeed.runtime.zero.config import ZeroStageEnum
 from deepspeed.runtime.zero.offload_config import OffloadDeviceEnum
+from deepspeed.runtime.zero.mics_utils import create_hierarchical_dp_groups, hierarchical_all_reduce
 from deepspeed.ops.adam import DeepSpeedCPUAdam
 from deepspeed.utils import logger
 from deepspeed.utils.bwc import bwc_tensor_model_parallel_rank
@@ -121,6 +122,7 @@ class DeepSpeedZeroOptimizer(ZeROOptimizer):
                  expert_parallel_group=None,
                  expert_data_parallel_group=None,
                  reduce_scatter=True,
+                 hierarchical_reduce_scatter=False,
                  overlap_comm=False,
                  offload_optimizer_config=None,
                  mpu=None,
@@ -199,6 +201,14 @@ class DeepSpeedZeroOptimizer(ZeROOptimizer):
         self.real_dp_process_group = [dp_process_group for i in range(len(self.optimizer.param_groups))]
         self.partition_count = [dp_size for i in range(len(self.optimizer.param_groups))]
 
+        #intra-node and inter-node groups for reducing over the data parallel group in two levels
+        self.hierarchical_dp_process_groups = None
+        if hierarchical_reduce_scatter:
+            self.hierarchical_dp_process_groups = create_hierarchical_dp_groups(self.dp_process_group)
+            if self.hierarchical_dp_process_groups is None and dist.get_rank() == 0:
+                logger.warning("Data parallel group does not span several nodes with more than one rank each, "
+                               "hierarchical reduce scatter will be disabled.")
+
         self.is_gradient_accumulation_boundary = True
 
         # CPU-Offload requires contiguous gradients
@@ -980,14 +990,14 @@ class DeepSpeedZeroOptimizer(ZeROOptimizer):
             if self.gradient_predivide_factor != 1.0:
                 tensor_to_allreduce.mul_(1. / self.gradient_predivide_factor)
 
-            dist.all_reduce(tensor_to_allreduce, group=self.dp_process_group)
+            self._all_reduce(tensor_to_allreduce, self.dp_process_group)
 
             if self.gradient_predivide_factor != dp_world_size:
                 tensor_to_allreduce.mul_(self.gradient_predivide_factor /
                                          (dp_world_size / float(self.sequence_parallel_size)))
         else:
             tensor_to_allreduce.div_(dp_world_size / float(self.sequence_parallel_size))
-            dist.all_reduce(tensor_to_allreduce, group=self.dp_process_group)
+            self._all_reduce(tensor_to_allreduce, self.dp_process_group)
 
         if self.communication_data_type != tensor.dtype and tensor is not tensor_to_allreduce:
             tensor.copy_(tensor_to_allreduce)
@@ -1497,7 +1507,7 @@ class DeepSpeedZeroOptimizer(ZeROOptimizer):
 
         if rank is None:
             #    "All Reducing"
-            dist.all_reduce(tensor_to_allreduce, group=process_group)
+            self._all_reduce(tensor_to_allreduce, process_group)
         else:
             global_rank = dist.get_global_rank(process_group, rank)
             dist.reduce(tensor_to_allreduce, global_rank, group=process_group)
@@ -1508,6 +1518,13 @@ class DeepSpeedZeroOptimizer(ZeROOptimizer):
 
         return tensor
 
+    def _all_reduce(self, tensor, process_group):
+        # only 1/ranks-per-node of the tensor crosses nodes when reducing hierarchically
+        if self.hierarchical_dp_process_groups is not None and process_group is self.dp_process_group:
+            hierarchical_all_reduce(tensor, *self.hierarchical_dp_process_groups)
+        else:
+            dist.all_reduce(tensor, group=process_group)
+
     def _clear_previous_reduced_grads(self):
         if self.previous_reduced_grads is not None:
             for param in self.previous_reduced_grads:
@@ -0,0 +1,113 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+#!/usr/bin/env python
+# Compare BatchedSampler against sampling each request of the batch in a Python loop.
+#
+# usage:
+# ./batched_sampling_bench.py -t
+# ./batched_sampling_bench.py -c
+
+import argparse
+import random
+
+import torch
+
+from deepspeed.inference.v2.sampling import BatchedSampler, SamplingParams
+
+N_SEQS = 256
+VOCAB_SIZE = 32000
+PROMPT_LEN = 128
+TIMES = 20
+
+random.seed(0)
+torch.manual_seed(0)
+
+params = [
+    SamplingParams(temperature=random.choice([0.0, 0.7, 1.0]),
+                   top_k=random.choice([0, 50]),
+                   top_p=random.choice([1.0, 0.9]),
+                   repetition_penalty=random.choice([1.0, 1.2]),
+                   stop_token_ids=(2, )) for _ in range(N_SEQS)
+]
+prompts = [torch.randint(0, VOCAB_SIZE, (PROMPT_LEN, )) for _ in range(N_SEQS)]
+# Scaled so the distributions are peaked, like language model outputs.
+logits = torch.randn(N_SEQS, VOCAB_SIZE) * 5
+
+
+def sample_one(p: SamplingParams, row: torch.Tensor, history: torch.Tensor, generator: torch.Generator) -> int:
+    """
+    Typical per-request sampling of a single row of logits.
+    """
+    row = row.float().clone()
+    if p.repetition_penalty != 1.0:
+        seen = row[history]
+        row[history] = torch.where(seen > 0, seen / p.repetition_penalty, seen * p.repetition_penalty)
+    if p.temperature == 0:
+        return int(torch.argmax(row))
+    row = row / p.temperature
+    if p.top_k > 0:
+        threshold = torch.topk(row, p.top_k).values[-1]
+        row = row.masked_fill(row < threshold, float("-inf"))
+    if p.top_p < 1.0:
+        sorted_row, sorted_idx = torch.sort(row, descending=True)
+        probs = torch.softmax(sorted_row, dim=-1)
+        remove = torch.cumsum(probs, dim=-1) - probs >= p.top_p
+        row[sorted_idx[remove]] = float("-inf")
+    return int(torch.multinomial(torch.softmax(row, dim=-1), 1, generator=generator))
+
+
+def per_request():
+    generators = [torch.Generator().manual_seed(uid) for uid in range(N_SEQS)]
+    histories = [prompt.clone() for prompt in prompts]
+    for _ in range(TIMES):
+        for uid in range(N_SEQS):
+            token = sample_one(params[uid], logits[uid], histories[uid], generators[uid])
+            histories[uid] = torch.cat([histories[uid], torch.tensor([token])])
+            _ = token in params[uid].stop_token_ids
+
+
+def batched():
+    sampler = BatchedSampler()
+    for uid in range(N_SEQS):
+        sampler.add_request(uid, params[uid], prompt_tokens=prompts[uid])
+    uids = list(range(N_SEQS))
+    for _ in range(TIMES):
+        sampler.sample(uids, logits)
+
+
+#### cProfile ####
+
+import cProfile
+
+
+def cprofileme():
+    print("--------------- cProfile -----------------")
+    print("per_request")
+    cProfile.run("per_request()", sort=-1)
+    print("batched")
+    cProfile.run("batched()", sort=-1)
+
+
+#### timeit ####
+
+import timeit
+
+
+def timeme():
+    print("--------------- timeit -----------------")
+    print(f'per_request={timeit.Timer("per_request()", globals=globals()).timeit(number=1)}')
+    print(f'batched    ={timeit.Timer("batched()", globals=globals()).timeit(number=1)}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", action='store_true')
+    parser.add_argument("-t", action='store_true')
+    args = parser.parse_args()
+    if args.c:
+        cprofileme()
+    elif args.t:
+        timeme()
@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+#!/usr/bin/env python
+# Compare the vectorized BlockedAllocator against the previous linked-list allocator.
+#
+# usage:
+# ./blocked_allocator_bench.py -t
+# ./blocked_allocator_bench.py -c
+
+import argparse
+import random
+
+import torch
+
+from deepspeed.inference.v2.ragged.blocked_allocator import BlockedAllocator
+
+NUM_BLOCKS = 100_000
+BLOCKS_PER_REQUEST = 32
+TIMES = 20
+
+
+class LinkedListBlockedAllocator:
+    """
+    Reference copy of the original linked-list allocator for comparison.
+    """
+
+    def __init__(self, num_blocks: int) -> None:
+        self._num_blocks = num_blocks
+        self._blocks = torch.arange(1, num_blocks + 1, dtype=torch.int32, device='cpu')
+        self._head = 0
+        self._free_blocks = num_blocks
+
+    def allocate(self, num_blocks: int) -> torch.Tensor:
+        if num_blocks > self._free_blocks:
+            raise ValueError(f'Not enough free blocks in the KV-cache to allocate {num_blocks} blocks')
+
+        allocated_blocks = torch.zeros(num_blocks, dtype=torch.int32)
+        for i in range(num_blocks):
+            allocated_blocks[i] = self._head
+            self._head = self._blocks[self._head].item()
+            self._blocks[allocated_blocks[i]] = -1
+            self._free_blocks -= 1
+
+        return allocated_blocks
+
+    def free(self, blocks) -> None:
+        for block in blocks:
+            if block < 0 or block >= self._num_blocks:
+                raise ValueError(f'Invalid block {block} provided to free')
+            if self._blocks[block] != -1:
+                raise ValueError(f'Block {block} is already free')
+
+        for block in blocks:
+            self._blocks[block] = self._head
+            self._head = block
+            self._free_blocks += 1
+
+    @property
+    def free_blocks(self) -> int:
+        return self._free_blocks
+
+
+def churn(allocator_cls) -> None:
+    """
+    Fill the cache in fixed size requests and then free them all in a shuffled order.
+    """
+    random.seed(0)
+    allocator = allocator_cls(NUM_BLOCKS)
+    for _ in range(TIMES):
+        allocs = [allocator.allocate(BLOCKS_PER_REQUEST) for _ in range(NUM_BLOCKS // BLOCKS_PER_REQUEST)]
+        random.shuffle(allocs)
+        for alloc in allocs:
+            allocator.free(alloc)
+    assert allocator.free_blocks == NUM_BLOCKS
+
+
+def linked_list():
+    churn(LinkedListBlockedAllocator)
+
+
+def vectorized():
+    churn(BlockedAllocator)
+
+
+#### cProfile ####
+
+import cProfile
+
+
+def cprofileme():
+    print("--------------- cProfile -----------------")
+    print("linked_list")
+    cProfile.run("linked_list()", sort=-1)
+    print("vectorized")
+    cProfile.run("vectorized()", sort=-1)
+
+
+#### timeit ####
+
+import timeit
+
+
+def timeme():
+    print("--------------- timeit -----------------")
+    print(f'linked_list={timeit.Timer("linked_list()", globals=globals()).timeit(number=1)}')
+    print(f'vectorized ={timeit.Timer("vectorized()", globals=globals()).timeit(number=1)}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", action='store_true')
+    parser.add_argument("-t", action='store_true')
+    args = parser.parse_args()
+    if args.c:
+        cprofileme()
+    elif args.t:
+        timeme()
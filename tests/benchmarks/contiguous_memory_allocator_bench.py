@@ -0,0 +1,271 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+#!/usr/bin/env python
+# Compare the best-fit ContiguousMemoryAllocator with incremental defragmentation against the
+# previous linear-scan allocator that compacts the whole buffer, on a ZeRO-3 like allocation trace.
+#
+# A trace recorded from a real run can be replayed instead of the synthetic one, as a json list of
+# ["alloc", tensor_id, numel] and ["free", tensor_id] events.
+#
+# usage:
+# ./contiguous_memory_allocator_bench.py -t
+# ./contiguous_memory_allocator_bench.py -c
+# ./contiguous_memory_allocator_bench.py -t --trace trace.json --buffer-size 100000000
+
+import argparse
+import contextlib
+import io
+import json
+import random
+
+import torch
+
+from deepspeed.runtime.zero.contiguous_memory_allocator import ContiguousMemoryAllocator
+
+HIDDEN = 256
+NUM_LAYERS = 48
+LIVE_LAYERS = 3
+STEPS = 20
+
+
+class LinearScanContiguousMemoryAllocator:
+    """
+    Reference copy of the allocation, release and defragmentation paths of the original allocator,
+    without its prints, for comparison.
+    """
+
+    def __init__(self, size, dtype, device):
+        self.buffer = torch.zeros(size, dtype=dtype, device=device)
+        self.contiguous_sizes = {0: size}
+        self.tensor_addresses = {}
+        self.tensor_sizes = {}
+        self.tensor_ids = {}
+        self.tensor_map = {}
+        self.total_size = size
+        self.total_free = size
+        self.largest_contiguous = size
+        self.num_defragmentations = 0
+        self.defragmented_numel = 0
+
+    def allocate_tensor(self, size):
+        assert size <= self.total_free, "Not enough memory in buffer. Allocation failed"
+        if self.largest_contiguous < size:
+            self._defragment_memory()
+        self.total_free = self.total_free - size
+        tensor_address = self._get_new_tensor_address(size)
+        return self._get_new_tensor(tensor_address, size)
+
+    def release_tensor(self, tensor):
+        self._release_tensor(id(tensor))
+        self.total_free += tensor.numel()
+
+    def _release_tensor(self, tensor_id):
+        address = self.tensor_addresses[tensor_id]
+        contiguous_size = self.tensor_map[tensor_id].numel()
+        del self.tensor_addresses[tensor_id]
+        del self.tensor_ids[address]
+        del self.tensor_map[tensor_id]
+        del self.tensor_sizes[address]
+        self._consolidate_address(address, contiguous_size)
+        self.largest_contiguous = self._largest_contiguous()
+
+    def _consolidate_address(self, address, contiguous_size):
+        end_address = address + contiguous_size
+        if end_address in self.contiguous_sizes:
+            contiguous_size += self.contiguous_sizes[end_address]
+            del self.contiguous_sizes[end_address]
+        for addr, size in self.contiguous_sizes.items():
+            if addr + size == address:
+                del self.contiguous_sizes[addr]
+                contiguous_size += size
+                address = addr
+                break
+        self.contiguous_sizes[address] = contiguous_size
+
+    def _defragment_memory(self):
+        self.num_defragmentations += 1
+        empty_addresses = sorted(self.contiguous_sizes.keys())
+        tensor_addresses = sorted(self.tensor_addresses.values())
+        for tensor_addr in tensor_addresses:
+            empty_addr = empty_addresses[0]
+            empty_size = self.contiguous_sizes[empty_addr]
+            tensor_size = self.tensor_sizes[tensor_addr]
+            tensor_id = self.tensor_ids[tensor_addr]
+            if empty_addr < tensor_addr:
+                src_addr = tensor_addr
+                dest_addr = empty_addr
+                while src_addr < (tensor_addr + tensor_size):
+                    copy_size = min(empty_size, tensor_addr + tensor_size - src_addr)
+                    self.buffer.narrow(0, dest_addr, copy_size).copy_(self.buffer.narrow(0, src_addr, copy_size))
+                    src_addr += copy_size
+                    dest_addr += copy_size
+                self._replace_old_address_with_new(tensor_id, empty_addr)
+                self.defragmented_numel += tensor_size
+            empty_addresses = sorted(self.contiguous_sizes.keys())
+
+    def _replace_old_address_with_new(self, tensor_id, new_address):
+        tensor = self.tensor_map[tensor_id]
+        tensor_size = tensor.numel()
+        tensor.data = self.buffer.narrow(0, new_address, tensor_size).data
+        self._release_tensor(tensor_id)
+        self._mark_as_occupied(new_address, tensor_size)
+        self.tensor_ids[new_address] = tensor_id
+        self.tensor_map[tensor_id] = tensor
+        self.tensor_addresses[tensor_id] = new_address
+        self.tensor_sizes[new_address] = tensor_size
+
+    def _get_new_tensor_address(self, size):
+        tensor_address = None
+        for address, contiguous_size in self.contiguous_sizes.items():
+            if contiguous_size >= size and \
+                    (tensor_address is None or contiguous_size < self.contiguous_sizes[tensor_address]):
+                tensor_address = address
+        return tensor_address
+
+    def _get_new_tensor(self, address, size):
+        new_tensor = self.buffer.narrow(0, address, size)
+        tensor_id = id(new_tensor)
+        self.tensor_addresses[tensor_id] = address
+        self.tensor_sizes[address] = size
+        self.tensor_ids[address] = tensor_id
+        self.tensor_map[tensor_id] = new_tensor
+        self._mark_as_occupied(address, size)
+        return new_tensor
+
+    def _largest_contiguous(self):
+        return max(self.contiguous_sizes.values()) if len(self.contiguous_sizes) > 0 else 0
+
+    def _mark_as_occupied(self, address, size):
+        available_contiguous_size = self.contiguous_sizes[address]
+        del self.contiguous_sizes[address]
+        if available_contiguous_size != size:
+            self.contiguous_sizes[address + size] = available_contiguous_size - size
+        self.largest_contiguous = self._largest_contiguous()
+
+    def fragmentation(self):
+        return 1.0 - self.largest_contiguous / self.total_free if self.total_free > 0 else 0.0
+
+
+def synthetic_trace():
+    """
+    Parameters of transformer layers are gathered in forward order and released once a few layers
+    later ones are live, then gathered again in reverse order for backward. Small parameters such as
+    norms and biases are kept live for a random number of layers, as persistent and prefetched
+    parameters are, so the freed layers leave holes between them.
+    """
+    random.seed(0)
+    h = HIDDEN
+    layer = [3 * h * h, 3 * h, h * h, h, 2 * h, 4 * h * h, 4 * h, 4 * h * h, h, 2 * h]
+    events = []
+    next_id = 0
+    live = {}
+    for step in range(STEPS):
+        order = list(range(NUM_LAYERS)) + list(reversed(range(NUM_LAYERS)))
+        for position, layer_id in enumerate(order):
+            for numel in layer:
+                lifetime = random.randint(1, LIVE_LAYERS) if numel < h * h else LIVE_LAYERS
+                events.append(["alloc", next_id, numel])
+                live[next_id] = position + lifetime
+                next_id += 1
+            for tensor_id in [tensor_id for tensor_id, release in live.items() if release <= position]:
+                events.append(["free", tensor_id])
+                del live[tensor_id]
+        for tensor_id in list(live):
+            events.append(["free", tensor_id])
+            del live[tensor_id]
+    return events
+
+
+def peak_live_numel(events):
+    sizes = {}
+    live = peak = 0
+    for event in events:
+        if event[0] == "alloc":
+            sizes[event[1]] = event[2]
+            live += event[2]
+            peak = max(peak, live)
+        else:
+            live -= sizes.pop(event[1])
+    return peak
+
+
+def replay(allocator_cls):
+    allocator = allocator_cls(buffer_size, torch.float32, 'cpu')
+    tensors = {}
+    fragmentation = []
+    # the allocator prints its layout around every defragmentation
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            if event[0] == "alloc":
+                tensors[event[1]] = allocator.allocate_tensor(event[2])
+            else:
+                allocator.release_tensor(tensors.pop(event[1]))
+                fragmentation.append(allocator.fragmentation())
+    assert allocator.total_free == buffer_size
+    return allocator, fragmentation
+
+
+def report(name, allocator_cls):
+    allocator, fragmentation = replay(allocator_cls)
+    print(f"{name}: defragmentations={allocator.num_defragmentations} "
+          f"defragmented_numel={allocator.defragmented_numel} "
+          f"mean_fragmentation={sum(fragmentation) / max(len(fragmentation), 1):.3f} "
+          f"max_fragmentation={max(fragmentation, default=0.0):.3f}")
+
+
+def linear_scan():
+    replay(LinearScanContiguousMemoryAllocator)
+
+
+def best_fit():
+    replay(ContiguousMemoryAllocator)
+
+
+#### cProfile ####
+
+import cProfile
+
+
+def cprofileme():
+    print("--------------- cProfile -----------------")
+    print("linear_scan")
+    cProfile.run("linear_scan()", sort=-1)
+    print("best_fit")
+    cProfile.run("best_fit()", sort=-1)
+
+
+#### timeit ####
+
+import timeit
+
+
+def timeme():
+    print("--------------- timeit -----------------")
+    print(f'linear_scan={timeit.Timer("linear_scan()", globals=globals()).timeit(number=1)}')
+    print(f'best_fit   ={timeit.Timer("best_fit()", globals=globals()).timeit(number=1)}')
+    report("linear_scan", LinearScanContiguousMemoryAllocator)
+    report("best_fit   ", ContiguousMemoryAllocator)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", action='store_true')
+    parser.add_argument("-t", action='store_true')
+    parser.add_argument("--trace", type=str, default=None, help="json allocation trace to replay")
+    parser.add_argument("--buffer-size", type=int, default=None, help="defaults to 1.02x the peak live numel")
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        with open(args.trace) as f:
+            events = json.load(f)
+    else:
+        events = synthetic_trace()
+    buffer_size = args.buffer_size or int(1.02 * peak_live_numel(events))
+
+    if args.c:
+        cprofileme()
+    elif args.t:
+        timeme()
@@ -0,0 +1,86 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+#!/usr/bin/env python
+# Compare building a RaggedBatchWrapper one sequence at a time against the bulk insert path.
+# Both paths finish with the same single host-to-device metadata transfer.
+#
+# usage:
+# ./ragged_batch_bench.py -t
+# ./ragged_batch_bench.py -c
+
+import argparse
+
+import torch
+
+from deepspeed.inference.v2.ragged import DSStateManagerConfig, PlaceholderSequenceDescriptor, RaggedBatchWrapper
+
+N_SEQS = 512
+N_PREFILL_SEQS = 8
+PREFILL_TOKENS = 256
+TIMES = 200
+
+config = DSStateManagerConfig(max_tracked_sequences=N_SEQS,
+                              max_ragged_sequence_count=N_SEQS,
+                              max_ragged_batch_size=N_SEQS + N_PREFILL_SEQS * PREFILL_TOKENS)
+batch = RaggedBatchWrapper(config)
+
+# A mixed batch of mostly decode tokens and a few prompts.
+seq_descs = [PlaceholderSequenceDescriptor(seen_tokens=i, kv_blocks_ptr=4096 * i) for i in range(N_SEQS)]
+seq_tokens = [
+    torch.randint(0, 32000, (PREFILL_TOKENS if i < N_PREFILL_SEQS else 1, ), dtype=torch.int64) for i in range(N_SEQS)
+]
+
+
+def incremental(n_seqs: int = N_SEQS):
+    for _ in range(TIMES):
+        batch.clear()
+        for seq_desc, tokens in zip(seq_descs[:n_seqs], seq_tokens[:n_seqs]):
+            batch.insert_sequence(seq_desc, tokens, do_checks=False)
+        batch.finalize()
+
+
+def bulk(n_seqs: int = N_SEQS):
+    for _ in range(TIMES):
+        batch.clear()
+        batch.insert_sequences(seq_descs[:n_seqs], seq_tokens[:n_seqs], do_checks=False)
+        batch.finalize()
+
+
+#### cProfile ####
+
+import cProfile
+
+
+def cprofileme():
+    print("--------------- cProfile -----------------")
+    print("incremental")
+    cProfile.run("incremental()", sort=-1)
+    print("bulk")
+    cProfile.run("bulk()", sort=-1)
+
+
+#### timeit ####
+
+import timeit
+
+
+def timeme():
+    print("--------------- timeit -----------------")
+    for n_seqs in (256, N_SEQS):
+        print(f"{n_seqs} sequences")
+        print(f'incremental={timeit.Timer(f"incremental({n_seqs})", globals=globals()).timeit(number=1)}')
+        print(f'bulk       ={timeit.Timer(f"bulk({n_seqs})", globals=globals()).timeit(number=1)}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", action='store_true')
+    parser.add_argument("-t", action='store_true')
+    args = parser.parse_args()
+    if args.c:
+        cprofileme()
+    elif args.t:
+        timeme()
@@ -0,0 +1,83 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import json
+import os
+
+import pytest
+import torch
+from torch import nn
+
+import deepspeed
+from deepspeed.module_inject.auto_tp import AutoTP
+from deepspeed.module_inject.auto_tp_checkpoint import TP_SHARDS_MANIFEST, load_tp_shards, save_tp_shards
+from deepspeed.module_inject.layers import LinearAllreduce, LinearLayer
+from deepspeed.module_inject.tp_shard import set_num_kv_heads
+
+TP_SIZE = 2
+
+
+class Block(nn.Module):
+
+    def __init__(self, hidden=16):
+        super().__init__()
+        self.norm = nn.LayerNorm(hidden)
+        self.up = nn.Linear(hidden, 4 * hidden)
+        self.down = nn.Linear(4 * hidden, hidden)
+        self.register_buffer("inv_freq", torch.arange(hidden, dtype=torch.float32), persistent=False)
+
+    def forward(self, x):
+        return self.down(self.up(self.norm(x)))
+
+
+def autotp(model):
+    set_num_kv_heads(None)
+    autotp = AutoTP(model, (".down", ), "", None, (nn.Linear, ), Block)
+    autotp.set_tensor_parallel_config(TP_SIZE, None)
+    autotp.update_linear_policies()
+    return autotp._replace_module(model)
+
+
+@pytest.mark.inference
+def test_save_load_tp_shards(tmpdir):
+    model = autotp(Block())
+    assert isinstance(model.up, LinearLayer) and isinstance(model.down, LinearAllreduce)
+    save_tp_shards(model, str(tmpdir), TP_SIZE, dtype=torch.float32)
+
+    with open(os.path.join(tmpdir, TP_SHARDS_MANIFEST)) as f:
+        manifest = json.load(f)
+    assert manifest["tp_size"] == TP_SIZE
+    assert manifest["shards"] == ["tp_rank_00.pt", "tp_rank_01.pt"]
+    assert "inv_freq" in manifest["tensors"]
+
+    # A later launch creates the model on the meta device, so nothing but the shard is read.
+    with deepspeed.OnDevice(dtype=torch.float32, device="meta"):
+        meta_model = Block()
+    loaded = autotp(meta_model)
+    loaded.to_empty(device="cpu")
+    load_tp_shards(loaded, str(tmpdir), TP_SIZE, dtype=torch.float32, mmap=True)
+
+    expected = dict(model.named_parameters())
+    expected.update(dict(model.named_buffers()))
+    for name, tensor in list(loaded.named_parameters()) + list(loaded.named_buffers()):
+        assert torch.equal(tensor, expected[name]), name
+
+    x = torch.randn(2, 16)
+    assert torch.equal(loaded(x), model(x))
+
+
+@pytest.mark.inference
+def test_tp_shards_mismatch(tmpdir):
+    model = autotp(Block())
+    save_tp_shards(model, str(tmpdir), TP_SIZE, dtype=torch.float32)
+
+    with pytest.raises(ValueError):
+        load_tp_shards(model, str(tmpdir), TP_SIZE * 2, dtype=torch.float32)
+    with pytest.raises(ValueError):
+        load_tp_shards(model, str(tmpdir), TP_SIZE, dtype=torch.float16)
+    with pytest.raises(ValueError):
+        load_tp_shards(autotp(Block(hidden=32)), str(tmpdir), TP_SIZE, dtype=torch.float32)
+    with pytest.raises(FileNotFoundError):
+        load_tp_shards(model, os.path.join(tmpdir, "missing"), TP_SIZE)
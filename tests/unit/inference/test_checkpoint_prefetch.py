@@ -0,0 +1,58 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import os
+import threading
+
+import pytest
+import torch
+
+import deepspeed.module_inject.load_checkpoint as load_checkpoint
+from deepspeed.module_inject.load_checkpoint import prefetch_state_dicts
+
+
+def save_shards(tmpdir, n_groups, group_size):
+    ckpt_groups = []
+    for i in range(n_groups):
+        ckpt_files = []
+        for j in range(group_size):
+            ckpt_file = os.path.join(tmpdir, f"shard_{i}_{j}.pt")
+            torch.save({"weight": torch.full((4, 4), i * group_size + j, dtype=torch.float16)}, ckpt_file)
+            ckpt_files.append(ckpt_file)
+        ckpt_groups.append(ckpt_files)
+    return ckpt_groups
+
+
+@pytest.mark.inference
+@pytest.mark.parametrize("num_workers", [0, 1, 3])
+@pytest.mark.parametrize("mmap", [False, True])
+def test_prefetch_order(tmpdir, num_workers, mmap):
+    ckpt_groups = save_shards(tmpdir, n_groups=5, group_size=2)
+    loaded = [[sd["weight"][0, 0].item() for sd in sds]
+              for sds in prefetch_state_dicts(ckpt_groups, num_workers=num_workers, mmap=mmap)]
+    assert loaded == [[2 * i, 2 * i + 1] for i in range(5)]
+
+
+@pytest.mark.inference
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_prefetch_bounded_lookahead(tmpdir, monkeypatch, num_workers):
+    ckpt_groups = save_shards(tmpdir, n_groups=6, group_size=1)
+    load_state_dict = load_checkpoint.load_state_dict
+    lock = threading.Lock()
+    started = []
+
+    def recording_load(ckpt_file, mmap=False):
+        with lock:
+            started.append(ckpt_file)
+        return load_state_dict(ckpt_file, mmap)
+
+    monkeypatch.setattr(load_checkpoint, "load_state_dict", recording_load)
+
+    for i, sds in enumerate(prefetch_state_dicts(ckpt_groups, num_workers=num_workers)):
+        # While group i is sliced, at most ``num_workers`` further groups have been read.
+        with lock:
+            assert len(started) <= i + 1 + num_workers
+        assert sds[0]["weight"][0, 0].item() == i
+    assert len(started) == len(ckpt_groups)
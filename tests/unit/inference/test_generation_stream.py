@@ -0,0 +1,97 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import threading
+
+import pytest
+import torch
+
+from deepspeed.inference.streamer import GenerationStream
+
+PROMPT = torch.tensor([[1, 2, 3]])
+
+
+def fake_generate(input_ids, max_new_tokens, streamer=None, step_events=None):
+    # Mirrors HF ``generate``: the prompt is streamed first, then the tokens of every step.
+    streamer.put(input_ids)
+    output = input_ids
+    for step in range(max_new_tokens):
+        if step_events is not None:
+            step_events[step].wait()
+        token = torch.tensor([100 + step])
+        streamer.put(token)
+        output = torch.cat([output, token[:, None]], dim=-1)
+    streamer.end()
+    return output
+
+
+@pytest.mark.inference
+@pytest.mark.parametrize("skip_prompt", [True, False])
+def test_stream_tokens(skip_prompt):
+    stream = GenerationStream(skip_prompt=skip_prompt).start(fake_generate, PROMPT, max_new_tokens=4)
+    tokens = [t.tolist() for t in stream]
+
+    expected = [[100], [101], [102], [103]]
+    assert tokens == expected if skip_prompt else tokens == [PROMPT.tolist()] + expected
+    assert stream.output.tolist() == [[1, 2, 3, 100, 101, 102, 103]]
+    assert not stream.running
+
+
+@pytest.mark.inference
+def test_first_token_before_completion():
+    step_events = [threading.Event() for _ in range(3)]
+    step_events[0].set()
+    stream = GenerationStream(timeout=10).start(fake_generate, PROMPT, max_new_tokens=3, step_events=step_events)
+
+    # The first token is available while the following steps are still blocked.
+    assert next(stream).tolist() == [100]
+    assert stream.running
+
+    for event in step_events[1:]:
+        event.set()
+    assert [t.tolist() for t in stream] == [[101], [102]]
+
+
+@pytest.mark.inference
+def test_cancel_mid_stream():
+    step_events = [threading.Event() for _ in range(8)]
+    step_events[0].set()
+    stream = GenerationStream(timeout=10).start(fake_generate, PROMPT, max_new_tokens=8, step_events=step_events)
+    assert next(stream).tolist() == [100]
+
+    stream.cancel()
+    step_events[1].set()
+    # Generation stops at the next step and no further tokens are produced.
+    assert list(stream) == []
+    assert stream.cancelled
+    assert stream.output is None
+    assert not stream.running
+
+
+@pytest.mark.inference
+def test_close_stream():
+    step_events = [threading.Event() for _ in range(4)]
+    with GenerationStream().start(fake_generate, PROMPT, max_new_tokens=4, step_events=step_events) as stream:
+        step_events[0].set()
+        assert next(stream).tolist() == [100]
+        for event in step_events[1:]:
+            event.set()
+    # Leaving the context cancels the remaining steps and joins the generation thread.
+    assert not stream.running
+    assert stream.cancelled
+
+
+@pytest.mark.inference
+def test_stream_error():
+
+    def failing_generate(input_ids, streamer=None):
+        streamer.put(input_ids)
+        streamer.put(torch.tensor([100]))
+        raise NotImplementedError("num_beams > 1")
+
+    stream = GenerationStream().start(failing_generate, PROMPT)
+    assert next(stream).tolist() == [100]
+    with pytest.raises(NotImplementedError):
+        next(stream)
@@ -0,0 +1,141 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import os
+from functools import partial
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.checkpoint import ShardedCheckpointLoader, shard_loader
+from deepspeed.inference.v2.checkpoint.huggingface_engine import _load_bin
+from deepspeed.inference.v2.checkpoint.shard_loader import _partition, safetensors_data_ranges
+
+safetensors_torch = pytest.importorskip("safetensors.torch")
+
+
+def _make_shards(tmpdir, extension: str):
+    torch.manual_seed(0)
+    shards = [{f"layers.{i}.{j}.weight": torch.randn(16, 8) for j in range(3)} for i in range(4)]
+    paths = []
+    for i, shard in enumerate(shards):
+        path = os.path.join(tmpdir, f"model-{i}.{extension}")
+        if extension == "safetensors":
+            safetensors_torch.save_file(shard, path)
+        else:
+            torch.save(shard, path)
+        paths.append(path)
+
+    reference = {name: param for shard in shards for name, param in shard.items()}
+    return paths, reference
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("extension", ["safetensors", "bin"])
+@pytest.mark.parametrize("prefetch_shards", [0, 1, 3])
+def test_loads_all_parameters(tmpdir, extension: str, prefetch_shards: int) -> None:
+    paths, reference = _make_shards(tmpdir, extension)
+    loader = ShardedCheckpointLoader(paths,
+                                     load_fn=partial(torch.load, map_location="cpu"),
+                                     prefetch_shards=prefetch_shards)
+
+    loaded = list(loader.parameters())
+    # Shards are consumed in order.
+    assert [name.split(".")[1] for name, _ in loaded] == [str(i) for i in range(4) for _ in range(3)]
+    assert len(loaded) == len(reference)
+    for name, param in loaded:
+        assert torch.equal(param, reference[name])
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("extension", ["safetensors", "bin"])
+def test_param_filter(tmpdir, extension: str) -> None:
+    paths, reference = _make_shards(tmpdir, extension)
+    loader = ShardedCheckpointLoader(paths,
+                                     load_fn=partial(torch.load, map_location="cpu"),
+                                     param_filter=lambda name: name.endswith(".1.weight"))
+
+    loaded = dict(loader.parameters())
+    assert sorted(loaded.keys()) == sorted(name for name in reference if name.endswith(".1.weight"))
+
+
+@pytest.mark.inference_v2
+def test_early_close(tmpdir) -> None:
+    paths, _ = _make_shards(tmpdir, "safetensors")
+    params = ShardedCheckpointLoader(paths, prefetch_shards=2).parameters()
+    next(params)
+    params.close()
+
+
+@pytest.mark.inference_v2
+def test_safetensors_data_ranges(tmpdir) -> None:
+    path = os.path.join(tmpdir, "model.safetensors")
+    safetensors_torch.save_file({"a": torch.zeros(4, dtype=torch.float16), "b": torch.zeros(3)}, path)
+
+    ranges = safetensors_data_ranges(path)
+    assert sorted(ranges.keys()) == ["a", "b"]
+    assert sorted(end - start for start, end in ranges.values()) == [8, 12]
+    assert max(end for _, end in ranges.values()) == os.path.getsize(path)
+
+
+@pytest.mark.inference_v2
+def test_missing_loader(tmpdir) -> None:
+    paths, _ = _make_shards(tmpdir, "bin")
+    with pytest.raises(ValueError):
+        list(ShardedCheckpointLoader(paths).parameters())
+
+    with pytest.raises(ValueError):
+        ShardedCheckpointLoader(paths, prefetch_shards=-1)
+
+    with pytest.raises(ValueError):
+        ShardedCheckpointLoader(paths, local_rank=2, local_world_size=2)
+
+
+@pytest.mark.inference_v2
+def test_partition() -> None:
+    ranges = [(0, 10), (20, 25), (30, 40)]
+    parts = [_partition(ranges, rank, 3) for rank in range(3)]
+    assert parts == [[(0, 8)], [(8, 10), (20, 25), (30, 31)], [(31, 40)]]
+    assert _partition(ranges, 0, 1) == ranges
+    assert _partition([], 1, 2) == []
+
+
+@pytest.mark.inference_v2
+def test_readahead_is_split_between_ranks(tmpdir, monkeypatch) -> None:
+    paths, reference = _make_shards(tmpdir, "safetensors")
+    read = []
+    monkeypatch.setattr(shard_loader, "_readahead", lambda path, ranges: read.append((path, ranges)))
+
+    for rank in range(3):
+        loader = ShardedCheckpointLoader(paths,
+                                         param_filter=lambda name: not name.endswith(".1.weight"),
+                                         local_rank=rank,
+                                         local_world_size=3)
+        loaded = dict(loader.parameters())
+        assert sorted(loaded.keys()) == sorted(name for name in reference if not name.endswith(".1.weight"))
+        for name, param in loaded.items():
+            assert torch.equal(param, reference[name])
+
+    # Together the ranks read ahead each wanted byte of each shard exactly once.
+    for path in paths:
+        ranges = safetensors_data_ranges(path)
+        wanted = sorted(byte for name, (start, end) in ranges.items() if not name.endswith(".1.weight")
+                        for byte in range(start, end))
+        read_ahead = sorted(byte for read_path, read_ranges in read if read_path == path for start, end in read_ranges
+                            for byte in range(start, end))
+        assert read_ahead == wanted
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("zipfile", [True, False])
+def test_load_bin(tmpdir, zipfile: bool) -> None:
+    path = os.path.join(tmpdir, "pytorch_model.bin")
+    state_dict = {"a": torch.randn(4, 3), "b": torch.arange(5)}
+    torch.save(state_dict, path, _use_new_zipfile_serialization=zipfile)
+
+    loaded = _load_bin(path)
+    assert sorted(loaded.keys()) == ["a", "b"]
+    for name, param in loaded.items():
+        assert torch.equal(param, state_dict[name])
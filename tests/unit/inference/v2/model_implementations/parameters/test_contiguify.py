@@ -3,6 +3,7 @@
 
 # DeepSpeed Team
 
+import os
 from typing import List
 
 import pytest
@@ -11,8 +12,10 @@ import torch
 from deepspeed.accelerator import get_accelerator
 from deepspeed.inference.v2.model_implementations.flat_model_helpers import (
     flatten_inference_model,
+    load_flattened_buffer,
     restore_inference_model,
 )
+from deepspeed.utils.torch import required_torch_version
 from deepspeed.inference.v2.model_implementations.layer_container_base import LayerContainer
 from .utils import SimpleParam, DummyInferenceModel
 
@@ -118,3 +121,20 @@ def test_contiguify_roundtrip():
 
     validate_containers(transformer_containers_r, non_transformer_container_r, transformer_params,
                         non_transformer_params)
+
+
+@pytest.mark.inference_v2
+@pytest.mark.skipif(not required_torch_version(min_version=2.1), reason="mmap loading requires torch >= 2.1")
+@pytest.mark.parametrize("mmap", [False, True])
+def test_load_flattened_buffer(tmpdir, mmap: bool):
+    """
+    Validate the serialized flat buffer is restored on the accelerator with or without memory mapping.
+    """
+    buffer = torch.randint(0, 255, (4096, ), dtype=torch.uint8, device=get_accelerator().current_device())
+    buffer_path = os.path.join(tmpdir, "params.pt")
+    torch.save(buffer, buffer_path)
+
+    restored = load_flattened_buffer(buffer_path, mmap=mmap)
+
+    assert restored.device == buffer.device
+    assert torch.equal(restored, buffer)
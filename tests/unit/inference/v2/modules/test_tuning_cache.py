@@ -0,0 +1,188 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import os
+import time
+from typing import Optional
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.config_v2 import KernelTuningConfig
+from deepspeed.inference.v2.inference_utils import DtypeEnum
+from deepspeed.inference.v2.modules import tuning_cache
+from deepspeed.inference.v2.modules.configs import DSLinearConfig
+from deepspeed.inference.v2.modules.interfaces import DSLinearBase
+from deepspeed.inference.v2.modules.module_registry import DSModuleRegistryBase
+from deepspeed.inference.v2.modules.tuning_cache import TuningCache, calibrate, select_implementation, tuning_key
+
+
+class TuningTestRegistry(DSModuleRegistryBase):
+    registry = {}
+
+    @staticmethod
+    def associated_class():
+        return DSLinearBase
+
+
+class TorchLinear(DSLinearBase):
+
+    delay = 0.0
+
+    @staticmethod
+    def supports_config(config: DSLinearConfig) -> bool:
+        return config.input_dtype == torch.float32
+
+    def transform_param(self, param: torch.Tensor) -> torch.Tensor:
+        return param
+
+    def forward(self, hidden_states: torch.Tensor, w: torch.Tensor, b: Optional[torch.Tensor] = None) -> torch.Tensor:
+        time.sleep(self.delay)
+        return hidden_states @ w.t()
+
+    @property
+    def output(self) -> torch.Tensor:
+        return None
+
+
+@TuningTestRegistry.register_module
+class SlowLinear(TorchLinear):
+    delay = 2e-3
+
+    @staticmethod
+    def name():
+        return "slow_linear"
+
+
+@TuningTestRegistry.register_module
+class FastLinear(TorchLinear):
+
+    @staticmethod
+    def name():
+        return "fast_linear"
+
+
+@TuningTestRegistry.register_module
+class Fp16OnlyLinear(FastLinear):
+
+    @staticmethod
+    def name():
+        return "fp16_linear"
+
+    @staticmethod
+    def supports_config(config: DSLinearConfig) -> bool:
+        return config.input_dtype == torch.float16
+
+
+CONFIG = DSLinearConfig(max_tokens=32,
+                        in_channels=8,
+                        out_channels=8,
+                        input_dtype=DtypeEnum.fp32,
+                        output_dtype=DtypeEnum.fp32)
+
+
+class CountingBenchmark:
+
+    def __init__(self) -> None:
+        self.n_calls = 0
+
+    def __call__(self, module, config, n_tokens):
+        self.n_calls += 1
+        w = module.transform_param(torch.randn(config.out_channels, config.in_channels))
+        hidden_states = torch.randn(n_tokens, config.in_channels)
+        return lambda: module(hidden_states, w)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(tuning_cache, "_OPEN_CACHES", {})
+
+
+@pytest.mark.inference_v2
+def test_calibrate_selects_fastest() -> None:
+    winner, timings = calibrate(TuningTestRegistry, ["slow_linear", "fast_linear"],
+                                CONFIG,
+                                CountingBenchmark(),
+                                batch_buckets=(1, 16, 64),
+                                iterations=2)
+    assert winner == "fast_linear"
+    # Buckets are clipped to the module's max_tokens.
+    assert sorted(timings["slow_linear"].keys()) == [1, 16, 32]
+
+
+@pytest.mark.inference_v2
+def test_calibration_is_persisted(tmp_path) -> None:
+    path = str(tmp_path / "tuning.json")
+    tuning = KernelTuningConfig(cache_path=path, calibrate=True, batch_buckets=(1, 8), iterations=2, model_key="tiny")
+
+    benchmark = CountingBenchmark()
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, tuning,
+                                 benchmark=benchmark) == "fast_linear"
+    assert benchmark.n_calls == 4
+
+    key = tuning_key(TuningTestRegistry, CONFIG, "tiny")
+    on_disk = TuningCache(path)
+    assert on_disk.lookup(key) == "fast_linear"
+    assert set(on_disk.timings(key).keys()) == {"slow_linear", "fast_linear"}
+
+    # A later build (new process) loads the decision instead of calibrating again.
+    tuning_cache._OPEN_CACHES.clear()
+    benchmark = CountingBenchmark()
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, tuning,
+                                 benchmark=benchmark) == "fast_linear"
+    assert benchmark.n_calls == 0
+
+    # Other models do not share the entry.
+    other = KernelTuningConfig(cache_path=path, model_key="other")
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, other) == "slow_linear"
+
+
+@pytest.mark.inference_v2
+def test_selection_fallbacks(tmp_path) -> None:
+    # Tuning disabled.
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, KernelTuningConfig()) == "slow_linear"
+
+    path = str(tmp_path / "tuning.json")
+    tuning = KernelTuningConfig(cache_path=path, calibrate=True, iterations=1)
+
+    # Excluded implementations are never selected. A single candidate is not calibrated or recorded.
+    benchmark = CountingBenchmark()
+    assert select_implementation(TuningTestRegistry,
+                                 "slow_linear",
+                                 CONFIG,
+                                 tuning,
+                                 exclude=["fast_linear"],
+                                 benchmark=benchmark) == "slow_linear"
+    assert benchmark.n_calls == 0
+    assert len(tuning_cache.get_tuning_cache(path)) == 0
+    assert not os.path.exists(path)
+
+    # Without a benchmark nothing is calibrated either.
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, tuning) == "slow_linear"
+    assert len(tuning_cache.get_tuning_cache(path)) == 0
+
+    # Entries naming an implementation that no longer supports the config are ignored.
+    cache = tuning_cache.get_tuning_cache(path)
+    cache.record(tuning_key(TuningTestRegistry, CONFIG), "fp16_linear")
+    no_calibration = KernelTuningConfig(cache_path=path)
+    assert select_implementation(TuningTestRegistry, "slow_linear", CONFIG, no_calibration) == "slow_linear"
+
+
+@pytest.mark.inference_v2
+def test_save_merges_entries(tmp_path) -> None:
+    path = str(tmp_path / "tuning.json")
+    first = TuningCache(path)
+    second = TuningCache(path)
+
+    first.record("a", "fast_linear", {"fast_linear": {1: 0.5}})
+    first.save()
+    second.record("b", "slow_linear")
+    second.save()
+
+    merged = TuningCache(path)
+    assert len(merged) == 2
+    assert merged.lookup("a") == "fast_linear"
+    assert merged.timings("a") == {"fast_linear": {"1": 0.5}}
+    assert merged.lookup("b") == "slow_linear"
@@ -0,0 +1,244 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import List, Optional, Tuple
+
+import torch
+
+from deepspeed.inference.v2.engine_v2 import InferenceEngineV2
+from deepspeed.inference.v2.inference_utils import DtypeEnum
+from deepspeed.inference.v2.ragged import (
+    AllocationMode,
+    DSStateManager,
+    DSStateManagerConfig,
+    KVCacheConfig,
+    MemoryConfig,
+)
+from deepspeed.inference.v2.ragged import ragged_manager
+from deepspeed.inference.v2.ragged.blocked_allocator import BlockedAllocator
+from deepspeed.inference.v2.ragged.kv_cache import KVCacheOccupancy
+from deepspeed.inference.v2.ragged.sequence_descriptor import DSSequenceDescriptor
+
+BLOCK_SIZE = 4
+MAX_BLOCKS = 64
+
+
+class FakeKVCache:
+    """
+    Stands in for ``BlockedKVCache`` so that a ``DSStateManager`` can be built on the host. Blocks are
+    tracked with a ``BlockedAllocator`` per cache group, and each block holds the token written to each
+    of its slots by ``FakeModel`` (-1 for an empty slot). With ``offload`` set, a host tier of
+    ``num_host_blocks`` blocks per cache group backs ``offload`` and ``restore``.
+    """
+
+    def __init__(self,
+                 configs: Tuple[KVCacheConfig, ...],
+                 memory_config: MemoryConfig,
+                 mp_group=None,
+                 offload: bool = False,
+                 num_host_blocks: int = 0) -> None:
+        assert AllocationMode(memory_config.mode) is AllocationMode.ALLOCATE
+        self._allocators = [BlockedAllocator(memory_config.size) for _ in configs]
+        self._caches = [
+            torch.full((memory_config.size, config.block_size), -1, dtype=torch.int64) for config in configs
+        ]
+        self._offload = offload
+        if offload:
+            self._host_allocators = [BlockedAllocator(num_host_blocks) for _ in configs]
+            self._host_caches = [
+                torch.full((num_host_blocks, config.block_size), -1, dtype=torch.int64) for config in configs
+            ]
+
+    def reserve(self, num_blocks: int, cache_group: int = 0) -> torch.Tensor:
+        return self._allocators[cache_group].allocate(num_blocks)
+
+    def free(self, blocks, cache_group: int = 0) -> None:
+        self._allocators[cache_group].free(blocks)
+
+    def copy_blocks(self, src_blocks: torch.Tensor, dst_blocks: torch.Tensor, cache_group: int = 0) -> None:
+        cache = self._caches[cache_group]
+        cache[dst_blocks.long()] = cache[src_blocks.long()]
+
+    def offload(self, blocks: torch.Tensor, cache_group: int = 0) -> torch.Tensor:
+        if not self._offload:
+            raise RuntimeError("KV-cache offloading is not enabled.")
+        host_blocks = self._host_allocators[cache_group].allocate(blocks.numel())
+        self._host_caches[cache_group][host_blocks.long()] = self._caches[cache_group][blocks.long()]
+        self._allocators[cache_group].free(blocks)
+        return host_blocks
+
+    def restore(self, blocks: torch.Tensor, cache_group: int = 0) -> torch.Tensor:
+        if not self._offload:
+            raise RuntimeError("KV-cache offloading is not enabled.")
+        new_blocks = self.reserve(blocks.numel(), cache_group=cache_group)
+        self._caches[cache_group][new_blocks.long()] = self._host_caches[cache_group][blocks.long()]
+        self._host_allocators[cache_group].free(blocks)
+        return new_blocks
+
+    def free_host(self, blocks, cache_group: int = 0) -> None:
+        self._host_allocators[cache_group].free(blocks)
+
+    def get_cache(self, cache_id: int, cache_group: int = 0) -> torch.Tensor:
+        return self._caches[cache_group]
+
+    def get_scales(self, cache_id: int, cache_group: int = 0) -> Optional[torch.Tensor]:
+        return None
+
+    @property
+    def free_blocks(self) -> List[int]:
+        return [allocator.free_blocks for allocator in self._allocators]
+
+    @property
+    def offload_enabled(self) -> bool:
+        return self._offload
+
+    def occupancy(self) -> Tuple[Tuple[KVCacheOccupancy, ...], Tuple[KVCacheOccupancy, ...]]:
+        device = tuple(KVCacheOccupancy(cache.shape[0], free) for cache, free in zip(self._caches, self.free_blocks))
+        if not self._offload:
+            return device, ()
+        host = tuple(
+            KVCacheOccupancy(cache.shape[0], allocator.free_blocks)
+            for cache, allocator in zip(self._host_caches, self._host_allocators))
+        return device, host
+
+    @property
+    def num_caches(self) -> int:
+        return len(self._caches)
+
+
+class _FakeRaggedUtils:
+
+    def allocate_fast_host_buffer(self, device_buffer: torch.Tensor) -> torch.Tensor:
+        return torch.empty_like(device_buffer, device="cpu")
+
+
+class _FakeRaggedUtilsBuilder:
+
+    def load(self) -> _FakeRaggedUtils:
+        return _FakeRaggedUtils()
+
+
+class _HostAccelerator:
+
+    def current_device(self) -> str:
+        return "cpu"
+
+
+class FakeBatch:
+    """
+    Records the sequences and tokens inserted by ``InferenceEngineV2.put`` in place of a ``RaggedBatchWrapper``.
+    """
+
+    def __init__(self) -> None:
+        self.sequences: List[Tuple[DSSequenceDescriptor, torch.Tensor]] = []
+
+    def clear(self) -> None:
+        self.sequences = []
+
+    def insert_sequences(self, seq_descs, tokens, do_checks: bool = True) -> None:
+        self.sequences.extend(zip(seq_descs, tokens))
+
+    def finalize(self, all_token_logits: bool = False) -> None:
+        pass
+
+    @property
+    def current_sequences(self) -> int:
+        return len(self.sequences)
+
+    @property
+    def current_tokens(self) -> int:
+        return sum(tokens.numel() for _, tokens in self.sequences)
+
+
+class FakeModel:
+    """
+    Model with the KV allocation of ``DSTransformerModelBase`` whose forward writes each token into its
+    slot of the ``FakeKVCache``, so that tests can check which tokens the blocks of a sequence hold.
+    """
+
+    tp_size = 1
+
+    def __init__(self, state_manager: DSStateManager) -> None:
+        self.state_manager = state_manager
+
+    def maybe_allocate_kv(self, sequence: DSSequenceDescriptor, n_new_tokens: int) -> None:
+        block_size = self.state_manager.kv_block_size
+        n_needed_blocks = -(-(sequence.seen_tokens + n_new_tokens) // block_size) - sequence.cur_allocated_blocks
+        if n_needed_blocks > 0:
+            sequence.extend_kv_cache(self.state_manager.allocate_blocks(n_needed_blocks))
+
+    def prepare_batch(self, batch: FakeBatch) -> None:
+        pass
+
+    def forward(self, batch: FakeBatch) -> torch.Tensor:
+        for seq, tokens in batch.sequences:
+            for cache_group in range(self.state_manager.n_kv_cache_groups):
+                cache = self.state_manager.get_cache(0, cache_group=cache_group)
+                block_ids = seq.kv_cache_ids(cache_group=cache_group)[0]
+                for position, token in enumerate(tokens.tolist(), start=seq.seen_tokens):
+                    cache[block_ids[position // cache.shape[1]], position % cache.shape[1]] = token
+        return torch.zeros((batch.current_sequences, 1))
+
+    def maybe_free_kv(self, sequence: DSSequenceDescriptor) -> None:
+        self.state_manager.release_retired_blocks(sequence)
+
+
+def kv_config(**kwargs) -> KVCacheConfig:
+    kwargs.setdefault("block_size", BLOCK_SIZE)
+    return KVCacheConfig(cache_shape=(1, 1, 8),
+                         cache_dtype=DtypeEnum.fp32,
+                         max_blocks_per_allocation_group=MAX_BLOCKS,
+                         **kwargs)
+
+
+def build_state_manager(monkeypatch,
+                        kv_configs: Optional[Tuple[KVCacheConfig, ...]] = None,
+                        n_blocks: int = MAX_BLOCKS,
+                        **config_kwargs) -> DSStateManager:
+    """
+    Build a ``DSStateManager`` on the host with a ``FakeKVCache`` of ``n_blocks`` blocks per cache group.
+    """
+    monkeypatch.setattr(ragged_manager, "RaggedUtilsBuilder", _FakeRaggedUtilsBuilder)
+    monkeypatch.setattr(ragged_manager, "get_accelerator", _HostAccelerator)
+    monkeypatch.setattr(ragged_manager, "BlockedKVCache", FakeKVCache)
+
+    config = DSStateManagerConfig(max_tracked_sequences=8,
+                                  max_ragged_sequence_count=4,
+                                  max_context=BLOCK_SIZE * MAX_BLOCKS,
+                                  memory_config=MemoryConfig(mode=AllocationMode.ALLOCATE, size=n_blocks),
+                                  **config_kwargs)
+    return DSStateManager(config, kv_configs if kv_configs is not None else (kv_config(), ))
+
+
+def build_engine(monkeypatch, **kwargs) -> InferenceEngineV2:
+    """
+    Build an ``InferenceEngineV2`` around the state manager of ``build_state_manager`` and a ``FakeModel``.
+    """
+    engine = InferenceEngineV2.__new__(InferenceEngineV2)
+    engine._state_manager = build_state_manager(monkeypatch, **kwargs)
+    engine._model = FakeModel(engine._state_manager)
+    engine._batch = FakeBatch()
+    engine._telemetry = None
+    engine._lora = None
+    engine._seq_adapters = {}
+    return engine
+
+
+def put(engine: InferenceEngineV2, uid: int, tokens: List[int]) -> torch.Tensor:
+    """
+    Run a forward of ``tokens`` for a single sequence and return the tokens that reached the model.
+    """
+    engine.put([uid], [torch.tensor(tokens)], do_checks=False)
+    return engine._batch.sequences[0][1]
+
+
+def sequence_tokens(state_manager: DSStateManager, uid: int, cache_group: int = 0) -> List[int]:
+    """
+    The tokens held by the KV blocks of a sequence for each of its seen tokens (-1 for an empty slot).
+    """
+    seq = state_manager.get_sequence(uid)
+    cache = state_manager.get_cache(0, cache_group=cache_group)
+    block_ids = seq.kv_cache_ids(cache_group=cache_group)[0]
+    return [cache[block_ids[i // cache.shape[1]], i % cache.shape[1]].item() for i in range(seq.seen_tokens)]
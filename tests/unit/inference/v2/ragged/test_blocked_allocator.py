@@ -162,3 +162,30 @@ def test_long_running_allocation(test_iters: int) -> None:
 
     assert num_allocs == num_frees + len(all_allocs)
     assert num_blocks_allocated == num_blocks_freed + (TOTAL_BLOCKS - allocator.free_blocks)
+
+
+@pytest.mark.inference_v2
+def test_duplicate_dealloc() -> None:
+    allocator = BlockedAllocator(4)
+    blocks = allocator.allocate(2)
+
+    with pytest.raises(ValueError):
+        allocator.free(torch.tensor([blocks[0], blocks[0]]))
+
+    # Neither block should be freed by the failed call.
+    assert allocator.free_blocks == 2
+
+    allocator.free(blocks[0].item())
+    assert allocator.free_blocks == 3
+
+
+@pytest.mark.inference_v2
+def test_reuse_after_free() -> None:
+    allocator = BlockedAllocator(8)
+    first = allocator.allocate(8)
+    allocator.free(first[2:5])
+
+    # Only the freed blocks may be handed back out.
+    reused = allocator.allocate(3)
+    assert sorted(reused.tolist()) == sorted(first[2:5].tolist())
+    assert allocator.free_blocks == 0
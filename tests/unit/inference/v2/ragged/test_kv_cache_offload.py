@@ -0,0 +1,70 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.accelerator import get_accelerator
+from deepspeed.inference.v2.inference_utils import DtypeEnum
+from deepspeed.inference.v2.ragged import AllocationMode, KVCacheConfig, MemoryConfig
+from deepspeed.inference.v2.ragged.kv_cache import BlockedKVCache
+
+
+def _build_cache(n_blocks: int = 16, n_host_blocks: int = 8) -> BlockedKVCache:
+    config = KVCacheConfig(block_size=4, cache_shape=(2, 2, 8), cache_dtype=DtypeEnum.fp32)
+    memory_config = MemoryConfig(mode=AllocationMode.ALLOCATE, size=n_blocks)
+    return BlockedKVCache((config, ), memory_config, offload=True, num_host_blocks=n_host_blocks)
+
+
+@pytest.mark.inference_v2
+def test_offload_restore_roundtrip() -> None:
+    kv_cache = _build_cache()
+    blocks = kv_cache.reserve(5)
+
+    for i, block in enumerate(blocks.tolist()):
+        kv_cache._caches[0][:, block].fill_(float(i + 1))
+    expected = kv_cache._caches[0][:, blocks.long()].clone()
+
+    host_blocks = kv_cache.offload(blocks)
+    assert host_blocks.numel() == 5
+
+    device, host = kv_cache.occupancy()
+    assert device[0].free_blocks == 16
+    assert host[0].used_blocks == 5
+
+    # Scribble over the freed accelerator blocks before restoring.
+    kv_cache.reserve(16)
+    kv_cache._caches[0].zero_()
+    kv_cache.free(torch.arange(16, dtype=torch.int32))
+
+    restored = kv_cache.restore(host_blocks)
+    get_accelerator().synchronize()
+
+    assert torch.equal(kv_cache._caches[0][:, restored.long()], expected)
+
+    device, host = kv_cache.occupancy()
+    assert device[0].used_blocks == 5
+    assert host[0].used_blocks == 0
+
+
+@pytest.mark.inference_v2
+def test_offload_host_capacity() -> None:
+    kv_cache = _build_cache(n_host_blocks=2)
+    blocks = kv_cache.reserve(3)
+
+    with pytest.raises(ValueError):
+        kv_cache.offload(blocks)
+
+    # A failed offload must not release the accelerator blocks.
+    assert kv_cache.free_blocks[0] == 13
+
+
+@pytest.mark.inference_v2
+def test_offload_disabled() -> None:
+    config = KVCacheConfig(block_size=4, cache_shape=(2, 2, 8), cache_dtype=DtypeEnum.fp32)
+    kv_cache = BlockedKVCache((config, ), MemoryConfig(mode=AllocationMode.ALLOCATE, size=4))
+
+    with pytest.raises(RuntimeError):
+        kv_cache.offload(kv_cache.reserve(1))
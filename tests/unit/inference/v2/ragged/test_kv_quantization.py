@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.accelerator import get_accelerator
+from deepspeed.inference.v2.inference_utils import DtypeEnum
+from deepspeed.inference.v2.ragged import AllocationMode, KVCacheConfig, KVQuantizationType, MemoryConfig
+from deepspeed.inference.v2.ragged.kv_cache import BlockedKVCache
+from deepspeed.inference.v2.ragged.kv_quantization import dequantize_kv_blocks, quantize_kv_blocks
+
+# Relative error bound of each format, with respect to the largest magnitude of a block and head.
+TOLERANCES = {
+    KVQuantizationType.INT8: 1 / 254,
+    KVQuantizationType.FP8: 1 / 16,
+}
+
+BLOCK_SHAPE = (4, 2, 2, 8)
+
+
+def _build_cache(quantization: KVQuantizationType, offload: bool = False) -> BlockedKVCache:
+    config = KVCacheConfig(block_size=4, cache_shape=(2, 2, 8), cache_dtype=DtypeEnum.fp32, quantization=quantization)
+    memory_config = MemoryConfig(mode=AllocationMode.ALLOCATE, size=8)
+    return BlockedKVCache((config, ), memory_config, offload=offload, num_host_blocks=4)
+
+
+def _blocks(n_blocks: int) -> torch.Tensor:
+    # Heads and keys/values with very different magnitudes exercise the per-head scales.
+    magnitudes = torch.tensor([[1.0, 100.0], [0.01, 5.0]]).view(1, 1, 2, 2, 1)
+    return torch.randn(n_blocks, *BLOCK_SHAPE) * magnitudes
+
+
+def _assert_close(actual: torch.Tensor, expected: torch.Tensor, quantization: KVQuantizationType) -> None:
+    bound = expected.abs().amax(dim=(1, 4), keepdim=True) * TOLERANCES[quantization]
+    assert ((actual - expected).abs() <= bound + 1e-6).all()
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("quantization", [KVQuantizationType.INT8, KVQuantizationType.FP8])
+def test_reference_roundtrip(quantization: KVQuantizationType) -> None:
+    blocks = _blocks(3)
+    quantized, scales = quantize_kv_blocks(blocks, quantization)
+    assert quantized.element_size() == 1
+    assert scales.shape == (3, 2, 2)
+
+    _assert_close(dequantize_kv_blocks(quantized, scales, torch.float32), blocks, quantization)
+
+    # Empty blocks must not produce NaNs.
+    zeros, zero_scales = quantize_kv_blocks(torch.zeros(1, *BLOCK_SHAPE), quantization)
+    assert not dequantize_kv_blocks(zeros, zero_scales, torch.float32).isnan().any()
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("quantization", [KVQuantizationType.INT8, KVQuantizationType.FP8])
+def test_quantized_cache(quantization: KVQuantizationType) -> None:
+    kv_cache = _build_cache(quantization, offload=True)
+    blocks = kv_cache.reserve(3)
+    values = _blocks(3)
+    for cache_id in range(2):
+        kv_cache.store_blocks(cache_id, blocks, values * (cache_id + 1))
+
+    assert kv_cache.get_cache(0).element_size() == 1
+    _assert_close(kv_cache.load_blocks(1, blocks).cpu(), values * 2, quantization)
+
+    # Scales travel with their blocks when blocks are copied, offloaded and restored.
+    copies = kv_cache.reserve(3)
+    kv_cache.copy_blocks(blocks, copies)
+    assert torch.equal(kv_cache.load_blocks(0, copies), kv_cache.load_blocks(0, blocks))
+
+    expected = kv_cache.load_blocks(1, blocks)
+    host_blocks = kv_cache.offload(blocks)
+    kv_cache.reserve(kv_cache.free_blocks[0])
+    kv_cache.get_scales(1).fill_(0.0)
+    kv_cache.free(torch.tensor([b for b in range(8) if b not in copies.tolist()], dtype=torch.int32))
+
+    restored = kv_cache.restore(host_blocks)
+    get_accelerator().synchronize()
+    assert torch.equal(kv_cache.load_blocks(1, restored), expected)
+
+
+@pytest.mark.inference_v2
+def test_quantized_footprint() -> None:
+    dense = KVCacheConfig(block_size=64, cache_shape=(32, 8, 128), cache_dtype=DtypeEnum.fp16)
+    quantized = KVCacheConfig(block_size=64,
+                              cache_shape=(32, 8, 128),
+                              cache_dtype=DtypeEnum.fp16,
+                              quantization=KVQuantizationType.INT8)
+    ratio = BlockedKVCache.block_footprint(dense) / BlockedKVCache.block_footprint(quantized)
+    assert 1.9 < ratio < 2.0
+
+    # Unquantized caches have no scales.
+    assert _build_cache(KVQuantizationType.NONE).get_scales(0) is None
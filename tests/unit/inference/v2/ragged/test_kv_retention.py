@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+
+from deepspeed.pydantic_v1 import ValidationError
+
+from deepspeed.inference.v2.ragged import KVCacheConfig, KVCacheType
+from deepspeed.inference.v2.ragged.ragged_manager import retired_kv_blocks
+from .state_manager_testing_utils import BLOCK_SIZE, MAX_BLOCKS, build_engine, kv_config, put, sequence_tokens
+
+
+def _config(window_size: int, sink_blocks: int = 0) -> KVCacheConfig:
+    return kv_config(type=KVCacheType.LOCAL, window_size=window_size, sink_blocks=sink_blocks)
+
+
+@pytest.mark.inference_v2
+def test_retired_blocks() -> None:
+    config = _config(window_size=8)
+    # The next token at position 12 attends to positions 5 through 12, so block 0 is retired.
+    assert retired_kv_blocks(12, config) == 1
+    assert retired_kv_blocks(10, config) == 0
+    assert retired_kv_blocks(15, config) == 2
+
+    dense = KVCacheConfig(block_size=BLOCK_SIZE, cache_shape=(1, 1, 8))
+    assert retired_kv_blocks(1000, dense) == 0
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("sink_blocks", [0, 1, 2])
+def test_long_chat_bounded_memory(monkeypatch, sink_blocks: int) -> None:
+    config = _config(window_size=10, sink_blocks=sink_blocks)
+    engine = build_engine(monkeypatch, kv_configs=(config, ))
+    state_manager = engine._state_manager
+
+    put(engine, 0, list(range(9)))
+    seq = state_manager.get_sequence(0)
+    sinks = seq.all_block_ids()[:sink_blocks].tolist()
+
+    max_retained = 0
+    for token in range(9, 159):
+        put(engine, 0, [token])
+        max_retained = max(max_retained, seq.all_block_ids().numel())
+
+    assert seq.seen_tokens == 159
+    # Blocks only cover the sinks and the window of the next token, rounded out to full blocks.
+    assert max_retained <= sink_blocks + -(-config.window_size // BLOCK_SIZE) + 1
+    assert state_manager.free_blocks == [MAX_BLOCKS - seq.all_block_ids().numel()]
+    assert seq.all_block_ids()[:sink_blocks].tolist() == sinks
+
+    # Released blocks keep their position, so the block of the next token is still found by index.
+    assert seq.cur_allocated_blocks == 40
+    assert seq.n_released_blocks() == 40 - seq.all_block_ids().numel()
+    window_blocks = seq.kv_cache_ids()[0][sink_blocks + seq.n_released_blocks():40]
+    assert window_blocks.tolist() == seq.all_block_ids()[sink_blocks:].tolist()
+
+    # The sinks and the window still hold their tokens.
+    tokens = sequence_tokens(state_manager, 0)
+    assert tokens[:sink_blocks * BLOCK_SIZE] == list(range(sink_blocks * BLOCK_SIZE))
+    assert tokens[-config.window_size:] == list(range(159 - config.window_size, 159))
+
+    engine.flush(0)
+    assert state_manager.free_blocks == [MAX_BLOCKS]
+
+
+@pytest.mark.inference_v2
+def test_released_blocks_cannot_be_detached(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, kv_configs=(_config(window_size=8, sink_blocks=1), ))
+    state_manager = engine._state_manager
+    put(engine, 0, list(range(26)))
+    seq = state_manager.get_sequence(0)
+    assert seq.n_released_blocks() == 3
+    assert state_manager.free_blocks == [MAX_BLOCKS - 4]
+
+    # Blocks after the released range may still be detached, i.e. to truncate the sequence.
+    engine.truncate(0, 23)
+    assert state_manager.free_blocks == [MAX_BLOCKS - 3]
+    with pytest.raises(RuntimeError):
+        engine.truncate(0, 22)
+    with pytest.raises(ValueError):
+        seq.detach_kv_blocks(3)
+    with pytest.raises(ValueError):
+        seq.release_kv_blocks(0, 5)
+
+
+@pytest.mark.inference_v2
+def test_window_config_validation() -> None:
+    with pytest.raises(ValidationError):
+        KVCacheConfig(block_size=BLOCK_SIZE, cache_shape=(1, 1, 8), window_size=8)
+    with pytest.raises(ValidationError):
+        KVCacheConfig(type=KVCacheType.LOCAL, block_size=BLOCK_SIZE, cache_shape=(1, 1, 8), sink_blocks=1)
@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+
+from .state_manager_testing_utils import build_engine, put, sequence_tokens
+
+
+def _host_free_blocks(state_manager):
+    return [occupancy.free_blocks for occupancy in state_manager._kv_cache.occupancy()[1]]
+
+
+@pytest.mark.inference_v2
+def test_park_resume_roundtrip(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, n_blocks=8, offload=True, offload_blocks=8)
+    state_manager = engine._state_manager
+    tokens = list(range(10))
+    put(engine, 0, tokens)
+
+    engine.park(0)
+    assert state_manager.is_parked(0)
+    assert state_manager._kv_cache.free_blocks == [8]
+    assert _host_free_blocks(state_manager) == [5]
+
+    # Overwrite the released blocks so that the restored contents must come from the host tier.
+    other = list(range(100, 112))
+    put(engine, 1, other)
+
+    engine.resume(0)
+    assert not state_manager.is_parked(0)
+    assert state_manager._kv_cache.free_blocks == [2]
+    assert _host_free_blocks(state_manager) == [8]
+    assert sequence_tokens(state_manager, 0) == tokens
+    assert sequence_tokens(state_manager, 1) == other
+
+    # A parked sequence is resumed by its next forward.
+    engine.park(0)
+    assert put(engine, 0, [10, 11]).tolist() == [10, 11]
+    assert not state_manager.is_parked(0)
+    assert sequence_tokens(state_manager, 0) == tokens + [10, 11]
+
+    engine.park(0)
+    engine.flush(0)
+    engine.flush(1)
+    assert state_manager._kv_cache.free_blocks == [8]
+    assert _host_free_blocks(state_manager) == [8]
+
+
+@pytest.mark.inference_v2
+def test_park_keeps_cached_prefix(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, n_blocks=8, enable_prefix_cache=True, offload=True, offload_blocks=8)
+    state_manager = engine._state_manager
+    tokens = list(range(10))
+    put(engine, 0, tokens)
+    cached = state_manager.get_sequence(0).all_block_ids()[:2].tolist()
+
+    # Only the partial block is copied to the host, the shared blocks stay on the accelerator.
+    engine.park(0)
+    assert state_manager._kv_cache.free_blocks == [6]
+    assert _host_free_blocks(state_manager) == [7]
+    assert state_manager.prefix_cache.n_evictable_blocks == 0
+
+    engine.resume(0)
+    assert state_manager.get_sequence(0).all_block_ids()[:2].tolist() == cached
+    assert state_manager._kv_cache.free_blocks == [5]
+    assert sequence_tokens(state_manager, 0) == tokens
+
+
+@pytest.mark.inference_v2
+def test_resume_evicts_cached_blocks(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, n_blocks=6, enable_prefix_cache=True, offload=True, offload_blocks=8)
+    state_manager = engine._state_manager
+    tokens = list(range(10))
+    put(engine, 0, tokens)
+    engine.park(0)
+    assert state_manager._kv_cache.free_blocks == [4]
+
+    other = list(range(100, 116))
+    put(engine, 1, other)
+    engine.flush(1)
+    assert state_manager._kv_cache.free_blocks == [0]
+    assert state_manager.prefix_cache.n_evictable_blocks == 4
+
+    engine.resume(0)
+    assert state_manager._kv_cache.free_blocks == [0]
+    assert state_manager.prefix_cache.n_evictable_blocks == 3
+    assert sequence_tokens(state_manager, 0) == tokens
+
+
+@pytest.mark.inference_v2
+def test_resume_without_capacity(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, n_blocks=6, enable_prefix_cache=True, offload=True, offload_blocks=8)
+    state_manager = engine._state_manager
+    tokens = list(range(10))
+    put(engine, 0, tokens)
+    engine.park(0)
+
+    # The cached blocks are all referenced by the running sequence, so none can be evicted.
+    put(engine, 1, list(range(100, 116)))
+    assert state_manager._kv_cache.free_blocks == [0]
+    with pytest.raises(RuntimeError):
+        engine.resume(0)
+    assert state_manager.is_parked(0)
+    assert state_manager._kv_cache.free_blocks == [0]
+    assert _host_free_blocks(state_manager) == [7]
+
+    # Eviction coming up short is caught before any block is restored.
+    engine.flush(1)
+    with monkeypatch.context() as m:
+        m.setattr(state_manager.prefix_cache, "evict", lambda n_blocks: [])
+        with pytest.raises(RuntimeError):
+            engine.resume(0)
+    assert state_manager.is_parked(0)
+    assert state_manager._kv_cache.free_blocks == [0]
+    assert _host_free_blocks(state_manager) == [7]
+
+    engine.resume(0)
+    assert sequence_tokens(state_manager, 0) == tokens
@@ -0,0 +1,165 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Dict, List
+
+import pytest
+import torch
+
+from deepspeed.pydantic_v1 import ValidationError
+
+from deepspeed.inference.v2.ragged import (
+    DSStateManagerConfig,
+    PreemptedSequence,
+    PreemptionCandidate,
+    PreemptionConfig,
+    PreemptionMode,
+    PreemptionOrder,
+    PreemptionPolicy,
+)
+from deepspeed.inference.v2.ragged.blocked_allocator import BlockedAllocator
+from deepspeed.inference.v2.ragged.sequence_descriptor import DSSequenceDescriptor
+from .state_manager_testing_utils import build_engine, put, sequence_tokens
+
+BLOCK_SIZE = 4
+N_BLOCKS = 12
+
+
+class FakeKVCache:
+    """
+    Tracks the KV blocks of sequences with a ``BlockedAllocator`` in place of a KV-cache.
+    """
+
+    def __init__(self) -> None:
+        self.allocator = BlockedAllocator(N_BLOCKS)
+        self.seqs: Dict[int, DSSequenceDescriptor] = {}
+        self.priorities: Dict[int, int] = {}
+        self.arrivals: Dict[int, int] = {}
+
+    def admit(self, uid: int, n_tokens: int, priority: int = 0) -> None:
+        kv_ids = torch.zeros((1, N_BLOCKS), dtype=torch.int32)
+        seq = DSSequenceDescriptor(uid, (kv_ids, ), (kv_ids.clone(), ))
+        seq.extend_kv_cache(self.allocator.allocate(-(-n_tokens // BLOCK_SIZE)))
+        seq.pre_forward(n_tokens)
+        seq.post_forward()
+        self.seqs[uid] = seq
+        self.priorities[uid] = priority
+        self.arrivals[uid] = len(self.arrivals)
+
+    def candidates(self) -> List[PreemptionCandidate]:
+        return [
+            PreemptionCandidate(uid, self.priorities[uid], self.arrivals[uid],
+                                seq.all_block_ids().numel()) for uid, seq in self.seqs.items()
+        ]
+
+    def release(self, uid: int) -> PreemptedSequence:
+        seq = self.seqs.pop(uid)
+        self.allocator.free(seq.all_block_ids())
+        return PreemptedSequence(uid, PreemptionMode.RECOMPUTE, seq.seen_tokens, self.priorities[uid],
+                                 self.arrivals[uid])
+
+
+def _policy(order: PreemptionOrder) -> PreemptionPolicy:
+    return PreemptionPolicy(PreemptionConfig(mode=PreemptionMode.RECOMPUTE, order=order))
+
+
+@pytest.mark.inference_v2
+def test_priority_victims() -> None:
+    cache = FakeKVCache()
+    cache.admit(0, 12, priority=1)
+    cache.admit(1, 8)
+    cache.admit(2, 8)
+    cache.admit(3, 12, priority=2)
+    assert cache.allocator.free_blocks == 2
+
+    # A burst arrives that needs 5 blocks: the low priority sequences go first, newest first.
+    policy = _policy(PreemptionOrder.PRIORITY)
+    victims = policy.select_victims(cache.candidates(), 5 - cache.allocator.free_blocks, max_priority=1)
+    assert [victim.uid for victim in victims] == [2, 1]
+
+    preempted = [cache.release(victim.uid) for victim in victims]
+    assert cache.allocator.free_blocks == 6
+    assert [seq.n_tokens for seq in preempted] == [8, 8]
+
+    # Sequences of a higher priority than the burst are not preempted for it.
+    assert policy.select_victims(cache.candidates(), 4, max_priority=1) == []
+    assert [victim.uid for victim in policy.select_victims(cache.candidates(), 3, max_priority=2)] == [0]
+
+    # Re-admission is the reverse of preemption, so the earliest admitted sequence returns first.
+    assert policy.readmission_order(preempted) == [1, 2]
+
+
+@pytest.mark.inference_v2
+def test_newest_victims() -> None:
+    cache = FakeKVCache()
+    for uid, priority in enumerate([0, 3, 1]):
+        cache.admit(uid, 8, priority=priority)
+
+    policy = _policy(PreemptionOrder.NEWEST)
+    victims = policy.select_victims(cache.candidates(), 3, max_priority=0)
+    assert [victim.uid for victim in victims] == [2, 1]
+
+    preempted = [cache.release(victim.uid) for victim in victims]
+    assert policy.readmission_order(preempted) == [1, 2]
+
+
+@pytest.mark.inference_v2
+def test_insufficient_victims() -> None:
+    cache = FakeKVCache()
+    cache.admit(0, 8)
+    cache.admit(1, 4)
+
+    policy = _policy(PreemptionOrder.PRIORITY)
+    # Preempting every candidate would still not free enough blocks, so nothing is preempted.
+    assert policy.select_victims(cache.candidates(), 4) == []
+    assert policy.select_victims(cache.candidates(), 0) == []
+
+    disabled = PreemptionPolicy(PreemptionConfig())
+    assert not disabled.enabled
+    assert disabled.select_victims(cache.candidates(), 1) == []
+
+
+@pytest.mark.inference_v2
+def test_swap_requires_offload() -> None:
+    with pytest.raises(ValidationError):
+        DSStateManagerConfig(preemption={"mode": "swap"})
+    config = DSStateManagerConfig(offload=True, preemption={"mode": "swap", "order": "newest"})
+    assert PreemptionOrder(config.preemption.order) is PreemptionOrder.NEWEST
+
+
+@pytest.mark.inference_v2
+def test_swap_preemption(monkeypatch) -> None:
+    engine = build_engine(monkeypatch,
+                          n_blocks=N_BLOCKS,
+                          offload=True,
+                          offload_blocks=3,
+                          preemption=PreemptionConfig(mode=PreemptionMode.SWAP))
+    state_manager = engine._state_manager
+    tokens = {uid: list(range(uid * 100, uid * 100 + 8)) for uid in range(3)}
+    engine.set_priority(0, 1)
+    for uid in range(3):
+        put(engine, uid, tokens[uid])
+    assert state_manager._kv_cache.free_blocks == [6]
+
+    # The newest low priority sequence is parked, the host tier is then too full for the next victim so it
+    # is released instead.
+    preempted = state_manager.preempt(4, max_priority=0)
+    assert [(seq.uid, seq.mode, seq.n_tokens) for seq in preempted] == [(2, PreemptionMode.SWAP, 8),
+                                                                        (1, PreemptionMode.RECOMPUTE, 8)]
+    assert state_manager.is_parked(2)
+    assert state_manager.get_sequence(1) is None
+    assert state_manager._kv_cache.free_blocks == [10]
+    assert sorted(state_manager.preempted_sequences) == [1, 2]
+    assert state_manager.readmission_order() == [1, 2]
+
+    # The released sequence is re-admitted with its full token history, the parked one is restored by put.
+    assert put(engine, 1, tokens[1]).tolist() == tokens[1]
+    assert sorted(state_manager.preempted_sequences) == [2]
+    assert put(engine, 2, [300]).tolist() == [300]
+    assert not state_manager.is_parked(2)
+    assert state_manager.preempted_sequences == {}
+    assert sequence_tokens(state_manager, 2) == tokens[2] + [300]
+    assert sequence_tokens(state_manager, 1) == tokens[1]
+    assert sequence_tokens(state_manager, 0) == tokens[0]
@@ -0,0 +1,256 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.ragged.cache_tree import PrefixCacheTree
+from deepspeed.inference.v2.ragged.sequence_descriptor import DSSequenceDescriptor
+from .state_manager_testing_utils import BLOCK_SIZE, build_engine, put, sequence_tokens
+
+
+def _insert_sequence(tree: PrefixCacheTree, tokens, block_ids):
+    nodes = []
+    parent = None
+    for i, block_id in enumerate(block_ids):
+        node, _ = tree.insert(parent, tokens[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE], block_id)
+        tree.acquire([node])
+        nodes.append(node)
+        parent = node
+    return nodes
+
+
+@pytest.mark.inference_v2
+def test_longest_prefix_match() -> None:
+    tree = PrefixCacheTree(BLOCK_SIZE)
+    tokens = list(range(12))
+    _insert_sequence(tree, tokens, [7, 8, 9])
+
+    # Shares the first two blocks only.
+    query = tokens[:8] + [100, 101, 102, 103, 104]
+    matched = tree.match(torch.tensor(query))
+    assert [node.block_id for node in matched] == [7, 8]
+
+    # Bounded by max_blocks.
+    assert [node.block_id for node in tree.match(tokens, max_blocks=1)] == [7]
+
+    # Diverges in the first block.
+    assert tree.match([0, 1, 2, 99] + tokens[4:]) == []
+
+
+@pytest.mark.inference_v2
+def test_duplicate_insert_is_not_owned() -> None:
+    tree = PrefixCacheTree(BLOCK_SIZE)
+    first, owned = tree.insert(None, [1, 2, 3, 4], 0)
+    assert owned
+
+    second, owned = tree.insert(None, [1, 2, 3, 4], 5)
+    assert not owned
+    assert second is first
+    assert tree.n_cached_blocks == 1
+
+
+@pytest.mark.inference_v2
+def test_referenced_blocks_are_not_evicted() -> None:
+    tree = PrefixCacheTree(BLOCK_SIZE)
+    nodes = _insert_sequence(tree, list(range(8)), [0, 1])
+    assert tree.n_evictable_blocks == 0
+    assert tree.evict(2) == []
+
+    tree.release(nodes)
+    assert tree.n_evictable_blocks == 2
+
+    # Leaves are evicted before their parents.
+    assert tree.evict(2) == [1, 0]
+    assert tree.n_cached_blocks == 0
+    assert tree.n_evictable_blocks == 0
+
+
+@pytest.mark.inference_v2
+def test_lru_eviction_order() -> None:
+    tree = PrefixCacheTree(BLOCK_SIZE)
+    a = _insert_sequence(tree, [0] * 4, [10])
+    b = _insert_sequence(tree, [1] * 4, [11])
+    c = _insert_sequence(tree, [2] * 4, [12])
+    tree.release(a + b + c)
+
+    # Touching ``a`` makes ``b`` the least recently used block.
+    tree.match([0] * 4)
+    assert tree.evict(1) == [11]
+    assert tree.evict(1) == [12]
+    assert tree.evict(1) == [10]
+
+
+@pytest.mark.inference_v2
+def test_shared_prefix_ref_counting() -> None:
+    tree = PrefixCacheTree(BLOCK_SIZE)
+    nodes = _insert_sequence(tree, list(range(8)), [0, 1])
+
+    # A second sequence attaches the shared prefix.
+    attached = tree.match(list(range(8)) + [50])
+    tree.acquire(attached)
+
+    tree.release(nodes)
+    assert tree.n_evictable_blocks == 0
+    assert tree.evict(2) == []
+
+    tree.release(attached)
+    assert sorted(tree.evict(2)) == [0, 1]
+
+
+@pytest.mark.inference_v2
+def test_attach_cached_blocks() -> None:
+    kv_ids = torch.zeros((1, 16), dtype=torch.int32)
+    seq = DSSequenceDescriptor(0, (kv_ids, ), (kv_ids.clone(), ))
+
+    seq.extend_kv_cache(torch.tensor([3, 4], dtype=torch.int32), n_cached_tokens=2 * BLOCK_SIZE)
+    assert seq.seen_tokens == 2 * BLOCK_SIZE
+    assert seq.cur_allocated_blocks == 2
+
+    seq.pre_forward(1)
+    seq.post_forward()
+
+    # Cached blocks can only be attached to a fresh sequence.
+    with pytest.raises(RuntimeError):
+        seq.extend_kv_cache(torch.tensor([5], dtype=torch.int32), n_cached_tokens=BLOCK_SIZE)
+
+
+@pytest.mark.inference_v2
+def test_truncate_and_replace_block() -> None:
+    kv_ids = torch.zeros((1, 16), dtype=torch.int32)
+    seq = DSSequenceDescriptor(0, (kv_ids, ), (kv_ids.clone(), ))
+
+    seq.extend_kv_cache(torch.tensor([3, 4], dtype=torch.int32), n_cached_tokens=2 * BLOCK_SIZE)
+    seq.truncate(BLOCK_SIZE - 1)
+    assert seq.seen_tokens == BLOCK_SIZE - 1
+
+    # Copy-on-write of the partially kept shared block.
+    seq.replace_kv_block(0, 7)
+    assert seq.kv_cache_ids(on_device=False)[0, :2].tolist() == [7, 4]
+    assert seq.kv_cache_ids(on_device=True)[0, :2].tolist() == [7, 4]
+
+    with pytest.raises(ValueError):
+        seq.truncate(BLOCK_SIZE)
+
+    with pytest.raises(ValueError):
+        seq.replace_kv_block(2, 9)
+
+    seq.pre_forward(1)
+    with pytest.raises(RuntimeError):
+        seq.truncate(1)
+
+
+@pytest.mark.inference_v2
+def test_put_attaches_cached_prefix(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True)
+    state_manager = engine._state_manager
+    tokens = list(range(11))
+    assert put(engine, 0, tokens).tolist() == tokens
+    assert state_manager.prefix_cache.n_cached_blocks == 2
+
+    # Only the tokens after the cached prefix reach the model.
+    assert put(engine, 1, tokens[:8] + [50, 51, 52]).tolist() == [50, 51, 52]
+    first, second = state_manager.get_sequence(0), state_manager.get_sequence(1)
+    assert second.seen_tokens == 11
+    assert second.all_block_ids()[:2].tolist() == first.all_block_ids()[:2].tolist()
+    assert second.all_block_ids()[2] != first.all_block_ids()[2]
+    assert sequence_tokens(state_manager, 1) == tokens[:8] + [50, 51, 52]
+    assert sequence_tokens(state_manager, 0) == tokens
+
+    # At least one token is run through the model so there are logits to return.
+    assert put(engine, 2, tokens[:8]).tolist() == tokens[4:8]
+    assert state_manager.get_sequence(2).all_block_ids()[0] == first.all_block_ids()[0]
+
+
+@pytest.mark.inference_v2
+def test_release_keeps_cached_blocks(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True, n_blocks=8)
+    state_manager = engine._state_manager
+    tokens = list(range(10))
+    put(engine, 0, tokens)
+    cached = state_manager.get_sequence(0).all_block_ids()[:2].tolist()
+
+    # Only the partial block is freed, the full blocks stay cached and are counted as free.
+    engine.flush(0)
+    assert state_manager._kv_cache.free_blocks == [6]
+    assert state_manager.free_blocks == [8]
+    assert state_manager.prefix_cache.n_evictable_blocks == 2
+
+    assert put(engine, 1, tokens).tolist() == tokens[8:]
+    assert state_manager.get_sequence(1).all_block_ids()[:2].tolist() == cached
+    assert sequence_tokens(state_manager, 1) == tokens
+
+
+@pytest.mark.inference_v2
+def test_release_duplicate_blocks(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True, n_blocks=8)
+    state_manager = engine._state_manager
+    tokens = torch.arange(9)
+
+    # Both sequences are created before either is cached, so the second one holds private copies of the
+    # blocks cached by the first.
+    engine.put([0, 1], [tokens, tokens], do_checks=False)
+    first, second = state_manager.get_sequence(0), state_manager.get_sequence(1)
+    assert [node.block_id for node in second.prefix_nodes] == first.all_block_ids()[:2].tolist()
+    assert state_manager.prefix_cache.n_cached_blocks == 2
+    assert state_manager._kv_cache.free_blocks == [2]
+
+    engine.flush(0)
+    assert state_manager._kv_cache.free_blocks == [3]
+    assert sequence_tokens(state_manager, 1) == tokens.tolist()
+
+    # The private copies are freed with the sequence, the cached blocks are kept.
+    engine.flush(1)
+    assert state_manager._kv_cache.free_blocks == [6]
+    assert state_manager.free_blocks == [8]
+
+
+@pytest.mark.inference_v2
+def test_allocate_evicts_cached_blocks(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True, n_blocks=6)
+    state_manager = engine._state_manager
+    put(engine, 0, list(range(12)))
+    engine.flush(0)
+    assert state_manager._kv_cache.free_blocks == [3]
+    assert state_manager.prefix_cache.n_evictable_blocks == 3
+
+    # The sequence needs 5 blocks, so the 2 least recently used cached blocks (leaves first) are evicted.
+    tokens = list(range(100, 120))
+    put(engine, 1, tokens)
+    assert state_manager._kv_cache.free_blocks == [0]
+    assert sequence_tokens(state_manager, 1) == tokens
+    assert state_manager.prefix_cache.n_cached_blocks == 6
+    assert state_manager.prefix_cache.n_evictable_blocks == 1
+
+    # The first cached block survived the eviction.
+    engine.flush(1)
+    assert put(engine, 2, list(range(4)) + [7]).tolist() == [7]
+    assert sequence_tokens(state_manager, 2) == list(range(4)) + [7]
+
+    engine.flush(2)
+    assert state_manager.free_blocks == [6]
+
+
+@pytest.mark.inference_v2
+def test_truncate_duplicate_block(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True, n_blocks=8)
+    state_manager = engine._state_manager
+    tokens = torch.arange(9)
+    engine.put([0, 1], [tokens, tokens], do_checks=False)
+    second_blocks = state_manager.get_sequence(1).all_block_ids().tolist()
+
+    # The kept block of the second sequence is its private copy, so it is kept rather than copied.
+    engine.truncate(1, 6)
+    assert state_manager.get_sequence(1).all_block_ids().tolist() == second_blocks[:2]
+    assert state_manager.get_sequence(1).prefix_nodes == state_manager.get_sequence(0).prefix_nodes[:1]
+    assert state_manager._kv_cache.free_blocks == [3]
+
+    put(engine, 1, [70, 71, 72])
+    assert sequence_tokens(state_manager, 0) == tokens.tolist()
+    assert sequence_tokens(state_manager, 1) == tokens[:6].tolist() + [70, 71, 72]
+
+    engine.flush(0)
+    engine.flush(1)
+    assert state_manager.free_blocks == [8]
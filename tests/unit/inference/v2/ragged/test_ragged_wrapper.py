@@ -110,3 +110,41 @@ def test_multi_sequence_batch(seq_lens: List[int]) -> None:
 
     assert batch.current_tokens == 0
     assert batch.current_sequences == 0
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize('seq_lens', [[1], [1, 32, 243], [64, 1, 1, 1, 1, 393, 27, 2], [1] * 256])
+@pytest.mark.parametrize('n_incremental', [0, 1])
+def test_bulk_insert(seq_lens: List[int], n_incremental: int) -> None:
+    """
+    Test that inserting sequences in bulk, optionally after some incremental insertions, produces
+    the same device metadata as inserting them one at a time.
+    """
+    config = DSStateManagerConfig(max_ragged_sequence_count=256, max_ragged_batch_size=1024)
+    reference = RaggedBatchWrapper(config)
+    batch = RaggedBatchWrapper(config)
+
+    all_toks = [torch.randint(0, 100, (seq_len, )) for seq_len in seq_lens]
+    seq_descs = [
+        PlaceholderSequenceDescriptor(seen_tokens=3 * i, kv_blocks_ptr=1024 * (i + 1)) for i in range(len(seq_lens))
+    ]
+
+    for seq_desc, toks in zip(seq_descs, all_toks):
+        reference.insert_sequence(seq_desc, toks)
+    reference.finalize()
+
+    for seq_desc, toks in zip(seq_descs[:n_incremental], all_toks[:n_incremental]):
+        batch.insert_sequence(seq_desc, toks)
+    batch.insert_sequences(seq_descs[n_incremental:], all_toks[n_incremental:])
+    batch.finalize()
+
+    assert batch.current_tokens == sum(seq_lens)
+    assert batch.current_sequences == len(seq_lens)
+    assert torch.equal(batch.input_ids(), reference.input_ids())
+    assert torch.equal(batch.tokens_to_seq(), reference.tokens_to_seq())
+    assert torch.equal(batch.inflight_seq_descriptors()[:, :3], reference.inflight_seq_descriptors()[:, :3])
+    assert torch.equal(batch.kv_ptrs(), reference.kv_ptrs())
+    assert torch.equal(batch.batch_metadata_buffer(), reference.batch_metadata_buffer())
+
+    with pytest.raises(RuntimeError):
+        batch.insert_sequences([PlaceholderSequenceDescriptor()], [torch.zeros(1025, dtype=torch.int64)])
@@ -0,0 +1,138 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.ragged.sequence_descriptor import DSSequenceDescriptor
+from .state_manager_testing_utils import BLOCK_SIZE, MAX_BLOCKS, build_engine, put, sequence_tokens
+
+
+def _build_sequence(n_allocation_groups: int = 1) -> DSSequenceDescriptor:
+    kv_ids = torch.zeros((n_allocation_groups, MAX_BLOCKS), dtype=torch.int32)
+    return DSSequenceDescriptor(0, (kv_ids, ), (kv_ids.clone(), ))
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("n_keep", [0, 1, 4, 5, 11])
+def test_truncate_frees_trailing_blocks(monkeypatch, n_keep: int) -> None:
+    engine = build_engine(monkeypatch)
+    state_manager = engine._state_manager
+    tokens = list(range(12))
+    put(engine, 0, tokens[:7])
+    put(engine, 0, tokens[7:])
+    seq = state_manager.get_sequence(0)
+    blocks = seq.all_block_ids().tolist()
+    assert len(blocks) == 3
+
+    engine.truncate(0, n_keep)
+    n_keep_blocks = -(-n_keep // BLOCK_SIZE)
+    assert seq.seen_tokens == n_keep
+    assert seq.cur_allocated_blocks == n_keep_blocks
+    assert seq.all_block_ids().tolist() == blocks[:n_keep_blocks]
+    assert state_manager.free_blocks == [MAX_BLOCKS - n_keep_blocks]
+
+    # Decoding resumes from the truncated position and reuses the freed blocks.
+    put(engine, 0, list(range(100, 106)))
+    assert sequence_tokens(state_manager, 0) == tokens[:n_keep] + list(range(100, 106))
+    assert seq.cur_allocated_blocks == -(-(n_keep + 6) // BLOCK_SIZE)
+    assert state_manager.free_blocks == [MAX_BLOCKS - seq.cur_allocated_blocks]
+
+    engine.flush(0)
+    assert state_manager.free_blocks == [MAX_BLOCKS]
+
+
+@pytest.mark.inference_v2
+def test_rollback(monkeypatch) -> None:
+    engine = build_engine(monkeypatch)
+    state_manager = engine._state_manager
+    put(engine, 0, list(range(9)))
+
+    # Rejected speculative tokens are discarded and the next forward overwrites their slots.
+    engine.rollback(0, 3)
+    assert state_manager.get_sequence(0).seen_tokens == 6
+    assert state_manager.free_blocks == [MAX_BLOCKS - 2]
+    put(engine, 0, [50, 51])
+    assert sequence_tokens(state_manager, 0) == list(range(6)) + [50, 51]
+
+    with pytest.raises(ValueError):
+        engine.rollback(0, 9)
+    with pytest.raises(ValueError):
+        engine.rollback(1, 1)
+    with pytest.raises(ValueError):
+        engine.truncate(1, 0)
+
+
+@pytest.mark.inference_v2
+def test_truncate_shared_block(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True)
+    state_manager = engine._state_manager
+    tokens = list(range(9))
+    put(engine, 0, tokens)
+    assert put(engine, 1, tokens[:8] + [50]).tolist() == [50]
+    shared = state_manager.get_sequence(0).all_block_ids()[:2].tolist()
+    assert state_manager.get_sequence(1).all_block_ids()[:2].tolist() == shared
+
+    # The partially kept block is shared, so the sequence continues in a copy of it.
+    engine.truncate(1, 6)
+    seq = state_manager.get_sequence(1)
+    assert seq.all_block_ids()[0] == shared[0]
+    assert seq.all_block_ids()[1] not in shared
+    assert len(seq.prefix_nodes) == 1
+    assert state_manager.free_blocks == [MAX_BLOCKS - 4]
+
+    put(engine, 1, [70, 71, 72])
+    assert sequence_tokens(state_manager, 0) == tokens
+    assert sequence_tokens(state_manager, 1) == tokens[:6] + [70, 71, 72]
+
+    # Truncating to a block boundary releases the shared block without copying it.
+    engine.truncate(1, 4)
+    assert seq.all_block_ids().tolist() == shared[:1]
+    assert state_manager.prefix_cache.n_cached_blocks == 3
+
+    engine.flush(0)
+    engine.flush(1)
+    assert state_manager.free_blocks == [MAX_BLOCKS]
+
+
+@pytest.mark.inference_v2
+def test_truncate_invalid() -> None:
+    seq = _build_sequence()
+    seq.extend_kv_cache(torch.tensor([0, 1], dtype=torch.int32))
+    seq.pre_forward(6)
+    seq.post_forward()
+
+    with pytest.raises(ValueError):
+        seq.truncate(7)
+
+    with pytest.raises(ValueError):
+        seq.truncate(-1)
+
+    seq.pre_forward(2)
+    with pytest.raises(RuntimeError):
+        seq.truncate(3)
+    seq.post_forward()
+
+    seq.truncate(3)
+    assert seq.seen_tokens == 3
+
+
+@pytest.mark.inference_v2
+def test_free_kv_cache() -> None:
+    seq = _build_sequence(n_allocation_groups=2)
+    seq.extend_kv_cache([torch.tensor([3, 5, 7], dtype=torch.int32), torch.tensor([2, 4], dtype=torch.int32)])
+
+    seq.free_kv_cache([torch.tensor([5], dtype=torch.int32), torch.tensor([], dtype=torch.int32)])
+    assert [ids.tolist() for ids in seq.allocation_group_block_ids()] == [[3, 7], [2, 4]]
+    assert seq.kv_cache_ids(on_device=True)[0, :2].tolist() == [3, 7]
+    assert seq.cur_allocated_blocks == 4
+
+    # Blocks not owned by the allocation group are rejected without modifying any group.
+    with pytest.raises(ValueError):
+        seq.free_kv_cache([torch.tensor([3], dtype=torch.int32), torch.tensor([5], dtype=torch.int32)])
+    assert [ids.tolist() for ids in seq.allocation_group_block_ids()] == [[3, 7], [2, 4]]
+
+    with pytest.raises(ValueError):
+        seq.free_kv_cache(torch.tensor([3], dtype=torch.int32))
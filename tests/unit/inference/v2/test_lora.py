@@ -0,0 +1,192 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.config_v2 import LoRAConfig
+from deepspeed.inference.v2.inference_utils import ActivationType, DtypeEnum
+from deepspeed.inference.v2.lora import LoRAAdapter, LoRAAdapterCache, LoRAManager
+from deepspeed.inference.v2.modules.configs import DSLinearConfig
+from deepspeed.inference.v2.modules.interfaces import DSLinearBase
+from .ragged.state_manager_testing_utils import build_engine
+
+DIM = 16
+N_LAYERS = 3
+
+
+class TorchLinear(DSLinearBase):
+
+    @staticmethod
+    def name():
+        return "torch_linear"
+
+    @staticmethod
+    def supports_config(config: DSLinearConfig) -> bool:
+        return True
+
+    def transform_param(self, param: torch.Tensor) -> torch.Tensor:
+        return param
+
+    def forward(self, hidden_states: torch.Tensor, w: torch.Tensor, b: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return hidden_states @ w.t()
+
+    @property
+    def output(self) -> torch.Tensor:
+        return None
+
+
+def _linear(activation: ActivationType = ActivationType.IDENTITY) -> TorchLinear:
+    config = DSLinearConfig(max_tokens=64,
+                            in_channels=DIM,
+                            out_channels=DIM,
+                            activation=activation,
+                            input_dtype=DtypeEnum.fp32,
+                            output_dtype=DtypeEnum.fp32)
+    return TorchLinear(config, {})
+
+
+class TinyModel(torch.nn.Module):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.num_layers = N_LAYERS
+        self._transformer = [
+            SimpleNamespace(qkv_w=torch.randn(DIM, DIM) / DIM, attn_out_w=torch.randn(DIM, DIM) / DIM)
+            for _ in range(N_LAYERS)
+        ]
+        self.qkv = _linear()
+        self.attn_out = _linear()
+        self.mlp_1 = _linear(ActivationType.GELU)
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        for layer in self._transformer:
+            hidden_states = self.qkv(hidden_states, layer.qkv_w)
+            hidden_states = self.attn_out(hidden_states, layer.attn_out_w)
+        return hidden_states
+
+
+def _merged_forward(model: TinyModel, hidden_states: torch.Tensor, adapter: Optional[LoRAAdapter]) -> torch.Tensor:
+    for idx, layer in enumerate(model._transformer):
+        for target in ("qkv", "attn_out"):
+            w = getattr(layer, f"{target}_w")
+            if adapter is not None and (idx, target) in adapter.weights:
+                a, b = adapter.weights[(idx, target)]
+                w = w + (a @ b).t()
+            hidden_states = hidden_states @ w.t()
+    return hidden_states
+
+
+def _adapter(keys, rank: int = 4) -> LoRAAdapter:
+    return LoRAAdapter({key: (torch.randn(DIM, rank), torch.randn(rank, DIM)) for key in keys}, scaling=0.5)
+
+
+@pytest.mark.inference_v2
+def test_segmented_matches_merged_weights() -> None:
+    torch.manual_seed(0)
+    model = TinyModel()
+    manager = LoRAManager(model, LoRAConfig(targets=("qkv", "attn_out")), torch.device("cpu"))
+
+    adapters = {
+        3: _adapter([(0, "qkv"), (1, "attn_out"), (2, "qkv")]),
+        7: _adapter([(i, t) for i in range(N_LAYERS) for t in ("qkv", "attn_out")], rank=2),
+    }
+    for adapter_id, adapter in adapters.items():
+        manager.register_adapter(adapter_id, adapter)
+
+    seq_adapters = [3, None, 7, 3]
+    token_counts = [3, 2, 4, 1]
+    hidden_states = torch.randn(sum(token_counts), DIM)
+
+    manager.prepare(seq_adapters, token_counts)
+    output = model(hidden_states)
+
+    offset = 0
+    for adapter_id, n_tokens in zip(seq_adapters, token_counts):
+        rows = hidden_states[offset:offset + n_tokens]
+        expected = _merged_forward(model, rows, adapters.get(adapter_id, None))
+        assert torch.allclose(output[offset:offset + n_tokens], expected, atol=1e-4)
+        offset += n_tokens
+
+    # A batch using a single adapter and a batch without adapters.
+    manager.prepare([7], [5])
+    assert torch.allclose(model(hidden_states[:5]), _merged_forward(model, hidden_states[:5], adapters[7]), atol=1e-4)
+    manager.prepare([None], [5])
+    assert torch.allclose(model(hidden_states[:5]), _merged_forward(model, hidden_states[:5], None), atol=1e-4)
+
+
+@pytest.mark.inference_v2
+def test_invalid_targets() -> None:
+    model = TinyModel()
+    with pytest.raises(ValueError):
+        LoRAManager(model, LoRAConfig(targets=("mlp_1", )), torch.device("cpu"))
+    with pytest.raises(ValueError):
+        LoRAManager(model, LoRAConfig(targets=("mlp_2", )), torch.device("cpu"))
+
+    manager = LoRAManager(model, LoRAConfig(targets=("qkv", )), torch.device("cpu"))
+    with pytest.raises(ValueError):
+        manager.register_adapter(0, _adapter([(0, "attn_out")]))
+    with pytest.raises(ValueError):
+        manager.register_adapter(0, _adapter([(N_LAYERS, "qkv")]))
+
+
+@pytest.mark.inference_v2
+def test_adapter_cache_lru() -> None:
+    cache = LoRAAdapterCache(2, torch.device("cpu"), torch.float16)
+    adapters = {i: _adapter([(0, "qkv")]) for i in range(4)}
+
+    weights = cache.load({0: adapters[0], 1: adapters[1]})
+    assert weights[0][(0, "qkv")][0].dtype == torch.float16
+    assert cache.resident_adapters == [0, 1]
+
+    # Using 0 makes 1 the least recently used, so it is evicted for 2.
+    cache.load({0: adapters[0]})
+    cache.load({2: adapters[2]})
+    assert cache.resident_adapters == [0, 2]
+
+    # Adapters of the batch are never evicted by each other.
+    cache.load({3: adapters[3], 0: adapters[0]})
+    assert sorted(cache.resident_adapters) == [0, 3]
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    with pytest.raises(ValueError):
+        cache.load({i: adapters[i] for i in range(3)})
+
+
+@pytest.mark.inference_v2
+def test_fuse() -> None:
+    factors = [(torch.randn(DIM, 2), torch.randn(2, 5)), (torch.randn(DIM, 3), torch.randn(3, 4))]
+    a, b = LoRAAdapter.fuse(factors)
+    hidden_states = torch.randn(6, DIM)
+    expected = torch.cat([hidden_states @ fa @ fb for fa, fb in factors], dim=1)
+    assert torch.allclose(hidden_states @ a @ b, expected, atol=1e-5)
+
+
+@pytest.mark.inference_v2
+def test_engine_rejects_batch_over_adapter_capacity(monkeypatch) -> None:
+    engine = build_engine(monkeypatch)
+    engine._lora = LoRAManager(TinyModel(), LoRAConfig(max_cached_adapters=2, targets=("qkv", )), torch.device("cpu"))
+    for adapter_id in range(3):
+        engine._lora.register_adapter(adapter_id, _adapter([(0, "qkv")]))
+
+    tokens = [torch.arange(5) for _ in range(3)]
+    with pytest.raises(ValueError):
+        engine.put([0, 1, 2], tokens, do_checks=False, adapter_ids=[0, 1, 2])
+    # The batch is rejected before any sequence is created or bound to an adapter.
+    assert engine._state_manager.n_tracked_sequences == 0
+    assert engine._seq_adapters == {}
+    assert engine.free_blocks == [engine._state_manager.kv_cache_occupancy()["device"][0].total_blocks]
+
+    engine.put([0, 1, 2], tokens, do_checks=False, adapter_ids=[0, 1, None])
+    assert engine._seq_adapters == {0: 0, 1: 1}
+
+    # Existing sequences keep their adapter, so this batch also uses three adapters.
+    with pytest.raises(ValueError):
+        engine.put([0, 1, 3], tokens, do_checks=False, adapter_ids=[None, None, 2])
+    assert engine._state_manager.get_sequence(3) is None
+    assert [engine._state_manager.get_sequence(uid).seen_tokens for uid in range(3)] == [5, 5, 5]
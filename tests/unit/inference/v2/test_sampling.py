@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.inference.v2 import sampling
+from deepspeed.inference.v2.sampling import BatchedSampler, SamplingParams, uniform_from_counter
+
+VOCAB_SIZE = 64
+
+
+def _logits(n_seqs: int, seed: int = 0) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(n_seqs, VOCAB_SIZE, generator=generator) * 3
+
+
+@pytest.mark.inference_v2
+def test_uniform_from_counter() -> None:
+    seeds = torch.arange(4096, dtype=torch.int64)
+    draws = uniform_from_counter(seeds, torch.zeros_like(seeds))
+    assert draws.min() >= 0 and draws.max() < 1
+    assert abs(draws.mean().item() - 0.5) < 0.02
+
+    # Streams are pure functions of (seed, counter).
+    assert torch.equal(draws[7:9], uniform_from_counter(seeds[7:9], torch.zeros(2, dtype=torch.int64)))
+    assert not torch.equal(draws, uniform_from_counter(seeds, torch.ones_like(seeds)))
+
+
+@pytest.mark.inference_v2
+def test_greedy_and_degenerate_filters() -> None:
+    sampler = BatchedSampler()
+    sampler.add_request(0, SamplingParams(temperature=0.0))
+    sampler.add_request(1, SamplingParams(top_k=1))
+    sampler.add_request(2, SamplingParams(top_p=1e-6))
+    sampler.add_request(3, SamplingParams(temperature=1e-4))
+
+    logits = _logits(4)
+    tokens, finished = sampler.sample([0, 1, 2, 3], logits)
+    assert torch.equal(tokens, torch.argmax(logits, dim=-1))
+    assert not finished.any()
+
+
+@pytest.mark.inference_v2
+def test_batch_composition_invariance() -> None:
+    params = [
+        SamplingParams(temperature=0.7, top_k=10),
+        SamplingParams(temperature=1.3, top_p=0.9),
+        SamplingParams(repetition_penalty=1.5),
+        SamplingParams(temperature=0.0),
+    ]
+
+    together = BatchedSampler(seed=3)
+    alone = BatchedSampler(seed=3)
+    for uid, p in enumerate(params):
+        together.add_request(uid, p, prompt_tokens=torch.arange(uid, uid + 4))
+        alone.add_request(uid, p, prompt_tokens=torch.arange(uid, uid + 4))
+
+    for step in range(8):
+        logits = _logits(len(params), seed=step)
+        batched, _ = together.sample(range(len(params)), logits)
+        # Reverse order and one request at a time must give identical tokens.
+        for uid in reversed(range(len(params))):
+            single, _ = alone.sample([uid], logits[uid:uid + 1])
+            assert single.item() == batched[uid].item()
+
+
+@pytest.mark.inference_v2
+def test_explicit_seed_is_reproducible() -> None:
+    outputs = []
+    for uid in (5, 11):
+        sampler = BatchedSampler(seed=uid)
+        sampler.add_request(uid, SamplingParams(seed=1234))
+        outputs.append([sampler.sample([uid], _logits(1, seed=step))[0].item() for step in range(16)])
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.inference_v2
+def test_sampling_distribution() -> None:
+    n_seqs = 4096
+    sampler = BatchedSampler()
+    for uid in range(n_seqs):
+        sampler.add_request(uid, SamplingParams(temperature=2.0, top_k=3))
+
+    base = torch.tensor([2.0, 1.0, 0.0, 4.0] + [-1.0] * (VOCAB_SIZE - 4))
+    tokens, _ = sampler.sample(range(n_seqs), base.expand(n_seqs, -1))
+
+    expected = torch.softmax(torch.tensor([2.0, 1.0, 4.0]) / 2.0, dim=0)
+    counts = torch.bincount(tokens, minlength=VOCAB_SIZE).float() / n_seqs
+    assert counts[[2] + list(range(4, VOCAB_SIZE))].sum() == 0
+    assert torch.allclose(counts[[0, 1, 3]], expected, atol=0.03)
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("n_candidates", [4, 256])
+def test_nucleus_support(monkeypatch, n_candidates: int) -> None:
+    # Few candidates forces the full sort fallback for flat distributions.
+    monkeypatch.setattr(sampling, "NUCLEUS_CANDIDATES", n_candidates)
+
+    n_seqs = 2048
+    sampler = BatchedSampler()
+    for uid in range(n_seqs):
+        sampler.add_request(uid, SamplingParams(top_p=0.6))
+
+    base = torch.linspace(1.0, 0.0, VOCAB_SIZE)
+    tokens, _ = sampler.sample(range(n_seqs), base.expand(n_seqs, -1))
+
+    probs = torch.softmax(base, dim=0)
+    n_nucleus = int((torch.cumsum(probs, dim=0) - probs < 0.6).sum())
+    counts = torch.bincount(tokens, minlength=VOCAB_SIZE)
+    assert counts[n_nucleus:].sum() == 0
+    assert (counts[:n_nucleus] > 0).all()
+
+
+@pytest.mark.inference_v2
+def test_repetition_penalty() -> None:
+    sampler = BatchedSampler()
+    sampler.add_request(0, SamplingParams(temperature=0.0, repetition_penalty=10.0), prompt_tokens=torch.tensor([3]))
+    sampler.add_request(1, SamplingParams(temperature=0.0))
+
+    logits = torch.zeros(2, VOCAB_SIZE)
+    logits[:, 3] = 2.0
+    logits[:, 5] = 1.0
+    logits[:, 7] = 0.5
+
+    tokens, _ = sampler.sample([0, 1], logits)
+    assert tokens.tolist() == [5, 3]
+
+    # Generated tokens are penalized too.
+    tokens, _ = sampler.sample([0, 1], logits)
+    assert tokens.tolist() == [7, 3]
+
+    # Slots are recycled without leaking the penalty state.
+    sampler.remove_request(0)
+    sampler.add_request(2, SamplingParams(temperature=0.0, repetition_penalty=10.0))
+    tokens, _ = sampler.sample([2], logits[:1])
+    assert tokens.tolist() == [3]
+
+
+@pytest.mark.inference_v2
+def test_stop_criteria() -> None:
+    sampler = BatchedSampler()
+    sampler.add_request(0, SamplingParams(temperature=0.0, stop_token_ids=(9, 3)))
+    sampler.add_request(1, SamplingParams(temperature=0.0, max_new_tokens=2))
+    sampler.add_request(2, SamplingParams(temperature=0.0, stop_token_ids=(4, )))
+
+    logits = torch.zeros(3, VOCAB_SIZE)
+    logits[:, 3] = 1.0
+
+    _, finished = sampler.sample([0, 1, 2], logits)
+    assert finished.tolist() == [True, False, False]
+    _, finished = sampler.sample([1, 2], logits[1:])
+    assert finished.tolist() == [True, False]
+    assert sampler.n_generated(1) == 2
+
+
+@pytest.mark.inference_v2
+def test_invalid_params() -> None:
+    with pytest.raises(ValueError):
+        SamplingParams(temperature=-1.0)
+    with pytest.raises(ValueError):
+        SamplingParams(top_p=0.0)
+    with pytest.raises(ValueError):
+        SamplingParams(top_k=-1)
+
+    sampler = BatchedSampler()
+    sampler.add_request(0, SamplingParams())
+    with pytest.raises(ValueError):
+        sampler.add_request(0, SamplingParams())
+    with pytest.raises(ValueError):
+        sampler.sample([0], _logits(2))
@@ -0,0 +1,225 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Dict, Iterable, List, Optional
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.config_v2 import RaggedInferenceEngineConfig
+from deepspeed.inference.v2.scheduler import (ChunkedPrefillPolicy, ContinuousBatchingScheduler, FCFSPolicy,
+                                              ShortestPromptFirstPolicy)
+from deepspeed.inference.v2.ragged import PlaceholderSequenceDescriptor
+from deepspeed.inference.v2.scheduling_utils import BatchReservation, SchedulingResult
+
+VOCAB_SIZE = 64
+BLOCK_SIZE = 4
+
+
+def ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+class StubEngine:
+    """
+    CPU stand-in for ``InferenceEngineV2`` with the same KV block accounting as the dense
+    transformer models. The "model" predicts ``last_token + 1``. The stub doubles as the state
+    manager and model for ``BatchReservation``.
+    """
+
+    def __init__(self, n_blocks: int = 64, **manager_kwargs) -> None:
+        self.config = RaggedInferenceEngineConfig(state_manager=manager_kwargs)
+        self.n_blocks = n_blocks
+        self.seqs: Dict[int, List[int]] = {}  # uid -> [seen_tokens, allocated_blocks]
+        self.batches: List[List[int]] = []
+
+    @property
+    def free_blocks(self) -> List[int]:
+        return [self.n_blocks - sum(blocks for _, blocks in self.seqs.values())]
+
+    @property
+    def n_tracked_sequences(self) -> int:
+        return len(self.seqs)
+
+    def get_sequence(self, uid: int) -> Optional[PlaceholderSequenceDescriptor]:
+        if uid not in self.seqs:
+            return None
+        seen, allocated = self.seqs[uid]
+        return PlaceholderSequenceDescriptor(seen_tokens=seen, cur_allocated_blocks=allocated)
+
+    def get_kv_requirements(self, seq_desc, max_tokens: int, max_blocks: int):
+        total_tokens = seq_desc.seen_tokens + max_tokens
+        req_blocks = ceil_div(total_tokens, BLOCK_SIZE) - seq_desc.cur_allocated_blocks
+        if req_blocks <= max_blocks:
+            return max_tokens, req_blocks
+        return (max_blocks + seq_desc.cur_allocated_blocks) * BLOCK_SIZE - seq_desc.seen_tokens, max_blocks
+
+    def query(self, uid: int, max_tokens: int, max_blocks: int):
+        seq_desc = self.get_sequence(uid)
+        if seq_desc is None:
+            if len(self.seqs) == self.config.state_manager.max_tracked_sequences:
+                return (0, 0)
+            seq_desc = PlaceholderSequenceDescriptor()
+        return self.get_kv_requirements(seq_desc, max_tokens, max_blocks)
+
+    def create_reservation(self) -> BatchReservation:
+        return BatchReservation(self, self, self.config.state_manager)
+
+    def can_schedule(self, uids: Iterable[int], lengths: Iterable[int]) -> SchedulingResult:
+        reservation = self.create_reservation()
+        for uid, length in zip(uids, lengths):
+            reservation.add(uid, length)
+        return reservation.result
+
+    def put(self, uids, tokens, do_checks: bool = True) -> torch.Tensor:
+        assert self.can_schedule(uids, [t.numel() for t in tokens]) == SchedulingResult.Success
+        self.batches.append([t.numel() for t in tokens])
+        logits = torch.zeros(len(uids), VOCAB_SIZE)
+        for i, (uid, toks) in enumerate(zip(uids, tokens)):
+            seen, _ = self.seqs.get(uid, (0, 0))
+            self.seqs[uid] = [seen + toks.numel(), ceil_div(seen + toks.numel(), BLOCK_SIZE)]
+            logits[i, (toks[-1].item() + 1) % VOCAB_SIZE] = 1.0
+        return logits
+
+    def flush(self, uid: int) -> None:
+        del self.seqs[uid]
+
+
+def _manager_kwargs(**overrides):
+    kwargs = dict(max_tracked_sequences=16, max_ragged_batch_size=32, max_ragged_sequence_count=8)
+    kwargs.update(overrides)
+    return kwargs
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("policy", [FCFSPolicy(), ShortestPromptFirstPolicy(), ChunkedPrefillPolicy(8)])
+def test_generates_all_requests(policy) -> None:
+    engine = StubEngine(**_manager_kwargs())
+    scheduler = ContinuousBatchingScheduler(engine, policy=policy)
+
+    prompts = {uid: torch.arange(uid, uid + 3 + 5 * uid) for uid in range(6)}
+    for uid, prompt in prompts.items():
+        scheduler.add_request(uid, prompt, max_new_tokens=5)
+
+    outputs = scheduler.run()
+
+    for uid, prompt in prompts.items():
+        last = prompt[-1].item()
+        assert outputs[uid] == [(last + i) % VOCAB_SIZE for i in range(1, 6)]
+
+    # All state is released on the engine once requests complete.
+    assert engine.seqs == {}
+    assert all(sum(batch) <= 32 for batch in engine.batches)
+
+
+@pytest.mark.inference_v2
+def test_stop_tokens() -> None:
+    engine = StubEngine(**_manager_kwargs())
+    scheduler = ContinuousBatchingScheduler(engine)
+    scheduler.add_request(0, torch.tensor([1, 2, 3]), max_new_tokens=10, stop_token_ids=[6])
+
+    assert scheduler.run() == {0: [4, 5, 6]}
+
+
+@pytest.mark.inference_v2
+def test_chunked_prefill_budget() -> None:
+    engine = StubEngine(**_manager_kwargs())
+    scheduler = ContinuousBatchingScheduler(engine, policy=ChunkedPrefillPolicy(token_budget=6))
+    scheduler.add_request(0, torch.arange(20), max_new_tokens=2)
+    scheduler.add_request(1, torch.arange(3), max_new_tokens=2)
+
+    scheduler.run()
+
+    # Prefill chunks never exceed the budget, the second request is admitted in the same forward
+    # as the tail of the first prompt.
+    assert engine.batches[:4] == [[6], [6], [6], [2, 3]]
+
+
+@pytest.mark.inference_v2
+def test_shortest_prompt_first_order() -> None:
+    engine = StubEngine(**_manager_kwargs(max_ragged_sequence_count=1))
+    scheduler = ContinuousBatchingScheduler(engine, policy=ShortestPromptFirstPolicy())
+    scheduler.add_request(0, torch.arange(12), max_new_tokens=1)
+    scheduler.add_request(1, torch.arange(2), max_new_tokens=1)
+
+    assert list(scheduler.stream()) == [(1, 2), (0, 12)]
+
+
+@pytest.mark.inference_v2
+def test_kv_cache_limit_defers_admission() -> None:
+    # Room for only a single request's KV blocks at a time.
+    engine = StubEngine(n_blocks=3, **_manager_kwargs())
+    scheduler = ContinuousBatchingScheduler(engine)
+    scheduler.add_request(0, torch.arange(8), max_new_tokens=3)
+    scheduler.add_request(1, torch.arange(8), max_new_tokens=3)
+
+    outputs = scheduler.run()
+    assert outputs == {0: [8, 9, 10], 1: [8, 9, 10]}
+    assert engine.batches[0] == [8]
+
+
+@pytest.mark.inference_v2
+def test_long_prompt_is_chunked() -> None:
+    engine = StubEngine(**_manager_kwargs(max_ragged_batch_size=16))
+    scheduler = ContinuousBatchingScheduler(engine)
+    scheduler.add_request(0, torch.arange(40), max_new_tokens=1)
+
+    assert scheduler.run() == {0: [40]}
+    assert engine.batches == [[16], [16], [8]]
+
+
+@pytest.mark.inference_v2
+def test_cancel() -> None:
+    engine = StubEngine(**_manager_kwargs())
+    scheduler = ContinuousBatchingScheduler(engine)
+    scheduler.add_request(0, torch.arange(4), max_new_tokens=10)
+    scheduler.add_request(1, torch.arange(4), max_new_tokens=2)
+
+    scheduler.step()
+    scheduler.cancel(0)
+    assert 0 not in engine.seqs
+
+    assert scheduler.run() == {1: [5]}
+
+
+@pytest.mark.inference_v2
+def test_reservation_totals() -> None:
+    engine = StubEngine(n_blocks=4, **_manager_kwargs(max_tracked_sequences=3, max_ragged_sequence_count=2))
+    engine.seqs[0] = [6, 2]
+
+    reservation = engine.create_reservation()
+    # Decoding uid 0 fits in its second block.
+    assert reservation.add(0, 1) == SchedulingResult.Success
+    assert reservation.n_blocks == 0
+
+    # A new 8 token sequence needs 2 blocks.
+    assert reservation.add(1, 8) == SchedulingResult.Success
+    assert (reservation.n_tokens, reservation.n_blocks, reservation.free_blocks) == (9, 2, 0)
+
+    assert reservation.add(2, 1) == SchedulingResult.BatchSequenceLimitExceeded
+    assert reservation.remove(0) == SchedulingResult.KVCacheLimitExceeded
+    assert reservation.remove(1) == SchedulingResult.Success
+
+    # Re-adding a uid replaces its previous entry.
+    assert reservation.add(2, 40) == SchedulingResult.KVCacheLimitExceeded
+    assert reservation.add(2, 4) == SchedulingResult.Success
+    assert (reservation.n_sequences, reservation.n_tokens) == (1, 4)
+
+    assert reservation.add(3, 33) == SchedulingResult.KVCacheLimitExceeded
+    assert reservation.remove(3) == SchedulingResult.Success
+
+
+@pytest.mark.inference_v2
+def test_reservation_limits() -> None:
+    engine = StubEngine(
+        **_manager_kwargs(max_tracked_sequences=2, max_ragged_batch_size=8, max_ragged_sequence_count=2))
+    engine.seqs[0] = [4, 1]
+
+    reservation = engine.create_reservation()
+    assert reservation.add(1, 4) == SchedulingResult.Success
+    assert reservation.add(2, 4) == SchedulingResult.EngineSequenceLimitExceeded
+    assert reservation.remove(2) == SchedulingResult.Success
+    assert reservation.add(0, 5) == SchedulingResult.BatchTokenLimitExceeded
+    assert reservation.free_tokens == -1
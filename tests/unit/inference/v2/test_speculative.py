@@ -0,0 +1,132 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+from typing import Callable, Dict, List
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.speculative import SpeculativeDecoder
+
+VOCAB_SIZE = 32
+
+
+def target_model(history: List[int]) -> int:
+    return (sum(history) * 7 + len(history)) % VOCAB_SIZE
+
+
+def draft_model(history: List[int]) -> int:
+    # Agrees with the target model except on every third position.
+    if len(history) % 3 == 0:
+        return (target_model(history) + 1) % VOCAB_SIZE
+    return target_model(history)
+
+
+class StubEngine:
+    """
+    CPU stand-in for ``InferenceEngineV2`` that keeps the full token history of each sequence in
+    place of its KV-cache.
+    """
+
+    def __init__(self, model: Callable[[List[int]], int]) -> None:
+        self.model = model
+        self.history: Dict[int, List[int]] = {}
+        self.n_forwards = 0
+        self.n_rolled_back = 0
+
+    def _logits(self, history: List[int]) -> torch.Tensor:
+        logits = torch.zeros(VOCAB_SIZE)
+        logits[self.model(history)] = 1.0
+        return logits
+
+    def put(self, uids, tokens, do_checks: bool = True, all_token_logits: bool = False) -> torch.Tensor:
+        self.n_forwards += 1
+        logits = []
+        for uid, toks in zip(uids, tokens):
+            history = self.history.setdefault(uid, [])
+            for token in toks.tolist():
+                history.append(token)
+                if all_token_logits:
+                    logits.append(self._logits(history))
+            if not all_token_logits:
+                logits.append(self._logits(history))
+        return torch.stack(logits)
+
+    def rollback(self, uid: int, n_tokens: int) -> None:
+        assert 0 <= n_tokens <= len(self.history[uid])
+        self.n_rolled_back += n_tokens
+        del self.history[uid][len(self.history[uid]) - n_tokens:]
+
+    def flush(self, uid: int) -> None:
+        del self.history[uid]
+
+
+def greedy_reference(prompt: List[int], n_tokens: int) -> List[int]:
+    history = list(prompt)
+    for _ in range(n_tokens):
+        history.append(target_model(history))
+    return history[len(prompt):]
+
+
+@pytest.mark.inference_v2
+@pytest.mark.parametrize("num_speculative_tokens", [1, 3, 5])
+def test_matches_target_greedy(num_speculative_tokens: int) -> None:
+    target = StubEngine(target_model)
+    draft = StubEngine(draft_model)
+    decoder = SpeculativeDecoder(target, draft, num_speculative_tokens=num_speculative_tokens)
+
+    prompts = {uid: torch.arange(uid, uid + 4 + uid) for uid in range(4)}
+    outputs = {uid: [token] for uid, token in decoder.prefill(prompts.keys(), prompts.values()).items()}
+
+    n_steps = 0
+    while min(len(out) for out in outputs.values()) < 20:
+        for uid, tokens in decoder.step(prompts.keys()).items():
+            assert 1 <= len(tokens) <= num_speculative_tokens + 1
+            outputs[uid].extend(tokens)
+        n_steps += 1
+
+    for uid, prompt in prompts.items():
+        generated = outputs[uid]
+        assert generated == greedy_reference(prompt.tolist(), len(generated))
+        # The KV state of both engines only reflects accepted tokens. The last accepted token is
+        # yet to be processed by the target, and possibly the last two by the draft.
+        assert target.history[uid] == prompt.tolist() + generated[:-1]
+        assert draft.history[uid] == (prompt.tolist() + generated)[:len(draft.history[uid])]
+        assert len(draft.history[uid]) >= len(prompt) + len(generated) - 2
+
+    # Verification takes a single target forward per step.
+    assert target.n_forwards == n_steps + 1
+    assert target.n_rolled_back > 0
+
+    for uid in prompts:
+        decoder.flush(uid)
+    assert target.history == {} and draft.history == {}
+
+
+@pytest.mark.inference_v2
+def test_perfect_draft_accepts_all() -> None:
+    target = StubEngine(target_model)
+    draft = StubEngine(target_model)
+    decoder = SpeculativeDecoder(target, draft, num_speculative_tokens=4)
+
+    prompt = torch.arange(6)
+    generated = list(decoder.prefill([0], [prompt]).values())
+    for _ in range(3):
+        tokens = decoder.step([0])[0]
+        assert len(tokens) == 5
+        generated.extend(tokens)
+
+    assert generated == greedy_reference(prompt.tolist(), len(generated))
+    assert target.n_rolled_back == 0 and draft.n_rolled_back == 0
+
+
+@pytest.mark.inference_v2
+def test_invalid_arguments() -> None:
+    with pytest.raises(ValueError):
+        SpeculativeDecoder(StubEngine(target_model), StubEngine(draft_model), num_speculative_tokens=0)
+
+    decoder = SpeculativeDecoder(StubEngine(target_model), StubEngine(draft_model))
+    with pytest.raises(ValueError):
+        decoder.step([0])
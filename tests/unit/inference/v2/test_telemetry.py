@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import pytest
+import torch
+
+from deepspeed.inference.v2.config_v2 import TelemetryConfig
+from deepspeed.inference.v2.telemetry import EngineTelemetry, StepTelemetry, TelemetryRingBuffer
+from .ragged.state_manager_testing_utils import build_engine, put
+
+
+class RecordingMonitor:
+
+    def __init__(self) -> None:
+        self.events = []
+
+    def write_events(self, event_list) -> None:
+        self.events.extend(event_list)
+
+
+def _step(telemetry: EngineTelemetry, n_tokens: int) -> StepTelemetry:
+    step = telemetry.begin_step()
+    for phase in ("batch_build", "finalize", "forward", "post_forward"):
+        step.mark(phase)
+    step.n_tokens = n_tokens
+    step.n_sequences = 2
+    step.free_blocks = (10, 3)
+    step.kv_fragmentation = (0.25, 0.0)
+    step.prefix_cache_hits = 1
+    step.prefix_cache_hit_tokens = 64
+    telemetry.end_step(step)
+    return step
+
+
+@pytest.mark.inference_v2
+def test_step_events() -> None:
+    telemetry = EngineTelemetry(TelemetryConfig(synchronize=False))
+    step = _step(telemetry, 17)
+
+    assert list(step.timings.keys()) == ["batch_build", "finalize", "forward", "post_forward"]
+    assert all(value >= 0 for value in step.timings.values())
+
+    events = {name: (value, idx) for name, value, idx in step.events()}
+    assert events["Inference/Batch/tokens"] == (17, 0)
+    assert events["Inference/KVCache/free_blocks_1"] == (3, 0)
+    assert events["Inference/KVCache/fragmentation_0"] == (0.25, 0)
+    assert events["Inference/PrefixCache/hit_tokens"] == (64, 0)
+    assert events["Inference/Time/total"][0] == pytest.approx(step.total_time)
+
+
+@pytest.mark.inference_v2
+def test_ring_buffer() -> None:
+    buffer = TelemetryRingBuffer(3)
+    assert buffer.latest is None
+
+    for idx in range(5):
+        step = StepTelemetry(idx)
+        step.timings["forward"] = float(idx)
+        buffer.append(step)
+
+    assert len(buffer) == 3
+    assert [step.step for step in buffer] == [2, 3, 4]
+    assert buffer.latest.step == 4
+    assert buffer.mean_timings() == {"forward": 3.0}
+
+    with pytest.raises(ValueError):
+        TelemetryRingBuffer(0)
+
+
+@pytest.mark.inference_v2
+def test_hooks_and_monitor_interval() -> None:
+    monitor = RecordingMonitor()
+    telemetry = EngineTelemetry(TelemetryConfig(buffer_size=2, synchronize=False, monitor_interval=2), monitor=monitor)
+
+    seen = []
+    telemetry.add_hook(seen.append)
+    for n_tokens in range(5):
+        _step(telemetry, n_tokens)
+
+    assert telemetry.n_steps == 5
+    assert [step.n_tokens for step in seen] == list(range(5))
+    assert [step.step for step in telemetry.buffer] == [3, 4]
+
+    # Only every other step is written to the monitor.
+    assert sorted({idx for _, _, idx in monitor.events}) == [0, 2, 4]
+
+    telemetry.remove_hook(seen.append)
+    _step(telemetry, 5)
+    assert len(seen) == 5
+
+
+@pytest.mark.inference_v2
+def test_kv_fragmentation(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True)
+    state_manager = engine._state_manager
+    assert state_manager.kv_fragmentation() == (0.0, )
+
+    put(engine, 0, list(range(9)))
+    assert state_manager.kv_fragmentation() == (0.25, )
+
+    # The two shared prefix blocks are counted once, leaving 6 empty slots out of 16.
+    put(engine, 1, list(range(8)) + [50])
+    assert state_manager.kv_fragmentation() == (0.375, )
+
+
+@pytest.mark.inference_v2
+def test_kv_fragmentation_private_copies(monkeypatch) -> None:
+    engine = build_engine(monkeypatch, enable_prefix_cache=True)
+    state_manager = engine._state_manager
+
+    # Both sequences prefill the prefix in the same forward, so the second one holds full private copies of
+    # the two blocks cached by the first: 6 empty slots out of 24.
+    tokens = torch.arange(9)
+    engine.put([0, 1], [tokens, tokens], do_checks=False)
+    assert state_manager.kv_fragmentation() == (0.25, )
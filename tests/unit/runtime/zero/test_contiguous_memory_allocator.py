@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import random
+
+import torch
+
+from deepspeed.runtime.zero.contiguous_memory_allocator import ContiguousMemoryAllocator
+
+
+def allocate(mem, size, value):
+    return mem.allocate_tensor(size).fill_(value)
+
+
+def test_best_fit_and_coalescing():
+    mem = ContiguousMemoryAllocator(256, torch.float32, 'cpu')
+    tensors = [allocate(mem, size, i) for i, size in enumerate([32, 64, 16, 64, 80])]
+    for i in (0, 1, 3):
+        mem.release_tensor(tensors[i])
+    # The first two blocks are coalesced on release.
+    assert mem.contiguous_sizes == {0: 96, 112: 64}
+    assert mem.memory_stats()["num_free_blocks"] == 2
+    assert mem.fragmentation() == 1.0 - 96 / 160
+
+    # Best fit places the tensor in the smallest block it fits, not the first one.
+    t = allocate(mem, 48, 5)
+    assert mem.tensor_addresses[id(t)] == 112
+    assert mem.contiguous_sizes == {0: 96, 160: 16}
+
+    mem.release_tensor(tensors[2])
+    assert mem.contiguous_sizes == {0: 112, 160: 16}
+    mem.release_tensor(t)
+    assert mem.contiguous_sizes == {0: 176}
+    assert mem.fragmentation() == 0.0
+
+
+def test_defragment_moves_fewest_elements():
+    mem = ContiguousMemoryAllocator(256, torch.float32, 'cpu')
+    tensors = [allocate(mem, size, i) for i, size in enumerate([64, 8, 64, 8, 64, 48])]
+    for i in (0, 2, 4):
+        mem.release_tensor(tensors[i])
+    assert mem.largest_contiguous == 64
+
+    param = torch.nn.Parameter(torch.empty(2, 4))
+    mem.assign_to_param(tensors[1], param, 8, (2, 4))
+
+    # Only the 8 elements between the first two free blocks are moved, not every live tensor.
+    t = allocate(mem, 136, 6)
+    stats = mem.memory_stats()
+    assert stats["num_defragmentations"] == 1
+    assert stats["defragmented_numel"] == 8
+    assert mem.tensor_addresses[id(t)] == 0
+
+    for i in (1, 3, 5):
+        assert torch.all(tensors[i] == i)
+    assert torch.all(t == 6)
+    # The parameter follows its moved buffer.
+    assert param.data.data_ptr() == tensors[1].data_ptr()
+    assert torch.all(param.data == 1)
+
+
+def test_defragment_compacts_when_needed():
+    mem = ContiguousMemoryAllocator(128, torch.float32, 'cpu')
+    tensors = [allocate(mem, 16, i) for i in range(8)]
+    for i in (0, 2, 4, 6):
+        mem.release_tensor(tensors[i])
+
+    # All free memory is requested, so every live tensor has to move.
+    t = allocate(mem, 64, 8)
+    assert mem.memory_stats()["num_defragmentations"] == 1
+    assert mem.total_free == 0
+    for i in (1, 3, 5, 7):
+        assert torch.all(tensors[i] == i)
+    assert torch.all(t == 8)
+
+
+def check_allocator(mem, tensors):
+    segments = sorted([(address, size, False) for address, size in mem.contiguous_sizes.items()] +
+                      [(address, size, True) for address, size in mem.tensor_sizes.items()])
+    end = 0
+    for i, (address, size, occupied) in enumerate(segments):
+        assert address == end and size > 0
+        # free blocks are always coalesced
+        assert occupied or i == 0 or segments[i - 1][2]
+        end = address + size
+    assert end == mem.total_size
+    assert mem.free_blocks == sorted((size, address) for address, size in mem.contiguous_sizes.items())
+    assert mem.contiguous_ends == {address + size: address for address, size in mem.contiguous_sizes.items()}
+    assert mem.total_free == sum(mem.contiguous_sizes.values())
+    assert mem.largest_contiguous == max(mem.contiguous_sizes.values(), default=0)
+
+    assert len(tensors) == len(mem.tensor_map)
+    for value, t in tensors.items():
+        address = mem.tensor_addresses[id(t)]
+        assert t.data_ptr() == mem.buffer[address:].data_ptr()
+        assert torch.all(t == value)
+
+
+def test_random_alloc_release():
+    rng = random.Random(0)
+    for _ in range(300):
+        mem = ContiguousMemoryAllocator(200, torch.float32, 'cpu')
+        tensors = {}
+        for value in range(60):
+            if tensors and rng.random() < 0.45:
+                mem.release_tensor(tensors.pop(rng.choice(list(tensors))))
+            else:
+                size = rng.randint(1, 40)
+                if size > mem.total_free:
+                    continue
+                tensors[value] = allocate(mem, size, value)
+            check_allocator(mem, tensors)
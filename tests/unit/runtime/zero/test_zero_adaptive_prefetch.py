@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import time
+
+from deepspeed.runtime.zero.partitioned_param_prefetch import AdaptivePrefetchController
+
+NUM_SUB_MODULES = 10
+NUMEL_PER_SUB_MODULE = 1000
+STEP_NUMEL = NUM_SUB_MODULES * NUMEL_PER_SUB_MODULE
+
+
+def test_depth_hides_fetch_latency():
+    controller = AdaptivePrefetchController(prefetch_bucket_size=100, max_live_parameters=10**9)
+    # Nothing is known before a fetch that was not prefetched has been measured.
+    assert not controller.update(100.0, 0.0, 0.0, 0, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=True)
+    assert controller.depth is None and controller.bucket_size == 100
+
+    # Fetching a submodule takes 3 ms and computing it 1 ms, so prefetching runs 3 submodules ahead.
+    assert controller.update(40.0, 30.0, 0.0, STEP_NUMEL, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+    assert controller.depth == 3
+    assert controller.bucket_size == 3 * NUMEL_PER_SUB_MODULE
+
+    # Compute that takes longer than fetching needs a single submodule of lookahead.
+    controller = AdaptivePrefetchController(prefetch_bucket_size=100, max_live_parameters=10**9)
+    controller.update(130.0, 30.0, 0.0, STEP_NUMEL, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+    assert controller.depth == 1
+    assert controller.bucket_size == NUMEL_PER_SUB_MODULE
+
+
+def test_waiting_increases_depth():
+    controller = AdaptivePrefetchController(prefetch_bucket_size=100, max_live_parameters=10**9)
+    controller.update(130.0, 30.0, 0.0, STEP_NUMEL, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+    assert controller.depth == 1
+
+    # Prefetched parameters are still waited for, so prefetching runs further ahead step by step ...
+    controller.update(120.0, 0.0, 20.0, 0, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=True)
+    assert controller.depth == 2
+    controller.update(110.0, 0.0, 10.0, 0, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=True)
+    assert controller.depth == 3
+    # ... and backs off once they no longer are.
+    controller.update(100.0, 0.0, 0.0, 0, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=True)
+    assert controller.depth == 2
+    controller.update(100.0, 0.0, 0.0, 0, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=True)
+    assert controller.depth == 1
+
+
+def test_bucket_size_within_memory_cap():
+    controller = AdaptivePrefetchController(prefetch_bucket_size=100, max_live_parameters=2500)
+    controller.update(40.0, 30.0, 0.0, STEP_NUMEL, NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+    assert controller.depth == 3
+    assert controller.bucket_size == 2500
+
+
+def test_end_step_measures_timers():
+    controller = AdaptivePrefetchController(prefetch_bucket_size=100, max_live_parameters=10**9)
+    assert not controller.end_step(NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+
+    controller.start_step()
+    for _ in range(NUM_SUB_MODULES):
+        controller.start_fetch(prefetched=False)
+        time.sleep(0.002)
+        controller.stop_fetch(prefetched=False, numel=NUMEL_PER_SUB_MODULE)
+    assert controller.end_step(NUM_SUB_MODULES, STEP_NUMEL, trace_complete=False)
+    assert controller.depth >= 1
+    assert controller.bucket_size == controller.depth * NUMEL_PER_SUB_MODULE
@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import os
+
+import pytest
+import torch
+
+import deepspeed
+import deepspeed.comm as dist
+from deepspeed.runtime.zero.mics_utils import (_generate_hierarchical_ranks, create_hierarchical_dp_groups,
+                                               hierarchical_all_reduce)
+from unit.common import DistributedTest
+from unit.simple_model import SimpleModel, random_dataloader
+
+# pretend every 2 ranks are a node
+NDEV_PER_NODE = 2
+
+
+def test_generate_hierarchical_ranks():
+    intra, inter = _generate_hierarchical_ranks([[0, 2, 4, 6, 8, 10], [1, 3, 5, 7, 9, 11]], n_span_nodes=3)
+    assert intra == [[[0, 2], [4, 6], [8, 10]], [[1, 3], [5, 7], [9, 11]]]
+    assert inter == [[[0, 4, 8], [2, 6, 10]], [[1, 5, 9], [3, 7, 11]]]
+
+
+class TestHierarchicalAllReduce(DistributedTest):
+    world_size = 4
+    backend = "gloo"
+    requires_cuda_env = False
+
+    @pytest.mark.parametrize("numel", [8, 11])
+    def test(self, numel):
+        os.environ["NDEV_PER_NODE"] = str(NDEV_PER_NODE)
+        groups = create_hierarchical_dp_groups(dist.get_world_group())
+        assert groups is not None
+        intra_node_group, inter_node_group = groups
+        assert dist.get_world_size(group=intra_node_group) == NDEV_PER_NODE
+        assert dist.get_world_size(group=inter_node_group) == self.world_size // NDEV_PER_NODE
+
+        torch.manual_seed(dist.get_rank())
+        tensor = torch.randn(numel, 3)
+        expected = tensor.clone()
+        dist.all_reduce(expected)
+        hierarchical_all_reduce(tensor, intra_node_group, inter_node_group)
+        assert torch.allclose(tensor, expected)
+
+
+@pytest.mark.parametrize("zero_stage", [1, 2])
+class TestZeroHierarchicalReduceScatter(DistributedTest):
+    world_size = 4
+
+    def test(self, zero_stage):
+        os.environ["NDEV_PER_NODE"] = str(NDEV_PER_NODE)
+        hidden_dim = 10
+
+        def train(hierarchical_reduce_scatter):
+            config_dict = {
+                "train_micro_batch_size_per_gpu": 2,
+                "steps_per_print": 1,
+                "zero_optimization": {
+                    "stage": zero_stage,
+                    "reduce_bucket_size": 20,
+                    "hierarchical_reduce_scatter": hierarchical_reduce_scatter,
+                },
+                "optimizer": {
+                    "type": "Adam",
+                    "params": {
+                        "lr": 1e-3,
+                        "torch_adam": True
+                    }
+                },
+            }
+            torch.manual_seed(0)
+            model = SimpleModel(hidden_dim=hidden_dim)
+            model, _, _, _ = deepspeed.initialize(config=config_dict, model=model, model_parameters=model.parameters())
+            assert (model.optimizer.hierarchical_dp_process_groups is not None) == hierarchical_reduce_scatter
+            # different data on every rank, so that the averaged gradients depend on all ranks
+            torch.manual_seed(dist.get_rank())
+            data_loader = random_dataloader(model=model,
+                                            total_samples=8,
+                                            hidden_dim=hidden_dim,
+                                            device=model.device,
+                                            dtype=torch.float32)
+            for batch in data_loader:
+                loss = model(batch[0], batch[1])
+                model.backward(loss)
+                model.step()
+            return [p.detach().clone() for p in model.module.parameters()]
+
+        for flat, hierarchical in zip(train(False), train(True)):
+            assert torch.allclose(flat, hierarchical)
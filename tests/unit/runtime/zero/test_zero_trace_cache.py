@@ -0,0 +1,131 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import json
+
+import torch
+
+from deepspeed.runtime.zero.partitioned_param_trace import (PartitionedParameterTraceCache,
+                                                            PartitionedParameterTraceLibrary, model_fingerprint)
+
+
+class TraceModel(torch.nn.Module):
+
+    def __init__(self, hidden_dim, n_layers=3):
+        super().__init__()
+        self.layers = torch.nn.ModuleList([torch.nn.Linear(hidden_dim, hidden_dim) for _ in range(n_layers)])
+        self.norm = torch.nn.LayerNorm(hidden_dim)
+
+    def forward(self, x):
+        for layer in self.layers:
+            x = layer(x)
+        return self.norm(x)
+
+
+def set_module_ids(model):
+    # ZeRO-3 assigns these when it registers its hooks
+    for module_id, module in enumerate(model.modules()):
+        module.id = module_id
+    return model
+
+
+def test_model_fingerprint():
+    assert model_fingerprint(TraceModel(8)) == model_fingerprint(TraceModel(8))
+    # Structure and parameter shapes change the fingerprint, parameter values do not.
+    assert model_fingerprint(TraceModel(8)) != model_fingerprint(TraceModel(16))
+    assert model_fingerprint(TraceModel(8)) != model_fingerprint(TraceModel(8, n_layers=4))
+
+
+def test_trace_cache_roundtrip(tmpdir):
+    model = TraceModel(8)
+    traces = [[model.layers[0], model.layers[1], model.layers[2], model.norm, model.layers[2], model.layers[0]],
+              [model.layers[0], model.norm, model.layers[0]]]
+    PartitionedParameterTraceCache(str(tmpdir), model, training=True).save(traces)
+
+    # A new instance of the same model maps the cached traces onto its own submodules.
+    restarted = TraceModel(8)
+    loaded = PartitionedParameterTraceCache(str(tmpdir), restarted, training=True).load()
+    assert loaded == [[
+        restarted.layers[0], restarted.layers[1], restarted.layers[2], restarted.norm, restarted.layers[2],
+        restarted.layers[0]
+    ], [restarted.layers[0], restarted.norm, restarted.layers[0]]]
+
+    # Evaluation traces and other models are cached separately.
+    assert PartitionedParameterTraceCache(str(tmpdir), restarted, training=False).load() is None
+    assert PartitionedParameterTraceCache(str(tmpdir), TraceModel(16), training=True).load() is None
+
+
+def test_trace_cache_rejects_stale_trace(tmpdir):
+    model = TraceModel(8)
+    cache = PartitionedParameterTraceCache(str(tmpdir), model, training=True)
+    cache.save([[model.layers[0], model.norm]])
+
+    with open(cache.path) as f:
+        trace = json.load(f)
+    trace["submodule_orders"][0].append("layers.7")
+    with open(cache.path, "w") as f:
+        json.dump(trace, f)
+    assert cache.load() is None
+
+    with open(cache.path, "w") as f:
+        f.write("{")
+    assert cache.load() is None
+
+
+def test_trace_library_match():
+    model = set_module_ids(TraceModel(8, n_layers=4))
+    layers = list(model.layers)
+    library = PartitionedParameterTraceLibrary(max_traces=4)
+    full = library.add(layers + [model.norm])
+    early_exit = library.add(layers[:2] + [model.norm])
+    assert len(library) == 2 and library.most_recent() is early_exit
+
+    # Steps are matched by the path taken so far, preferring the most recently used trace.
+    path = [layers[0], layers[1]]
+    signature = full.prefix_signatures[1]
+    assert early_exit.prefix_signatures[1] == signature
+    assert library.match(1, signature, layers[1]) is early_exit
+    assert library.match(2, full.prefix_signatures[2], layers[2]) is full
+    assert library.match(2, full.prefix_signatures[2], layers[3]) is None
+    assert library.match(len(path), early_exit.prefix_signatures[2], model.norm) is early_exit
+
+    # Adding a known path returns the stored trace and marks it as most recently used.
+    assert library.add(layers + [model.norm]) is full
+    assert library.most_recent() is full
+    assert library.get(*early_exit.key) is early_exit
+
+
+def test_trace_library_eviction():
+    model = set_module_ids(TraceModel(8, n_layers=4))
+    layers = list(model.layers)
+    library = PartitionedParameterTraceLibrary(max_traces=2)
+    first = library.add([layers[0], layers[1], model.norm])
+    library.add([layers[0], layers[2], model.norm])
+    library.use(first)
+    library.add([layers[0], layers[3], model.norm])
+
+    # The least recently used trace is evicted, along with the submodule adjacency it contributed.
+    assert [trace.submodule_order[1] for trace in library] == [layers[1], layers[3]]
+    assert library.get(3, library.add([layers[0], layers[1], model.norm]).key[1]) is not None
+    assert len(library) == 2
+    assert list(library.predict(layers[0], layers[2])) == []
+
+
+def test_trace_library_predict():
+    model = set_module_ids(TraceModel(8, n_layers=4))
+    layers = list(model.layers)
+    library = PartitionedParameterTraceLibrary(max_traces=4)
+    # forward followed by the backward pass, which visits the layers in reverse order
+    library.add(layers + layers[::-1])
+    library.add(layers[:2] + [model.norm] + layers[1::-1])
+
+    # The predecessor tells the forward and the backward pass apart.
+    assert list(library.predict(layers[0], layers[1]))[:3] == [layers[2], layers[3], layers[3]]
+    assert list(library.predict(layers[2], layers[1]))[0] == layers[0]
+    assert list(library.predict(model.norm, layers[1]))[0] == layers[0]
+    # Without a known predecessor, the most frequent successor is followed.
+    assert list(library.predict(layers[3], layers[1]))[0] == layers[0]
+    assert list(library.predict(None, model.norm))[:2] == [layers[1], layers[0]]
+    assert list(library.predict(None, TraceModel(8).norm)) == []